@@ -11,6 +11,7 @@ from .few_shot_classification import (
     GermanTrafficSignsFewShotDataModuleConfig,
     GermanTrafficSignsMultiViewFewShotDatasetConfig,
     MSCOCOFewShotDataModuleConfig,
+    MultiSourceFewShotDataModuleConfig,
     OmniglotFewShotDataModuleConfig,
     OmniglotMultiViewFewShotDatasetConfig,
     QuickDrawFewShotDataModuleConfig,
@@ -147,4 +148,10 @@ def add_datamodule_configs(config_store: ConfigStore):
         node=MSCOCOFewShotDataModuleConfig,
     )
 
+    config_store.store(
+        group="datamodule",
+        name="MultiSourceFewShotClassification",
+        node=MultiSourceFewShotDataModuleConfig,
+    )
+
     return config_store
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Any, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
 
 from gate.configs import get_module_import_path
 from gate.configs.datamodule.base import DataLoaderConfig
@@ -44,7 +44,10 @@ from gate.configs.datasets.transforms import (
     VGGFlowersSupportSetTransformConfig,
 )
 from gate.configs.string_variables import DATASET_DIR, NUM_TRAIN_SAMPLES
-from gate.datamodules.tf_hub.few_shot_episodic_sets import FewShotDataModule
+from gate.datamodules.tf_hub.few_shot_episodic_sets import (
+    FewShotDataModule,
+    MultiSourceFewShotDataModule,
+)
 
 
 @dataclass
@@ -59,6 +62,12 @@ class FewShotDataModuleConfig:
     transform_eval: FewShotTransformConfig
     train_num_episodes: int = NUM_TRAIN_SAMPLES
     eval_num_episodes: int = 600
+    batch_episodes: bool = False
+    cache_eval_episodes: bool = False
+    bucket_episodes_by_shape: bool = False
+    episode_bucket_width: int = 1
+    pad_episodes: bool = False
+    max_images_per_batch: Optional[int] = None
     _target_: str = get_module_import_path(FewShotDataModule)
 
 
@@ -317,3 +326,70 @@ class MSCOCOFewShotDataModuleConfig(FewShotDataModuleConfig):
         support_set_input_transform=MSCOCOSupportSetTransformConfig(),
         query_set_input_transform=MSCOCOQuerySetTransformConfig(),
     )
+
+
+@dataclass
+class MultiSourceFewShotDataModuleConfig:
+    """
+    Class for configuring a few shot datamodule that mixes the episodes of
+    several datasets, each transformed with its own transforms
+    """
+
+    dataset_configs: Dict[str, Any] = field(
+        default_factory=lambda: dict(
+            cub200=CUB200FewShotDatasetConfig(dataset_root=DATASET_DIR),
+            aircraft=AircraftFewShotDatasetConfig(dataset_root=DATASET_DIR),
+            dtd=DTDFewShotDatasetConfig(dataset_root=DATASET_DIR),
+            vgg_flowers=VGGFlowersFewShotDatasetConfig(dataset_root=DATASET_DIR),
+        )
+    )
+    data_loader_config: DataLoaderConfig = DataLoaderConfig()
+    transform_train: Any = FewShotTransformConfig(
+        support_set_input_transform=CUB200SupportSetTransformConfig(),
+        query_set_input_transform=CUB200QuerySetTransformConfig(),
+    )
+    transform_eval: Any = FewShotTransformConfig(
+        support_set_input_transform=CUB200SupportSetTransformConfig(),
+        query_set_input_transform=CUB200QuerySetTransformConfig(),
+    )
+    source_weights: Optional[Dict[str, float]] = None
+    source_transforms_train: Dict[str, Any] = field(
+        default_factory=lambda: dict(
+            aircraft=FewShotTransformConfig(
+                support_set_input_transform=AircraftSupportSetTransformConfig(),
+                query_set_input_transform=AircraftQuerySetTransformConfig(),
+            ),
+            dtd=FewShotTransformConfig(
+                support_set_input_transform=DTDSupportSetTransformConfig(),
+                query_set_input_transform=DTDQuerySetTransformConfig(),
+            ),
+            vgg_flowers=FewShotTransformConfig(
+                support_set_input_transform=VGGFlowersSupportSetTransformConfig(),
+                query_set_input_transform=VGGFlowersQuerySetTransformConfig(),
+            ),
+        )
+    )
+    source_transforms_eval: Dict[str, Any] = field(
+        default_factory=lambda: dict(
+            aircraft=FewShotTransformConfig(
+                support_set_input_transform=AircraftSupportSetTransformConfig(),
+                query_set_input_transform=AircraftQuerySetTransformConfig(),
+            ),
+            dtd=FewShotTransformConfig(
+                support_set_input_transform=DTDSupportSetTransformConfig(),
+                query_set_input_transform=DTDQuerySetTransformConfig(),
+            ),
+            vgg_flowers=FewShotTransformConfig(
+                support_set_input_transform=VGGFlowersSupportSetTransformConfig(),
+                query_set_input_transform=VGGFlowersQuerySetTransformConfig(),
+            ),
+        )
+    )
+    train_num_episodes: int = NUM_TRAIN_SAMPLES
+    eval_num_episodes: int = 600
+    cache_eval_episodes: bool = False
+    bucket_episodes_by_shape: bool = False
+    episode_bucket_width: int = 1
+    pad_episodes: bool = False
+    max_images_per_batch: Optional[int] = None
+    _target_: str = get_module_import_path(MultiSourceFewShotDataModule)
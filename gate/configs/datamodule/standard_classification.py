@@ -8,10 +8,10 @@ from gate.configs.datasets.standard_classification import (
     OmniglotDatasetConfig,
 )
 from gate.configs.datasets.transforms import (
-    cifar10_eval_transforms,
-    cifar10_train_transforms,
-    cifar100_eval_transforms,
-    cifar100_train_transforms,
+    cifar10_batch_transforms,
+    cifar10_train_augmentations,
+    cifar100_batch_transforms,
+    cifar100_train_augmentations,
     omniglot_transform_config,
     stl10_eval_transforms,
     stl10_train_transforms,
@@ -32,6 +32,7 @@ from gate.datasets.tf_hub.standard.cifar import (
 class StandardDatasetTransformConfig:
     input_transform: Optional[Any] = MISSING
     target_transform: Optional[Any] = MISSING
+    batch_input_transform: Optional[Any] = None
 
 
 @dataclass
@@ -58,40 +59,52 @@ class OmniglotEvalTransformConfig:
 class CIFAR10TrainTransformConfig:
     input_transform: Optional[Dict] = field(
         default_factory=lambda: dict(
-            _target_=get_module_import_path(cifar10_train_transforms)
+            _target_=get_module_import_path(cifar10_train_augmentations)
         )
     )
     target_transform: Optional[Dict] = None
+    batch_input_transform: Optional[Dict] = field(
+        default_factory=lambda: dict(
+            _target_=get_module_import_path(cifar10_batch_transforms)
+        )
+    )
 
 
 @dataclass
 class CIFAR10EvalTransformConfig:
-    input_transform: Optional[Dict] = field(
+    input_transform: Optional[Dict] = None
+    target_transform: Optional[Dict] = None
+    batch_input_transform: Optional[Dict] = field(
         default_factory=lambda: dict(
-            _target_=get_module_import_path(cifar10_eval_transforms)
+            _target_=get_module_import_path(cifar10_batch_transforms)
         )
     )
-    target_transform: Optional[Dict] = None
 
 
 @dataclass
 class CIFAR100TrainTransformConfig:
     input_transform: Optional[Dict] = field(
         default_factory=lambda: dict(
-            _target_=get_module_import_path(cifar100_train_transforms)
+            _target_=get_module_import_path(cifar100_train_augmentations)
         )
     )
     target_transform: Optional[Dict] = None
+    batch_input_transform: Optional[Dict] = field(
+        default_factory=lambda: dict(
+            _target_=get_module_import_path(cifar100_batch_transforms)
+        )
+    )
 
 
 @dataclass
 class CIFAR100EvalTransformConfig:
-    input_transform: Optional[Dict] = field(
+    input_transform: Optional[Dict] = None
+    target_transform: Optional[Dict] = None
+    batch_input_transform: Optional[Dict] = field(
         default_factory=lambda: dict(
-            _target_=get_module_import_path(cifar100_eval_transforms)
+            _target_=get_module_import_path(cifar100_batch_transforms)
         )
     )
-    target_transform: Optional[Dict] = None
 
 
 @dataclass
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 from gate.configs import get_module_import_path
 from gate.datasets.learn2learn_hub.few_shot.fungi import (
@@ -72,6 +72,17 @@ class FewShotDatasetConfig:
     support_set_target_transform: Any = None
     query_set_target_transform: Any = None
     rescan_cache: bool = False
+    storage_mode: str = "in_memory"
+    split_aware_ingest: bool = False
+    share_subsets: bool = True
+    extra_feature_keys: Optional[List[str]] = None
+    ingest_batch_size: Optional[int] = None
+    tfds_reader: str = "tensorflow"
+    image_cache_size: Optional[List[int]] = None
+    image_cache_interpolation: str = "bilinear"
+    decoded_image_cache_bytes: int = 256 * 1024 * 1024
+    episode_manifest_path: Optional[str] = None
+    episode_manifest_range: Optional[List[int]] = None
     _target_: Any = get_module_import_path(FewShotClassificationDatasetTFDS)
 
 
@@ -213,8 +224,11 @@ class QuickDrawFewShotDatasetConfig(FewShotDatasetConfig):
     """
 
     _target_: Any = get_module_import_path(QuickDrawFewShotClassificationDataset)
+    max_samples_per_class: Optional[int] = 1000
+    class_sampling_seed: int = 0
 
 
+@dataclass
 class QuickDrawMultiViewFewShotDatasetConfig(MultiViewFewShotDatasetConfig):
     """
     Class for configuring a few shot dataset
@@ -223,6 +237,8 @@ class QuickDrawMultiViewFewShotDatasetConfig(MultiViewFewShotDatasetConfig):
     _target_: Any = get_module_import_path(
         QuickDrawMultiViewFewShotClassificationDataset
     )
+    max_samples_per_class: Optional[int] = 1000
+    class_sampling_seed: int = 0
 
 
 @dataclass
@@ -241,3 +257,6 @@ class MSCOCOFewShotDatasetConfig(FewShotDatasetConfig):
     """
 
     _target_: Any = get_module_import_path(MSCOCOFewShotClassificationDataset)
+    storage_mode: str = "encoded"
+    crop_cache_size: Optional[List[int]] = None
+    crop_cache_interpolation: str = "bilinear"
@@ -30,6 +30,7 @@ class CIFAR10DatasetConfig(DatasetConfig):
     train: Optional[bool] = None
     input_transform: Optional[Any] = None
     target_transform: Optional[Any] = None
+    tfds_reader: str = "tensorflow"
     _target_: str = get_module_import_path(CIFAR10ClassificationDataset)
 
 
@@ -45,6 +46,7 @@ class CIFAR100DatasetConfig(DatasetConfig):
     train: Optional[bool] = None
     input_transform: Optional[Any] = None
     target_transform: Optional[Any] = None
+    tfds_reader: str = "tensorflow"
     _target_: str = get_module_import_path(CIFAR100ClassificationDataset)
 
 
@@ -73,4 +75,5 @@ class OmniglotDatasetConfig(DatasetConfig):
     split_name: str = "train"
     input_transform: Optional[Any] = None
     target_transform: Optional[Any] = None
+    tfds_reader: str = "tensorflow"
     _target_: str = get_module_import_path(OmniglotClassificationDataset)
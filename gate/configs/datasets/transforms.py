@@ -2,6 +2,7 @@ from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Tuple
 
 import hydra.utils
+import torch
 from omegaconf import DictConfig, ListConfig
 from torchvision.transforms import transforms
 
@@ -15,6 +16,7 @@ from gate.datasets.transforms import (
     RandomCropResizeCustom,
     MultipleRandomCropResizeCustom,
     RandomMaskCustom,
+    ResizeToTensor,
     SuperClassExistingLabels,
 )
 
@@ -24,9 +26,7 @@ def omniglot_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(28, 28)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(28, 28)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -37,9 +37,7 @@ def omniglot_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(28, 28)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(28, 28)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -50,9 +48,7 @@ def cub200_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -63,9 +59,7 @@ def cub200_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -76,9 +70,7 @@ def aircraft_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -89,9 +81,7 @@ def aircraft_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -102,9 +92,7 @@ def dtd_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -113,9 +101,7 @@ def dtd_support_set_transforms(
 def dtd_query_set_transforms(additional_transforms: Optional[Any] = None):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -126,9 +112,7 @@ def mscoco_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -139,9 +123,7 @@ def mscoco_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -152,9 +134,7 @@ def vgg_flowers_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -165,9 +145,7 @@ def vgg_flowers_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -178,8 +156,7 @@ def fungi_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -190,8 +167,7 @@ def fungi_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -202,9 +178,7 @@ def german_traffic_signs_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -215,9 +189,7 @@ def german_traffic_signs_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(84, 84)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(84, 84)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -228,9 +200,7 @@ def quickdraw_support_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(28, 28)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(28, 28)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -241,9 +211,7 @@ def quickdraw_query_set_transforms(
 ):
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(28, 28)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(28, 28)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -311,6 +279,55 @@ def cifar100_eval_transforms(additional_transforms: Optional[Any] = None):
     )
 
 
+def cifar10_train_augmentations(additional_transforms: Optional[Any] = None):
+    return compose_with_additional_transforms(
+        [
+            transforms.ToPILImage(),
+            transforms.RandomCrop(32, padding=4),
+            transforms.RandomHorizontalFlip(),
+            transforms.PILToTensor(),
+        ],
+        additional_transforms=additional_transforms,
+    )
+
+
+def cifar10_batch_transforms(additional_transforms: Optional[Any] = None):
+    return compose_with_additional_transforms(
+        [
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize(
+                mean=[0.4914, 0.4822, 0.4465],
+                std=[0.2023, 0.1994, 0.2010],
+            ),
+        ],
+        additional_transforms=additional_transforms,
+    )
+
+
+def cifar100_train_augmentations(additional_transforms: Optional[Any] = None):
+    return compose_with_additional_transforms(
+        [
+            transforms.ToPILImage(),
+            transforms.RandomCrop(32, padding=4),
+            transforms.RandomHorizontalFlip(),
+            transforms.PILToTensor(),
+        ],
+        additional_transforms=additional_transforms,
+    )
+
+
+def cifar100_batch_transforms(additional_transforms: Optional[Any] = None):
+    return compose_with_additional_transforms(
+        [
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize(
+                mean=[0.5071, 0.4866, 0.4409], std=[0.2009, 0.1984, 0.2023]
+            ),
+        ],
+        additional_transforms=additional_transforms,
+    )
+
+
 def stl10_train_transforms(additional_transforms: Optional[Any] = None):
     return compose_with_additional_transforms(
         [
@@ -338,9 +355,7 @@ def omniglot_transform_config(additional_transforms=None):
 
     return compose_with_additional_transforms(
         [
-            transforms.ToPILImage(),
-            transforms.Resize(size=(28, 28)),
-            transforms.ToTensor(),
+            ResizeToTensor(size=(28, 28)),
         ],
         additional_transforms=additional_transforms,
     )
@@ -479,3 +494,5 @@ class FewShotTransformConfig:
     query_set_input_transform: Optional[Any] = InputTransformConfig()
     support_set_target_transform: Optional[Any] = TargetTransformConfig()
     query_set_target_transform: Optional[Any] = TargetTransformConfig()
+    # applied to whole meta-batches of uint8 images when episodes are batched
+    batch_input_transform: Optional[Any] = None
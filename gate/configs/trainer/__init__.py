@@ -1,7 +1,7 @@
 from hydra.core.config_store import ConfigStore
 
 from .base import BaseTrainer
-from .gpu import DDPTrainer, DPTrainer
+from .gpu import DDPFewShotTrainer, DDPTrainer, DPTrainer
 from .mps import MPSTrainer
 
 
@@ -9,6 +9,7 @@ def add_trainer_configs(config_store: ConfigStore):
     config_store.store(group="trainer", name="base", node=BaseTrainer)
     config_store.store(group="trainer", name="gpu-dp", node=DPTrainer)
     config_store.store(group="trainer", name="gpu-ddp", node=DDPTrainer)
+    config_store.store(group="trainer", name="gpu-ddp-few-shot", node=DDPFewShotTrainer)
     config_store.store(group="trainer", name="mps", node=MPSTrainer)
 
     return config_store
@@ -23,6 +23,12 @@ class DDPTrainer(BaseTrainer):
     plugins: Any = DDPPlugin()
 
 
+@dataclass
+class DDPFewShotTrainer(DDPTrainer):
+    # few-shot datamodules draw the episodes of every rank themselves
+    replace_sampler_ddp: bool = False
+
+
 @dataclass
 class DPTrainer(BaseTrainer):
     accelerator: str = "gpu"
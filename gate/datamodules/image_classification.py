@@ -1,8 +1,12 @@
-from typing import Any, Dict, Optional, Union
+import functools
+import json
+from typing import Any, Dict, Optional, Tuple, Union
 
 import hydra.utils
+import numpy as np
 import torch.utils.data
-from torch.utils.data import DataLoader
+from omegaconf import DictConfig, OmegaConf
+from torch.utils.data import DataLoader, Subset
 
 from gate.configs.datamodule.base import DataLoaderConfig
 from gate.configs.datasets.standard_classification import (
@@ -11,6 +15,55 @@ from gate.configs.datasets.standard_classification import (
     PreSplitDatasetConfig,
 )
 from gate.datamodules.base import DataModule
+from gate.datasets.shared_subsets import acquire_shared_subsets
+
+
+def get_batch_input_transform(transform_config: Any) -> Optional[Any]:
+    """
+    Build the `batch_input_transform` of a transform config, which is
+    applied to whole batches of images once they reach their device, or
+    return None when the config has none.
+    """
+    batch_input_transform = getattr(transform_config, "batch_input_transform", None)
+
+    if isinstance(batch_input_transform, (Dict, DictConfig)):
+        return hydra.utils.instantiate(batch_input_transform)
+
+    return batch_input_transform
+
+
+@functools.lru_cache(maxsize=None)
+def get_random_split_indices(
+    num_items: int, val_set_percentage: float, seed: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split `range(num_items)` into train and val indices, the same ones
+    `torch.utils.data.random_split` picks for the same seed. The indices are
+    cached per process, keyed by their arguments.
+    """
+    num_training_items = int(num_items * (1.0 - val_set_percentage))
+    permutation = torch.randperm(
+        num_items, generator=torch.Generator().manual_seed(seed)
+    ).numpy()
+    permutation.flags.writeable = False
+
+    return permutation[:num_training_items], permutation[num_training_items:]
+
+
+def get_dataset_kwargs(dataset_config: Any) -> Dict[str, Any]:
+    """
+    Turn a dataset config into the kwargs that load one of its splits,
+    leaving out what the datamodules set themselves: the split to load,
+    the input transform, and how to split off a validation set.
+    """
+    dataset_kwargs = OmegaConf.to_container(
+        OmegaConf.structured(dataset_config), resolve=True
+    )
+
+    for key in ["train", "split_name", "val_set_percentage", "input_transform"]:
+        dataset_kwargs.pop(key, None)
+
+    return dataset_kwargs
 
 
 class TwoSplitDataModule(DataModule):
@@ -25,65 +78,94 @@ class TwoSplitDataModule(DataModule):
 
         self.transform_train = transform_train
         self.transform_eval = transform_eval
+        self.batch_input_transform_train = get_batch_input_transform(transform_train)
+        self.batch_input_transform_eval = get_batch_input_transform(transform_eval)
+        self.split_sets = {}
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        # images are loaded as uint8, so they are converted to float and
+        # normalized here, a batch at a time on the device they train on
+        training = self.trainer is not None and self.trainer.training
+        batch_input_transform = (
+            self.batch_input_transform_train
+            if training
+            else self.batch_input_transform_eval
+        )
 
-    def setup(self, stage: Optional[str] = None):
+        if batch_input_transform is None:
+            return batch
 
-        if stage == "fit" or stage is None:
-            train_set = hydra.utils.instantiate(
-                config=self.dataset_config,
-                dataset_root=self.dataset_root,
-                train=True,
-                input_transform=self.transform_train.input_transform,
-            )
+        inputs, targets = batch
+        inputs = dict(inputs, image=batch_input_transform(inputs["image"]))
 
-            num_training_items = int(
-                len(train_set) * (1.0 - self.dataset_config.val_set_percentage)
-            )
+        return inputs, targets
 
-            num_val_items = len(train_set) - num_training_items
+    def load_split_set(self, split_name: str) -> Any:
+        """
+        Load a split without an input transform, once per process: stages
+        of this datamodule, and datamodules with the same dataset config,
+        reuse it and give it their transforms with `with_input_transform`.
+        """
+        if split_name not in self.split_sets:
+            dataset_kwargs = get_dataset_kwargs(self.dataset_config)
+            dataset_kwargs.update(
+                dataset_root=str(self.dataset_root), split_name=split_name
+            )
+            key = (
+                "split_set",
+                json.dumps(dataset_kwargs, sort_keys=True, default=str),
+            )
 
-            self.train_set, self.val_set = torch.utils.data.random_split(
-                train_set,
-                [num_training_items, num_val_items],
-                generator=torch.Generator().manual_seed(self.seed),
+            self.split_sets[split_name] = acquire_shared_subsets(
+                key=key,
+                owner=self,
+                load_fn=lambda: hydra.utils.instantiate(dataset_kwargs),
             )
 
-            self.input_shape_dict = self.train_set.input_shape_dict
-            self.target_shape_dict = self.train_set.target_shape_dict
+        return self.split_sets[split_name]
 
-        elif stage == "validate":
-            train_set = hydra.utils.instantiate(
-                config=self.dataset_config,
-                dataset_root=self.dataset_root,
-                train=True,
-                input_transform=self.transform_eval.input_transform,
+    def setup(self, stage: Optional[str] = None):
+
+        if stage == "fit" or stage is None:
+            train_set = self.load_split_set("train")
+            train_idx, val_idx = get_random_split_indices(
+                len(train_set), self.dataset_config.val_set_percentage, self.seed
             )
 
-            num_training_items = int(
-                len(train_set) * (1.0 - self.dataset_config.val_set_percentage)
+            self.train_set = Subset(
+                train_set.with_input_transform(self.transform_train.input_transform),
+                train_idx,
+            )
+            self.val_set = Subset(
+                train_set.with_input_transform(self.transform_eval.input_transform),
+                val_idx,
             )
 
-            num_val_items = len(train_set) - num_training_items
+            self.input_shape_dict = train_set.input_shape_dict
+            self.target_shape_dict = train_set.target_shape_dict
 
-            _, self.val_set = torch.utils.data.random_split(
-                train_set,
-                [num_training_items, num_val_items],
-                generator=torch.Generator().manual_seed(self.seed),
+        elif stage == "validate":
+            train_set = self.load_split_set("train")
+            _, val_idx = get_random_split_indices(
+                len(train_set), self.dataset_config.val_set_percentage, self.seed
             )
 
-            self.input_shape_dict = self.val_set.input_shape_dict
-            self.target_shape_dict = self.val_set.target_shape_dict
+            self.val_set = Subset(
+                train_set.with_input_transform(self.transform_eval.input_transform),
+                val_idx,
+            )
+
+            self.input_shape_dict = train_set.input_shape_dict
+            self.target_shape_dict = train_set.target_shape_dict
 
         elif stage == "test":
-            self.test_set = hydra.utils.instantiate(
-                config=self.dataset_config,
-                dataset_root=self.dataset_root,
-                train=False,
-                input_transform=self.transform_eval.input_transform,
+            test_set = self.load_split_set("test")
+            self.test_set = test_set.with_input_transform(
+                self.transform_eval.input_transform
             )
 
-            self.input_shape_dict = self.test_set.input_shape_dict
-            self.target_shape_dict = self.test_set.target_shape_dict
+            self.input_shape_dict = test_set.input_shape_dict
+            self.target_shape_dict = test_set.target_shape_dict
 
         else:
             raise ValueError(f"Invalid stage name passed {stage}")
@@ -172,42 +254,30 @@ class PreSplitDataModule(TwoSplitDataModule):
     def setup(self, stage: Optional[str] = None):
 
         if stage == "fit" or stage is None:
-            self.train_set = hydra.utils.instantiate(
-                config=self.dataset_config,
-                dataset_root=self.dataset_root,
-                split_name=self.split_name_to_phase_dict["train"],
-                input_transform=self.transform_train.input_transform,
-            )
+            self.train_set = self.load_split_set(
+                self.split_name_to_phase_dict["train"]
+            ).with_input_transform(self.transform_train.input_transform)
 
-            self.val_set = hydra.utils.instantiate(
-                config=self.dataset_config,
-                dataset_root=self.dataset_root,
-                split_name=self.split_name_to_phase_dict["val"],
-                input_transform=self.transform_eval.input_transform,
-            )
+            self.val_set = self.load_split_set(
+                self.split_name_to_phase_dict["val"]
+            ).with_input_transform(self.transform_eval.input_transform)
 
             self.input_shape_dict = self.train_set.input_shape_dict
             self.target_shape_dict = self.train_set.target_shape_dict
 
         elif stage == "validate":
-            self.val_set = hydra.utils.instantiate(
-                config=self.dataset_config,
-                dataset_root=self.dataset_root,
-                split_name=self.split_name_to_phase_dict["val"],
-                input_transform=self.transform_eval.input_transform,
-            )
+            self.val_set = self.load_split_set(
+                self.split_name_to_phase_dict["val"]
+            ).with_input_transform(self.transform_eval.input_transform)
 
             self.input_shape_dict = self.val_set.input_shape_dict
             self.target_shape_dict = self.val_set.target_shape_dict
 
         # Assign test dataset for use in dataloader(s)
         elif stage == "test":
-            self.test_set = hydra.utils.instantiate(
-                config=self.dataset_config,
-                dataset_root=self.dataset_root,
-                split_name=self.split_name_to_phase_dict["test"],
-                input_transform=self.transform_eval.input_transform,
-            )
+            self.test_set = self.load_split_set(
+                self.split_name_to_phase_dict["test"]
+            ).with_input_transform(self.transform_eval.input_transform)
 
             self.input_shape_dict = self.test_set.input_shape_dict
             self.target_shape_dict = self.test_set.target_shape_dict
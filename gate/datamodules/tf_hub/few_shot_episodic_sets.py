@@ -1,8 +1,12 @@
-from typing import Optional
+import pathlib
+from typing import Any, Dict, Optional
 
 import hydra.utils
+import torch.distributed
 import torch.utils.data
-from torch.utils.data import DataLoader
+from omegaconf import DictConfig, OmegaConf
+from torch.utils.data import DataLoader, Sampler
+from torchvision.transforms import ConvertImageDtype
 
 from gate.configs.datamodule.base import DataLoaderConfig
 from gate.configs.datamodule.few_shot_classification import (
@@ -10,6 +14,34 @@ from gate.configs.datamodule.few_shot_classification import (
     FewShotTransformConfig,
 )
 from gate.datamodules.base import DataModule
+from gate.datamodules.image_classification import get_batch_input_transform
+from gate.datasets.data_utils import get_batch_size
+from gate.datasets.episode_cache import EpisodeCache, get_episode_cache_key
+from gate.datasets.episode_mixing import MultiSourceEpisodeDataset
+from gate.datasets.episode_sampler import (
+    DistributedEpisodeSampler,
+    EpisodeBudgetBatchSampler,
+    EpisodeIndexBatchSampler,
+    EpisodeShapeBatchSampler,
+    get_distributed_rank,
+    get_distributed_world_size,
+    trainer_replaces_samplers,
+)
+from gate.datasets.tf_hub.few_shot.base import collate_padded_episodes
+
+
+def get_config_fingerprint(config: Any) -> Any:
+    """
+    Describe a (structured) config, or an already built object, in a form
+    that can be stored as JSON and compared across runs.
+    """
+    if config is None or isinstance(config, (bool, int, float, str)):
+        return config
+
+    if isinstance(config, DictConfig) or hasattr(config, "__dataclass_fields__"):
+        return OmegaConf.to_container(OmegaConf.structured(config), resolve=True)
+
+    return repr(config)
 
 
 class FewShotDataModule(DataModule):
@@ -21,6 +53,12 @@ class FewShotDataModule(DataModule):
         transform_eval: FewShotTransformConfig,
         train_num_episodes: int,
         eval_num_episodes: int,
+        batch_episodes: bool = False,
+        cache_eval_episodes: bool = False,
+        bucket_episodes_by_shape: bool = False,
+        episode_bucket_width: int = 1,
+        pad_episodes: bool = False,
+        max_images_per_batch: Optional[int] = None,
     ):
 
         super(FewShotDataModule, self).__init__(dataset_config, data_loader_config)
@@ -32,46 +70,329 @@ class FewShotDataModule(DataModule):
         self.rescan_cache = self.dataset_config.rescan_cache
         self.train_num_episodes = train_num_episodes
         self.eval_num_episodes = eval_num_episodes
+        self.batch_episodes = batch_episodes
+        self.batch_input_transform_train = get_batch_input_transform(transform_train)
+        self.batch_input_transform_eval = get_batch_input_transform(transform_eval)
+        self.cache_eval_episodes = cache_eval_episodes
+        self.rescan_eval_episode_cache = self.rescan_cache
+        self.eval_episode_caches = {}
+        self.bucket_episodes_by_shape = bucket_episodes_by_shape
+        self.episode_bucket_width = episode_bucket_width
+        self.pad_episodes = pad_episodes
+        self.max_images_per_batch = max_images_per_batch
+        self.train_index_sampler = None
+        self.train_index_sampler_state = None
+
+        if batch_episodes and (bucket_episodes_by_shape or pad_episodes):
+            raise ValueError(
+                "batch_episodes only builds meta-batches of episodes of one "
+                "shape, it can not be combined with bucket_episodes_by_shape "
+                "or pad_episodes"
+            )
+
+        if episode_bucket_width > 1 and not pad_episodes:
+            raise ValueError(
+                f"Episodes bucketed with an episode_bucket_width of "
+                f"{episode_bucket_width} differ in size, set pad_episodes to "
+                f"batch them"
+            )
+
+        if max_images_per_batch is not None:
+            if bucket_episodes_by_shape:
+                raise ValueError(
+                    "max_images_per_batch packs episodes by their number of "
+                    "images, it can not be combined with bucket_episodes_by_shape"
+                )
+
+            if not pad_episodes:
+                raise ValueError(
+                    "Episodes packed up to max_images_per_batch differ in size, "
+                    "set pad_episodes to batch them"
+                )
+
+    def get_transform_kwargs(self, transform_config: Any) -> Dict[str, Any]:
+        """
+        Return the per-sample transforms a dataset is built with. With
+        `batch_episodes` the datasets write whole meta-batches of uint8
+        images and use none, the `batch_input_transform` of the transform
+        config is applied to the batches instead.
+        """
+        transform_keys = [
+            "support_set_input_transform",
+            "query_set_input_transform",
+            "support_set_target_transform",
+            "query_set_target_transform",
+        ]
+
+        if self.batch_episodes:
+            return {key: None for key in transform_keys}
+
+        return {key: getattr(transform_config, key) for key in transform_keys}
+
+    def build_dataset(
+        self, split_name: str, rescan_cache: bool, num_episodes: int
+    ) -> Any:
+        transform_config = (
+            self.transform_train if split_name == "train" else self.transform_eval
+        )
+
+        return hydra.utils.instantiate(
+            config=self.dataset_config,
+            split_name=split_name,
+            **self.get_transform_kwargs(transform_config),
+            _recursive_=False,
+            rescan_cache=rescan_cache,
+            num_episodes=num_episodes,
+        )
+
+    def get_dataset_fingerprint(self) -> Dict[str, Any]:
+        dataset_config = get_config_fingerprint(self.dataset_config)
+        dataset_config.pop("rescan_cache", None)
+        return dataset_config
+
+    def get_eval_set(self, dataset: Any, split_name: str) -> Any:
+        """
+        With `cache_eval_episodes`, return the episodes of an evaluation
+        dataset from an `EpisodeCache` under `dataset_root`, which is
+        written by the first pass over them and read by every later one.
+        Caches are keyed by the dataset config, split, number of episodes
+        and evaluation transforms, so any change to those builds a new one.
+        Each rank of a distributed run then reads its own shard of it.
+        """
+        if not self.cache_eval_episodes:
+            return dataset
+
+        if split_name not in self.eval_episode_caches:
+            dataset_config = self.get_dataset_fingerprint()
+
+            metadata = dict(
+                dataset_config=dataset_config,
+                split_name=split_name,
+                num_episodes=len(dataset),
+                transforms={
+                    key: get_config_fingerprint(value)
+                    for key, value in self.get_transform_kwargs(
+                        self.transform_eval
+                    ).items()
+                },
+            )
+            dataset_name = dataset_config.get("dataset_name", "episodes")
+            cache_dir = (
+                pathlib.Path(self.dataset_root)
+                / "episode_cache"
+                / f"{dataset_name}_{split_name}_{get_episode_cache_key(metadata)[:16]}"
+            )
+
+            def load_or_build_cache(rescan_cache):
+                return EpisodeCache.load_or_build(
+                    cache_dir=cache_dir,
+                    get_episodes_fn=lambda: DataLoader(
+                        dataset,
+                        batch_size=None,
+                        num_workers=self.data_loader_config.num_workers,
+                    ),
+                    metadata=metadata,
+                    rescan_cache=rescan_cache,
+                )
+
+            # in a distributed run the cache is built once, by rank 0, and
+            # the other ranks wait for it rather than build it all over
+            if get_distributed_world_size() > 1:
+                if torch.distributed.get_rank() == 0:
+                    cache = load_or_build_cache(self.rescan_eval_episode_cache)
+                torch.distributed.barrier()
+                if torch.distributed.get_rank() != 0:
+                    cache = load_or_build_cache(False)
+            else:
+                cache = load_or_build_cache(self.rescan_eval_episode_cache)
+
+            self.eval_episode_caches[split_name] = cache
+
+        return self.eval_episode_caches[split_name]
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Save the position of the training episode stream with the
+        checkpoint, so that a resumed run draws the episodes its
+        interrupted one had yet to draw rather than start over.
+        """
+        if self.train_index_sampler is None:
+            return {}
+
+        return dict(train_index_sampler=self.train_index_sampler.state_dict())
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        # restored before the training loader is built, which seeks to it
+        self.train_index_sampler_state = state_dict.get("train_index_sampler")
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        training = self.trainer is not None and self.trainer.training
+
+        # episodes are counted as consumed once they reach the model, not
+        # once drawn, since workers load episodes ahead of it
+        if training and self.train_index_sampler is not None:
+            self.train_index_sampler.advance(get_batch_size(batch) or 0)
+
+        if not self.batch_episodes:
+            return batch
+
+        # meta-batches of images are loaded as uint8, so they are converted
+        # here, a batch at a time on the device they train on
+        batch_input_transform = (
+            self.batch_input_transform_train
+            if training
+            else self.batch_input_transform_eval
+        )
+        if batch_input_transform is None:
+            batch_input_transform = ConvertImageDtype(torch.get_default_dtype())
+
+        input_dict, target_dict = batch
+        for set_name in ["support_set", "query_set"]:
+            images = input_dict["image"][set_name]
+            transformed_images = batch_input_transform(images.flatten(0, 1))
+            input_dict["image"][set_name] = transformed_images.reshape(
+                images.shape[:2] + transformed_images.shape[1:]
+            )
+
+        return input_dict, target_dict
+
+    def get_index_sampler(
+        self, dataset: Any, shuffle: bool, even_shards: bool
+    ) -> Sampler:
+        """
+        Return the sampler of the episode indices of a loader, a
+        `DistributedEpisodeSampler`. In a distributed run it draws the
+        shard of this rank, which no other rank loads, so that episodes
+        are not drawn twice and evaluation is split between ranks rather
+        than repeated on each. Training loaders use `even_shards`, so that
+        every rank steps through as many batches.
+
+        Every loader shards its episodes itself, so a distributed trainer
+        must run with `replace_sampler_ddp=False` (see `setup`): Lightning
+        would otherwise shard the shards of `batch_episodes` loaders again,
+        and fail to rebuild the batch samplers of `bucket_episodes_by_shape`
+        and `max_images_per_batch`.
+        """
+        return DistributedEpisodeSampler(
+            dataset,
+            num_replicas=get_distributed_world_size(),
+            rank=get_distributed_rank(),
+            shuffle=shuffle,
+            seed=self.seed,
+            drop_last=even_shards,
+        )
+
+    def get_dataloader(
+        self,
+        dataset: Any,
+        batch_size: int,
+        shuffle: bool,
+        drop_last: bool,
+        episode_sampler: Optional[Any] = None,
+        index_sampler: Optional[Sampler] = None,
+    ) -> DataLoader:
+        """
+        Build the loader of a few-shot dataset. With `bucket_episodes_by_shape`
+        the episodes are batched with others of the same set sizes, which
+        `episode_sampler` (by default the dataset's) tells ahead of loading
+        them, and with `pad_episodes` episodes of different set sizes are
+        padded into one meta-batch, with masks of their examples. With
+        `max_images_per_batch` the episodes are instead packed into batches
+        of as many as fit in that many (padded) images, and `batch_size` is
+        ignored.
+
+        Episode indices are drawn by `index_sampler`, by default
+        `get_index_sampler` of the dataset: in a distributed run every rank
+        loads its own shard of the episodes.
+        """
+        collate_fn = collate_padded_episodes if self.pad_episodes else None
+        if index_sampler is None:
+            index_sampler = self.get_index_sampler(
+                dataset, shuffle=shuffle, even_shards=False
+            )
+
+        if self.max_images_per_batch is not None:
+            return DataLoader(
+                dataset,
+                batch_sampler=EpisodeBudgetBatchSampler(
+                    index_sampler,
+                    episode_sampler=episode_sampler or dataset.episode_sampler,
+                    max_images_per_batch=self.max_images_per_batch,
+                ),
+                collate_fn=collate_fn,
+                num_workers=self.data_loader_config.num_workers,
+                pin_memory=self.data_loader_config.pin_memory,
+                prefetch_factor=self.data_loader_config.prefetch_factor,
+                persistent_workers=self.data_loader_config.persistent_workers,
+            )
+
+        if self.bucket_episodes_by_shape:
+            return DataLoader(
+                dataset,
+                batch_sampler=EpisodeShapeBatchSampler(
+                    index_sampler,
+                    episode_sampler=episode_sampler or dataset.episode_sampler,
+                    batch_size=batch_size,
+                    drop_last=drop_last,
+                    bucket_width=self.episode_bucket_width,
+                ),
+                collate_fn=collate_fn,
+                num_workers=self.data_loader_config.num_workers,
+                pin_memory=self.data_loader_config.pin_memory,
+                prefetch_factor=self.data_loader_config.prefetch_factor,
+                persistent_workers=self.data_loader_config.persistent_workers,
+            )
+
+        if not self.batch_episodes:
+            return DataLoader(
+                dataset,
+                sampler=index_sampler,
+                batch_size=batch_size,
+                collate_fn=collate_fn,
+                num_workers=self.data_loader_config.num_workers,
+                pin_memory=self.data_loader_config.pin_memory,
+                prefetch_factor=self.data_loader_config.prefetch_factor,
+                persistent_workers=self.data_loader_config.persistent_workers,
+                drop_last=drop_last,
+            )
+
+        if not hasattr(dataset, "get_episode_batch"):
+            raise ValueError(
+                f"{type(dataset).__name__} can not build batches of episodes"
+            )
+
+        # the dataset builds a whole meta-batch from every list of indices
+        return DataLoader(
+            dataset,
+            sampler=EpisodeIndexBatchSampler(
+                index_sampler,
+                batch_size=batch_size,
+                drop_last=drop_last,
+            ),
+            batch_size=None,
+            num_workers=self.data_loader_config.num_workers,
+            pin_memory=self.data_loader_config.pin_memory,
+            prefetch_factor=self.data_loader_config.prefetch_factor,
+            persistent_workers=self.data_loader_config.persistent_workers,
+        )
 
     def setup(self, stage: Optional[str] = None):
+        if trainer_replaces_samplers(self.trainer):
+            raise ValueError(
+                f"{self.__class__.__name__} draws the shard of episodes of "
+                f"every rank itself, run the distributed trainer with "
+                f"replace_sampler_ddp=False (e.g. trainer=gpu-ddp-few-shot)"
+            )
 
         if stage == "fit":
-            self.train_set = hydra.utils.instantiate(
-                config=self.dataset_config,
+            self.train_set = self.build_dataset(
                 split_name="train",
-                support_set_input_transform=(
-                    self.transform_train.support_set_input_transform
-                ),
-                query_set_input_transform=(
-                    self.transform_train.query_set_input_transform
-                ),
-                support_set_target_transform=(
-                    self.transform_train.support_set_target_transform
-                ),
-                query_set_target_transform=(
-                    self.transform_train.query_set_target_transform
-                ),
-                _recursive_=False,
                 rescan_cache=self.rescan_cache,
                 num_episodes=self.train_num_episodes,
             )
 
-            self.val_set = hydra.utils.instantiate(
-                config=self.dataset_config,
+            self.val_set = self.build_dataset(
                 split_name="val",
-                support_set_input_transform=(
-                    self.transform_eval.support_set_input_transform
-                ),
-                query_set_input_transform=(
-                    self.transform_eval.query_set_input_transform
-                ),
-                support_set_target_transform=(
-                    self.transform_eval.support_set_target_transform
-                ),
-                query_set_target_transform=(
-                    self.transform_eval.query_set_target_transform
-                ),
-                _recursive_=False,
                 rescan_cache=False,
                 num_episodes=self.eval_num_episodes,
             )
@@ -80,22 +401,8 @@ class FewShotDataModule(DataModule):
 
             self.input_shape_dict = self.train_set.input_shape_dict
         elif stage == "validate":
-            self.val_set = hydra.utils.instantiate(
-                config=self.dataset_config,
+            self.val_set = self.build_dataset(
                 split_name="val",
-                support_set_input_transform=(
-                    self.transform_eval.support_set_input_transform
-                ),
-                query_set_input_transform=(
-                    self.transform_eval.query_set_input_transform
-                ),
-                support_set_target_transform=(
-                    self.transform_eval.support_set_target_transform
-                ),
-                query_set_target_transform=(
-                    self.transform_eval.query_set_target_transform
-                ),
-                _recursive_=self.rescan_cache,
                 rescan_cache=False,
                 num_episodes=self.eval_num_episodes,
             )
@@ -105,22 +412,8 @@ class FewShotDataModule(DataModule):
             self.input_shape_dict = self.train_set.input_shape_dict
             # Assign test dataset for use in dataloader(s)
         elif stage == "test" or stage is None:
-            self.test_set = hydra.utils.instantiate(
-                config=self.dataset_config,
+            self.test_set = self.build_dataset(
                 split_name="test",
-                support_set_input_transform=(
-                    self.transform_eval.support_set_input_transform
-                ),
-                query_set_input_transform=(
-                    self.transform_eval.query_set_input_transform
-                ),
-                support_set_target_transform=(
-                    self.transform_eval.support_set_target_transform
-                ),
-                query_set_target_transform=(
-                    self.transform_eval.query_set_target_transform
-                ),
-                _recursive_=False,
                 rescan_cache=self.rescan_cache,
                 num_episodes=self.eval_num_episodes,
             )
@@ -137,14 +430,10 @@ class FewShotDataModule(DataModule):
             )
 
     def dummy_batch(self):
-        temp_dataloader = DataLoader(
+        temp_dataloader = self.get_dataloader(
             self.val_set,
             batch_size=self.data_loader_config.val_batch_size,
             shuffle=self.data_loader_config.eval_shuffle,
-            num_workers=self.data_loader_config.num_workers,
-            pin_memory=self.data_loader_config.pin_memory,
-            prefetch_factor=self.data_loader_config.prefetch_factor,
-            persistent_workers=self.data_loader_config.persistent_workers,
             drop_last=self.data_loader_config.eval_drop_last,
         )
 
@@ -154,43 +443,161 @@ class FewShotDataModule(DataModule):
             return input_dict, target_dict
 
     def train_dataloader(self):
+        self.train_index_sampler = self.get_index_sampler(
+            self.train_set,
+            shuffle=self.data_loader_config.train_shuffle,
+            even_shards=True,
+        )
+        if self.train_index_sampler_state is not None:
+            self.train_index_sampler.load_state_dict(self.train_index_sampler_state)
+            self.train_index_sampler_state = None
 
-        return DataLoader(
+        return self.get_dataloader(
             self.train_set,
             batch_size=self.data_loader_config.train_batch_size,
             shuffle=self.data_loader_config.train_shuffle,
-            num_workers=self.data_loader_config.num_workers,
-            pin_memory=self.data_loader_config.pin_memory,
-            prefetch_factor=self.data_loader_config.prefetch_factor,
-            persistent_workers=self.data_loader_config.persistent_workers,
             drop_last=self.data_loader_config.train_drop_last,
+            index_sampler=self.train_index_sampler,
         )
 
     def val_dataloader(self):
 
-        return DataLoader(
-            self.val_set,
+        return self.get_dataloader(
+            self.get_eval_set(self.val_set, split_name="val"),
             batch_size=self.data_loader_config.val_batch_size,
             shuffle=self.data_loader_config.eval_shuffle,
-            num_workers=self.data_loader_config.num_workers,
-            pin_memory=self.data_loader_config.pin_memory,
-            prefetch_factor=self.data_loader_config.prefetch_factor,
-            persistent_workers=self.data_loader_config.persistent_workers,
             drop_last=self.data_loader_config.eval_drop_last,
+            episode_sampler=self.val_set.episode_sampler,
         )
 
     def test_dataloader(self):
 
-        return DataLoader(
-            self.test_set,
+        return self.get_dataloader(
+            self.get_eval_set(self.test_set, split_name="test"),
             batch_size=self.data_loader_config.test_batch_size,
             shuffle=self.data_loader_config.eval_shuffle,
-            num_workers=self.data_loader_config.num_workers,
-            pin_memory=self.data_loader_config.pin_memory,
-            prefetch_factor=self.data_loader_config.prefetch_factor,
-            persistent_workers=self.data_loader_config.persistent_workers,
             drop_last=self.data_loader_config.eval_drop_last,
+            episode_sampler=self.test_set.episode_sampler,
         )
 
     def predict_dataloader(self):
         return self.test_dataloader()
+
+
+class MultiSourceFewShotDataModule(FewShotDataModule):
+    """
+    A few-shot datamodule whose episodes are mixed from several datasets,
+    one per entry of `dataset_configs`, through a
+    `MultiSourceEpisodeDataset` per split, so that all sources share one
+    DataLoader and its workers. Sources are transformed with their entry
+    of `source_transforms_train` / `source_transforms_eval`, if any, or
+    else with `transform_train` / `transform_eval`.
+    """
+
+    def __init__(
+        self,
+        dataset_configs: Dict[str, FewShotDatasetConfig],
+        data_loader_config: DataLoaderConfig,
+        transform_train: FewShotTransformConfig,
+        transform_eval: FewShotTransformConfig,
+        train_num_episodes: int,
+        eval_num_episodes: int,
+        source_weights: Optional[Dict[str, float]] = None,
+        source_transforms_train: Optional[Dict[str, FewShotTransformConfig]] = None,
+        source_transforms_eval: Optional[Dict[str, FewShotTransformConfig]] = None,
+        cache_eval_episodes: bool = False,
+        bucket_episodes_by_shape: bool = False,
+        episode_bucket_width: int = 1,
+        pad_episodes: bool = False,
+        max_images_per_batch: Optional[int] = None,
+    ):
+        if len(dataset_configs) == 0:
+            raise ValueError("A multi-source datamodule needs at least one source")
+
+        super(MultiSourceFewShotDataModule, self).__init__(
+            dataset_config=next(iter(dataset_configs.values())),
+            data_loader_config=data_loader_config,
+            transform_train=transform_train,
+            transform_eval=transform_eval,
+            train_num_episodes=train_num_episodes,
+            eval_num_episodes=eval_num_episodes,
+            cache_eval_episodes=cache_eval_episodes,
+            bucket_episodes_by_shape=bucket_episodes_by_shape,
+            episode_bucket_width=episode_bucket_width,
+            pad_episodes=pad_episodes,
+            max_images_per_batch=max_images_per_batch,
+        )
+
+        self.dataset_configs = dataset_configs
+        self.source_weights = source_weights
+        self.source_transforms_train = source_transforms_train or {}
+        self.source_transforms_eval = source_transforms_eval or {}
+
+    def build_dataset(
+        self, split_name: str, rescan_cache: bool, num_episodes: int
+    ) -> MultiSourceEpisodeDataset:
+        if split_name == "train":
+            transform_config, source_transforms = (
+                self.transform_train,
+                self.source_transforms_train,
+            )
+        else:
+            transform_config, source_transforms = (
+                self.transform_eval,
+                self.source_transforms_eval,
+            )
+
+        # every source can give up to all episodes of the mix
+        datasets = {
+            source_name: hydra.utils.instantiate(
+                config=dataset_config,
+                split_name=split_name,
+                **self.get_transform_kwargs(
+                    source_transforms.get(source_name, transform_config)
+                ),
+                _recursive_=False,
+                rescan_cache=rescan_cache,
+                num_episodes=num_episodes,
+            )
+            for source_name, dataset_config in self.dataset_configs.items()
+        }
+
+        return MultiSourceEpisodeDataset(
+            datasets=datasets,
+            num_episodes=num_episodes,
+            source_weights=self.source_weights,
+            seed=self.seed,
+            num_workers=self.data_loader_config.num_workers,
+        )
+
+    def get_dataset_fingerprint(self) -> Dict[str, Any]:
+        dataset_configs = {}
+        for source_name, dataset_config in self.dataset_configs.items():
+            dataset_configs[source_name] = get_config_fingerprint(dataset_config)
+            dataset_configs[source_name].pop("rescan_cache", None)
+
+        return dict(
+            dataset_name="_".join(self.dataset_configs.keys()),
+            dataset_configs=dataset_configs,
+            source_weights=self.source_weights,
+            source_transforms_eval={
+                source_name: get_config_fingerprint(transform_config)
+                for source_name, transform_config in self.source_transforms_eval.items()
+            },
+            seed=self.seed,
+        )
+
+    def get_source_episode_counts(self) -> Dict[str, Dict[str, int]]:
+        """
+        Return the number of episodes loaded so far from every source, for
+        every split that is set up.
+        """
+        return {
+            split_name: dataset.get_source_episode_counts()
+            for split_name, dataset in [
+                ("train", self.train_set),
+                ("val", self.val_set),
+                ("test", self.test_set),
+            ]
+            if dataset is not None
+        }
@@ -0,0 +1,524 @@
+import collections
+import json
+import os
+import pathlib
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.encoded_store import (
+    DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+    DecodedImageCache,
+    DecodedImageCacheInfo,
+)
+from gate.datasets.memmap_store import _stack_column, replace_directory
+
+log = get_logger(
+    __name__,
+)
+
+CHUNKED_STORE_FORMAT_VERSION = 1
+DEFAULT_CHUNK_BYTES = 1024 * 1024
+
+
+class ChunkCodecs:
+    LZ4: str = "lz4"
+    ZSTD: str = "zstd"
+    ZLIB: str = "zlib"
+
+
+def get_chunk_codec(
+    codec: str, compression_level: Optional[int] = None
+) -> Tuple[Callable[[bytes], bytes], Callable[[bytes, int], bytes]]:
+    """
+    Return the (compress, decompress) functions of `codec`, where
+    decompress takes the compressed chunk and its uncompressed size. The
+    `lz4` and `zstandard` packages are only imported when their codec is
+    used, and all three codecs release the GIL, so chunks are
+    (de)compressed in parallel by threads.
+    """
+    if codec == ChunkCodecs.LZ4:
+        import lz4.block
+
+        def compress(data):
+            return lz4.block.compress(
+                data, compression=compression_level or 0, store_size=False
+            )
+
+        def decompress(data, raw_size):
+            return lz4.block.decompress(data, uncompressed_size=raw_size)
+
+    elif codec == ChunkCodecs.ZSTD:
+        import zstandard
+
+        def compress(data):
+            return zstandard.ZstdCompressor(
+                level=compression_level if compression_level is not None else 3
+            ).compress(data)
+
+        def decompress(data, raw_size):
+            return zstandard.ZstdDecompressor().decompress(
+                data, max_output_size=raw_size
+            )
+
+    elif codec == ChunkCodecs.ZLIB:
+
+        def compress(data):
+            return zlib.compress(
+                data, compression_level if compression_level is not None else 1
+            )
+
+        def decompress(data, raw_size):
+            return zlib.decompress(data, bufsize=raw_size)
+
+    else:
+        raise ValueError(
+            f"Invalid chunk codec {codec}, must be one of {ChunkCodecs.LZ4}, "
+            f"{ChunkCodecs.ZSTD}, {ChunkCodecs.ZLIB}"
+        )
+
+    return compress, decompress
+
+
+def resolve_chunk_codec(codec: str) -> str:
+    """
+    Return `codec`, or `ChunkCodecs.ZLIB` when the package of `codec` is not
+    installed.
+    """
+    try:
+        get_chunk_codec(codec)
+    except ImportError:
+        log.warning(
+            f"The {codec} chunk codec is not installed, falling back to "
+            f"{ChunkCodecs.ZLIB}"
+        )
+        return ChunkCodecs.ZLIB
+
+    return codec
+
+
+def get_chunk_ranges(
+    image_sizes: np.ndarray, group_ids: np.ndarray, chunk_bytes: int
+) -> List[Tuple[int, int]]:
+    """
+    Split samples laid out back to back, with `image_sizes` bytes each, into
+    [start, end) ranges of at most `chunk_bytes` (or one sample, if larger),
+    which never span two groups.
+    """
+    chunk_ranges = []
+    start = 0
+    num_bytes = 0
+
+    for idx, (image_size, group_id) in enumerate(zip(image_sizes, group_ids)):
+        if idx > start and (
+            group_id != group_ids[start] or num_bytes + image_size > chunk_bytes
+        ):
+            chunk_ranges.append((start, idx))
+            start = idx
+            num_bytes = 0
+
+        num_bytes += int(image_size)
+
+    if start < len(image_sizes):
+        chunk_ranges.append((start, len(image_sizes)))
+
+    return chunk_ranges
+
+
+def get_subset_group_ids(
+    num_samples: int,
+    subset_idx: int,
+    class_to_address_dict: Dict[Any, Any],
+) -> np.ndarray:
+    """
+    Return the index of the class of every sample of subset `subset_idx`
+    in `class_to_address_dict`, or -1 for samples that are in no class.
+    """
+    group_ids = np.full((num_samples,), -1, dtype=np.int64)
+
+    for group_id, addresses in enumerate(class_to_address_dict.values()):
+        addresses = np.asarray(addresses, dtype=np.int64).reshape(-1, 2)
+        group_ids[addresses[addresses[:, 0] == subset_idx, 1]] = group_id
+
+    return group_ids
+
+
+class ChunkedImageStore:
+    """
+    A build-once, read-many store of a single dataset subset whose images
+    are compressed in chunks.
+
+    Images are laid out grouped by class (or by any `group_ids` given when
+    building), cut into chunks of about `chunk_bytes` uncompressed bytes
+    which never span two groups, and every chunk is compressed with LZ4,
+    zstd or zlib into one file (`chunks.bin`). A chunk index
+    (`chunk_offsets.npy`, `chunk_raw_sizes.npy`) locates the chunks, and a
+    sample index (`sample_chunks.npy`, `sample_offsets.npy`, `shapes.npy`)
+    locates every image in its chunk, so that reading the samples of an
+    episode only decompresses the chunks they fall in. Every other
+    fixed-shape feature is kept as a column array.
+
+    Samples keep their index in the subset, so the store stands in for the
+    subset beneath the class to (subset_idx, sample_idx) index of the
+    episodic datasets. Decompressed chunks are kept in a `DecodedImageCache`
+    of `chunk_cache_bytes`, and `prefetch` decompresses the chunks of a set
+    of samples with a pool of `num_workers` threads.
+    """
+
+    def __init__(
+        self,
+        store_dir: Union[str, pathlib.Path],
+        chunk_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+        num_workers: Optional[int] = None,
+    ):
+        self.store_dir = pathlib.Path(store_dir)
+
+        with open(self.store_dir / "manifest.json", "r") as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        self.image_key = self.manifest["image_key"]
+        self.column_keys = self.manifest["column_keys"]
+        self.num_samples = self.manifest["num_samples"]
+        self.codec = self.manifest["codec"]
+        self.num_workers = num_workers
+        self.cache = DecodedImageCache(max_bytes=chunk_cache_bytes)
+
+        self._decompress = get_chunk_codec(self.codec)[1]
+        self._chunks = None
+        self._chunk_offsets = None
+        self._chunk_raw_sizes = None
+        self._sample_chunks = None
+        self._sample_offsets = None
+        self._shapes = None
+        self._columns = None
+        self._executor = None
+
+    @staticmethod
+    def exists(store_dir: Union[str, pathlib.Path]) -> bool:
+        manifest_path = pathlib.Path(store_dir) / "manifest.json"
+
+        if not manifest_path.exists():
+            return False
+
+        with open(manifest_path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        return manifest.get("chunked_format_version") == CHUNKED_STORE_FORMAT_VERSION
+
+    @classmethod
+    def build(
+        cls,
+        store_dir: Union[str, pathlib.Path],
+        subset: Any,
+        image_key: str,
+        group_ids: Optional[np.ndarray] = None,
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+        codec: str = ChunkCodecs.LZ4,
+        compression_level: Optional[int] = None,
+        num_workers: Optional[int] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        chunk_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+    ) -> "ChunkedImageStore":
+        """
+        Compress the images of `subset` (a `MemmapImageStore`,
+        `ColumnarSubset` or list of sample dicts) into a store and return
+        it opened. Chunks are compressed by `num_workers` threads, and the
+        store is written to a temporary directory and moved into place once
+        complete, like a `MemmapImageStore`.
+        """
+        store_dir = pathlib.Path(store_dir)
+        store_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = store_dir.parent / f".{store_dir.name}.{uuid.uuid4().hex}.tmp"
+        tmp_dir.mkdir(parents=True)
+
+        compress = get_chunk_codec(codec, compression_level)[0]
+        num_samples = len(subset)
+
+        def get_image(index):
+            if hasattr(subset, "get_image"):
+                return subset.get_image(index)
+            return subset[index][image_key]
+
+        if group_ids is None:
+            group_ids = np.zeros((num_samples,), dtype=np.int64)
+
+        # samples of no group are laid out after all the groups
+        group_ids = np.where(group_ids < 0, np.iinfo(np.int64).max, group_ids)
+        layout = np.argsort(group_ids, kind="stable")
+
+        shapes = np.zeros((num_samples, 3), dtype=np.int32)
+        for index in range(num_samples):
+            image_shape = get_image(index).shape
+            if len(image_shape) != 3:
+                raise ValueError(
+                    f"Only decoded HxWxC images can be chunked, sample {index} "
+                    f"has an image of shape {image_shape}"
+                )
+            shapes[index] = image_shape
+
+        chunk_ranges = get_chunk_ranges(
+            image_sizes=np.prod(shapes[layout], axis=1, dtype=np.int64),
+            group_ids=group_ids[layout],
+            chunk_bytes=chunk_bytes,
+        )
+
+        sample_chunks = np.zeros((num_samples,), dtype=np.int32)
+        sample_offsets = np.zeros((num_samples,), dtype=np.int64)
+        chunk_raw_sizes = np.zeros((len(chunk_ranges),), dtype=np.int64)
+
+        def get_chunk(chunk_idx):
+            start, end = chunk_ranges[chunk_idx]
+            images = [
+                np.ascontiguousarray(get_image(index), dtype=np.uint8).tobytes()
+                for index in layout[start:end]
+            ]
+            offset = 0
+            for index, image in zip(layout[start:end], images):
+                sample_chunks[index] = chunk_idx
+                sample_offsets[index] = offset
+                offset += len(image)
+            chunk_raw_sizes[chunk_idx] = offset
+            return compress(b"".join(images))
+
+        chunk_offsets = np.zeros((len(chunk_ranges) + 1,), dtype=np.int64)
+        num_workers = num_workers or os.cpu_count() or 1
+
+        with open(tmp_dir / "chunks.bin", "wb") as chunk_file, ThreadPoolExecutor(
+            max_workers=num_workers
+        ) as executor:
+
+            def write_chunk(chunk_idx, future):
+                chunk = future.result()
+                chunk_file.write(chunk)
+                chunk_offsets[chunk_idx + 1] = chunk_offsets[chunk_idx] + len(chunk)
+
+            # keep a bounded number of chunks in flight, written in order
+            in_flight = collections.deque()
+            for chunk_idx in range(len(chunk_ranges)):
+                in_flight.append((chunk_idx, executor.submit(get_chunk, chunk_idx)))
+                if len(in_flight) > 2 * num_workers:
+                    write_chunk(*in_flight.popleft())
+            while len(in_flight) > 0:
+                write_chunk(*in_flight.popleft())
+
+        columns = {}
+        if hasattr(subset, "column_keys"):
+            column_keys = subset.column_keys
+        elif num_samples > 0:
+            column_keys = [key for key in subset[0].keys() if key != image_key]
+        else:
+            column_keys = []
+
+        for key in column_keys:
+            column = (
+                subset.column(key)
+                if hasattr(subset, "column")
+                else _stack_column([sample[key] for sample in subset])
+            )
+            if column is None:
+                log.info(
+                    f"Feature {key} does not have a fixed shape, "
+                    f"it will not be kept in the store at {store_dir}"
+                )
+                continue
+            np.save(tmp_dir / f"column_{key}.npy", np.asarray(column))
+            columns[key] = column
+
+        np.save(tmp_dir / "chunk_offsets.npy", chunk_offsets)
+        np.save(tmp_dir / "chunk_raw_sizes.npy", chunk_raw_sizes)
+        np.save(tmp_dir / "sample_chunks.npy", sample_chunks)
+        np.save(tmp_dir / "sample_offsets.npy", sample_offsets)
+        np.save(tmp_dir / "shapes.npy", shapes)
+
+        manifest = dict(
+            chunked_format_version=CHUNKED_STORE_FORMAT_VERSION,
+            image_key=image_key,
+            column_keys=list(columns.keys()),
+            num_samples=num_samples,
+            num_chunks=len(chunk_ranges),
+            codec=codec,
+            chunk_bytes=int(chunk_bytes),
+            num_bytes=int(chunk_raw_sizes.sum()),
+            num_compressed_bytes=int(chunk_offsets[-1]),
+            metadata=metadata or {},
+        )
+
+        with open(tmp_dir / "manifest.json", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        replace_directory(tmp_dir, store_dir)
+
+        log.info(
+            f"Built chunked store at {store_dir} with {num_samples} samples in "
+            f"{manifest['num_chunks']} {codec} chunks, "
+            f"{manifest['num_bytes']} bytes compressed to "
+            f"{manifest['num_compressed_bytes']}"
+        )
+
+        return cls(
+            store_dir, chunk_cache_bytes=chunk_cache_bytes, num_workers=num_workers
+        )
+
+    def _open(self):
+        self._chunk_offsets = np.load(self.store_dir / "chunk_offsets.npy")
+        self._chunk_raw_sizes = np.load(self.store_dir / "chunk_raw_sizes.npy")
+        self._sample_chunks = np.load(
+            self.store_dir / "sample_chunks.npy", mmap_mode="r"
+        )
+        self._sample_offsets = np.load(
+            self.store_dir / "sample_offsets.npy", mmap_mode="r"
+        )
+        self._shapes = np.load(self.store_dir / "shapes.npy", mmap_mode="r")
+        self._columns = {
+            key: np.load(self.store_dir / f"column_{key}.npy", mmap_mode="r")
+            for key in self.column_keys
+        }
+        if self._chunk_offsets[-1] > 0:
+            self._chunks = np.memmap(
+                self.store_dir / "chunks.bin", dtype=np.uint8, mode="r"
+            )
+        else:
+            self._chunks = np.empty((0,), dtype=np.uint8)
+
+    @property
+    def chunks(self) -> np.ndarray:
+        if self._chunks is None:
+            self._open()
+        return self._chunks
+
+    @property
+    def num_chunks(self) -> int:
+        return self.manifest["num_chunks"]
+
+    def column(self, key: str) -> np.ndarray:
+        if key == self.image_key:
+            raise KeyError(
+                f"{key} is stored in compressed chunks, use get_image instead"
+            )
+        if self._columns is None:
+            self._open()
+        return self._columns[key]
+
+    def decompress_chunk(self, chunk_idx: int) -> np.ndarray:
+        if self._chunks is None:
+            self._open()
+
+        start, end = self._chunk_offsets[chunk_idx], self._chunk_offsets[chunk_idx + 1]
+        chunk = self._decompress(
+            self.chunks[start:end].tobytes(), int(self._chunk_raw_sizes[chunk_idx])
+        )
+        return np.frombuffer(chunk, dtype=np.uint8)
+
+    def get_chunk(self, chunk_idx: int) -> np.ndarray:
+        return self.cache.get(chunk_idx, lambda: self.decompress_chunk(chunk_idx))
+
+    def get_sample_chunks(self, indices: Sequence[int]) -> np.ndarray:
+        if self._sample_chunks is None:
+            self._open()
+        return np.unique(self._sample_chunks[np.asarray(indices, dtype=np.int64)])
+
+    def prefetch(self, indices: Sequence[int]):
+        """
+        Decompress the chunks that hold the samples at `indices` and are
+        not cached yet, in parallel, into the chunk cache.
+        """
+        chunk_idxs = [
+            int(chunk_idx)
+            for chunk_idx in self.get_sample_chunks(indices)
+            if int(chunk_idx) not in self.cache.images
+        ]
+
+        if len(chunk_idxs) <= 1:
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+        for chunk_idx, chunk in zip(
+            chunk_idxs, self._executor.map(self.decompress_chunk, chunk_idxs)
+        ):
+            self.cache.get(chunk_idx, lambda: chunk)
+
+    def get_image(self, index: int) -> np.ndarray:
+        if self._sample_chunks is None:
+            self._open()
+
+        shape = tuple(self._shapes[index])
+        offset = int(self._sample_offsets[index])
+        chunk = self.get_chunk(int(self._sample_chunks[index]))
+        return chunk[offset : offset + int(np.prod(shape))].reshape(shape)
+
+    def cache_info(self) -> DecodedImageCacheInfo:
+        return self.cache.cache_info()
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if index < 0:
+            index += self.num_samples
+
+        sample = {self.image_key: self.get_image(index)}
+
+        for key in self.column_keys:
+            sample[key] = self.column(key)[index]
+
+        return sample
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self.num_samples):
+            yield self[index]
+
+    def __getstate__(self):
+        # memory maps are reopened lazily, and the chunk cache and thread
+        # pool recreated, in the receiving process
+        state = self.__dict__.copy()
+        for key in [
+            "_chunks",
+            "_chunk_offsets",
+            "_chunk_raw_sizes",
+            "_sample_chunks",
+            "_sample_offsets",
+            "_shapes",
+            "_columns",
+            "_executor",
+            "_decompress",
+        ]:
+            state[key] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._decompress = get_chunk_codec(self.codec)[1]
+
+
+def prefetch_subset_samples(
+    subsets: Sequence[Any], addresses: Iterable[Tuple[int, int]]
+):
+    """
+    Let the subsets that can (e.g. `ChunkedImageStore`s) fetch the samples
+    at the (subset_idx, sample_idx) `addresses` ahead of them being read
+    one by one.
+    """
+    subset_indices = {}
+    for subset_idx, sample_idx in addresses:
+        subset_indices.setdefault(int(subset_idx), []).append(int(sample_idx))
+
+    for subset_idx, indices in subset_indices.items():
+        if hasattr(subsets[subset_idx], "prefetch"):
+            subsets[subset_idx].prefetch(indices)
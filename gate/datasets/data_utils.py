@@ -1,14 +1,33 @@
+import io
+import json
 import pathlib
+import uuid
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Callable, Iterator, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import h5py
+import numpy as np
 import torch.utils.data
+import torchvision.transforms.functional as F
 from numpy import random
+from PIL import Image
 from torch.utils.data import Subset
+from torchvision.transforms import InterpolationMode
 
 from gate.base.utils.loggers import get_logger
+from gate.datasets.memmap_store import replace_directory
 
 log = get_logger(
     __name__,
@@ -29,6 +48,70 @@ class FewShotSuperSplitSetOptions:
     TEST: str = "test"
 
 
+@dataclass
+class DatasetStorageOptions:
+    IN_MEMORY: str = "in_memory"
+    MEMMAP: str = "memmap"
+    ENCODED: str = "encoded"
+    ENCODED_MEMMAP: str = "encoded_memmap"
+    CHUNKED: str = "chunked"
+
+
+@dataclass
+class TFDSReaderOptions:
+    TENSORFLOW: str = "tensorflow"
+    TFRECORD: str = "tfrecord"
+    SYNTHETIC: str = "synthetic"
+
+
+def get_image_cache_name(size: Sequence[int], interpolation: str) -> str:
+    height, width = size
+    return f"{height}x{width}_{interpolation}"
+
+
+def resize_image(
+    image: np.ndarray, size: Sequence[int], interpolation: str = "bilinear"
+) -> np.ndarray:
+    """
+    Resize a HxWxC uint8 image to `size` (height, width) exactly as
+    `ToPILImage()` followed by `Resize(size, interpolation)` would, keeping
+    the channel dimension.
+    """
+    num_channels = image.shape[-1]
+    pil_image = Image.fromarray(image[..., 0] if num_channels == 1 else image)
+    resized_image = np.asarray(
+        F.resize(
+            pil_image,
+            size=list(size),
+            interpolation=InterpolationMode(interpolation),
+        )
+    )
+
+    if resized_image.ndim == 2:
+        resized_image = resized_image[..., None]
+
+    return resized_image
+
+
+def get_batch_size(batch: Any) -> Optional[int]:
+    """
+    Return the number of episodes (or samples) of a batch, the length of
+    the first tensor found in its targets.
+    """
+    _, target_dict = batch
+    values = [target_dict]
+    while len(values) > 0:
+        value = values.pop(0)
+        if isinstance(value, torch.Tensor):
+            return len(value) if value.dim() > 0 else None
+        if isinstance(value, dict):
+            values.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            values.extend(value)
+
+    return None
+
+
 def collate_resample_none(batch):
     batch = list(filter(lambda x: x is not None, batch))
     # logging.info(len(batch))
@@ -62,8 +145,16 @@ def get_class_to_idx_dict(
     class_to_idx_dict = defaultdict(list)
 
     for subset_idx, subset in enumerate(subsets):
-        for sample_idx, sample in enumerate(subset):
-            key = sample[class_name_key]
+        # memory-mapped stores expose labels as a column, which avoids
+        # touching the image data while building the index
+        if class_name_key in getattr(subset, "column_keys", []):
+            subset_labels = subset.column(class_name_key)
+        elif isinstance(subset, np.ndarray):
+            subset_labels = subset
+        else:
+            subset_labels = (sample[class_name_key] for sample in subset)
+
+        for sample_idx, key in enumerate(subset_labels):
             if label_extractor_fn is not None:
                 key = label_extractor_fn(key)
             class_to_idx_dict[key].append((int(subset_idx), int(sample_idx)))
@@ -75,42 +166,384 @@ def get_class_to_idx_dict(
     return temp_class_to_idx_dict
 
 
-def get_class_to_image_idx_and_bbox(
-    subsets: List[Iterator],
+def select_split_classes(
+    class_names: List[Any],
+    split_name: str,
+    split_percentage: Optional[Dict[str, int]] = None,
+    split_config: Optional[Dict[str, List[Any]]] = None,
+) -> List[Any]:
+    """
+    Return the classes out of the sorted `class_names` that belong to
+    `split_name`, either listed explicitly in `split_config` or taken as
+    consecutive class index ranges sized by `split_percentage`.
+    """
+    if split_config is not None:
+        return list(split_config[split_name])
+
+    num_train_classes = split_percentage[FewShotSuperSplitSetOptions.TRAIN]
+    num_val_classes = split_percentage[FewShotSuperSplitSetOptions.VAL]
+    num_test_classes = split_percentage[FewShotSuperSplitSetOptions.TEST]
+
+    if split_name == FewShotSuperSplitSetOptions.TRAIN:
+        in_split = lambda idx: idx < num_train_classes
+    elif split_name == FewShotSuperSplitSetOptions.VAL:
+        in_split = (
+            lambda idx: num_train_classes < idx < num_train_classes + num_val_classes
+        )
+    elif split_name == FewShotSuperSplitSetOptions.TEST:
+        in_split = (
+            lambda idx: num_train_classes + num_val_classes
+            < idx
+            < num_train_classes + num_val_classes + num_test_classes
+        )
+    else:
+        raise ValueError(f"Invalid split name passed {split_name}")
+
+    return [class_name for idx, class_name in enumerate(class_names) if in_split(idx)]
+
+
+CLASS_INDEX_FORMAT_VERSION = 1
+
+
+class PerClassReservoir:
+    """
+    Keep a uniform random sample of at most `capacity` items of every class
+    of a stream of (integer class label, item) pairs in a single pass, with
+    one reservoir (Algorithm R) per class.
+
+    Labels are offered a batch at a time and items are only fetched, with
+    `get_item_fn`, for the samples that enter a reservoir, which is the same
+    as offering them one at a time. The kept items only depend on `seed`
+    and on the order of the stream.
+    """
+
+    def __init__(self, capacity: int, seed: int = 0):
+        self.capacity = capacity
+        self.rng = np.random.RandomState(seed)
+        self.class_counts = np.zeros(shape=(0,), dtype=np.int64)
+        self.items = []
+        self.stream_indices = []
+        self.num_seen = 0
+
+    def _grow(self, num_classes: int):
+        num_new_classes = num_classes - len(self.class_counts)
+        if num_new_classes <= 0:
+            return
+        self.class_counts = np.concatenate(
+            [self.class_counts, np.zeros(shape=(num_new_classes,), dtype=np.int64)]
+        )
+        self.items.extend([None] * self.capacity for _ in range(num_new_classes))
+        self.stream_indices.extend(
+            np.full(shape=(self.capacity,), fill_value=-1, dtype=np.int64)
+            for _ in range(num_new_classes)
+        )
+
+    def add(self, labels: np.ndarray, get_item_fn: Callable[[int], Any]):
+        labels = np.asarray(labels)
+
+        if labels.dtype.kind not in "iu":
+            raise ValueError(
+                f"{self.__class__.__name__} needs integer class labels, "
+                f"got labels of dtype {labels.dtype}"
+            )
+
+        labels = labels.astype(np.int64).reshape(-1)
+        if len(labels) == 0:
+            return
+
+        self._grow(int(labels.max()) + 1)
+
+        # position of every sample among the samples of its class seen so far
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        group_starts = np.flatnonzero(
+            np.concatenate([[True], sorted_labels[1:] != sorted_labels[:-1]])
+        )
+        group_sizes = np.diff(np.append(group_starts, len(labels)))
+        ranks = np.empty_like(labels)
+        ranks[order] = np.arange(len(labels)) - np.repeat(group_starts, group_sizes)
+        positions = self.class_counts[labels] + ranks
+
+        draws = self.rng.random_sample(len(labels))
+        slots = np.where(
+            positions < self.capacity,
+            positions,
+            np.floor(draws * (positions + 1)).astype(np.int64),
+        )
+
+        for batch_idx in np.flatnonzero(slots < self.capacity):
+            label, slot = labels[batch_idx], slots[batch_idx]
+            self.items[label][slot] = get_item_fn(int(batch_idx))
+            self.stream_indices[label][slot] = self.num_seen + batch_idx
+
+        self.class_counts += np.bincount(labels, minlength=len(self.class_counts))
+        self.num_seen += len(labels)
+
+    def get_class_items(self) -> Dict[int, List[Any]]:
+        """
+        Return the kept items of every class that was seen, in stream order.
+        """
+        class_items = {}
+
+        for label, (items, stream_indices) in enumerate(
+            zip(self.items, self.stream_indices)
+        ):
+            num_items = min(int(self.class_counts[label]), self.capacity)
+            if num_items == 0:
+                continue
+            order = np.argsort(stream_indices[:num_items], kind="stable")
+            class_items[label] = [items[idx] for idx in order]
+
+        return class_items
+
+
+def save_class_index(
+    index_dir: Union[str, pathlib.Path],
+    class_to_records_dict: Dict[Any, Any],
+    manifest: Dict[str, Any],
+) -> Optional[Dict[Any, np.ndarray]]:
+    """
+    Store a class to records index (e.g. the (subset_idx, sample_idx)
+    addresses of each class) as one flat int32 records array with per-class
+    offsets, next to a JSON manifest describing the inputs it was built
+    from. Returns the index as loaded back by `load_class_index`, or None
+    if the class names cannot be stored without pickling.
+    """
+    class_names = np.array(list(class_to_records_dict.keys()))
+
+    if class_names.dtype.kind not in "iuSU":
+        log.info(
+            f"Class names of dtype {class_names.dtype} can not be stored, "
+            f"the class index at {index_dir} will not be cached"
+        )
+        return None
+
+    class_records = [
+        np.array(records, dtype=np.int32) for records in class_to_records_dict.values()
+    ]
+    record_width = max(
+        [records.shape[-1] for records in class_records if len(records)] or [2]
+    )
+    class_records = [records.reshape(-1, record_width) for records in class_records]
+    class_offsets = np.cumsum(
+        [0] + [len(records) for records in class_records], dtype=np.int64
+    )
+    records = np.concatenate(
+        class_records + [np.zeros(shape=(0, record_width), dtype=np.int32)], axis=0
+    )
+
+    index_dir = pathlib.Path(index_dir)
+    index_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = index_dir.parent / f".{index_dir.name}.{uuid.uuid4().hex}.tmp"
+    tmp_dir.mkdir(parents=True)
+
+    np.savez(
+        tmp_dir / "class_index.npz",
+        class_names=class_names,
+        class_offsets=class_offsets,
+        records=records,
+    )
+
+    with open(tmp_dir / "manifest.json", "w") as manifest_file:
+        json.dump(
+            dict(format_version=CLASS_INDEX_FORMAT_VERSION, **manifest), manifest_file
+        )
+
+    replace_directory(tmp_dir, index_dir)
+
+    return load_class_index(index_dir=index_dir, manifest=manifest)
+
+
+def load_class_index(
+    index_dir: Union[str, pathlib.Path], manifest: Dict[str, Any]
+) -> Optional[Dict[Any, np.ndarray]]:
+    """
+    Load an index stored by `save_class_index`, returning a dict of class name
+    to an int32 array of records, or None if there is no index at
+    `index_dir` or it was built from inputs other than those in `manifest`.
+    """
+    index_dir = pathlib.Path(index_dir)
+    manifest_path = index_dir / "manifest.json"
+
+    if not manifest_path.exists():
+        return None
+
+    with open(manifest_path, "r") as manifest_file:
+        stored_manifest = json.load(manifest_file)
+
+    expected_manifest = json.loads(
+        json.dumps(dict(format_version=CLASS_INDEX_FORMAT_VERSION, **manifest))
+    )
+
+    if stored_manifest != expected_manifest:
+        log.info(f"Class index at {index_dir} is out of date, it will be rebuilt")
+        return None
+
+    with np.load(index_dir / "class_index.npz") as class_index:
+        class_names = class_index["class_names"].tolist()
+        class_offsets = class_index["class_offsets"]
+        records = class_index["records"]
+
+    return {
+        class_name: records[class_offsets[idx] : class_offsets[idx + 1]]
+        for idx, class_name in enumerate(class_names)
+    }
+
+
+# one record per object instance, with its box in pixels as
+# (row_min, col_min, row_max, col_max) of the image it is cropped from
+OBJECT_RECORD_DTYPE = np.dtype(
+    [
+        ("subset_idx", np.int32),
+        ("sample_idx", np.int32),
+        ("label", np.int32),
+        ("bbox", np.int16, (4,)),
+    ]
+)
+
+
+def get_image_shape(image: Union[np.ndarray, bytes]) -> Tuple[int, int]:
+    """
+    Return the (height, width) of a decoded image, or of an encoded one by
+    only reading its header.
+    """
+    if isinstance(image, np.ndarray) and image.dtype == np.uint8 and image.ndim == 3:
+        return image.shape[0], image.shape[1]
+
+    if isinstance(image, np.ndarray):
+        image = image.tobytes()
+
+    width, height = Image.open(io.BytesIO(image)).size
+    return height, width
+
+
+def get_object_records(
+    subsets: List[Iterable[Dict[str, Any]]],
+    image_key: str = "image",
     label_extractor_fn: Optional[Callable] = None,
-):
-    class_to_image_idx_and_bbox = defaultdict(list)
+) -> Tuple[np.ndarray, Dict[Any, np.ndarray]]:
+    """
+    Index every object instance of the samples of `subsets`, which hold
+    their objects' normalized boxes and labels under `objects`.
+
+    Returns a structured array of `OBJECT_RECORD_DTYPE` records, in
+    (subset, sample, object) order, and a dict of class name (the object
+    label passed through `label_extractor_fn`) to the int32 rows of its
+    records, with class names sorted. Objects whose box is less than a
+    pixel high or wide are left out, as there is nothing to crop.
+    """
+    subset_indices = []
+    sample_indices = []
+    labels = []
+    bboxes = []
 
     for subset_idx, subset in enumerate(subsets):
         for sample_idx, sample in enumerate(subset):
-            image = sample["image"]
-            objects = sample["objects"]
-            object_ids = objects["label"]
-            object_bboxes = objects["bbox"]
-            for object_idx, object_bbox in zip(object_ids, object_bboxes):
-                key = object_idx
-                if label_extractor_fn is not None:
-                    key = label_extractor_fn(key)
-
-                x_min = int(object_bbox[0] * image.shape[0])
-                y_min = int(object_bbox[1] * image.shape[1])
-                x_max = int(object_bbox[2] * image.shape[0])
-                y_max = int(object_bbox[3] * image.shape[1])
-
-                class_to_image_idx_and_bbox[key].append(
-                    dict(
-                        subset_idx=int(subset_idx),
-                        sample_idx=int(sample_idx),
-                        bbox=dict(x_min=x_min, y_min=y_min, x_max=x_max, y_max=y_max),
-                        label=int(object_idx),
-                    )
-                )
-
-    temp_class_to_image_idx_and_bbox = {}
-    for key in sorted(class_to_image_idx_and_bbox.keys()):
-        temp_class_to_image_idx_and_bbox[key] = class_to_image_idx_and_bbox[key]
-
-    return temp_class_to_image_idx_and_bbox
+            height, width = get_image_shape(sample[image_key])
+            object_labels = np.asarray(sample["objects"]["label"]).reshape(-1)
+            object_bboxes = np.asarray(
+                sample["objects"]["bbox"], dtype=np.float32
+            ).reshape(-1, 4)
+            scale = np.array([height, width, height, width], dtype=np.float32)
+
+            subset_indices.append(np.full(len(object_labels), subset_idx))
+            sample_indices.append(np.full(len(object_labels), sample_idx))
+            labels.append(object_labels)
+            bboxes.append((object_bboxes * scale).astype(np.int16))
+
+    objects = np.zeros(
+        shape=(sum(len(sample_labels) for sample_labels in labels),),
+        dtype=OBJECT_RECORD_DTYPE,
+    )
+
+    if len(objects) > 0:
+        objects["subset_idx"] = np.concatenate(subset_indices)
+        objects["sample_idx"] = np.concatenate(sample_indices)
+        objects["label"] = np.concatenate(labels)
+        objects["bbox"] = np.concatenate(bboxes)
+
+    bbox = objects["bbox"]
+    is_empty = (bbox[:, 2] <= bbox[:, 0]) | (bbox[:, 3] <= bbox[:, 1])
+    if is_empty.any():
+        log.info(f"Leaving out {int(is_empty.sum())} objects with empty boxes")
+        objects = objects[~is_empty]
+
+    # the label extractor is only called once per distinct label
+    unique_labels, label_inverse = np.unique(objects["label"], return_inverse=True)
+    unique_class_names = [
+        label_extractor_fn(label) if label_extractor_fn is not None else int(label)
+        for label in unique_labels.astype(np.int64)
+    ]
+
+    class_to_rows = defaultdict(list)
+    for label_idx, class_name in enumerate(unique_class_names):
+        class_to_rows[class_name].append(np.flatnonzero(label_inverse == label_idx))
+
+    return objects, {
+        class_name: np.sort(np.concatenate(class_to_rows[class_name])).astype(np.int32)
+        for class_name in sorted(class_to_rows.keys())
+    }
+
+
+def save_object_index(
+    index_dir: Union[str, pathlib.Path],
+    objects: np.ndarray,
+    class_to_rows: Dict[Any, np.ndarray],
+    manifest: Dict[str, Any],
+):
+    """
+    Store the object records and class rows returned by `get_object_records`
+    with `save_class_index`, as one row of int32 fields per object.
+    """
+    save_class_index(
+        index_dir=index_dir,
+        class_to_records_dict={
+            class_name: np.concatenate(
+                [
+                    rows[:, None],
+                    objects["subset_idx"][rows, None],
+                    objects["sample_idx"][rows, None],
+                    objects["label"][rows, None],
+                    objects["bbox"][rows],
+                ],
+                axis=1,
+            )
+            for class_name, rows in class_to_rows.items()
+        },
+        manifest=dict(manifest, object_record_fields=list(OBJECT_RECORD_DTYPE.names)),
+    )
+
+
+def load_object_index(
+    index_dir: Union[str, pathlib.Path], manifest: Dict[str, Any]
+) -> Optional[Tuple[np.ndarray, Dict[Any, np.ndarray]]]:
+    """
+    Load an object index stored by `save_object_index`, or return None if
+    there is none matching `manifest` at `index_dir`.
+    """
+    class_to_records_dict = load_class_index(
+        index_dir=index_dir,
+        manifest=dict(manifest, object_record_fields=list(OBJECT_RECORD_DTYPE.names)),
+    )
+
+    if class_to_records_dict is None:
+        return None
+
+    objects = np.zeros(
+        shape=(sum(len(records) for records in class_to_records_dict.values()),),
+        dtype=OBJECT_RECORD_DTYPE,
+    )
+    class_to_rows = {}
+
+    for class_name, records in class_to_records_dict.items():
+        rows = np.ascontiguousarray(records[:, 0])
+        objects["subset_idx"][rows] = records[:, 1]
+        objects["sample_idx"][rows] = records[:, 2]
+        objects["label"][rows] = records[:, 3]
+        objects["bbox"][rows] = records[:, 4:8]
+        class_to_rows[class_name] = rows
+
+    return objects, class_to_rows
 
 
 def store_dict_as_hdf5(input_dict: dict, h5_path: str):
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+from gate.datasets.tfrecord_reader import decode_image
+
+DEFAULT_DECODED_IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class DecodedImageCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    max_bytes: int
+    num_bytes: int
+    num_images: int
+
+
+class DecodedImageCache:
+    """
+    A least recently used cache of decoded uint8 images, bounded by the
+    total number of bytes of the images it holds rather than by their
+    count, since images of a dataset can differ widely in size.
+
+    Every process holds its own cache: caches are emptied when pickled, so
+    each DataLoader worker starts with an empty cache of `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        self.images = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, decode_fn: Callable[[], np.ndarray]) -> np.ndarray:
+        image = self.images.get(key)
+
+        if image is not None:
+            self.hits += 1
+            self.images.move_to_end(key)
+            return image
+
+        self.misses += 1
+        image = decode_fn()
+
+        if image.nbytes > self.max_bytes:
+            return image
+
+        self.images[key] = image
+        self.num_bytes += image.nbytes
+
+        while self.num_bytes > self.max_bytes:
+            _, evicted_image = self.images.popitem(last=False)
+            self.num_bytes -= evicted_image.nbytes
+
+        return image
+
+    def cache_info(self) -> DecodedImageCacheInfo:
+        return DecodedImageCacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            max_bytes=self.max_bytes,
+            num_bytes=self.num_bytes,
+            num_images=len(self.images),
+        )
+
+    def __getstate__(self):
+        return dict(max_bytes=self.max_bytes)
+
+    def __setstate__(self, state):
+        self.max_bytes = state["max_bytes"]
+        self.clear()
+
+
+class EncodedImageSubset:
+    """
+    A subset whose images are kept encoded (the original PNG or JPEG
+    bytes), either in a list of samples held in memory or in a
+    `MemmapImageStore` of one flat uint8 array per image. Images are
+    decoded when a sample is indexed, through a `DecodedImageCache`, which
+    trades decoding time for the memory of keeping every image decoded.
+    Subsets of the same dataset can share one cache, and so one budget, by
+    being given distinct `name`s.
+
+    Indexing it returns a dict of features with the image decoded to a
+    HxWxC uint8 array, like the subsets it stands in for.
+    """
+
+    def __init__(
+        self,
+        subset: Any,
+        image_key: str,
+        channels: Optional[int],
+        name: str = "",
+        cache: Optional[DecodedImageCache] = None,
+    ):
+        self.subset = subset
+        self.image_key = image_key
+        self.channels = channels
+        self.name = name
+        self.cache = cache if cache is not None else DecodedImageCache()
+
+    @property
+    def column_keys(self) -> List[str]:
+        if hasattr(self.subset, "column_keys"):
+            return self.subset.column_keys
+
+        if len(self.subset) == 0:
+            return []
+
+        return [key for key in self.subset[0].keys() if key != self.image_key]
+
+    def column(self, key: str) -> Any:
+        if hasattr(self.subset, "column"):
+            return self.subset.column(key)
+
+        return [sample[key] for sample in self.subset]
+
+    def get_encoded_image(self, index: int) -> bytes:
+        if hasattr(self.subset, "get_image"):
+            return self.subset.get_image(index).tobytes()
+
+        return self.subset[index][self.image_key]
+
+    def get_image(self, index: int) -> np.ndarray:
+        if index < 0:
+            index += len(self)
+
+        return self.cache.get(
+            (self.name, index),
+            lambda: decode_image(self.get_encoded_image(index), channels=self.channels),
+        )
+
+    def cache_info(self) -> DecodedImageCacheInfo:
+        return self.cache.cache_info()
+
+    def __len__(self):
+        return len(self.subset)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        sample = dict(self.subset[index])
+        sample[self.image_key] = self.get_image(index)
+        return sample
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+def get_decoded_image_cache_info(
+    subsets: List[Any],
+) -> Optional[DecodedImageCacheInfo]:
+    """
+    Sum the counters of the decoded image caches of the
+    `EncodedImageSubset`s in `subsets`, or return None when none of them
+    keeps images encoded.
+    """
+    caches = {
+        id(subset.cache): subset.cache
+        for subset in subsets
+        if isinstance(subset, EncodedImageSubset)
+    }
+    cache_infos = [cache.cache_info() for cache in caches.values()]
+
+    if len(cache_infos) == 0:
+        return None
+
+    return DecodedImageCacheInfo(*[sum(values) for values in zip(*cache_infos)])
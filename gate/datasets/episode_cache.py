@@ -0,0 +1,343 @@
+import hashlib
+import json
+import pathlib
+import shutil
+import uuid
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import torch
+from dotted_dict import DottedDict
+from torch.utils.data import Dataset
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.memmap_store import replace_directory
+
+log = get_logger(__name__)
+
+EPISODE_CACHE_FORMAT_VERSION = 1
+MAX_LEAF_NDIM = 8
+# leaves are written at aligned offsets, so that they can be viewed in place
+LEAF_ALIGNMENT = 64
+
+
+class EpisodeLeafKinds:
+    TENSOR: int = 0
+    ARRAY: int = 1
+    SCALAR: int = 2
+
+
+EPISODE_LEAF_DTYPE = np.dtype(
+    [
+        ("path", np.int32),
+        ("dtype", np.int16),
+        ("kind", np.int8),
+        ("ndim", np.int8),
+        ("offset", np.int64),
+        ("shape", np.int64, (MAX_LEAF_NDIM,)),
+    ]
+)
+
+
+def get_episode_cache_key(metadata: Dict[str, Any]) -> str:
+    return hashlib.sha1(
+        json.dumps(metadata, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def flatten_episode(
+    item: Any, path: Tuple[str, ...] = ()
+) -> Iterator[Tuple[Tuple[str, ...], Any]]:
+    """
+    Yield the (path, leaf) pairs of an episode, a (possibly nested) tuple,
+    list or mapping of tensors, arrays and scalars.
+    """
+    if isinstance(item, Mapping):
+        for key, value in item.items():
+            yield from flatten_episode(value, path + (str(key),))
+    elif isinstance(item, (tuple, list)):
+        for idx, value in enumerate(item):
+            yield from flatten_episode(value, path + (str(idx),))
+    else:
+        yield path, item
+
+
+def unflatten_episode(leaves: Sequence[Tuple[Tuple[str, ...], Any]]) -> Tuple:
+    """
+    Rebuild an episode flattened by `flatten_episode` whose top level is a
+    tuple (or list), with every mapping below it as a `DottedDict`.
+    """
+    episode = {}
+    for path, value in leaves:
+        node = episode
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+
+    def to_dotted_dict(node):
+        if not isinstance(node, dict):
+            return node
+        return DottedDict({key: to_dotted_dict(value) for key, value in node.items()})
+
+    return tuple(
+        to_dotted_dict(episode[str(idx)]) for idx in range(len(episode.keys()))
+    )
+
+
+class EpisodeCache(Dataset):
+    """
+    A build-once, read-many store of fully built (e.g. transformed
+    evaluation) episodes, read back as a dataset of the same episodes.
+
+    Every episode is flattened into its tensor, array and scalar leaves,
+    written one after the other to one flat file (`episodes.bin`), with a
+    leaf index (`leaves.npy`) of the path, dtype and shape of every leaf
+    and the range of leaves of every episode (`episode_offsets.npy`). The
+    file is memory-mapped lazily, once per process, and reading an episode
+    copies its leaves out of it into new tensors.
+
+    Only deterministic episodes should be cached: episodes drawn with
+    random transforms would be frozen at their first draw.
+    """
+
+    def __init__(self, cache_dir: Union[str, pathlib.Path]):
+        self.cache_dir = pathlib.Path(cache_dir)
+
+        with open(self.cache_dir / "manifest.json", "r") as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        self.num_episodes = self.manifest["num_episodes"]
+        self.paths = [tuple(path) for path in self.manifest["paths"]]
+        self.dtypes = [np.dtype(dtype) for dtype in self.manifest["dtypes"]]
+
+        self._data = None
+        self._leaves = None
+        self._episode_offsets = None
+
+    @staticmethod
+    def exists(cache_dir: Union[str, pathlib.Path]) -> bool:
+        manifest_path = pathlib.Path(cache_dir) / "manifest.json"
+
+        if not manifest_path.exists():
+            return False
+
+        with open(manifest_path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        return manifest.get("format_version") == EPISODE_CACHE_FORMAT_VERSION
+
+    @classmethod
+    def build(
+        cls,
+        cache_dir: Union[str, pathlib.Path],
+        episodes: Iterable[Any],
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> "EpisodeCache":
+        """
+        Write `episodes` to a cache and return it opened. The cache is
+        written to a temporary directory and moved into place once
+        complete, so that an interrupted build leaves no partial cache.
+        """
+        cache_dir = pathlib.Path(cache_dir)
+        cache_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = cache_dir.parent / f".{cache_dir.name}.{uuid.uuid4().hex}.tmp"
+        tmp_dir.mkdir(parents=True)
+
+        path_ids = {}
+        dtype_ids = {}
+        leaves = []
+        episode_offsets = [0]
+        num_bytes = 0
+
+        with open(tmp_dir / "episodes.bin", "wb") as data_file:
+            for episode in episodes:
+                for path, value in flatten_episode(episode):
+                    if isinstance(value, torch.Tensor):
+                        kind = EpisodeLeafKinds.TENSOR
+                        array = value.detach().cpu().contiguous().numpy()
+                    elif isinstance(value, np.ndarray):
+                        kind = EpisodeLeafKinds.ARRAY
+                        array = np.ascontiguousarray(value)
+                    elif isinstance(value, (bool, int, float, np.number)):
+                        kind = EpisodeLeafKinds.SCALAR
+                        array = np.asarray(value)
+                    else:
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                        raise ValueError(
+                            f"Episode leaf {'/'.join(path)} of type "
+                            f"{type(value).__name__} can not be cached"
+                        )
+
+                    if array.ndim > MAX_LEAF_NDIM or array.dtype.hasobject:
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                        raise ValueError(
+                            f"Episode leaf {'/'.join(path)} of dtype "
+                            f"{array.dtype} and shape {array.shape} can not be "
+                            f"cached"
+                        )
+
+                    padding = -num_bytes % LEAF_ALIGNMENT
+                    data_file.write(b"\0" * padding)
+                    num_bytes += padding
+
+                    leaves.append(
+                        (
+                            path_ids.setdefault(path, len(path_ids)),
+                            dtype_ids.setdefault(array.dtype.str, len(dtype_ids)),
+                            kind,
+                            array.ndim,
+                            num_bytes,
+                            array.shape + (0,) * (MAX_LEAF_NDIM - array.ndim),
+                        )
+                    )
+
+                    data_file.write(array.tobytes())
+                    num_bytes += array.nbytes
+
+                episode_offsets.append(len(leaves))
+
+        np.save(tmp_dir / "leaves.npy", np.array(leaves, dtype=EPISODE_LEAF_DTYPE))
+        np.save(
+            tmp_dir / "episode_offsets.npy", np.array(episode_offsets, dtype=np.int64)
+        )
+
+        manifest = dict(
+            format_version=EPISODE_CACHE_FORMAT_VERSION,
+            num_episodes=len(episode_offsets) - 1,
+            num_bytes=num_bytes,
+            paths=[list(path) for path in path_ids.keys()],
+            dtypes=list(dtype_ids.keys()),
+            metadata=metadata or {},
+        )
+        with open(tmp_dir / "manifest.json", "w") as manifest_file:
+            json.dump(manifest, manifest_file, default=str)
+
+        replace_directory(tmp_dir, cache_dir)
+
+        log.info(
+            f"Cached {manifest['num_episodes']} episodes "
+            f"({num_bytes / 1024 ** 2:.1f} MiB) to {cache_dir}"
+        )
+
+        return cls(cache_dir)
+
+    @classmethod
+    def load_or_build(
+        cls,
+        cache_dir: Union[str, pathlib.Path],
+        get_episodes_fn: Callable[[], Iterable[Any]],
+        metadata: Dict[str, Any],
+        rescan_cache: bool = False,
+    ) -> "EpisodeCache":
+        """
+        Open the cache at `cache_dir` if it was built from the same
+        `metadata`, or else build it from the episodes `get_episodes_fn`
+        returns.
+        """
+        if (
+            not rescan_cache
+            and cls.exists(cache_dir)
+            and cls(cache_dir).manifest["metadata"]
+            == json.loads(json.dumps(metadata, default=str))
+        ):
+            log.info(f"Loaded episode cache from {cache_dir}")
+            return cls(cache_dir)
+
+        return cls.build(
+            cache_dir=cache_dir, episodes=get_episodes_fn(), metadata=metadata
+        )
+
+    def _open(self):
+        self._leaves = np.load(self.cache_dir / "leaves.npy")
+        self._episode_offsets = np.load(self.cache_dir / "episode_offsets.npy")
+        if self.manifest["num_bytes"] > 0:
+            self._data = np.memmap(
+                self.cache_dir / "episodes.bin", dtype=np.uint8, mode="r"
+            ).view(np.ndarray)
+        else:
+            self._data = np.empty((0,), dtype=np.uint8)
+
+    def get_leaves(self, index: int) -> List[Tuple[Tuple[str, ...], Any]]:
+        if self._data is None:
+            self._open()
+
+        if index < 0:
+            index += self.num_episodes
+
+        leaves = []
+        start, end = self._episode_offsets[index], self._episode_offsets[index + 1]
+        for leaf in self._leaves[start:end].tolist():
+            path_id, dtype_id, kind, ndim, offset, shape = leaf
+            dtype = self.dtypes[dtype_id]
+            shape = tuple(shape[:ndim])
+            num_bytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+            array = (
+                self._data[offset : offset + num_bytes]
+                .view(dtype)
+                .reshape(shape)
+                .copy()
+            )
+
+            if kind == EpisodeLeafKinds.TENSOR:
+                value = torch.from_numpy(array)
+            elif kind == EpisodeLeafKinds.SCALAR:
+                value = array.item()
+            else:
+                value = array
+
+            leaves.append((self.paths[path_id], value))
+
+        return leaves
+
+    def __len__(self):
+        return self.num_episodes
+
+    def __getitem__(self, index):
+        # a list of indices, as given by a BatchSampler, is a meta-batch
+        if isinstance(index, (list, tuple, np.ndarray)):
+            return self.get_episode_batch(index)
+
+        return unflatten_episode(self.get_leaves(int(index)))
+
+    def get_episode_batch(self, indices: Sequence[int]) -> Tuple:
+        """
+        Stack the cached episodes at `indices` into one meta-batch, which
+        needs episodes of a fixed shape.
+        """
+        episode_leaves = [self.get_leaves(int(index)) for index in indices]
+
+        return unflatten_episode(
+            [
+                (
+                    path,
+                    (
+                        torch.stack([leaves[idx][1] for leaves in episode_leaves])
+                        if isinstance(value, torch.Tensor)
+                        else torch.as_tensor(
+                            np.stack([leaves[idx][1] for leaves in episode_leaves])
+                        )
+                    ),
+                )
+                for idx, (path, value) in enumerate(episode_leaves[0])
+            ]
+        )
+
+    def __getstate__(self):
+        # the memory map is reopened lazily in the receiving process
+        state = self.__dict__.copy()
+        state["_data"] = None
+        state["_leaves"] = None
+        state["_episode_offsets"] = None
+        return state
@@ -0,0 +1,177 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, get_worker_info
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.episode_sampler import Episode
+
+log = get_logger(__name__)
+
+
+def get_episode_sources(
+    num_episodes: int, source_weights: np.ndarray, seed: int = 0
+) -> np.ndarray:
+    """
+    Draw the source of every episode index with probabilities proportional
+    to `source_weights`, from a generator seeded with `seed`, so that the
+    same index is drawn from the same source on every run and in every
+    worker.
+    """
+    rng = np.random.RandomState(seed)
+
+    return rng.choice(
+        len(source_weights),
+        size=num_episodes,
+        p=source_weights / source_weights.sum(),
+    ).astype(np.int32)
+
+
+def get_source_episode_indices(source_ids: np.ndarray, num_sources: int) -> np.ndarray:
+    """
+    Number the episodes drawn from each source in order, so that the k-th
+    episode drawn from a source is episode k of that source.
+    """
+    source_episode_indices = np.zeros(len(source_ids), dtype=np.int64)
+    for source_id in range(num_sources):
+        source_mask = source_ids == source_id
+        source_episode_indices[source_mask] = np.arange(source_mask.sum())
+
+    return source_episode_indices
+
+
+class MultiSourceEpisodeSampler:
+    """
+    The episode sampler of a `MultiSourceEpisodeDataset`, which tells the
+    episode of an index from the episode sampler of its source, e.g. for
+    `EpisodeShapeBatchSampler` or `EpisodeBudgetBatchSampler` to batch
+    episodes of all sources ahead of loading them.
+    """
+
+    def __init__(
+        self,
+        source_ids: np.ndarray,
+        source_episode_indices: np.ndarray,
+        episode_samplers: List[Any],
+    ):
+        self.source_ids = source_ids
+        self.source_episode_indices = source_episode_indices
+        self.episode_samplers = episode_samplers
+
+    def __len__(self):
+        return len(self.source_ids)
+
+    def sample(self, index: int) -> Episode:
+        episode_sampler = self.episode_samplers[self.source_ids[index]]
+
+        return episode_sampler.sample(int(self.source_episode_indices[index]))
+
+
+class MultiSourceEpisodeDataset(Dataset):
+    """
+    Mix the episodes of several episodic datasets (e.g. Omniglot, CUB and
+    Aircraft) into one dataset, whose every episode is drawn from a single
+    source, picked per index with probabilities proportional to
+    `source_weights` (equal by default). The sources of all indices are
+    drawn up front from `seed`, so episodes are reproducible, and the k-th
+    episode drawn from a source is episode k of that source (wrapping
+    around if it has fewer), so no episode is drawn twice.
+
+    All sources are read through one DataLoader, and so one pool of
+    workers. The sources are loaded once, in the process that builds the
+    dataset, before workers are started: with a memory-mapped
+    `storage_mode`, every worker reads the images of every source through
+    the same page cache rather than a copy of its own. Episodes of all
+    sources are batched together, so they should be transformed to the
+    same image shape.
+
+    The number of episodes loaded from every source, by all workers, is
+    counted in shared memory, with one row of counters per worker (and one
+    for the main process) so that workers never write the same counter,
+    and read with `get_source_episode_counts`.
+    """
+
+    def __init__(
+        self,
+        datasets: Dict[str, Dataset],
+        num_episodes: int,
+        source_weights: Optional[Dict[str, float]] = None,
+        seed: int = 0,
+        num_workers: int = 0,
+    ):
+        super(MultiSourceEpisodeDataset, self).__init__()
+
+        if len(datasets) == 0:
+            raise ValueError("A multi-source dataset needs at least one source")
+
+        self.source_names = list(datasets.keys())
+        self.datasets = list(datasets.values())
+        self.num_episodes = num_episodes
+        self.seed = seed
+
+        if source_weights is None:
+            source_weights = {name: 1.0 for name in self.source_names}
+
+        unknown_source_names = set(source_weights.keys()) - set(self.source_names)
+        if len(unknown_source_names) > 0:
+            raise ValueError(
+                f"source_weights given for unknown sources "
+                f"{sorted(unknown_source_names)}, the sources are "
+                f"{self.source_names}"
+            )
+
+        self.source_weights = np.array(
+            [float(source_weights.get(name, 0.0)) for name in self.source_names]
+        )
+
+        if (self.source_weights < 0).any() or self.source_weights.sum() <= 0:
+            raise ValueError(
+                f"source_weights must be non-negative with a positive sum, "
+                f"got {source_weights}"
+            )
+
+        self.source_ids = get_episode_sources(
+            num_episodes=num_episodes, source_weights=self.source_weights, seed=seed
+        )
+        source_lengths = np.array([len(dataset) for dataset in self.datasets])
+        self.source_episode_indices = (
+            get_source_episode_indices(self.source_ids, num_sources=len(self.datasets))
+            % source_lengths[self.source_ids]
+        )
+        self.episode_sampler = MultiSourceEpisodeSampler(
+            source_ids=self.source_ids,
+            source_episode_indices=self.source_episode_indices,
+            episode_samplers=[dataset.episode_sampler for dataset in self.datasets],
+        )
+        self.input_shape_dict = getattr(self.datasets[0], "input_shape_dict", None)
+
+        self.episode_counts = torch.zeros(
+            (num_workers + 1, len(self.datasets)), dtype=torch.long
+        ).share_memory_()
+
+        source_num_episodes = np.bincount(self.source_ids, minlength=len(self.datasets))
+        log.info(
+            f"Mixing {num_episodes} episodes from "
+            f"{dict(zip(self.source_names, source_num_episodes.tolist()))}"
+        )
+
+    def __len__(self):
+        return self.num_episodes
+
+    def __getitem__(self, index):
+        source_id = int(self.source_ids[index])
+        episode = self.datasets[source_id][int(self.source_episode_indices[index])]
+
+        worker_info = get_worker_info()
+        self.episode_counts[
+            0 if worker_info is None else worker_info.id + 1, source_id
+        ] += 1
+
+        return episode
+
+    def get_source_episode_counts(self) -> Dict[str, int]:
+        return dict(zip(self.source_names, self.episode_counts.sum(dim=0).tolist()))
+
+    def reset_source_episode_counts(self):
+        self.episode_counts.zero_()
@@ -0,0 +1,881 @@
+import json
+import math
+import pathlib
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import torch
+import torch.distributed
+from torch.utils.data import BatchSampler, DistributedSampler, Sampler
+
+
+class ClassAddressIndex:
+    """
+    A class to records index (e.g. the (subset_idx, sample_idx) addresses of
+    each class) in CSR form: the records of all classes in one flat int32
+    array, class by class, with `class_offsets[i]:class_offsets[i + 1]`
+    spanning the records of class `i`. The class id of every record is
+    precomputed, so that the labels of an episode are a lookup rather than
+    a call to the label extractor per sample.
+    """
+
+    def __init__(
+        self,
+        class_names: List[Any],
+        class_offsets: np.ndarray,
+        records: np.ndarray,
+    ):
+        self.class_names = list(class_names)
+        self.class_offsets = np.asarray(class_offsets, dtype=np.int64)
+        self.records = np.asarray(records, dtype=np.int32)
+        self.class_sizes = np.diff(self.class_offsets)
+        self.record_class_ids = np.repeat(
+            np.arange(len(self.class_names), dtype=np.int32), self.class_sizes
+        )
+
+        if len(self.class_offsets) != len(self.class_names) + 1:
+            raise ValueError(
+                f"Expected {len(self.class_names) + 1} class offsets, "
+                f"got {len(self.class_offsets)}"
+            )
+
+    @classmethod
+    def from_class_to_records_dict(
+        cls, class_to_records_dict: Dict[Any, Any]
+    ) -> "ClassAddressIndex":
+        """
+        Build the index from a dict of class name to records, e.g. a list of
+        (subset_idx, sample_idx) tuples or an int32 array of object rows.
+        """
+        class_records = [
+            np.asarray(records, dtype=np.int32)
+            for records in class_to_records_dict.values()
+        ]
+        record_width = max(
+            [
+                1 if records.ndim == 1 else records.shape[-1]
+                for records in class_records
+                if len(records)
+            ]
+            or [2]
+        )
+        class_records = [records.reshape(-1, record_width) for records in class_records]
+        class_offsets = np.cumsum(
+            [0] + [len(records) for records in class_records], dtype=np.int64
+        )
+
+        return cls(
+            class_names=list(class_to_records_dict.keys()),
+            class_offsets=class_offsets,
+            records=np.concatenate(
+                class_records + [np.zeros(shape=(0, record_width), dtype=np.int32)],
+                axis=0,
+            ),
+        )
+
+    @property
+    def num_classes(self) -> int:
+        return len(self.class_names)
+
+    def __len__(self):
+        return self.num_classes
+
+    def get_class_records(self, class_id: int) -> np.ndarray:
+        return self.records[
+            self.class_offsets[class_id] : self.class_offsets[class_id + 1]
+        ]
+
+
+class Episode(NamedTuple):
+    # records of the samples of the episode, grouped by class in the order
+    # the classes were drawn and shuffled within each class
+    records: np.ndarray
+    # the episode (local) label of every sample
+    labels: np.ndarray
+    # whether every sample is in the support set, or else the query set
+    support_mask: np.ndarray
+    # the index class ids of the local labels 0, 1, ...
+    label_class_ids: np.ndarray
+
+    @property
+    def support_records(self) -> np.ndarray:
+        return self.records[self.support_mask]
+
+    @property
+    def query_records(self) -> np.ndarray:
+        return self.records[~self.support_mask]
+
+    @property
+    def support_labels(self) -> np.ndarray:
+        return self.labels[self.support_mask]
+
+    @property
+    def query_labels(self) -> np.ndarray:
+        return self.labels[~self.support_mask]
+
+    @property
+    def num_support(self) -> int:
+        return int(self.support_mask.sum())
+
+    @property
+    def num_queries(self) -> int:
+        return len(self.support_mask) - self.num_support
+
+
+class EpisodeSampler:
+    """
+    Draw the classes and samples of few-shot episodes from a
+    `ClassAddressIndex`, deterministically per episode index, with a
+    handful of numpy calls per episode rather than a loop per class.
+
+    Classes are drawn with replacement, each draw taking its own samples;
+    the shot and query counts are drawn once per episode, or per class with
+    `variable_num_queries_per_class_draw`. A class with fewer samples than
+    it needs keeps its last sample for the query set.
+    """
+
+    def __init__(
+        self,
+        class_index: ClassAddressIndex,
+        num_classes_per_set: int,
+        num_samples_per_class: int,
+        num_queries_per_class: int,
+        min_num_classes_per_set: Optional[int] = None,
+        min_num_samples_per_class: Optional[int] = None,
+        min_num_queries_per_class: Optional[int] = None,
+        variable_num_classes_per_set: bool = False,
+        variable_num_samples_per_class: bool = False,
+        variable_num_queries_per_class: bool = False,
+        variable_num_queries_per_class_draw: bool = False,
+    ):
+        self.class_index = class_index
+        self.num_classes_per_set = num_classes_per_set
+        self.num_samples_per_class = num_samples_per_class
+        self.num_queries_per_class = num_queries_per_class
+        self.min_num_classes_per_set = min_num_classes_per_set
+        self.min_num_samples_per_class = min_num_samples_per_class
+        self.min_num_queries_per_class = min_num_queries_per_class
+        self.variable_num_classes_per_set = variable_num_classes_per_set
+        self.variable_num_samples_per_class = variable_num_samples_per_class
+        self.variable_num_queries_per_class = variable_num_queries_per_class
+        self.variable_num_queries_per_class_draw = variable_num_queries_per_class_draw
+
+    @staticmethod
+    def get_rng(index: int) -> np.random.RandomState:
+        return np.random.RandomState(index)
+
+    def sample_classes(
+        self, rng: np.random.RandomState
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Draw the class ids of an episode, with replacement, and give every
+        distinct class a local label in a random order. Returns the drawn
+        class ids, the local label of every draw, and the class id of every
+        local label.
+        """
+        num_classes_per_set = (
+            rng.randint(self.min_num_classes_per_set, self.num_classes_per_set)
+            if self.variable_num_classes_per_set
+            else self.num_classes_per_set
+        )
+
+        class_ids = rng.randint(
+            0,
+            self.class_index.num_classes,
+            size=min(num_classes_per_set, self.class_index.num_classes),
+        )
+        unique_class_ids, class_labels = np.unique(class_ids, return_inverse=True)
+        label_order = rng.permutation(len(unique_class_ids))
+
+        return (
+            class_ids,
+            np.argsort(label_order)[class_labels],
+            unique_class_ids[label_order],
+        )
+
+    def sample_records(
+        self,
+        rng: np.random.RandomState,
+        class_ids: np.ndarray,
+        class_labels: np.ndarray,
+        label_class_ids: np.ndarray,
+        num_support: Union[int, np.ndarray],
+        num_queries: Union[int, np.ndarray],
+    ) -> Episode:
+        """
+        Draw `num_support + num_queries` samples without replacement from
+        every class of `class_ids` (scalars, or arrays with a count per
+        class), in one go: every candidate sample gets a random key, and
+        sorting the keys offset by their class draw shuffles the samples of
+        every draw in place.
+        """
+        class_sizes = self.class_index.class_sizes[class_ids]
+        num_selected = np.minimum(class_sizes, num_support + num_queries)
+        num_support = np.where(
+            num_selected > num_support, num_support, num_selected - 1
+        )
+
+        draw_ids = np.repeat(np.arange(len(class_ids)), class_sizes)
+        draw_starts = np.cumsum(class_sizes) - class_sizes
+        order = np.argsort(draw_ids + rng.random_sample(len(draw_ids)))
+        ranks = np.arange(len(draw_ids)) - draw_starts[draw_ids]
+
+        selected = ranks < num_selected[draw_ids]
+        draw_ids, ranks = draw_ids[selected], ranks[selected]
+        positions = (
+            self.class_index.class_offsets[class_ids][draw_ids]
+            + order[selected]
+            - draw_starts[draw_ids]
+        )
+
+        return Episode(
+            records=self.class_index.records[positions],
+            labels=class_labels[draw_ids].astype(np.int64),
+            support_mask=ranks < num_support[draw_ids],
+            label_class_ids=label_class_ids,
+        )
+
+    def sample(self, index: int) -> Episode:
+        rng = self.get_rng(index)
+
+        class_ids, class_labels, label_class_ids = self.sample_classes(rng)
+
+        if not self.variable_num_queries_per_class:
+            num_queries = self.num_queries_per_class
+        elif self.variable_num_queries_per_class_draw:
+            num_queries = rng.randint(
+                self.min_num_queries_per_class,
+                self.num_queries_per_class,
+                size=len(class_ids),
+            )
+        else:
+            # drawn once for all classes such that the query set is balanced
+            num_queries = rng.randint(
+                self.min_num_queries_per_class, self.num_queries_per_class
+            )
+
+        num_support = (
+            rng.randint(
+                self.min_num_samples_per_class,
+                self.num_samples_per_class,
+                size=len(class_ids),
+            )
+            if self.variable_num_samples_per_class
+            else self.num_samples_per_class
+        )
+
+        return self.sample_records(
+            rng=rng,
+            class_ids=class_ids,
+            class_labels=class_labels,
+            label_class_ids=label_class_ids,
+            num_support=num_support,
+            num_queries=num_queries,
+        )
+
+
+class EpisodeManifest:
+    """
+    The exact episodes a sampler generated, in CSR form: the records,
+    labels and support/query assignment of all samples of all episodes in
+    flat arrays, episode by episode, with `episode_offsets[i]:
+    episode_offsets[i + 1]` spanning the samples of episode `i`, and
+    likewise `label_offsets` spanning the class ids of its labels. Class
+    ids refer to `class_names`, the classes of the sampler's index, so that
+    a manifest can be replayed on a dataset that indexes them differently.
+
+    Manifests are saved as one compressed `.npz` file, and can be split
+    into contiguous ranges of episodes, e.g. to share them across machines.
+    """
+
+    def __init__(
+        self,
+        class_names: List[str],
+        episode_indices: np.ndarray,
+        episode_offsets: np.ndarray,
+        records: np.ndarray,
+        labels: np.ndarray,
+        support_mask: np.ndarray,
+        label_offsets: np.ndarray,
+        label_class_ids: np.ndarray,
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        self.class_names = [str(class_name) for class_name in class_names]
+        self.episode_indices = np.asarray(episode_indices, dtype=np.int64)
+        self.episode_offsets = np.asarray(episode_offsets, dtype=np.int64)
+        self.records = np.asarray(records, dtype=np.int32)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.support_mask = np.asarray(support_mask, dtype=bool)
+        self.label_offsets = np.asarray(label_offsets, dtype=np.int64)
+        self.label_class_ids = np.asarray(label_class_ids, dtype=np.int32)
+        self.metadata = metadata or {}
+
+        if not (
+            len(self.episode_offsets)
+            == len(self.label_offsets)
+            == len(self.episode_indices) + 1
+        ):
+            raise ValueError(
+                f"Expected {len(self.episode_indices) + 1} episode and label "
+                f"offsets, got {len(self.episode_offsets)} and "
+                f"{len(self.label_offsets)}"
+            )
+
+    @classmethod
+    def from_episodes(
+        cls,
+        episodes: Sequence[Episode],
+        class_names: List[Any],
+        episode_indices: Optional[Sequence[int]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> "EpisodeManifest":
+        if episode_indices is None:
+            episode_indices = np.arange(len(episodes))
+
+        return cls(
+            class_names=class_names,
+            episode_indices=episode_indices,
+            episode_offsets=np.cumsum(
+                [0] + [len(episode.records) for episode in episodes], dtype=np.int64
+            ),
+            records=(
+                np.concatenate([episode.records for episode in episodes], axis=0)
+                if len(episodes)
+                else np.zeros(shape=(0, 2), dtype=np.int32)
+            ),
+            labels=np.concatenate(
+                [episode.labels for episode in episodes] + [np.zeros((0,), np.int32)]
+            ),
+            support_mask=np.concatenate(
+                [episode.support_mask for episode in episodes] + [np.zeros((0,), bool)]
+            ),
+            label_offsets=np.cumsum(
+                [0] + [len(episode.label_class_ids) for episode in episodes],
+                dtype=np.int64,
+            ),
+            label_class_ids=np.concatenate(
+                [episode.label_class_ids for episode in episodes]
+                + [np.zeros((0,), np.int32)]
+            ),
+            metadata=metadata,
+        )
+
+    @classmethod
+    def from_sampler(
+        cls,
+        sampler: "EpisodeSampler",
+        indices: Sequence[int],
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> "EpisodeManifest":
+        """
+        Record the episodes `sampler` draws at `indices`.
+        """
+        indices = [int(index) for index in indices]
+
+        return cls.from_episodes(
+            episodes=[sampler.sample(index) for index in indices],
+            class_names=sampler.class_index.class_names,
+            episode_indices=indices,
+            metadata=metadata,
+        )
+
+    def save(self, path: Union[str, pathlib.Path]) -> None:
+        with open(path, "wb") as manifest_file:
+            np.savez_compressed(
+                manifest_file,
+                class_names=np.array(json.dumps(self.class_names)),
+                metadata=np.array(json.dumps(self.metadata, default=str)),
+                episode_indices=self.episode_indices,
+                episode_offsets=self.episode_offsets,
+                records=self.records,
+                labels=self.labels,
+                support_mask=self.support_mask,
+                label_offsets=self.label_offsets,
+                label_class_ids=self.label_class_ids,
+            )
+
+    @classmethod
+    def load(cls, path: Union[str, pathlib.Path]) -> "EpisodeManifest":
+        with np.load(path) as manifest_file:
+            return cls(
+                class_names=json.loads(manifest_file["class_names"].item()),
+                metadata=json.loads(manifest_file["metadata"].item()),
+                episode_indices=manifest_file["episode_indices"],
+                episode_offsets=manifest_file["episode_offsets"],
+                records=manifest_file["records"],
+                labels=manifest_file["labels"],
+                support_mask=manifest_file["support_mask"],
+                label_offsets=manifest_file["label_offsets"],
+                label_class_ids=manifest_file["label_class_ids"],
+            )
+
+    def __len__(self):
+        return len(self.episode_indices)
+
+    def __getitem__(self, index: int) -> Episode:
+        start, end = self.episode_offsets[index], self.episode_offsets[index + 1]
+        label_start, label_end = (
+            self.label_offsets[index],
+            self.label_offsets[index + 1],
+        )
+
+        return Episode(
+            records=self.records[start:end],
+            labels=self.labels[start:end].astype(np.int64),
+            support_mask=self.support_mask[start:end],
+            label_class_ids=self.label_class_ids[label_start:label_end],
+        )
+
+    def get_range(self, start: int, end: int) -> "EpisodeManifest":
+        """
+        Return the manifest of episodes `start` to `end` (exclusive).
+        """
+        start, end, _ = slice(start, end).indices(len(self))
+        end = max(start, end)
+        sample_start, sample_end = self.episode_offsets[[start, end]]
+        label_start, label_end = self.label_offsets[[start, end]]
+
+        return EpisodeManifest(
+            class_names=self.class_names,
+            episode_indices=self.episode_indices[start:end],
+            episode_offsets=self.episode_offsets[start : end + 1] - sample_start,
+            records=self.records[sample_start:sample_end],
+            labels=self.labels[sample_start:sample_end],
+            support_mask=self.support_mask[sample_start:sample_end],
+            label_offsets=self.label_offsets[start : end + 1] - label_start,
+            label_class_ids=self.label_class_ids[label_start:label_end],
+            metadata=self.metadata,
+        )
+
+    def get_shard(self, shard_idx: int, num_shards: int) -> "EpisodeManifest":
+        """
+        Return the `shard_idx`-th of `num_shards` contiguous, near equal
+        ranges of episodes.
+        """
+        bounds = np.linspace(0, len(self), num_shards + 1).astype(np.int64)
+        return self.get_range(bounds[shard_idx], bounds[shard_idx + 1])
+
+
+class ManifestEpisodeSampler:
+    """
+    Replay the episodes of an `EpisodeManifest` in place of an
+    `EpisodeSampler`: episode `index` is the `index`-th of the manifest,
+    with its class ids mapped onto the classes of `class_index` by name.
+    """
+
+    def __init__(self, manifest: EpisodeManifest, class_index: ClassAddressIndex):
+        self.manifest = manifest
+        self.class_index = class_index
+
+        class_name_to_id = {
+            str(class_name): class_id
+            for class_id, class_name in enumerate(class_index.class_names)
+        }
+        missing_class_names = [
+            class_name
+            for class_name in manifest.class_names
+            if class_name not in class_name_to_id
+        ]
+        if missing_class_names:
+            raise ValueError(
+                f"The classes {missing_class_names[:10]} of the episode manifest "
+                f"are not classes of the dataset"
+            )
+
+        if len(manifest.records) and (
+            manifest.records.shape[1:] != class_index.records.shape[1:]
+        ):
+            raise ValueError(
+                f"Episode manifest records of shape {manifest.records.shape[1:]} "
+                f"do not match dataset records of shape "
+                f"{class_index.records.shape[1:]}"
+            )
+
+        self.class_id_map = np.array(
+            [class_name_to_id[class_name] for class_name in manifest.class_names],
+            dtype=np.int32,
+        )
+
+    def __len__(self):
+        return len(self.manifest)
+
+    def sample(self, index: int) -> Episode:
+        episode = self.manifest[index]
+
+        return episode._replace(
+            label_class_ids=self.class_id_map[episode.label_class_ids]
+        )
+
+
+class EpisodeIndexBatchSampler(BatchSampler):
+    """
+    A `BatchSampler` of episode indices, which passes `set_epoch` on to the
+    sampler it batches: Lightning only sets the epoch of the sampler and
+    batch sampler of a loader, so without it the epoch of a wrapped
+    `DistributedEpisodeSampler` would never move on.
+    """
+
+    def set_epoch(self, epoch: int):
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+
+def get_sampler_epoch_key(sampler: Sampler) -> Optional[Tuple[Any, ...]]:
+    """
+    Identify the indices `sampler` is about to draw by its epoch, seed and
+    offset, or None for a sampler without an epoch (e.g. a `RandomSampler`),
+    which draws other indices on every iteration.
+    """
+    if not hasattr(sampler, "epoch"):
+        return None
+
+    return (
+        sampler.epoch,
+        getattr(sampler, "seed", None),
+        getattr(sampler, "offset", None),
+    )
+
+
+class EpisodeBatchSampler(Sampler):
+    """
+    The base of batch samplers that batch the episode indices drawn by
+    `sampler` by the episodes they draw. The batches of an epoch are built
+    once, by `iter_batches`, and kept for as long as `sampler` is on the
+    same epoch (see `get_sampler_epoch_key`), so that `__len__` is the
+    exact number of batches `__iter__` yields and the episodes are not
+    drawn again to count them. A sampler without an epoch draws new
+    batches on every iteration, and `__len__` counts those of the running,
+    or else the next, iteration.
+    """
+
+    def __init__(self, sampler: Sampler):
+        self.sampler = sampler
+        self.batches = None
+        self.batches_key = None
+        self.batches_drawn = False
+
+    def set_epoch(self, epoch: int):
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def iter_batches(self) -> Iterator[List[int]]:
+        raise NotImplementedError
+
+    def get_batches(self, draw: bool = False) -> List[List[int]]:
+        key = get_sampler_epoch_key(self.sampler)
+
+        if (
+            self.batches is None
+            or key != self.batches_key
+            or (draw and key is None and self.batches_drawn)
+        ):
+            self.batches = list(self.iter_batches())
+            self.batches_key = key
+            self.batches_drawn = False
+
+        self.batches_drawn = self.batches_drawn or draw
+
+        return self.batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        yield from self.get_batches(draw=True)
+
+    def __len__(self):
+        return len(self.get_batches())
+
+
+class EpisodeShapeBatchSampler(EpisodeBatchSampler):
+    """
+    Batch the episode indices drawn by `sampler` by the sizes of their
+    support and query sets, so that episodes of a variable way or shot can
+    be meta-batched. Episodes are bucketed by their set sizes, rounded up
+    to a multiple of `bucket_width` (e.g. to be padded to the same shape by
+    `collate_padded_episodes`), and a bucket is yielded as soon as it holds
+    `batch_size` episodes; what is left in the buckets at the end of an
+    epoch is yielded last, unless `drop_last` is set.
+
+    The set sizes of an episode are read off `episode_sampler`, which draws
+    the same episode for an index as the dataset does.
+    """
+
+    def __init__(
+        self,
+        sampler: Sampler,
+        episode_sampler: Any,
+        batch_size: int,
+        drop_last: bool = False,
+        bucket_width: int = 1,
+    ):
+        super(EpisodeShapeBatchSampler, self).__init__(sampler)
+        self.episode_sampler = episode_sampler
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.bucket_width = bucket_width
+        self.bucket_keys = {}
+
+    def get_bucket_key(self, index: int) -> Tuple[int, int]:
+        if index not in self.bucket_keys:
+            episode = self.episode_sampler.sample(index)
+            self.bucket_keys[index] = (
+                -(-episode.num_support // self.bucket_width),
+                -(-episode.num_queries // self.bucket_width),
+            )
+
+        return self.bucket_keys[index]
+
+    def iter_batches(self) -> Iterator[List[int]]:
+        buckets = {}
+        for index in self.sampler:
+            index = int(index)
+            bucket = buckets.setdefault(self.get_bucket_key(index), [])
+            bucket.append(index)
+
+            if len(bucket) == self.batch_size:
+                yield bucket
+                del buckets[self.get_bucket_key(index)]
+
+        if not self.drop_last:
+            yield from buckets.values()
+
+
+class EpisodeBudgetBatchSampler(EpisodeBatchSampler):
+    """
+    Pack the episode indices drawn by `sampler` into batches of as many
+    episodes as fit in `max_images_per_batch` images, for episodes whose
+    sizes vary widely (e.g. Meta-Dataset style ones), so that memory use is
+    predictable whatever episodes are drawn. A batch is counted in images
+    as it is padded by `collate_padded_episodes`: its number of episodes
+    times its largest support set plus its largest query set. An episode
+    larger than the budget makes a batch of its own.
+
+    Indices are packed `pool_size` at a time, sorted by the sizes of their
+    episodes within each pool, so that episodes of similar sizes share a
+    batch and little of the budget is spent on padding.
+    """
+
+    def __init__(
+        self,
+        sampler: Sampler,
+        episode_sampler: Any,
+        max_images_per_batch: int,
+        pool_size: int = 256,
+    ):
+        super(EpisodeBudgetBatchSampler, self).__init__(sampler)
+        self.episode_sampler = episode_sampler
+        self.max_images_per_batch = max_images_per_batch
+        self.pool_size = pool_size
+        self.episode_sizes = {}
+
+    def get_episode_size(self, index: int) -> Tuple[int, int]:
+        if index not in self.episode_sizes:
+            episode = self.episode_sampler.sample(index)
+            self.episode_sizes[index] = (episode.num_support, episode.num_queries)
+
+        return self.episode_sizes[index]
+
+    def pack(self, indices: List[int]) -> Iterator[List[int]]:
+        indices = sorted(indices, key=lambda index: sum(self.get_episode_size(index)))
+
+        batch, max_num_support, max_num_queries = [], 0, 0
+        for index in indices:
+            num_support, num_queries = self.get_episode_size(index)
+            batch_max_num_support = max(max_num_support, num_support)
+            batch_max_num_queries = max(max_num_queries, num_queries)
+
+            if (
+                batch
+                and (len(batch) + 1) * (batch_max_num_support + batch_max_num_queries)
+                > self.max_images_per_batch
+            ):
+                yield batch
+                batch = []
+                batch_max_num_support, batch_max_num_queries = num_support, num_queries
+
+            batch.append(index)
+            max_num_support, max_num_queries = (
+                batch_max_num_support,
+                batch_max_num_queries,
+            )
+
+        if batch:
+            yield batch
+
+    def iter_batches(self) -> Iterator[List[int]]:
+        pool = []
+        for index in self.sampler:
+            pool.append(int(index))
+
+            if len(pool) == self.pool_size:
+                yield from self.pack(pool)
+                pool = []
+
+        yield from self.pack(pool)
+
+
+def get_distributed_world_size() -> int:
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_world_size()
+
+    return 1
+
+
+def get_distributed_rank() -> int:
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank()
+
+    return 0
+
+
+def trainer_replaces_samplers(trainer: Any) -> bool:
+    """
+    Whether Lightning replaces the samplers of the loaders of `trainer` with
+    distributed ones, as a distributed trainer does unless it runs with
+    `replace_sampler_ddp=False` (`use_distributed_sampler=False` in later
+    versions of Lightning).
+    """
+    if trainer is None or trainer.world_size <= 1:
+        return False
+
+    accelerator_connector = trainer._accelerator_connector
+
+    return bool(
+        getattr(
+            accelerator_connector,
+            "use_distributed_sampler",
+            getattr(accelerator_connector, "replace_sampler_ddp", False),
+        )
+    )
+
+
+class AffinePermutation:
+    """
+    A seeded permutation of `range(size)`, which maps position `i` to
+    `(multiplier * i + increment) % size`, with a `multiplier` coprime with
+    `size` so that every index is drawn once. Any position is looked up in
+    O(1), without materialising the permutation, so an iteration over it
+    can start at any offset.
+
+    Consecutive positions are a fixed stride apart, which makes for a weak
+    shuffle of arbitrary data, but is enough for episode indices, each of
+    which seeds a random episode of its own.
+    """
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+
+        rng = np.random.RandomState(seed % 2**32)
+        if size <= 1:
+            self.multiplier, self.increment = 1, 0
+        else:
+            self.multiplier = int(rng.randint(1, size))
+            while math.gcd(self.multiplier, size) != 1:
+                self.multiplier = int(rng.randint(1, size))
+            self.increment = int(rng.randint(0, size))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position: int) -> int:
+        return (self.multiplier * position + self.increment) % self.size
+
+
+class DistributedEpisodeSampler(DistributedSampler):
+    """
+    Partition the episode indices of a dataset between the ranks of a
+    distributed run without overlap: every rank takes every
+    `num_replicas`-th index, from its rank on, of the same order of all
+    indices, with `shuffle` an `AffinePermutation` seeded by `seed` and the
+    epoch. With a single replica it is a plain (shuffling) sampler.
+
+    Unlike `DistributedSampler`, shards are never padded with repeated
+    indices, which would evaluate some episodes twice. With `drop_last`
+    the last indices are left out so that every rank gets the same number
+    (as training needs, to step in lockstep), and otherwise every index is
+    drawn once and shards differ in size by at most one (as evaluation
+    needs, to see every episode once).
+
+    The position of the sampler in its shard, the `offset` of the next
+    index to draw, is moved on with `advance` as indices are consumed, and
+    saved and restored with the epoch and seed by `state_dict` and
+    `load_state_dict`. An iteration starts at `offset`, which is a lookup
+    into the permutation rather than a replay of the indices before it, so
+    a resumed run draws the rest of its interrupted epoch and nothing else.
+    """
+
+    def __init__(
+        self,
+        dataset: Any,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = False,
+    ):
+        super(DistributedEpisodeSampler, self).__init__(
+            dataset,
+            num_replicas=num_replicas,
+            rank=rank,
+            shuffle=shuffle,
+            seed=seed,
+            drop_last=drop_last,
+        )
+
+        if drop_last:
+            self.num_samples = len(self.dataset) // self.num_replicas
+        else:
+            self.num_samples = len(
+                range(self.rank, len(self.dataset), self.num_replicas)
+            )
+        self.total_size = len(self.dataset)
+        self.offset = 0
+
+    def set_epoch(self, epoch: int):
+        if epoch != self.epoch:
+            self.offset = 0
+
+        super(DistributedEpisodeSampler, self).set_epoch(epoch)
+
+    def advance(self, num_indices: int):
+        self.offset += num_indices
+
+    def state_dict(self) -> Dict[str, int]:
+        return dict(epoch=self.epoch, seed=self.seed, offset=self.offset)
+
+    def load_state_dict(self, state_dict: Dict[str, int]):
+        if state_dict["seed"] != self.seed:
+            raise ValueError(
+                f"Can not resume a sampler seeded with {state_dict['seed']} "
+                f"with seed {self.seed}"
+            )
+
+        self.epoch = state_dict["epoch"]
+        self.offset = state_dict["offset"]
+
+    def __iter__(self) -> Iterator[int]:
+        # a finished epoch that is drawn again, e.g. by a loop that does not
+        # call set_epoch, starts over
+        start = self.offset if self.offset < self.num_samples else 0
+        self.offset = start
+
+        if self.shuffle:
+            permutation = AffinePermutation(
+                len(self.dataset), seed=self.seed + self.epoch
+            )
+        else:
+            permutation = range(len(self.dataset))
+
+        for position in range(start, self.num_samples):
+            yield permutation[self.rank + position * self.num_replicas]
+
+    def __len__(self):
+        return self.num_samples
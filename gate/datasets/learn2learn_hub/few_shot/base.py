@@ -1,27 +1,89 @@
+import json
 import multiprocessing
 import pathlib
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-from typing import Any, Callable, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Sequence
 
-import h5py
 import hydra
-import torch
-from PIL.Image import Image
+import numpy as np
 from omegaconf import DictConfig
-from torchvision.transforms import transforms
 from tqdm import tqdm
 
 from gate.base.utils.loggers import get_logger
-from gate.datasets.data_utils import get_class_to_idx_dict, store_dict_as_hdf5
-from gate.datasets.tf_hub.few_shot.base import FewShotClassificationDatasetTFDS
+from gate.datasets.data_utils import (
+    DatasetStorageOptions,
+    TFDSReaderOptions,
+    get_class_to_idx_dict,
+    get_image_cache_name,
+    load_class_index,
+    resize_image,
+    save_class_index,
+)
+from gate.datasets.encoded_store import DEFAULT_DECODED_IMAGE_CACHE_BYTES
+from gate.datasets.memmap_store import MemmapImageStore
+from gate.datasets.shared_subsets import get_callable_fingerprint
+from gate.datasets.tf_hub.few_shot.base import (
+    FewShotClassificationDatasetTFDS,
+    get_dataset_episode_sampler,
+)
 
 logger = get_logger(__name__)
 
+# the learn2learn dataset decoded by the workers of a decode pool, set once
+# per worker instead of being pickled along with every sample index
+_decode_dataset = None
 
-def data_load(item):
-    image, label = item
 
-    return transforms.ToTensor()(image).to(torch.uint8), label
+def init_decode_worker(dataset: Any):
+    global _decode_dataset
+    _decode_dataset = dataset
+
+
+def decode_sample(
+    index: int,
+    image_size: Optional[Sequence[int]] = None,
+    interpolation: str = "bilinear",
+) -> Dict[str, Any]:
+    """
+    Decode sample `index` of the dataset of this worker into a HxWx3 uint8
+    image, resized to `image_size` when given, and its label.
+    """
+    image, label = _decode_dataset[index]
+    image = np.asarray(image.convert("RGB"))
+
+    if image_size is not None:
+        image = resize_image(image, size=image_size, interpolation=interpolation)
+
+    return dict(image=image, label=int(label))
+
+
+def decode_samples(
+    dataset: Any,
+    image_size: Optional[Sequence[int]] = None,
+    interpolation: str = "bilinear",
+    num_workers: Optional[int] = None,
+    chunk_size: int = 64,
+):
+    """
+    Yield the decoded samples of a learn2learn dataset in order, decoded by
+    a pool of processes, since decoding and resizing with PIL holds the GIL.
+    """
+    with ProcessPoolExecutor(
+        max_workers=num_workers or multiprocessing.cpu_count(),
+        initializer=init_decode_worker,
+        initargs=(dataset,),
+    ) as executor:
+        yield from tqdm(
+            executor.map(
+                partial(
+                    decode_sample, image_size=image_size, interpolation=interpolation
+                ),
+                range(len(dataset)),
+                chunksize=chunk_size,
+            ),
+            total=len(dataset),
+        )
 
 
 class FewShotClassificationDatsetL2L(FewShotClassificationDatasetTFDS):
@@ -51,10 +113,47 @@ class FewShotClassificationDatsetL2L(FewShotClassificationDatasetTFDS):
         query_set_target_transform: Any = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
         label_extractor_fn: Optional[Callable] = None,
     ):
         super(FewShotClassificationDatasetTFDS, self).__init__()
 
+        if storage_mode not in (
+            DatasetStorageOptions.IN_MEMORY,
+            DatasetStorageOptions.MEMMAP,
+        ):
+            raise ValueError(
+                f"{self.__class__.__name__} only supports storage_mode "
+                f"{DatasetStorageOptions.IN_MEMORY} or "
+                f"{DatasetStorageOptions.MEMMAP}, got {storage_mode}"
+            )
+        self.storage_mode = storage_mode
+        # learn2learn datasets are loaded one split at a time, so there is
+        # nothing for share_subsets to share between splits
+        self.share_subsets = share_subsets
+        # learn2learn datasets only hold (image, label) pairs, so there are no
+        # extra features to keep
+        self.feature_keys = ["image", "label"]
+        # learn2learn datasets are decoded by a pool of processes below, in
+        # chunks of ingest_batch_size samples, instead of a tf.data pipeline
+        self.ingest_batch_size = ingest_batch_size
+        # learn2learn datasets are not read through TFDS
+        self.tfds_reader = tfds_reader
+        self.image_cache_size = image_cache_size
+        self.image_cache_interpolation = image_cache_interpolation
+        self.decoded_image_cache_bytes = decoded_image_cache_bytes
+        self.episode_manifest_path = episode_manifest_path
+        self.episode_manifest_range = episode_manifest_range
+
         self.dataset_name = dataset_name
         self.dataset_root = dataset_root
         self.input_target_annotation_keys = input_target_annotation_keys
@@ -131,46 +230,89 @@ class FewShotClassificationDatsetL2L(FewShotClassificationDatasetTFDS):
             download=download,
         )
 
-        dataset_new = []
-
-        logger.info(
-            f"Loading the {split_name} set of the {dataset_name} dataset into memory 💿"
-        )
-        with tqdm(total=len(dataset)) as pbar:
-            with ThreadPoolExecutor(
-                max_workers=multiprocessing.cpu_count()
-            ) as executor:
-                for i, (image, label) in enumerate(executor.map(data_load, dataset)):
-                    dataset_new.append((image, label))
-                    pbar.update(1)
-
-        self.subsets = [dataset_new]
-
-        # self.subsets = [dataset]
-
-        self.class_to_address_dict = get_class_to_idx_dict(
-            self.subsets,
-            class_name_key=1,
-            label_extractor_fn=None,
+        dataset_root = pathlib.Path(self.dataset_root)
+        store_name = split_name
+        if image_cache_size is not None:
+            image_cache_name = get_image_cache_name(
+                image_cache_size, image_cache_interpolation
+            )
+            store_name = f"{store_name}_{image_cache_name}"
+        manifest = dict(
+            dataset_name=self.dataset_name,
+            split_name=split_name,
+            num_samples=len(dataset),
+            image_cache_size=(
+                list(image_cache_size) if image_cache_size is not None else None
+            ),
+            image_cache_interpolation=image_cache_interpolation,
         )
 
-        self.label_extractor_fn = label_extractor_fn
-        dataset_root = (
-            pathlib.Path(self.dataset_root)
-            if isinstance(self.dataset_root, str)
-            else self.dataset_root
-        )
+        def get_samples():
+            return decode_samples(
+                dataset,
+                image_size=image_cache_size,
+                interpolation=image_cache_interpolation,
+                chunk_size=ingest_batch_size or 64,
+            )
 
-        hdf5_filepath = (
-            dataset_root / f"{split_name}_{self.dataset_name}_"
-            f"few_shot_classification_dataset.h5"
-        )
+        store_dir = dataset_root / f"{self.dataset_name}_memmap_store" / store_name
 
-        if hdf5_filepath.exists() and not rescan_cache:
-            self.class_to_address_dict = h5py.File(hdf5_filepath, "r")
+        if storage_mode == DatasetStorageOptions.MEMMAP:
+            if (
+                not rescan_cache
+                and MemmapImageStore.exists(store_dir)
+                and MemmapImageStore(store_dir).manifest["metadata"]
+                == json.loads(json.dumps(manifest))
+            ):
+                logger.info(f"Reusing memory-mapped store at {store_dir}")
+                subset = MemmapImageStore(store_dir)
+            else:
+                logger.info(
+                    f"Decoding the {split_name} set of the {dataset_name} "
+                    f"dataset into {store_dir} 💿"
+                )
+                subset = MemmapImageStore.build(
+                    store_dir=store_dir,
+                    samples=get_samples(),
+                    image_key="image",
+                    metadata=manifest,
+                )
         else:
-            self.class_to_address_dict = store_dict_as_hdf5(
-                self.class_to_address_dict, hdf5_filepath
+            logger.info(
+                f"Loading the {split_name} set of the {dataset_name} dataset "
+                f"into memory 💿"
             )
+            subset = list(get_samples())
+
+        self.subsets = [subset]
+
+        # class names are the labels as strings, sorted as such
+        index_dir = dataset_root / f"{self.dataset_name}_class_index" / store_name
+        index_manifest = dict(manifest, label_extractor=get_callable_fingerprint(str))
+        self.class_to_address_dict = (
+            None
+            if rescan_cache
+            else load_class_index(index_dir=index_dir, manifest=index_manifest)
+        )
+
+        if self.class_to_address_dict is None:
+            self.class_to_address_dict = save_class_index(
+                index_dir=index_dir,
+                class_to_records_dict=get_class_to_idx_dict(
+                    self.subsets,
+                    class_name_key="label",
+                    label_extractor_fn=str,
+                ),
+                manifest=index_manifest,
+            )
+        else:
+            logger.info(f"Loaded class index from {index_dir}")
+
+        self.label_extractor_fn = label_extractor_fn
         self.current_class_to_address_dict = self.class_to_address_dict
+        self.episode_sampler = get_dataset_episode_sampler(self)
+
+        if self.episode_manifest_path is not None:
+            self.num_episodes = len(self.episode_sampler)
+
         self.print_info = False
@@ -0,0 +1,420 @@
+import json
+import os
+import pathlib
+import shutil
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from gate.base.utils.loggers import get_logger
+
+log = get_logger(
+    __name__,
+)
+
+STORE_FORMAT_VERSION = 1
+
+
+def _stack_column(values: List[Any]) -> Optional[np.ndarray]:
+    """
+    Stack a list of per-sample feature values into a single numpy array,
+    returning None when the values do not share a shape (e.g. per-image
+    bounding box lists), since those cannot be kept as a flat column.
+    """
+    try:
+        column = np.asarray(values)
+    except ValueError:
+        return None
+
+    if column.dtype == object:
+        return None
+
+    return column
+
+
+def replace_directory(tmp_dir: pathlib.Path, target_dir: pathlib.Path):
+    """
+    Move the completely written `tmp_dir` into place at `target_dir`. An
+    existing `target_dir` is first renamed aside and only deleted once the
+    new directory is in place, so its files are never removed from under a
+    reader that is still opening them. If another process moved its own
+    directory into place first, `tmp_dir` is dropped instead.
+    """
+    stale_dir = None
+    if target_dir.exists():
+        stale_dir = target_dir.parent / f".{target_dir.name}.{uuid.uuid4().hex}.old"
+        try:
+            os.replace(target_dir, stale_dir)
+        except OSError:
+            # another process moved the old directory aside first
+            stale_dir = None
+
+    try:
+        os.replace(tmp_dir, target_dir)
+    except OSError:
+        # another process finished writing the same directory first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if stale_dir is not None:
+        shutil.rmtree(stale_dir, ignore_errors=True)
+
+
+def write_batches(
+    batches: Iterable[Dict[str, np.ndarray]],
+    images: Optional[np.ndarray],
+    image_key: str,
+) -> Dict[str, np.ndarray]:
+    """
+    Copy the images of each batch into consecutive rows of the preallocated
+    `images` array and return the remaining features concatenated into one
+    column each.
+    """
+    column_batches = {}
+    current_idx = 0
+
+    for batch in batches:
+        batch_size = len(batch[image_key])
+        images[current_idx : current_idx + batch_size] = batch[image_key]
+        current_idx += batch_size
+
+        for key, value in batch.items():
+            if key != image_key:
+                column_batches.setdefault(key, []).append(value)
+
+    columns = {}
+    for key, values in column_batches.items():
+        column = np.concatenate(values, axis=0)
+        if column.dtype == object:
+            # tf.string features come out as arrays of python bytes
+            column = column.astype(bytes)
+        columns[key] = column
+
+    return columns
+
+
+class ColumnarSubset:
+    """
+    An in-memory subset whose images share one shape, kept as a single
+    preallocated uint8 array with one array per other feature. Indexing it
+    returns a dict of features, like a `MemmapImageStore`.
+    """
+
+    def __init__(
+        self, image_key: str, images: np.ndarray, columns: Dict[str, np.ndarray]
+    ):
+        self.image_key = image_key
+        self.images = images
+        self.columns = columns
+        self.column_keys = list(columns.keys())
+
+    @classmethod
+    def build_from_batches(
+        cls,
+        batches: Iterable[Dict[str, np.ndarray]],
+        num_samples: int,
+        image_shape: Tuple[int, ...],
+        image_key: str,
+    ) -> "ColumnarSubset":
+        images = np.empty(shape=(num_samples,) + tuple(image_shape), dtype=np.uint8)
+        columns = write_batches(batches=batches, images=images, image_key=image_key)
+        return cls(image_key=image_key, images=images, columns=columns)
+
+    def column(self, key: str) -> np.ndarray:
+        return self.columns[key]
+
+    def get_image(self, index: int) -> np.ndarray:
+        return self.images[index]
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        sample = {self.image_key: self.images[index]}
+
+        for key in self.column_keys:
+            sample[key] = self.columns[key][index]
+
+        return sample
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+class MemmapImageStore:
+    """
+    A build-once, read-many store of a single dataset subset.
+
+    All images are kept back to back in one flat uint8 file (`images.bin`),
+    with `offsets.npy` and `shapes.npy` describing where each image starts
+    and how to reshape it. Every other fixed-shape feature is kept as a
+    column array. The files are opened lazily with `np.memmap`, once per
+    process, so DataLoader workers share the page cache instead of each
+    holding their own copy of the data.
+
+    Indexing a store returns a dict of features, just like the in-memory
+    list of samples it replaces.
+    """
+
+    def __init__(self, store_dir: Union[str, pathlib.Path]):
+        self.store_dir = pathlib.Path(store_dir)
+
+        with open(self.store_dir / "manifest.json", "r") as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        self.image_key = self.manifest["image_key"]
+        self.column_keys = self.manifest["column_keys"]
+        self.num_samples = self.manifest["num_samples"]
+
+        self._images = None
+        self._offsets = None
+        self._shapes = None
+        self._columns = None
+
+    @staticmethod
+    def exists(store_dir: Union[str, pathlib.Path]) -> bool:
+        manifest_path = pathlib.Path(store_dir) / "manifest.json"
+
+        if not manifest_path.exists():
+            return False
+
+        with open(manifest_path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        return manifest.get("format_version") == STORE_FORMAT_VERSION
+
+    @classmethod
+    def build(
+        cls,
+        store_dir: Union[str, pathlib.Path],
+        samples: Iterable[Dict[str, np.ndarray]],
+        image_key: str,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> "MemmapImageStore":
+        """
+        Stream `samples` to disk and return the opened store. The store is
+        written to a temporary directory and moved into place once complete,
+        so concurrent builders (e.g. one per DDP rank) never observe a
+        partially written store.
+        """
+        store_dir = pathlib.Path(store_dir)
+        store_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = store_dir.parent / f".{store_dir.name}.{uuid.uuid4().hex}.tmp"
+        tmp_dir.mkdir(parents=True)
+
+        offsets = []
+        shapes = []
+        columns = {}
+        current_offset = 0
+
+        with open(tmp_dir / "images.bin", "wb") as image_file:
+            for sample in samples:
+                image = np.ascontiguousarray(sample[image_key], dtype=np.uint8)
+                image_file.write(image.tobytes())
+
+                offsets.append(current_offset)
+                shapes.append(image.shape)
+                current_offset += image.size
+
+                for key, value in sample.items():
+                    if key != image_key:
+                        columns.setdefault(key, []).append(value)
+
+        shapes = np.array(shapes, dtype=np.int32)
+        if shapes.ndim == 1:
+            # no samples were written, keep the index two dimensional
+            shapes = shapes.reshape(0, 3)
+
+        columns = {key: _stack_column(values) for key, values in columns.items()}
+
+        return cls._finalize(
+            tmp_dir=tmp_dir,
+            store_dir=store_dir,
+            offsets=np.array(offsets, dtype=np.int64),
+            shapes=shapes,
+            columns=columns,
+            image_key=image_key,
+            num_bytes=current_offset,
+            metadata=metadata,
+        )
+
+    @classmethod
+    def build_from_batches(
+        cls,
+        store_dir: Union[str, pathlib.Path],
+        batches: Iterable[Dict[str, np.ndarray]],
+        num_samples: int,
+        image_shape: Tuple[int, ...],
+        image_key: str,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> "MemmapImageStore":
+        """
+        Like `build`, for images that all share `image_shape`. Batches of
+        samples (dicts of arrays with a leading batch dimension) are written
+        straight into a preallocated memory-mapped image file.
+        """
+        store_dir = pathlib.Path(store_dir)
+        store_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = store_dir.parent / f".{store_dir.name}.{uuid.uuid4().hex}.tmp"
+        tmp_dir.mkdir(parents=True)
+
+        image_size = int(np.prod(image_shape))
+        images = (
+            np.memmap(
+                tmp_dir / "images.bin",
+                dtype=np.uint8,
+                mode="w+",
+                shape=(num_samples,) + tuple(image_shape),
+            )
+            if num_samples > 0
+            else None
+        )
+        if images is None:
+            open(tmp_dir / "images.bin", "wb").close()
+
+        columns = write_batches(batches=batches, images=images, image_key=image_key)
+
+        if images is not None:
+            images.flush()
+            del images
+
+        return cls._finalize(
+            tmp_dir=tmp_dir,
+            store_dir=store_dir,
+            offsets=np.arange(num_samples, dtype=np.int64) * image_size,
+            shapes=np.tile(
+                np.array(image_shape, dtype=np.int32), reps=(num_samples, 1)
+            ),
+            columns=columns,
+            image_key=image_key,
+            num_bytes=num_samples * image_size,
+            metadata=metadata,
+        )
+
+    @classmethod
+    def _finalize(
+        cls,
+        tmp_dir: pathlib.Path,
+        store_dir: pathlib.Path,
+        offsets: np.ndarray,
+        shapes: np.ndarray,
+        columns: Dict[str, Optional[np.ndarray]],
+        image_key: str,
+        num_bytes: int,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> "MemmapImageStore":
+        np.save(tmp_dir / "offsets.npy", offsets)
+        np.save(tmp_dir / "shapes.npy", shapes)
+
+        column_keys = []
+        for key, column in columns.items():
+            if column is None:
+                log.info(
+                    f"Feature {key} does not have a fixed shape, "
+                    f"it will not be kept in the store at {store_dir}"
+                )
+                continue
+            np.save(tmp_dir / f"column_{key}.npy", column)
+            column_keys.append(key)
+
+        manifest = dict(
+            format_version=STORE_FORMAT_VERSION,
+            image_key=image_key,
+            column_keys=column_keys,
+            num_samples=len(offsets),
+            num_bytes=int(num_bytes),
+            metadata=metadata or {},
+        )
+
+        with open(tmp_dir / "manifest.json", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        replace_directory(tmp_dir, store_dir)
+
+        log.info(
+            f"Built memory-mapped store at {store_dir} with "
+            f"{manifest['num_samples']} samples, {manifest['num_bytes']} bytes"
+        )
+
+        return cls(store_dir)
+
+    def _open(self):
+        # plain ndarray views of the memory maps, which index much faster
+        # than np.memmap, as every image read slices all three of them
+        self._offsets = np.load(self.store_dir / "offsets.npy", mmap_mode="r").view(
+            np.ndarray
+        )
+        self._shapes = np.load(self.store_dir / "shapes.npy", mmap_mode="r").view(
+            np.ndarray
+        )
+        self._columns = {
+            key: np.load(self.store_dir / f"column_{key}.npy", mmap_mode="r")
+            for key in self.column_keys
+        }
+        if self.manifest["num_bytes"] > 0:
+            self._images = np.memmap(
+                self.store_dir / "images.bin", dtype=np.uint8, mode="r"
+            ).view(np.ndarray)
+        else:
+            self._images = np.empty((0,), dtype=np.uint8)
+
+    @property
+    def images(self) -> np.ndarray:
+        if self._images is None:
+            self._open()
+        return self._images
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._open()
+        return self._offsets
+
+    @property
+    def shapes(self) -> np.ndarray:
+        if self._shapes is None:
+            self._open()
+        return self._shapes
+
+    def column(self, key: str) -> np.ndarray:
+        if key == self.image_key:
+            raise KeyError(
+                f"{key} is stored in the flat image file, use get_image instead"
+            )
+        if self._columns is None:
+            self._open()
+        return self._columns[key]
+
+    def get_image(self, index: int) -> np.ndarray:
+        offset = int(self.offsets[index])
+        shape = tuple(self.shapes[index].tolist())
+        return self.images[offset : offset + int(np.prod(shape))].reshape(shape)
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if index < 0:
+            index += self.num_samples
+
+        sample = {self.image_key: self.get_image(index)}
+
+        for key in self.column_keys:
+            sample[key] = self.column(key)[index]
+
+        return sample
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self.num_samples):
+            yield self[index]
+
+    def __getstate__(self):
+        # memory maps are reopened lazily in the receiving process instead of
+        # being pickled (which would copy the whole store)
+        state = self.__dict__.copy()
+        state["_images"] = None
+        state["_offsets"] = None
+        state["_shapes"] = None
+        state["_columns"] = None
+        return state
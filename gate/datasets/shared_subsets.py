@@ -0,0 +1,132 @@
+import functools
+import hashlib
+import threading
+import weakref
+from dataclasses import dataclass
+from types import CodeType
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from gate.base.utils.loggers import get_logger
+
+log = get_logger(
+    __name__,
+)
+
+
+@dataclass
+class SharedSubsetsEntry:
+    value: Any
+    ref_count: int = 0
+
+
+_shared_subsets: Dict[Hashable, SharedSubsetsEntry] = {}
+_owner_finalizers = weakref.WeakKeyDictionary()
+_lock = threading.RLock()
+
+
+def _get_code_fingerprint(code: CodeType) -> str:
+    consts = [
+        _get_code_fingerprint(const) if isinstance(const, CodeType) else repr(const)
+        for const in code.co_consts
+    ]
+
+    return hashlib.sha1(
+        repr((code.co_code, consts, code.co_names)).encode()
+    ).hexdigest()[:16]
+
+
+def _get_value_fingerprint(value: Any) -> str:
+    if callable(value) and not isinstance(value, type):
+        return get_callable_fingerprint(value)
+
+    return repr(value)
+
+
+def get_callable_fingerprint(fn: Optional[Callable]) -> Optional[str]:
+    """
+    Identify a callable by where it is defined rather than by object
+    identity, so that e.g. `bytes_to_string` imported in two modules maps to
+    the same key. Functions also carry a hash of their code, constants and
+    closure values, so that editing a label extractor, or building it with
+    other closure values, changes the key; `functools.partial` objects are
+    identified by their function and arguments.
+    """
+    if fn is None:
+        return None
+
+    if isinstance(fn, functools.partial):
+        arguments = [_get_value_fingerprint(arg) for arg in fn.args] + [
+            f"{name}={_get_value_fingerprint(value)}"
+            for name, value in sorted(fn.keywords.items())
+        ]
+        return f"partial({get_callable_fingerprint(fn.func)}, {', '.join(arguments)})"
+
+    fingerprint = (
+        f"{getattr(fn, '__module__', None)}."
+        f"{getattr(fn, '__qualname__', type(fn).__qualname__)}"
+    )
+
+    code = getattr(fn, "__code__", None)
+    if code is not None:
+        closure = [
+            _get_value_fingerprint(cell.cell_contents)
+            for cell in getattr(fn, "__closure__", None) or ()
+        ]
+        fingerprint = f"{fingerprint}:{_get_code_fingerprint(code)}"
+        if len(closure) > 0:
+            closure_hash = hashlib.sha1(repr(closure).encode()).hexdigest()[:16]
+            fingerprint = f"{fingerprint}:{closure_hash}"
+
+    return fingerprint
+
+
+def acquire_shared_subsets(key: Hashable, owner: Any, load_fn: Callable[[], Any]):
+    """
+    Return the value stored under `key`, calling `load_fn` to create it if
+    no live owner currently holds it. The reference taken by `owner` is
+    released by `release_shared_subsets(owner)`, or automatically once
+    `owner` is garbage collected, and the value is dropped with its last
+    reference.
+    """
+    with _lock:
+        entry = _shared_subsets.get(key)
+
+        if entry is None:
+            entry = SharedSubsetsEntry(value=load_fn())
+            _shared_subsets[key] = entry
+        else:
+            log.info(f"Reusing loaded subsets for {key}")
+
+        entry.ref_count += 1
+        _owner_finalizers[owner] = weakref.finalize(
+            owner, _release_shared_subsets_key, key
+        )
+
+        return entry.value
+
+
+def _release_shared_subsets_key(key: Hashable):
+    with _lock:
+        entry = _shared_subsets.get(key)
+
+        if entry is None:
+            return
+
+        entry.ref_count -= 1
+
+        if entry.ref_count <= 0:
+            del _shared_subsets[key]
+            log.info(f"Released loaded subsets for {key}")
+
+
+def release_shared_subsets(owner: Any):
+    finalizer = _owner_finalizers.pop(owner, None)
+
+    if finalizer is not None:
+        # calling a finalizer more than once is a no-op
+        finalizer()
+
+
+def get_shared_subsets_ref_counts() -> Dict[Hashable, int]:
+    with _lock:
+        return {key: entry.ref_count for key, entry in _shared_subsets.items()}
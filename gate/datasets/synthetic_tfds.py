@@ -0,0 +1,380 @@
+import functools
+import hashlib
+import io
+import json
+import os
+import pathlib
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.tfrecord_reader import (
+    TFDSFeatureKinds,
+    TFRecordFeature,
+    _unflatten,
+    parse_split,
+)
+
+log = get_logger(
+    __name__,
+)
+
+SYNTHETIC_TFDS_SPEC_FILE_NAME = "synthetic_tfds.json"
+
+
+class SyntheticLabelEncodings:
+    INT: str = "int"
+    BYTES: str = "bytes"
+
+
+def get_synthetic_tfds_spec_path(
+    dataset_name: str, data_dir: Union[str, pathlib.Path]
+) -> pathlib.Path:
+    return (
+        pathlib.Path(data_dir)
+        / dataset_name.split(":")[0]
+        / SYNTHETIC_TFDS_SPEC_FILE_NAME
+    )
+
+
+def prepare_synthetic_tfds_dataset(
+    data_dir: Union[str, pathlib.Path],
+    dataset_name: str,
+    num_classes: int,
+    split_num_samples_per_class: Dict[str, int],
+    image_shape: Sequence[int] = (84, 84, 3),
+    label_encoding: str = SyntheticLabelEncodings.INT,
+    label_keys: Sequence[str] = ("label",),
+    image_key: str = "image",
+    seed: int = 0,
+) -> "SyntheticTFDSDataset":
+    """
+    Write the spec of a synthetic stand-in for the TFDS dataset
+    `dataset_name` under `data_dir`, so that the dataset classes read it,
+    with `tfds_reader=TFDSReaderOptions.SYNTHETIC`, in place of the real one.
+    Only the spec is stored: samples are generated when they are read.
+
+    Every split of `split_num_samples_per_class` has that many samples of
+    each of the `num_classes` classes, with HxWxC `image_shape` uint8 images
+    under `image_key` and the class of the sample under every key of
+    `label_keys`, as a `ClassLabel` int64 or, with
+    `SyntheticLabelEncodings.BYTES`, as the bytes of a `Text` class name.
+    """
+    if label_encoding not in (
+        SyntheticLabelEncodings.INT,
+        SyntheticLabelEncodings.BYTES,
+    ):
+        raise ValueError(
+            f"Invalid label_encoding {label_encoding}, must be one of "
+            f"{SyntheticLabelEncodings.INT}, {SyntheticLabelEncodings.BYTES}"
+        )
+
+    if len(image_shape) != 3 or image_shape[-1] not in (1, 3, 4):
+        raise ValueError(
+            f"image_shape must be HxWxC with 1, 3 or 4 channels, got {image_shape}"
+        )
+
+    spec = dict(
+        num_classes=int(num_classes),
+        split_num_samples_per_class={
+            split_name: int(num_samples)
+            for split_name, num_samples in split_num_samples_per_class.items()
+        },
+        image_shape=[int(dim) for dim in image_shape],
+        label_encoding=label_encoding,
+        label_keys=list(label_keys),
+        image_key=image_key,
+        seed=int(seed),
+    )
+
+    spec_path = get_synthetic_tfds_spec_path(dataset_name, data_dir)
+    spec_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_spec_path = spec_path.with_name(f"{spec_path.name}.tmp_{uuid.uuid4().hex}")
+
+    with open(tmp_spec_path, "w") as spec_file:
+        json.dump(spec, spec_file, indent=2)
+
+    os.replace(tmp_spec_path, spec_path)
+
+    return SyntheticTFDSDataset(dataset_name, data_dir)
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(image[..., 0] if image.shape[-1] == 1 else image).save(
+        buffer, format="PNG", compress_level=1
+    )
+    return buffer.getvalue()
+
+
+class SyntheticTFDSDataset:
+    """
+    A synthetic stand-in for a prepared TFDS dataset, with the interface of
+    `PreparedTFDSDataset`, whose samples are generated from their split and
+    position instead of being read from disk, so that the few-shot and
+    standard classification datasets can be driven at any scale without a
+    download.
+
+    Images mix a fixed pattern over the pixels with a byte hashed from the
+    position of the sample, shifted by a class dependent offset, and are
+    generated a batch at a time.
+    The label of the sample at position `i` of a split is
+    `i % num_classes`. Both are the same on every read, and images left
+    encoded are PNGs which decode back to the same pixels.
+    """
+
+    def __init__(self, dataset_name: str, data_dir: Union[str, pathlib.Path]):
+        spec_path = get_synthetic_tfds_spec_path(dataset_name, data_dir)
+
+        if not spec_path.exists():
+            raise FileNotFoundError(
+                f"No synthetic TFDS dataset {dataset_name} found in {data_dir}, "
+                f"create one with prepare_synthetic_tfds_dataset"
+            )
+
+        with open(spec_path, "r") as spec_file:
+            self.spec = json.load(spec_file)
+
+        self.dataset_name = dataset_name
+        self.num_classes = self.spec["num_classes"]
+        self.image_shape = tuple(self.spec["image_shape"])
+        self.image_key = self.spec["image_key"]
+        self.label_keys = self.spec["label_keys"]
+        self.label_encoding = self.spec["label_encoding"]
+        self.seed = self.spec["seed"]
+        self.split_num_examples = {
+            split_name: num_samples_per_class * self.num_classes
+            for split_name, num_samples_per_class in self.spec[
+                "split_num_samples_per_class"
+            ].items()
+        }
+        # caches built from the dataset are invalidated with any spec change
+        spec_hash = hashlib.sha1(json.dumps(self.spec, sort_keys=True).encode())
+        self.version = f"0.0.0+synthetic.{spec_hash.hexdigest()[:12]}"
+
+        label_feature_kwargs = (
+            dict(kind=TFDSFeatureKinds.CLASS_LABEL, dtype="int64")
+            if self.label_encoding == SyntheticLabelEncodings.INT
+            else dict(kind=TFDSFeatureKinds.TEXT, dtype="string")
+        )
+        self.features = {
+            self.image_key: TFRecordFeature(
+                key=self.image_key,
+                kind=TFDSFeatureKinds.IMAGE,
+                dtype="uint8",
+                shape=self.image_shape,
+            ),
+            **{
+                key: TFRecordFeature(key=key, shape=(), **label_feature_kwargs)
+                for key in self.label_keys
+            },
+        }
+        self.class_names = [
+            f"class_{label:0{len(str(self.num_classes - 1))}d}"
+            for label in range(self.num_classes)
+        ]
+
+    def _parse_split(self, split: str) -> Tuple[str, int, int]:
+        return parse_split(
+            split,
+            split_num_examples=self.split_num_examples,
+            dataset_name=self.dataset_name,
+        )
+
+    def num_examples(self, split: str) -> int:
+        _, start, end = self._parse_split(split)
+        return max(end - start, 0)
+
+    def get_features(
+        self, feature_keys: Optional[Sequence[str]] = None
+    ) -> List[TFRecordFeature]:
+        if feature_keys is None:
+            return list(self.features.values())
+
+        return [
+            feature
+            for feature in self.features.values()
+            if any(
+                feature.key == key or feature.key.startswith(f"{key}/")
+                for key in feature_keys
+            )
+        ]
+
+    def get_class_names(self, key: str) -> Optional[List[str]]:
+        if (
+            key not in self.label_keys
+            or self.label_encoding != SyntheticLabelEncodings.INT
+        ):
+            return None
+
+        return list(self.class_names)
+
+    def has_fixed_shapes(self, feature_keys: Optional[Sequence[str]] = None) -> bool:
+        return True
+
+    def get_labels(self, positions: np.ndarray) -> np.ndarray:
+        return positions % self.num_classes
+
+    def get_images(self, split_name: str, positions: np.ndarray) -> np.ndarray:
+        """
+        Generate the NxHxWxC uint8 images of the samples at `positions` of
+        `split_name`.
+        """
+        salt = np.uint32(zlib.crc32(f"{self.seed}/{split_name}".encode()))
+        # one pattern over the pixels and one byte per sample, combined with
+        # uint8 operations only, which keeps generation memory bound
+        pixels = np.arange(np.prod(self.image_shape), dtype=np.uint32)
+        pixel_pattern = ((pixels * np.uint32(40503) + salt) >> np.uint32(13)).astype(
+            np.uint8
+        )
+        sample_bytes = (
+            (positions.astype(np.uint32) * np.uint32(2654435761)) >> np.uint32(13)
+        ).astype(np.uint8)
+        offsets = (self.get_labels(positions) * 37 % 192).astype(np.uint8)
+
+        images = np.bitwise_xor(pixel_pattern[None, :], sample_bytes[:, None])
+        images &= np.uint8(63)
+        images += offsets[:, None]
+
+        return images.reshape((len(positions),) + self.image_shape)
+
+    def get_batch(
+        self,
+        split_name: str,
+        positions: np.ndarray,
+        feature_keys: Sequence[str],
+    ) -> Dict[str, np.ndarray]:
+        batch = {}
+
+        if self.image_key in feature_keys:
+            batch[self.image_key] = self.get_images(split_name, positions)
+
+        labels = self.get_labels(positions)
+        if self.label_encoding == SyntheticLabelEncodings.BYTES:
+            labels = np.array(
+                [self.class_names[label].encode("utf-8") for label in labels]
+            )
+
+        for key in self.label_keys:
+            if key in feature_keys:
+                batch[key] = labels
+
+        return batch
+
+    def get_positions(
+        self, split: str, sample_indices: Optional[np.ndarray] = None
+    ) -> Tuple[str, np.ndarray]:
+        """
+        Return the name of `split` and the positions in it of its samples,
+        restricted to `sample_indices` (positions in the sliced split) when
+        given, in split order like `PreparedTFDSDataset.iterate_records`.
+        """
+        split_name, start, end = self._parse_split(split)
+        positions = np.arange(start, end, dtype=np.int64)
+
+        if sample_indices is not None:
+            positions = positions[np.unique(np.asarray(sample_indices, np.int64))]
+
+        return split_name, positions
+
+    def iterate(
+        self,
+        split: str,
+        feature_keys: Optional[Sequence[str]] = None,
+        sample_indices: Optional[np.ndarray] = None,
+        decode_images: bool = True,
+        num_parallel_calls: Optional[int] = None,
+        chunk_size: int = 256,
+        map_fn: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the samples of `split` like `PreparedTFDSDataset.iterate`.
+        Samples are generated a chunk at a time, and images left encoded
+        are PNG encoded, and `map_fn` applied, by a pool of
+        `num_parallel_calls` threads.
+        """
+        keys = [feature.key for feature in self.get_features(feature_keys)]
+        split_name, positions = self.get_positions(split, sample_indices)
+
+        def get_sample(batch, idx):
+            sample = {}
+            for key in keys:
+                value = batch[key][idx]
+                if key == self.image_key and not decode_images:
+                    value = encode_png(value)
+                elif isinstance(value, np.bytes_):
+                    value = bytes(value)
+                sample[key] = value
+            sample = _unflatten(sample)
+            return map_fn(sample) if map_fn is not None else sample
+
+        use_threads = (num_parallel_calls is None or num_parallel_calls > 1) and (
+            map_fn is not None or not decode_images
+        )
+        executor = (
+            ThreadPoolExecutor(max_workers=num_parallel_calls) if use_threads else None
+        )
+
+        try:
+            for chunk_start in range(0, len(positions), chunk_size):
+                batch = self.get_batch(
+                    split_name, positions[chunk_start : chunk_start + chunk_size], keys
+                )
+                batch_indices = range(len(next(iter(batch.values()), [])))
+
+                if executor is None:
+                    for idx in batch_indices:
+                        yield get_sample(batch, idx)
+                else:
+                    yield from executor.map(
+                        functools.partial(get_sample, batch), batch_indices
+                    )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def iterate_batches(
+        self,
+        split: str,
+        batch_size: int,
+        feature_keys: Optional[Sequence[str]] = None,
+        sample_indices: Optional[np.ndarray] = None,
+        num_parallel_calls: Optional[int] = None,
+        map_fn: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Yield the samples of `split` stacked into batches of `batch_size`,
+        like `PreparedTFDSDataset.iterate_batches`, generating each batch at
+        once unless `map_fn` has to be applied to every sample.
+        """
+        if map_fn is None:
+            keys = [feature.key for feature in self.get_features(feature_keys)]
+            split_name, positions = self.get_positions(split, sample_indices)
+
+            for batch_start in range(0, len(positions), batch_size):
+                yield self.get_batch(
+                    split_name, positions[batch_start : batch_start + batch_size], keys
+                )
+            return
+
+        batch = []
+        for sample in self.iterate(
+            split,
+            feature_keys=feature_keys,
+            sample_indices=sample_indices,
+            num_parallel_calls=num_parallel_calls,
+            chunk_size=batch_size,
+            map_fn=map_fn,
+        ):
+            batch.append(sample)
+            if len(batch) == batch_size:
+                yield {key: np.stack([item[key] for item in batch]) for key in batch[0]}
+                batch = []
+
+        if len(batch) > 0:
+            yield {key: np.stack([item[key] for item in batch]) for key in batch[0]}
@@ -64,6 +64,17 @@ class AircraftFewShotClassificationDataset(FewShotClassificationDatasetTFDS):
         query_set_target_transform: Optional[Any] = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = "in_memory",
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = "tensorflow",
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = 256 * 1024 * 1024,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
     ):
         DATASET_NAME = "visual_domain_decathlon/aircraft"
         super(AircraftFewShotClassificationDataset, self).__init__(
@@ -82,6 +93,17 @@ class AircraftFewShotClassificationDataset(FewShotClassificationDatasetTFDS):
             variable_num_queries_per_class=variable_num_queries_per_class,
             support_to_query_ratio=support_to_query_ratio,
             rescan_cache=rescan_cache,
+            storage_mode=storage_mode,
+            split_aware_ingest=split_aware_ingest,
+            share_subsets=share_subsets,
+            extra_feature_keys=extra_feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            episode_manifest_path=episode_manifest_path,
+            episode_manifest_range=episode_manifest_range,
             input_target_annotation_keys=dict(
                 inputs="image",
                 targets="label",
@@ -128,6 +150,17 @@ class AircraftMultiViewFewShotClassificationDataset(
         query_set_target_transform: Optional[Any] = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = "in_memory",
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = "tensorflow",
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = 256 * 1024 * 1024,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
     ):
         DATASET_NAME = "visual_domain_decathlon/aircraft"
         super(AircraftMultiViewFewShotClassificationDataset, self).__init__(
@@ -146,6 +179,17 @@ class AircraftMultiViewFewShotClassificationDataset(
             variable_num_queries_per_class=variable_num_queries_per_class,
             support_to_query_ratio=support_to_query_ratio,
             rescan_cache=rescan_cache,
+            storage_mode=storage_mode,
+            split_aware_ingest=split_aware_ingest,
+            share_subsets=share_subsets,
+            extra_feature_keys=extra_feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            episode_manifest_path=episode_manifest_path,
+            episode_manifest_range=episode_manifest_range,
             input_target_annotation_keys=dict(
                 inputs="image",
                 targets="label",
@@ -1,26 +1,78 @@
 import copy
+import functools
+import hashlib
+import json
 import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 import h5py
 import hydra
 import numpy as np
-import tensorflow_datasets as tfds
 import torch
 from dotted_dict import DottedDict
 from omegaconf import DictConfig
 from torch import Tensor
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, default_collate
 from tqdm import tqdm
 
 from gate.base.utils.loggers import get_logger
+from gate.datasets.chunked_store import (
+    DEFAULT_CHUNK_BYTES,
+    ChunkCodecs,
+    ChunkedImageStore,
+    get_subset_group_ids,
+    prefetch_subset_samples,
+    resolve_chunk_codec,
+)
+from gate.datasets.encoded_store import (
+    DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+    DecodedImageCache,
+    DecodedImageCacheInfo,
+    EncodedImageSubset,
+    get_decoded_image_cache_info,
+)
+from gate.datasets.episode_sampler import (
+    ClassAddressIndex,
+    Episode,
+    EpisodeManifest,
+    EpisodeSampler,
+    ManifestEpisodeSampler,
+)
+from gate.datasets.memmap_store import ColumnarSubset, MemmapImageStore
+from gate.datasets.shared_subsets import (
+    acquire_shared_subsets,
+    get_callable_fingerprint,
+)
 from gate.datasets.data_utils import (
+    DatasetStorageOptions,
     FewShotSuperSplitSetOptions,
+    PerClassReservoir,
+    TFDSReaderOptions,
     get_class_to_idx_dict,
-    get_class_to_image_idx_and_bbox,
+    get_image_cache_name,
+    get_object_records,
+    load_class_index,
+    load_object_index,
+    resize_image,
+    save_class_index,
+    save_object_index,
+    select_split_classes,
     store_dict_as_hdf5,
 )
+from gate.datasets.tfrecord_reader import decode_image, load_prepared_tfds_dataset
 
 log = get_logger(
     __name__,
@@ -169,6 +221,1701 @@ def meta_augment_task(
     return new_support_inputs, new_support_labels, new_query_inputs, new_query_labels
 
 
+def get_required_feature_keys(*transforms: Any) -> List[str]:
+    """
+    Collect the names of the extra dataset features that `transforms` need,
+    declared by a transform through a `required_feature_keys` attribute.
+    Composed transforms are searched through their `transforms` attribute.
+    """
+    feature_keys = []
+
+    for transform in transforms:
+        if transform is None:
+            continue
+
+        feature_keys.extend(getattr(transform, "required_feature_keys", []))
+
+        if isinstance(getattr(transform, "transforms", None), (list, tuple)):
+            feature_keys.extend(get_required_feature_keys(*transform.transforms))
+
+    return list(dict.fromkeys(feature_keys))
+
+
+def get_tfds_decoders(
+    feature_keys: Optional[List[str]] = None,
+    skip_decoding_keys: Optional[List[str]] = None,
+) -> Any:
+    """
+    Build the `decoders` argument of `tfds.load` that only returns
+    `feature_keys` (all features if None), leaving `skip_decoding_keys`
+    as encoded bytes.
+    """
+    import tensorflow_datasets as tfds
+
+    skip_decoders = {
+        key: tfds.decode.SkipDecoding() for key in (skip_decoding_keys or [])
+    }
+
+    if feature_keys is None:
+        return skip_decoders or None
+
+    return tfds.decode.PartialDecoding(
+        {key: True for key in feature_keys}, decoders=skip_decoders or None
+    )
+
+
+def get_tfds_version(
+    dataset_name: str,
+    dataset_root: str,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+) -> str:
+    """
+    Return the version of a TFDS dataset, read from its prepared directory
+    rather than from its builder when `tfds_reader` does not use TensorFlow.
+    """
+    if tfds_reader != TFDSReaderOptions.TENSORFLOW:
+        return str(
+            load_prepared_tfds_dataset(
+                dataset_name,
+                data_dir=dataset_root,
+                download=False,
+                tfds_reader=tfds_reader,
+            ).version
+        )
+
+    import tensorflow_datasets as tfds
+
+    return str(tfds.builder(dataset_name, data_dir=dataset_root).version)
+
+
+def get_image_channels(
+    dataset_name: str,
+    dataset_root: str,
+    image_key: str,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+) -> Optional[int]:
+    """
+    Return the number of channels of the `image_key` feature of a TFDS
+    dataset, or None when it is not fixed.
+    """
+    if tfds_reader != TFDSReaderOptions.TENSORFLOW:
+        image_shape = (
+            load_prepared_tfds_dataset(
+                dataset_name,
+                data_dir=dataset_root,
+                download=False,
+                tfds_reader=tfds_reader,
+            )
+            .features[image_key]
+            .shape
+        )
+    else:
+        import tensorflow_datasets as tfds
+
+        image_shape = (
+            tfds.builder(dataset_name, data_dir=dataset_root)
+            .info.features[image_key]
+            .shape
+        )
+
+    return image_shape[-1] if len(image_shape) > 0 else None
+
+
+def get_class_label_names(
+    dataset_name: str,
+    dataset_root: str,
+    class_name_key: str,
+    download: bool,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+) -> Optional[List[str]]:
+    """
+    Return the class names of the `ClassLabel` feature `class_name_key` of a
+    TFDS dataset, indexed by integer label, or None if it has no names.
+    """
+    if tfds_reader != TFDSReaderOptions.TENSORFLOW:
+        return load_prepared_tfds_dataset(
+            dataset_name,
+            data_dir=dataset_root,
+            download=download,
+            tfds_reader=tfds_reader,
+        ).get_class_names(class_name_key)
+
+    import tensorflow_datasets as tfds
+
+    feature = tfds.builder(dataset_name, data_dir=dataset_root).info.features
+    for key in class_name_key.split("/"):
+        feature = feature[key]
+
+    return list(feature.names) if feature.names else None
+
+
+def check_tfds_reader(tfds_reader: str):
+    if tfds_reader not in (
+        TFDSReaderOptions.TENSORFLOW,
+        TFDSReaderOptions.TFRECORD,
+        TFDSReaderOptions.SYNTHETIC,
+    ):
+        raise ValueError(
+            f"Invalid tfds_reader {tfds_reader}, must be one of "
+            f"{TFDSReaderOptions.TENSORFLOW}, {TFDSReaderOptions.TFRECORD}, "
+            f"{TFDSReaderOptions.SYNTHETIC}"
+        )
+
+
+def get_subset_store_name(
+    subset_split_name_list: List[str], store_name_suffix: Optional[str] = None
+) -> str:
+    store_name = "_".join(
+        subset_name.replace(":", "_").replace("[", "_").replace("]", "_")
+        for subset_name in subset_split_name_list
+    )
+    if store_name_suffix is not None:
+        store_name = f"{store_name}_{store_name_suffix}"
+    return store_name
+
+
+def load_class_to_address_dict(
+    dataset_name: str,
+    dataset_root: str,
+    subset_split_name_list: List[str],
+    class_name_key: str,
+    label_extractor_fn: Optional[Callable],
+    rescan_cache: bool,
+    get_subsets_fn: Callable[[], List[Any]],
+    store_name_suffix: Optional[str] = None,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+    sample_indices_hash: Optional[str] = None,
+) -> Dict[Any, Any]:
+    """
+    Return the class to (subset_idx, sample_idx) index of a TFDS dataset.
+
+    The index is kept on disk under `dataset_root`, with a manifest of the
+    TFDS version, subset list, class key and label extractor it was built
+    from, and of the `sample_indices_hash` of the subsets, when they only
+    hold some of the samples of the TFDS subsets. It is reused unless
+    `rescan_cache` is set or any of those inputs changed, in which case it
+    is rebuilt from the subsets returned by `get_subsets_fn`.
+    """
+    index_dir = (
+        pathlib.Path(dataset_root)
+        / f"{dataset_name}_class_index"
+        / get_subset_store_name(subset_split_name_list, store_name_suffix)
+    )
+
+    manifest = dict(
+        dataset_name=dataset_name,
+        tfds_version=get_tfds_version(dataset_name, dataset_root, tfds_reader),
+        subset_split_name_list=list(subset_split_name_list),
+        class_name_key=class_name_key,
+        label_extractor=get_callable_fingerprint(label_extractor_fn),
+        store_name_suffix=store_name_suffix,
+        sample_indices_hash=sample_indices_hash,
+    )
+
+    if not rescan_cache:
+        class_to_address_dict = load_class_index(index_dir=index_dir, manifest=manifest)
+        if class_to_address_dict is not None:
+            log.info(f"Loaded class index from {index_dir}")
+            return class_to_address_dict
+
+    class_to_address_dict = get_class_to_idx_dict(
+        get_subsets_fn(),
+        class_name_key=class_name_key,
+        label_extractor_fn=label_extractor_fn,
+    )
+
+    cached_class_to_address_dict = save_class_index(
+        index_dir=index_dir,
+        class_to_records_dict=class_to_address_dict,
+        manifest=manifest,
+    )
+
+    return (
+        cached_class_to_address_dict
+        if cached_class_to_address_dict is not None
+        else class_to_address_dict
+    )
+
+
+def load_tfds_subset_labels(
+    dataset_name: str,
+    dataset_root: str,
+    subset_name: str,
+    download: bool,
+    image_key: str,
+    class_name_key: str,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+) -> np.ndarray:
+    """
+    Read only the `class_name_key` feature of a TFDS subset, skipping image
+    decoding, so that the classes of a dataset can be resolved before
+    any images are materialized.
+    """
+    if tfds_reader != TFDSReaderOptions.TENSORFLOW:
+        labels = [
+            sample[class_name_key]
+            for sample in load_prepared_tfds_dataset(
+                dataset_name,
+                data_dir=dataset_root,
+                download=download,
+                tfds_reader=tfds_reader,
+            ).iterate(subset_name, feature_keys=[class_name_key], num_parallel_calls=1)
+        ]
+        if len(labels) == 0:
+            return np.array([])
+        # text labels are kept as python bytes, like tfds returns them
+        return np.array(labels, dtype=object if isinstance(labels[0], bytes) else None)
+
+    import tensorflow_datasets as tfds
+
+    subset = tfds.load(
+        dataset_name,
+        split=subset_name,
+        shuffle_files=False,
+        download=download,
+        as_supervised=False,
+        data_dir=dataset_root,
+        decoders=get_tfds_decoders(feature_keys=[class_name_key]),
+    )
+
+    label_batches = [
+        label_batch
+        for label_batch in subset.map(lambda sample: sample[class_name_key])
+        .batch(4096)
+        .as_numpy_iterator()
+    ]
+
+    return (
+        np.concatenate(label_batches, axis=0)
+        if len(label_batches) > 0
+        else np.array([])
+    )
+
+
+def get_split_sample_indices(
+    dataset_name: str,
+    dataset_root: str,
+    subset_split_name_list: List[str],
+    download: bool,
+    image_key: str,
+    class_name_key: str,
+    label_extractor_fn: Optional[Callable],
+    split_name: str,
+    split_percentage: Optional[Dict[str, int]] = None,
+    split_config: Optional[DictConfig] = None,
+    rescan_cache: bool = True,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+) -> Tuple[List[Any], List[np.ndarray]]:
+    """
+    Resolve the classes of `split_name` from the labels of all subsets and
+    return them, along with the sorted indices of the samples of each subset
+    whose label belongs to one of them.
+    """
+    # this is the same index as that of the fully loaded subsets, so it
+    # is cached under the same name
+    class_to_address_dict = load_class_to_address_dict(
+        dataset_name=dataset_name,
+        dataset_root=dataset_root,
+        subset_split_name_list=subset_split_name_list,
+        class_name_key=class_name_key,
+        label_extractor_fn=label_extractor_fn,
+        rescan_cache=rescan_cache,
+        get_subsets_fn=lambda: [
+            load_tfds_subset_labels(
+                dataset_name=dataset_name,
+                dataset_root=dataset_root,
+                subset_name=subset_name,
+                download=download,
+                image_key=image_key,
+                class_name_key=class_name_key,
+                tfds_reader=tfds_reader,
+            )
+            for subset_name in subset_split_name_list
+        ],
+        tfds_reader=tfds_reader,
+    )
+
+    split_class_names = select_split_classes(
+        class_names=list(class_to_address_dict.keys()),
+        split_name=split_name,
+        split_percentage=split_percentage,
+        split_config=split_config,
+    )
+
+    subset_sample_indices = [[] for _ in subset_split_name_list]
+    for class_name in split_class_names:
+        for subset_idx, sample_idx in class_to_address_dict[class_name]:
+            subset_sample_indices[subset_idx].append(sample_idx)
+
+    subset_sample_indices = [
+        np.sort(np.array(sample_indices, dtype=np.int64))
+        for sample_indices in subset_sample_indices
+    ]
+
+    log.info(
+        f"Split {split_name} keeps {len(split_class_names)} of "
+        f"{len(class_to_address_dict)} classes and "
+        f"{sum(len(item) for item in subset_sample_indices)} of "
+        f"{sum(len(item) for item in class_to_address_dict.values())} samples"
+    )
+
+    return split_class_names, subset_sample_indices
+
+
+def get_sample_indices_hash(
+    sample_indices: Optional[Sequence[np.ndarray]],
+) -> Optional[str]:
+    """
+    Hash the indices of the samples kept of each subset, or return None when
+    all samples are kept, so that a store or index is not reused for another
+    selection of samples, e.g. after the classes of a split changed.
+    """
+    if sample_indices is None:
+        return None
+
+    digest = hashlib.sha1()
+    for indices in sample_indices:
+        indices = np.asarray(indices, dtype=np.int64)
+        digest.update(np.int64(len(indices)).tobytes())
+        digest.update(indices.tobytes())
+
+    return digest.hexdigest()
+
+
+def get_split_fingerprint(
+    split_name: str,
+    split_percentage: Optional[Dict[str, int]] = None,
+    split_config: Optional[DictConfig] = None,
+) -> str:
+    """
+    Describe the definition of the classes of `split_name`, as used by
+    `select_split_classes`, without resolving them.
+    """
+    if split_config is not None:
+        definition = dict(classes=list(split_config[split_name]))
+    else:
+        definition = dict(
+            percentage={key: split_percentage[key] for key in sorted(split_percentage)}
+        )
+
+    return json.dumps(dict(split_name=split_name, **definition), default=str)
+
+
+def store_matches_request(
+    store_dir: pathlib.Path,
+    feature_keys: Optional[List[str]],
+    tfds_reader: str,
+    sample_indices_hash: Optional[str] = None,
+) -> bool:
+    metadata = MemmapImageStore(store_dir).manifest["metadata"]
+
+    # a store of other samples of the subset, e.g. of the classes of a split
+    # that has since changed, is named the same way
+    if metadata.get("sample_indices_hash") != sample_indices_hash:
+        return False
+
+    # decoders may differ by a few intensity levels, so a store is only
+    # reused by the reader that built it
+    if metadata.get("tfds_reader", TFDSReaderOptions.TENSORFLOW) != tfds_reader:
+        return False
+
+    stored_feature_keys = metadata.get("feature_keys")
+
+    if stored_feature_keys is None:
+        return True
+
+    return feature_keys is not None and set(feature_keys) <= set(stored_feature_keys)
+
+
+def get_tfds_subset_source(
+    dataset_name: str,
+    dataset_root: str,
+    subset_name: str,
+    download: bool,
+    image_key: str,
+    feature_keys: Optional[List[str]],
+    sample_indices: Optional[np.ndarray],
+    ingest_batch_size: Optional[int],
+    image_size: Optional[Sequence[int]] = None,
+    interpolation: str = "bilinear",
+    decode_images: bool = True,
+) -> Tuple[int, Optional[Tuple[int, ...]], Iterable[Dict[str, Any]]]:
+    """
+    Read a TFDS subset with `tfds.load`. Return its number of samples, and
+    either the shape of its images and an iterable of batches of samples,
+    when they can be ingested in batches, or None and an iterable of
+    samples. When `image_size` is given, images are resized to it with
+    `resize_image` as they are decoded. Unless `decode_images` is set,
+    images are returned as their encoded bytes, one sample at a time.
+    """
+    import tensorflow as tf
+    import tensorflow_datasets as tfds
+
+    # images are decoded in a parallel map of our own when filtering,
+    # batching or resizing, rather than by tfds
+    skip_image_decoding = not decode_images or (
+        sample_indices is not None
+        or ingest_batch_size is not None
+        or image_size is not None
+    )
+
+    subset, subset_info = tfds.load(
+        dataset_name,
+        split=subset_name,
+        shuffle_files=False,
+        download=download,
+        as_supervised=False,
+        data_dir=dataset_root,
+        with_info=True,
+        decoders=get_tfds_decoders(
+            feature_keys=feature_keys,
+            skip_decoding_keys=[image_key] if skip_image_decoding else None,
+        ),
+    )
+
+    log.info(f"Loading into memory {subset_name} info: {subset_info}")
+
+    num_samples = len(subset)
+
+    if sample_indices is not None:
+        # drop unwanted samples before their images are decoded
+        keep_mask = np.zeros(shape=(num_samples,), dtype=bool)
+        keep_mask[sample_indices] = True
+        keep_mask = tf.constant(keep_mask)
+        subset = (
+            subset.enumerate()
+            .filter(lambda idx, sample: tf.gather(keep_mask, idx))
+            .map(lambda idx, sample: sample)
+        )
+        num_samples = len(sample_indices)
+
+    if skip_image_decoding and decode_images:
+        image_feature = subset_info.features[image_key]
+
+        def decode_image(encoded_image):
+            image = image_feature.decode_example(encoded_image)
+
+            if image_size is None:
+                return image
+
+            # resized with PIL rather than tf.image, so that images match
+            # those resized by the transforms
+            image = tf.numpy_function(
+                lambda item: resize_image(
+                    item, size=image_size, interpolation=interpolation
+                ),
+                [image],
+                tf.uint8,
+            )
+            image.set_shape((*image_size, image_feature.shape[-1]))
+            return image
+
+        subset = subset.map(
+            lambda sample: {**sample, image_key: decode_image(sample[image_key])},
+            num_parallel_calls=tf.data.AUTOTUNE,
+        )
+
+    if (
+        decode_images
+        and ingest_batch_size is not None
+        and all(
+            spec.shape.is_fully_defined()
+            for spec in tf.nest.flatten(subset.element_spec)
+        )
+    ):
+        return (
+            num_samples,
+            tuple(subset.element_spec[image_key].shape.as_list()),
+            subset.batch(ingest_batch_size)
+            .prefetch(tf.data.AUTOTUNE)
+            .as_numpy_iterator(),
+        )
+
+    return (
+        num_samples,
+        None,
+        ({key: sample[key].numpy() for key in sample.keys()} for sample in subset),
+    )
+
+
+def get_tfrecord_subset_source(
+    dataset_name: str,
+    dataset_root: str,
+    subset_name: str,
+    download: bool,
+    image_key: str,
+    feature_keys: Optional[List[str]],
+    sample_indices: Optional[np.ndarray],
+    ingest_batch_size: Optional[int],
+    image_size: Optional[Sequence[int]] = None,
+    interpolation: str = "bilinear",
+    decode_images: bool = True,
+    tfds_reader: str = TFDSReaderOptions.TFRECORD,
+) -> Tuple[int, Optional[Tuple[int, ...]], Iterable[Dict[str, Any]]]:
+    """
+    Like `get_tfds_subset_source`, reading the TFRecord shards of the
+    prepared dataset directly, without TensorFlow, or generating the samples
+    of a synthetic dataset with `TFDSReaderOptions.SYNTHETIC`.
+    """
+    prepared_dataset = load_prepared_tfds_dataset(
+        dataset_name,
+        data_dir=dataset_root,
+        download=download,
+        tfds_reader=tfds_reader,
+    )
+
+    num_samples = (
+        len(sample_indices)
+        if sample_indices is not None
+        else prepared_dataset.num_examples(subset_name)
+    )
+
+    image_shape = prepared_dataset.features[image_key].shape
+    map_fn = None
+
+    if image_size is not None:
+        image_shape = (*image_size, image_shape[-1])
+
+        def map_fn(sample):
+            return {
+                **sample,
+                image_key: resize_image(
+                    sample[image_key], size=image_size, interpolation=interpolation
+                ),
+            }
+
+    # resized images have a fixed shape even when the stored ones do not
+    other_feature_keys = [
+        key
+        for key in (
+            feature_keys
+            if feature_keys is not None
+            else prepared_dataset.features.keys()
+        )
+        if key != image_key
+    ]
+
+    if (
+        decode_images
+        and ingest_batch_size is not None
+        and all(dim is not None for dim in image_shape)
+        and prepared_dataset.has_fixed_shapes(other_feature_keys)
+    ):
+        return (
+            num_samples,
+            image_shape,
+            prepared_dataset.iterate_batches(
+                subset_name,
+                batch_size=ingest_batch_size,
+                feature_keys=feature_keys,
+                sample_indices=sample_indices,
+                map_fn=map_fn,
+            ),
+        )
+
+    return (
+        num_samples,
+        None,
+        prepared_dataset.iterate(
+            subset_name,
+            feature_keys=feature_keys,
+            sample_indices=sample_indices,
+            decode_images=decode_images,
+            map_fn=map_fn,
+        ),
+    )
+
+
+def load_tfds_subsets(
+    dataset_name: str,
+    dataset_root: str,
+    subset_split_name_list: List[str],
+    download: bool,
+    image_key: str,
+    storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+    rescan_cache: bool = True,
+    subset_sample_indices: Optional[List[np.ndarray]] = None,
+    store_name_suffix: Optional[str] = None,
+    feature_keys: Optional[List[str]] = None,
+    ingest_batch_size: Optional[int] = None,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+    image_cache_size: Optional[Sequence[int]] = None,
+    image_cache_interpolation: str = "bilinear",
+    decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+) -> List[Any]:
+    """
+    Load each TFDS subset in `subset_split_name_list` into an indexable
+    collection of numpy sample dicts.
+
+    With `DatasetStorageOptions.IN_MEMORY` every subset becomes a python
+    list held in RAM. With `DatasetStorageOptions.MEMMAP` every subset is
+    written once to a `MemmapImageStore` under `dataset_root` and opened
+    lazily, so that it is shared through the page cache by all processes
+    instead of being copied into each of them. Existing stores are reused
+    unless `rescan_cache` is set.
+
+    When `subset_sample_indices` is given, only those samples of each subset
+    are decoded and kept, in order, so sample `i` of the returned subset is
+    sample `subset_sample_indices[subset_idx][i]` of the TFDS subset.
+
+    When `feature_keys` is given, only those features are decoded and kept.
+
+    When `ingest_batch_size` is given and all features have a fixed shape,
+    samples are decoded in parallel and ingested a batch at a time, straight
+    into one preallocated image array (a `ColumnarSubset` in memory).
+
+    With `TFDSReaderOptions.TFRECORD` the prepared TFRecord shards are read
+    without importing TensorFlow, once the dataset has been downloaded, and
+    with `TFDSReaderOptions.SYNTHETIC` the samples of the synthetic dataset
+    prepared under `dataset_root` are generated instead.
+
+    When `image_cache_size` is given, images are resized to that (height,
+    width) with `image_cache_interpolation` as they are ingested, and memmap
+    stores are kept apart for every resolution and interpolation, so that
+    transforms that resize to the same size have nothing left to resize.
+
+    With `DatasetStorageOptions.ENCODED` (in memory) and
+    `DatasetStorageOptions.ENCODED_MEMMAP` (in a `MemmapImageStore`) images
+    are kept as their original encoded bytes, and only decoded when a
+    sample is indexed, through a `DecodedImageCache` of
+    `decoded_image_cache_bytes` shared by all subsets of each process.
+    Images are then decoded with PIL, whose JPEG decoder can differ from
+    that of TensorFlow by a few intensity levels.
+    """
+    encoded_storage_modes = (
+        DatasetStorageOptions.ENCODED,
+        DatasetStorageOptions.ENCODED_MEMMAP,
+    )
+    if storage_mode not in (
+        DatasetStorageOptions.IN_MEMORY,
+        DatasetStorageOptions.MEMMAP,
+        *encoded_storage_modes,
+    ):
+        raise ValueError(
+            f"Invalid storage_mode {storage_mode}, must be one of "
+            f"{DatasetStorageOptions.IN_MEMORY}, {DatasetStorageOptions.MEMMAP}, "
+            f"{DatasetStorageOptions.ENCODED}, "
+            f"{DatasetStorageOptions.ENCODED_MEMMAP}"
+        )
+
+    check_tfds_reader(tfds_reader)
+
+    keep_encoded = storage_mode in encoded_storage_modes
+    use_store = storage_mode in (
+        DatasetStorageOptions.MEMMAP,
+        DatasetStorageOptions.ENCODED_MEMMAP,
+    )
+
+    if keep_encoded and image_cache_size is not None:
+        raise ValueError(
+            f"image_cache_size can not be used with storage_mode {storage_mode}, "
+            f"as resized images would have to be encoded again"
+        )
+
+    if keep_encoded:
+        # images are decoded the same way whether they are read from memory
+        # or from a store, so the store name only marks them as encoded
+        image_channels = get_image_channels(
+            dataset_name, dataset_root, image_key, tfds_reader
+        )
+        decoded_image_cache = DecodedImageCache(max_bytes=decoded_image_cache_bytes)
+        store_name_suffix = "_".join(
+            item for item in [store_name_suffix, "encoded"] if item is not None
+        )
+
+    get_subset_source = (
+        functools.partial(get_tfrecord_subset_source, tfds_reader=tfds_reader)
+        if tfds_reader != TFDSReaderOptions.TENSORFLOW
+        else get_tfds_subset_source
+    )
+
+    if image_cache_size is not None:
+        image_cache_size = tuple(int(dim) for dim in image_cache_size)
+        store_name_suffix = "_".join(
+            item
+            for item in [
+                store_name_suffix,
+                get_image_cache_name(image_cache_size, image_cache_interpolation),
+            ]
+            if item is not None
+        )
+
+    subsets = []
+
+    for subset_idx, subset_name in enumerate(subset_split_name_list):
+        store_dir = (
+            pathlib.Path(dataset_root)
+            / f"{dataset_name}_memmap_store"
+            / get_subset_store_name([subset_name], store_name_suffix)
+        )
+        sample_indices = (
+            subset_sample_indices[subset_idx]
+            if subset_sample_indices is not None
+            else None
+        )
+        sample_indices_hash = (
+            get_sample_indices_hash([sample_indices])
+            if sample_indices is not None
+            else None
+        )
+
+        def add_subset(subset):
+            if keep_encoded:
+                subset = EncodedImageSubset(
+                    subset,
+                    image_key=image_key,
+                    channels=image_channels,
+                    name=subset_name,
+                    cache=decoded_image_cache,
+                )
+            subsets.append(subset)
+
+        if (
+            use_store
+            and not rescan_cache
+            and MemmapImageStore.exists(store_dir)
+            and store_matches_request(
+                store_dir, feature_keys, tfds_reader, sample_indices_hash
+            )
+        ):
+            log.info(f"Reusing memory-mapped store of {subset_name} at {store_dir}")
+            add_subset(MemmapImageStore(store_dir))
+            continue
+
+        num_samples, image_shape, source = get_subset_source(
+            dataset_name=dataset_name,
+            dataset_root=dataset_root,
+            subset_name=subset_name,
+            download=download,
+            image_key=image_key,
+            feature_keys=feature_keys,
+            sample_indices=sample_indices,
+            ingest_batch_size=ingest_batch_size,
+            image_size=image_cache_size,
+            interpolation=image_cache_interpolation,
+            decode_images=not keep_encoded,
+        )
+
+        metadata = dict(
+            dataset_name=dataset_name,
+            subset_name=subset_name,
+            store_name_suffix=store_name_suffix,
+            sample_indices_hash=sample_indices_hash,
+            feature_keys=feature_keys,
+            tfds_reader=tfds_reader,
+            image_cache_size=(
+                list(image_cache_size) if image_cache_size is not None else None
+            ),
+            image_cache_interpolation=image_cache_interpolation,
+            image_encoded=keep_encoded,
+        )
+
+        start_time = time.time()
+
+        if image_shape is not None:
+
+            def batch_iterator():
+                with tqdm(total=num_samples) as pbar:
+                    for batch in source:
+                        yield batch
+                        pbar.update(len(batch[image_key]))
+
+            if use_store:
+                subsets.append(
+                    MemmapImageStore.build_from_batches(
+                        store_dir=store_dir,
+                        batches=batch_iterator(),
+                        num_samples=num_samples,
+                        image_shape=image_shape,
+                        image_key=image_key,
+                        metadata=metadata,
+                    )
+                )
+            else:
+                subsets.append(
+                    ColumnarSubset.build_from_batches(
+                        batches=batch_iterator(),
+                        num_samples=num_samples,
+                        image_shape=image_shape,
+                        image_key=image_key,
+                    )
+                )
+        else:
+            if ingest_batch_size is not None and not keep_encoded:
+                log.info(
+                    f"Features of {dataset_name} {subset_name} do not all have "
+                    f"a fixed shape, they will be ingested one sample at a time"
+                )
+
+            def sample_iterator():
+                with tqdm(total=num_samples) as pbar:
+                    for sample in source:
+                        if keep_encoded and use_store:
+                            # encoded images are stored as flat uint8 arrays
+                            sample = {
+                                **sample,
+                                image_key: np.frombuffer(
+                                    sample[image_key], dtype=np.uint8
+                                ),
+                            }
+                        yield sample
+                        pbar.update(1)
+
+            if use_store:
+                add_subset(
+                    MemmapImageStore.build(
+                        store_dir=store_dir,
+                        samples=sample_iterator(),
+                        image_key=image_key,
+                        metadata=metadata,
+                    )
+                )
+            else:
+                add_subset(list(sample_iterator()))
+
+        elapsed_time = time.time() - start_time
+        log.info(
+            f"Ingested {num_samples} samples of {dataset_name} {subset_name} "
+            f"in {elapsed_time:.2f}s "
+            f"({num_samples / max(elapsed_time, 1e-6):.1f} images/sec)"
+        )
+
+    return subsets
+
+
+def iterate_encoded_sample_batches(
+    dataset_name: str,
+    dataset_root: str,
+    subset_name: str,
+    download: bool,
+    image_key: str,
+    feature_keys: Optional[List[str]],
+    batch_size: int,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """
+    Yield the samples of a TFDS subset, with their images left encoded, as
+    batches of a dict of feature arrays (or lists) and the batch size.
+    """
+    if tfds_reader != TFDSReaderOptions.TENSORFLOW:
+        samples = load_prepared_tfds_dataset(
+            dataset_name,
+            data_dir=dataset_root,
+            download=download,
+            tfds_reader=tfds_reader,
+        ).iterate(subset_name, feature_keys=feature_keys, decode_images=False)
+    else:
+        import tensorflow as tf
+        import tensorflow_datasets as tfds
+
+        subset = tfds.load(
+            dataset_name,
+            split=subset_name,
+            shuffle_files=False,
+            download=download,
+            as_supervised=False,
+            data_dir=dataset_root,
+            decoders=get_tfds_decoders(
+                feature_keys=feature_keys, skip_decoding_keys=[image_key]
+            ),
+        )
+
+        if all(
+            spec.shape.is_fully_defined()
+            for spec in tf.nest.flatten(subset.element_spec)
+        ):
+            for batch in (
+                subset.batch(batch_size).prefetch(tf.data.AUTOTUNE).as_numpy_iterator()
+            ):
+                yield batch, len(batch[image_key])
+            return
+
+        samples = subset.as_numpy_iterator()
+
+    chunk = []
+    for sample in samples:
+        chunk.append(sample)
+        if len(chunk) == batch_size:
+            yield list_of_dicts_to_dict_of_lists(chunk), len(chunk)
+            chunk = []
+
+    if len(chunk) > 0:
+        yield list_of_dicts_to_dict_of_lists(chunk), len(chunk)
+
+
+def load_tfds_class_capped_subsets(
+    dataset_name: str,
+    dataset_root: str,
+    subset_split_name_list: List[str],
+    download: bool,
+    image_key: str,
+    class_name_key: str,
+    max_samples_per_class: int,
+    class_sampling_seed: int = 0,
+    label_extractor_fn: Optional[Callable] = None,
+    storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+    rescan_cache: bool = True,
+    feature_keys: Optional[List[str]] = None,
+    ingest_batch_size: Optional[int] = None,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+    image_cache_size: Optional[Sequence[int]] = None,
+    image_cache_interpolation: str = "bilinear",
+    decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+) -> Tuple[List[Any], Dict[Any, Any]]:
+    """
+    Load at most `max_samples_per_class` samples of every class of a TFDS
+    dataset, for datasets too large to be loaded whole (e.g. QuickDraw).
+
+    The subsets in `subset_split_name_list` are streamed once, with their
+    images left encoded, through a `PerClassReservoir` seeded with
+    `class_sampling_seed`, so that the same samples are kept on every run.
+    Only the kept images are decoded. Classes are identified by the integer
+    labels of `class_name_key` (a `ClassLabel` feature), passed through
+    `label_extractor_fn` when given.
+
+    Every class becomes a subset of its own, so the returned class index
+    maps each class to (class subset_idx, sample_idx) addresses. With
+    `DatasetStorageOptions.MEMMAP` (or `ENCODED_MEMMAP`) every class is
+    written to its own `MemmapImageStore` shard, and the shards are reused,
+    along with the index, unless `rescan_cache` is set.
+    """
+    if storage_mode not in (
+        DatasetStorageOptions.IN_MEMORY,
+        DatasetStorageOptions.MEMMAP,
+        DatasetStorageOptions.ENCODED,
+        DatasetStorageOptions.ENCODED_MEMMAP,
+    ):
+        raise ValueError(f"Invalid storage_mode {storage_mode}")
+
+    check_tfds_reader(tfds_reader)
+
+    keep_encoded = storage_mode in (
+        DatasetStorageOptions.ENCODED,
+        DatasetStorageOptions.ENCODED_MEMMAP,
+    )
+    use_store = storage_mode in (
+        DatasetStorageOptions.MEMMAP,
+        DatasetStorageOptions.ENCODED_MEMMAP,
+    )
+
+    if keep_encoded and image_cache_size is not None:
+        raise ValueError(
+            f"image_cache_size can not be used with storage_mode {storage_mode}, "
+            f"as resized images would have to be encoded again"
+        )
+
+    store_name_suffix = "_".join(
+        [f"{max_samples_per_class}_per_class", f"seed_{class_sampling_seed}"]
+        + (["encoded"] if keep_encoded else [])
+        + (
+            [get_image_cache_name(image_cache_size, image_cache_interpolation)]
+            if image_cache_size is not None
+            else []
+        )
+    )
+    store_root = (
+        pathlib.Path(dataset_root)
+        / f"{dataset_name}_capped_store"
+        / get_subset_store_name(subset_split_name_list, store_name_suffix)
+    )
+    manifest = dict(
+        dataset_name=dataset_name,
+        tfds_version=get_tfds_version(dataset_name, dataset_root, tfds_reader),
+        subset_split_name_list=list(subset_split_name_list),
+        class_name_key=class_name_key,
+        label_extractor=get_callable_fingerprint(label_extractor_fn),
+        max_samples_per_class=max_samples_per_class,
+        class_sampling_seed=class_sampling_seed,
+        feature_keys=feature_keys,
+        tfds_reader=tfds_reader,
+        storage_mode=storage_mode,
+        image_cache_size=(
+            list(image_cache_size) if image_cache_size is not None else None
+        ),
+        image_cache_interpolation=image_cache_interpolation,
+    )
+
+    image_channels = get_image_channels(
+        dataset_name, dataset_root, image_key, tfds_reader
+    )
+    decoded_image_cache = DecodedImageCache(max_bytes=decoded_image_cache_bytes)
+
+    def get_shard(shard_idx, subset):
+        if keep_encoded:
+            return EncodedImageSubset(
+                subset,
+                image_key=image_key,
+                channels=image_channels,
+                name=f"shard_{shard_idx:05d}",
+                cache=decoded_image_cache,
+            )
+        return subset
+
+    if use_store and not rescan_cache:
+        class_to_address_dict = load_class_index(
+            index_dir=store_root / "class_index", manifest=manifest
+        )
+        if class_to_address_dict is not None:
+            log.info(f"Reusing class-capped store at {store_root}")
+            shard_dirs = sorted(store_root.glob("shard_*"))
+            return [
+                get_shard(shard_idx, MemmapImageStore(shard_dir))
+                for shard_idx, shard_dir in enumerate(shard_dirs)
+            ], class_to_address_dict
+
+    reservoir = PerClassReservoir(
+        capacity=max_samples_per_class, seed=class_sampling_seed
+    )
+    start_time = time.time()
+
+    for subset_name in subset_split_name_list:
+        log.info(
+            f"Sampling at most {max_samples_per_class} samples per class "
+            f"of {dataset_name} {subset_name}"
+        )
+        with tqdm() as pbar:
+            for batch, batch_size in iterate_encoded_sample_batches(
+                dataset_name=dataset_name,
+                dataset_root=dataset_root,
+                subset_name=subset_name,
+                download=download,
+                image_key=image_key,
+                feature_keys=feature_keys,
+                batch_size=ingest_batch_size or 4096,
+                tfds_reader=tfds_reader,
+            ):
+                reservoir.add(
+                    batch[class_name_key],
+                    get_item_fn=lambda idx: {
+                        key: value[idx] for key, value in batch.items()
+                    },
+                )
+                pbar.update(batch_size)
+
+    class_samples = reservoir.get_class_items()
+
+    log.info(
+        f"Kept {sum(len(samples) for samples in class_samples.values())} of "
+        f"{reservoir.num_seen} samples of {dataset_name}, from "
+        f"{len(class_samples)} classes, in {time.time() - start_time:.2f}s"
+    )
+
+    def decode_sample(sample):
+        image = decode_image(sample[image_key], channels=image_channels)
+        if image_cache_size is not None:
+            image = resize_image(
+                image, size=image_cache_size, interpolation=image_cache_interpolation
+            )
+        return {**sample, image_key: image}
+
+    def encode_sample(sample):
+        # encoded images are stored as flat uint8 arrays
+        return {
+            **sample,
+            image_key: np.frombuffer(sample[image_key], dtype=np.uint8),
+        }
+
+    subsets = []
+    class_to_address_dict = {}
+
+    with ThreadPoolExecutor() as executor:
+        for shard_idx, (label, samples) in enumerate(
+            tqdm(class_samples.items(), total=len(class_samples))
+        ):
+            if not keep_encoded:
+                samples = list(executor.map(decode_sample, samples))
+            elif use_store:
+                samples = [encode_sample(sample) for sample in samples]
+
+            if use_store:
+                shard = MemmapImageStore.build(
+                    store_dir=store_root / f"shard_{shard_idx:05d}",
+                    samples=samples,
+                    image_key=image_key,
+                    metadata=dict(manifest, label=int(label)),
+                )
+            else:
+                shard = samples
+
+            subsets.append(get_shard(shard_idx, shard))
+            class_name = (
+                label_extractor_fn(np.int64(label))
+                if label_extractor_fn is not None
+                else int(label)
+            )
+            class_to_address_dict.setdefault(class_name, []).extend(
+                (shard_idx, sample_idx) for sample_idx in range(len(samples))
+            )
+
+    if use_store:
+        cached_class_to_address_dict = save_class_index(
+            index_dir=store_root / "class_index",
+            class_to_records_dict=class_to_address_dict,
+            manifest=manifest,
+        )
+        if cached_class_to_address_dict is not None:
+            class_to_address_dict = cached_class_to_address_dict
+
+    return subsets, class_to_address_dict
+
+
+def load_chunked_subsets(
+    subsets: List[Any],
+    class_to_address_dict: Dict[Any, Any],
+    image_key: str,
+    chunk_codec: str = ChunkCodecs.LZ4,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    rescan_cache: bool = True,
+    chunk_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+) -> List[ChunkedImageStore]:
+    """
+    Compress every `MemmapImageStore` of `subsets` into a
+    `ChunkedImageStore` next to it, with its samples grouped by their class
+    in `class_to_address_dict`, so that the samples of a class share
+    chunks. Existing chunked stores are reused unless `rescan_cache` is set
+    or they were built from another store, codec, chunk size or class index.
+    """
+    chunk_codec = resolve_chunk_codec(chunk_codec)
+    chunked_subsets = []
+
+    for subset_idx, subset in enumerate(subsets):
+        if not isinstance(subset, MemmapImageStore):
+            raise ValueError(
+                f"Only memory-mapped stores can be chunked, subset {subset_idx} "
+                f"is a {type(subset).__name__}"
+            )
+
+        group_ids = get_subset_group_ids(
+            num_samples=len(subset),
+            subset_idx=subset_idx,
+            class_to_address_dict=class_to_address_dict,
+        )
+        store_dir = subset.store_dir.with_name(f"{subset.store_dir.name}_chunked")
+        metadata = dict(
+            source_metadata=subset.manifest["metadata"],
+            codec=chunk_codec,
+            chunk_bytes=int(chunk_bytes),
+            group_ids_hash=hashlib.sha1(group_ids.tobytes()).hexdigest(),
+        )
+
+        if (
+            not rescan_cache
+            and ChunkedImageStore.exists(store_dir)
+            and ChunkedImageStore(store_dir).manifest["metadata"]
+            == json.loads(json.dumps(metadata))
+        ):
+            chunked_subset = ChunkedImageStore(
+                store_dir, chunk_cache_bytes=chunk_cache_bytes
+            )
+        else:
+            chunked_subset = ChunkedImageStore.build(
+                store_dir=store_dir,
+                subset=subset,
+                image_key=image_key,
+                group_ids=group_ids,
+                chunk_bytes=chunk_bytes,
+                codec=chunk_codec,
+                metadata=metadata,
+                chunk_cache_bytes=chunk_cache_bytes,
+            )
+
+        chunked_subsets.append(chunked_subset)
+
+    return chunked_subsets
+
+
+def load_tfds_class_indexed_subsets(
+    dataset_name: str,
+    dataset_root: str,
+    subset_split_name_list: List[str],
+    download: bool,
+    image_key: str,
+    class_name_key: str,
+    label_extractor_fn: Optional[Callable] = None,
+    storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+    rescan_cache: bool = True,
+    split_aware_ingest: bool = False,
+    split_name: Optional[str] = None,
+    split_percentage: Optional[Dict[str, int]] = None,
+    split_config: Optional[DictConfig] = None,
+    feature_keys: Optional[List[str]] = None,
+    ingest_batch_size: Optional[int] = None,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+    image_cache_size: Optional[Sequence[int]] = None,
+    image_cache_interpolation: str = "bilinear",
+    decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+    max_samples_per_class: Optional[int] = None,
+    class_sampling_seed: int = 0,
+    chunk_codec: str = ChunkCodecs.LZ4,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    shared_subsets_owner: Optional[Any] = None,
+) -> Tuple[List[Any], Dict[Any, List[Tuple[int, int]]]]:
+    """
+    Load the subsets of a TFDS dataset together with their class to
+    (subset_idx, sample_idx) address index.
+
+    If `shared_subsets_owner` is given, the loaded subsets are shared
+    process-wide with every other owner that asks for the same data (e.g.
+    the train, val and test splits of a datamodule), and only loaded again
+    once all of those owners have been released or garbage collected.
+    With `split_aware_ingest` only the samples of `split_name` are loaded,
+    so the subsets are only shared between instances of the same split.
+    With `max_samples_per_class` at most that many samples of every class
+    are kept, see `load_tfds_class_capped_subsets`.
+    With the chunked `storage_mode` the samples are ingested into
+    memory-mapped stores and then compressed into chunks of about
+    `chunk_bytes` with `chunk_codec`, see `load_chunked_subsets`.
+    """
+    if max_samples_per_class is not None and split_aware_ingest:
+        raise ValueError(
+            "max_samples_per_class can not be used with split_aware_ingest"
+        )
+
+    # chunked stores are compressed from the memory-mapped stores
+    store_storage_mode = (
+        DatasetStorageOptions.MEMMAP
+        if storage_mode == DatasetStorageOptions.CHUNKED
+        else storage_mode
+    )
+
+    def load_stored_subsets():
+        if max_samples_per_class is not None:
+            return load_tfds_class_capped_subsets(
+                dataset_name=dataset_name,
+                dataset_root=dataset_root,
+                subset_split_name_list=subset_split_name_list,
+                download=download,
+                image_key=image_key,
+                class_name_key=class_name_key,
+                max_samples_per_class=max_samples_per_class,
+                class_sampling_seed=class_sampling_seed,
+                label_extractor_fn=label_extractor_fn,
+                storage_mode=store_storage_mode,
+                rescan_cache=rescan_cache,
+                feature_keys=feature_keys,
+                ingest_batch_size=ingest_batch_size,
+                tfds_reader=tfds_reader,
+                image_cache_size=image_cache_size,
+                image_cache_interpolation=image_cache_interpolation,
+                decoded_image_cache_bytes=decoded_image_cache_bytes,
+            )
+
+        if split_aware_ingest:
+            _, subset_sample_indices = get_split_sample_indices(
+                dataset_name=dataset_name,
+                dataset_root=dataset_root,
+                subset_split_name_list=subset_split_name_list,
+                download=download,
+                image_key=image_key,
+                class_name_key=class_name_key,
+                label_extractor_fn=label_extractor_fn,
+                split_name=split_name,
+                split_percentage=split_percentage,
+                split_config=split_config,
+                rescan_cache=rescan_cache,
+                tfds_reader=tfds_reader,
+            )
+        else:
+            subset_sample_indices = None
+
+        subsets = load_tfds_subsets(
+            dataset_name=dataset_name,
+            dataset_root=dataset_root,
+            subset_split_name_list=subset_split_name_list,
+            download=download,
+            image_key=image_key,
+            storage_mode=store_storage_mode,
+            rescan_cache=rescan_cache,
+            subset_sample_indices=subset_sample_indices,
+            store_name_suffix=split_name if split_aware_ingest else None,
+            feature_keys=feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+        )
+
+        class_to_address_dict = load_class_to_address_dict(
+            dataset_name=dataset_name,
+            dataset_root=dataset_root,
+            subset_split_name_list=subset_split_name_list,
+            class_name_key=class_name_key,
+            label_extractor_fn=label_extractor_fn,
+            rescan_cache=rescan_cache,
+            get_subsets_fn=lambda: subsets,
+            store_name_suffix=split_name if split_aware_ingest else None,
+            tfds_reader=tfds_reader,
+            sample_indices_hash=get_sample_indices_hash(subset_sample_indices),
+        )
+
+        return subsets, class_to_address_dict
+
+    def load_fn():
+        subsets, class_to_address_dict = load_stored_subsets()
+
+        if storage_mode == DatasetStorageOptions.CHUNKED:
+            subsets = load_chunked_subsets(
+                subsets=subsets,
+                class_to_address_dict=class_to_address_dict,
+                image_key=image_key,
+                chunk_codec=chunk_codec,
+                chunk_bytes=chunk_bytes,
+                rescan_cache=rescan_cache,
+                chunk_cache_bytes=decoded_image_cache_bytes,
+            )
+
+        return subsets, class_to_address_dict
+
+    if shared_subsets_owner is None:
+        return load_fn()
+
+    key = (
+        dataset_name,
+        str(dataset_root),
+        tuple(subset_split_name_list),
+        storage_mode,
+        image_key,
+        class_name_key,
+        get_callable_fingerprint(label_extractor_fn),
+        split_name if split_aware_ingest else None,
+        (
+            get_split_fingerprint(split_name, split_percentage, split_config)
+            if split_aware_ingest
+            else None
+        ),
+        None if feature_keys is None else tuple(feature_keys),
+        tfds_reader,
+        None if image_cache_size is None else tuple(image_cache_size),
+        image_cache_interpolation if image_cache_size is not None else None,
+        decoded_image_cache_bytes,
+        max_samples_per_class,
+        class_sampling_seed if max_samples_per_class is not None else None,
+        chunk_codec if storage_mode == DatasetStorageOptions.CHUNKED else None,
+        chunk_bytes if storage_mode == DatasetStorageOptions.CHUNKED else None,
+    )
+
+    return acquire_shared_subsets(key=key, owner=shared_subsets_owner, load_fn=load_fn)
+
+
+class MetaDatasetEpisodeSampler(EpisodeSampler):
+    """
+    Draw the episodes of Meta-Dataset style splits, with as many queries
+    per class as half the smallest drawn class (at most 10), and a support
+    set of at most 100 samples per class and 500 in total.
+    """
+
+    max_support_set_size: int = 500
+    max_per_class_support_set_size: int = 100
+
+    def sample(self, index: int) -> Episode:
+        rng = self.get_rng(index)
+
+        _, _, label_class_ids = self.sample_classes(rng)
+        class_sizes = self.class_index.class_sizes[label_class_ids]
+
+        class_names = self.class_index.class_names
+        class_to_num_available_samples = {
+            class_names[class_id]: class_size
+            for class_id, class_size in zip(
+                label_class_ids.tolist(), class_sizes.tolist()
+            )
+        }
+
+        log.info(f"Class to num available samples: {class_to_num_available_samples}")
+
+        # This is done once for all classes such that query set is balanced
+        num_query_samples_per_class = int(np.floor(class_sizes.min() * 0.5))
+
+        if num_query_samples_per_class == 0:
+            num_query_samples_per_class = 1
+
+        num_query_samples_per_class = min(num_query_samples_per_class, 10)
+
+        num_support_samples_per_class = np.full(
+            len(label_class_ids), self.num_samples_per_class
+        )
+
+        if self.variable_num_samples_per_class:
+            support_set_size = 0
+            for idx, class_size in enumerate(class_sizes.tolist()):
+                available_support_set_size = (
+                    self.max_support_set_size
+                    - support_set_size
+                    - (len(label_class_ids) - idx)
+                )
+                num_support_samples_per_class[idx] = rng.randint(
+                    self.min_num_samples_per_class,
+                    min(
+                        class_size,
+                        available_support_set_size,
+                        self.max_per_class_support_set_size,
+                    )
+                    - num_query_samples_per_class,
+                )
+                support_set_size += int(num_support_samples_per_class[idx])
+
+        return self.sample_records(
+            rng=rng,
+            class_ids=label_class_ids,
+            class_labels=np.arange(len(label_class_ids)),
+            label_class_ids=label_class_ids,
+            num_support=num_support_samples_per_class,
+            num_queries=num_query_samples_per_class,
+        )
+
+
+def get_dataset_episode_sampler(
+    dataset: Dataset,
+    variable_num_queries_per_class_draw: bool = False,
+    episode_sampler_class: type = EpisodeSampler,
+) -> Any:
+    """
+    Build the episode sampler of a few-shot dataset from the classes of its
+    split (`current_class_to_address_dict`) and its episode settings, or,
+    when the dataset has an `episode_manifest_path`, a sampler replaying
+    the episodes (`episode_manifest_range`) of that manifest.
+    """
+    class_index = ClassAddressIndex.from_class_to_records_dict(
+        dataset.current_class_to_address_dict
+    )
+
+    if dataset.episode_manifest_path is not None:
+        manifest = EpisodeManifest.load(dataset.episode_manifest_path)
+
+        for key in ["dataset_name", "split_name"]:
+            if manifest.metadata.get(key, getattr(dataset, key)) != getattr(
+                dataset, key
+            ):
+                raise ValueError(
+                    f"Episode manifest {dataset.episode_manifest_path} was "
+                    f"exported with {key} {manifest.metadata[key]}, "
+                    f"not {getattr(dataset, key)}"
+                )
+
+        if dataset.episode_manifest_range is not None:
+            manifest = manifest.get_range(*dataset.episode_manifest_range)
+
+        log.info(
+            f"Replaying {len(manifest)} episodes of {dataset.episode_manifest_path}"
+        )
+
+        return ManifestEpisodeSampler(manifest=manifest, class_index=class_index)
+
+    return episode_sampler_class(
+        class_index=class_index,
+        num_classes_per_set=dataset.num_classes_per_set,
+        num_samples_per_class=dataset.num_samples_per_class,
+        num_queries_per_class=dataset.num_queries_per_class,
+        min_num_classes_per_set=dataset.min_num_classes_per_set,
+        min_num_samples_per_class=dataset.min_num_samples_per_class,
+        min_num_queries_per_class=dataset.min_num_queries_per_class,
+        variable_num_classes_per_set=dataset.variable_num_classes_per_set,
+        variable_num_samples_per_class=dataset.variable_num_samples_per_class,
+        variable_num_queries_per_class=dataset.variable_num_queries_per_class,
+        variable_num_queries_per_class_draw=variable_num_queries_per_class_draw,
+    )
+
+
+def export_episode_manifest(
+    dataset: Dataset,
+    path: str,
+    indices: Optional[Sequence[int]] = None,
+) -> EpisodeManifest:
+    """
+    Save the episodes `indices` (by default all) of a few-shot dataset as
+    an `EpisodeManifest` at `path`, to be replayed by datasets built with
+    `episode_manifest_path=path`.
+    """
+    manifest = EpisodeManifest.from_sampler(
+        sampler=dataset.episode_sampler,
+        indices=range(len(dataset)) if indices is None else indices,
+        metadata=dict(dataset_name=dataset.dataset_name, split_name=dataset.split_name),
+    )
+    manifest.save(path)
+
+    return manifest
+
+
+def read_episode_inputs(
+    subsets: List[Any], episode: Episode, input_key: str
+) -> List[Any]:
+    """
+    Read the `input_key` feature of every (subset_idx, sample_idx) record of
+    an episode, letting the subsets prefetch them first.
+    """
+    addresses = episode.records.tolist()
+    prefetch_subset_samples(subsets, addresses)
+
+    return [
+        subsets[subset_idx][sample_idx][input_key]
+        for subset_idx, sample_idx in addresses
+    ]
+
+
+def split_episode_sets(
+    episode: Episode, data_inputs: List[Any]
+) -> Tuple[List[Any], List[int], List[Any], List[int]]:
+    """
+    Split the inputs of the samples of an episode into support and query
+    inputs and labels, turning HWC arrays into CHW tensors.
+    """
+    if len(data_inputs) > 0 and isinstance(data_inputs[0], np.ndarray):
+        data_inputs = [torch.tensor(sample).permute(2, 0, 1) for sample in data_inputs]
+
+    support_mask = episode.support_mask.tolist()
+
+    return (
+        [item for item, is_support in zip(data_inputs, support_mask) if is_support],
+        episode.support_labels.tolist(),
+        [item for item, is_support in zip(data_inputs, support_mask) if not is_support],
+        episode.query_labels.tolist(),
+    )
+
+
+def build_episode_batch(
+    subsets: List[Any], episodes: Sequence[Episode], input_key: str
+) -> Tuple[Tensor, Tensor, int]:
+    """
+    Write the images of a batch of episodes of the same shape straight into
+    one preallocated [tasks, examples, C, H, W] uint8 tensor, and their
+    labels into a [tasks, examples] tensor, with the support examples of
+    every task first. Returns the images, labels and number of support
+    examples per task.
+    """
+    num_support = int(episodes[0].support_mask.sum())
+    num_examples = len(episodes[0].records)
+
+    for episode in episodes:
+        if (
+            len(episode.records) != num_examples
+            or int(episode.support_mask.sum()) != num_support
+        ):
+            raise ValueError(
+                f"Episodes of {int(episode.support_mask.sum())} support and "
+                f"{len(episode.records) - int(episode.support_mask.sum())} query "
+                f"examples can not be batched with episodes of {num_support} "
+                f"support and {num_examples - num_support} query examples"
+            )
+
+    # the position of every example in its task, support examples first
+    example_idx = np.concatenate(
+        [
+            np.where(
+                episode.support_mask,
+                np.cumsum(episode.support_mask) - 1,
+                num_support + np.cumsum(~episode.support_mask) - 1,
+            )
+            for episode in episodes
+        ]
+    )
+    task_idx = np.repeat(np.arange(len(episodes)), num_examples)
+
+    addresses = np.concatenate([episode.records for episode in episodes]).tolist()
+    prefetch_subset_samples(subsets, addresses)
+
+    # stores read the image alone, rather than the whole sample
+    get_image_fns = [
+        (
+            subset.get_image
+            if getattr(subset, "image_key", None) == input_key
+            else lambda index, subset=subset: subset[index][input_key]
+        )
+        for subset in subsets
+    ]
+
+    images = None
+    for (subset_idx, sample_idx), task, example in zip(
+        addresses, task_idx.tolist(), example_idx.tolist()
+    ):
+        image = np.asarray(get_image_fns[subset_idx](sample_idx))
+
+        if images is None:
+            images = np.empty(
+                (len(episodes), num_examples, image.shape[2]) + image.shape[:2],
+                dtype=np.uint8,
+            )
+
+        if image.shape != images.shape[3:] + images.shape[2:3]:
+            raise ValueError(
+                f"Images of shape {image.shape} can not be batched with images "
+                f"of shape {images.shape[3:] + images.shape[2:3]}"
+            )
+
+        images[task, example] = image.transpose(2, 0, 1)
+
+    labels = np.empty((len(episodes), num_examples), dtype=np.int64)
+    labels[task_idx, example_idx] = np.concatenate(
+        [episode.labels for episode in episodes]
+    )
+
+    return torch.from_numpy(images), torch.from_numpy(labels), num_support
+
+
+EPISODE_SET_NAMES = ("support_set", "query_set")
+
+
+def pad_episode_set(values: Sequence[Any], size: int) -> Tensor:
+    """
+    Stack the sets `values` of one or more episodes, zero-padding every set
+    to `size` examples.
+    """
+    values = [torch.as_tensor(value) for value in values]
+    padded = values[0].new_zeros((len(values), size) + values[0].shape[1:])
+    for idx, value in enumerate(values):
+        padded[idx, : len(value)] = value
+
+    return padded
+
+
+def collate_padded_episodes(
+    episodes: Sequence[Tuple[Dict, Dict]],
+) -> Tuple[DottedDict, DottedDict]:
+    """
+    Collate (input_dict, target_dict) episodes whose support and query sets
+    vary in size into one meta-batch. Every `support_set*` and `query_set*`
+    entry of a modality (e.g. its inputs, targets and extras) is zero-padded
+    to the largest set of the batch, and the target dict of the modality
+    gets `support_set_mask` and `query_set_mask`, boolean [tasks, examples]
+    tensors that are False for the padding.
+    """
+    set_sizes = {
+        (modality_name, set_name): torch.tensor(
+            [len(episode[1][modality_name][set_name]) for episode in episodes]
+        )
+        for modality_name, targets in episodes[0][1].items()
+        for set_name in EPISODE_SET_NAMES
+        if set_name in targets
+    }
+
+    def collate(values: Sequence[Any], path: Tuple[str, ...]) -> Any:
+        if isinstance(values[0], dict):
+            return DottedDict(
+                {
+                    key: collate([value[key] for value in values], path + (key,))
+                    for key in values[0].keys()
+                }
+            )
+
+        for set_name in EPISODE_SET_NAMES:
+            if len(path) > 1 and path[1].startswith(set_name):
+                return pad_episode_set(
+                    values, size=int(set_sizes[(path[0], set_name)].max())
+                )
+
+        return default_collate(values)
+
+    input_dict = collate([episode[0] for episode in episodes], ())
+    target_dict = collate([episode[1] for episode in episodes], ())
+
+    for (modality_name, set_name), sizes in set_sizes.items():
+        target_dict[modality_name][f"{set_name}_mask"] = torch.arange(
+            int(sizes.max())
+        ).unsqueeze(0) < sizes.unsqueeze(1)
+
+    return input_dict, target_dict
+
+
 class FewShotClassificationDatasetTFDS(Dataset):
     def __init__(
         self,
@@ -198,6 +1945,20 @@ class FewShotClassificationDatasetTFDS(Dataset):
         query_set_target_transform: Any = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
+        max_samples_per_class: Optional[int] = None,
+        class_sampling_seed: int = 0,
+        chunk_codec: str = ChunkCodecs.LZ4,
         label_extractor_fn: Optional[Any] = None,
     ):
         super(FewShotClassificationDatasetTFDS, self).__init__()
@@ -264,200 +2025,175 @@ class FewShotClassificationDatasetTFDS(Dataset):
 
         self.split_name = split_name
         self.split_percentage = split_percentage
-        self.subsets = []
+        self.storage_mode = storage_mode
+        self.split_aware_ingest = split_aware_ingest
+        self.share_subsets = share_subsets
+        self.ingest_batch_size = ingest_batch_size
+        self.tfds_reader = tfds_reader
+        self.image_cache_size = image_cache_size
+        self.image_cache_interpolation = image_cache_interpolation
+        self.decoded_image_cache_bytes = decoded_image_cache_bytes
+        self.episode_manifest_path = episode_manifest_path
+        self.episode_manifest_range = episode_manifest_range
+        self.max_samples_per_class = max_samples_per_class
+        self.class_sampling_seed = class_sampling_seed
+        self.chunk_codec = chunk_codec
+
+        # only keep the features that are read from the dataset
+        self.feature_keys = list(
+            dict.fromkeys(
+                [
+                    self.input_target_annotation_keys["inputs"],
+                    self.input_target_annotation_keys["target_annotations"],
+                ]
+                + list(extra_feature_keys or [])
+                + get_required_feature_keys(
+                    self.support_set_input_transform,
+                    self.query_set_input_transform,
+                    self.support_set_target_transform,
+                    self.query_set_target_transform,
+                )
+            )
+        )
 
         if subset_split_name_list is None:
             subset_split_name_list = ["train", "test"]
 
-        for subset_name in subset_split_name_list:
-
-            subset, subset_info = tfds.load(
-                self.dataset_name,
-                split=subset_name,
-                shuffle_files=False,
-                download=download,
-                as_supervised=False,
-                data_dir=self.dataset_root,
-                with_info=True,
-            )
-
-            log.info(f"Loading into memory {subset_name} info: {subset_info}")
-            subset_samples = []
-            with tqdm(total=len(subset)) as pbar:
-                for sample in subset:
-                    sample = {key: sample[key].numpy() for key in sample.keys()}
-                    subset_samples.append(sample)
-                    pbar.update(1)
-                self.subsets.append(subset_samples)
-
-            if self.print_info:
-                log.info(f"Loaded two subsets with info: {subset_info}")
-
-        self.class_to_address_dict = get_class_to_idx_dict(
-            self.subsets,
+        self.subsets, self.class_to_address_dict = load_tfds_class_indexed_subsets(
+            dataset_name=self.dataset_name,
+            dataset_root=self.dataset_root,
+            subset_split_name_list=subset_split_name_list,
+            download=download,
+            image_key=self.input_target_annotation_keys["inputs"],
             class_name_key=self.input_target_annotation_keys["target_annotations"],
             label_extractor_fn=label_extractor_fn,
+            storage_mode=storage_mode,
+            rescan_cache=rescan_cache,
+            split_aware_ingest=split_aware_ingest,
+            split_name=split_name,
+            split_percentage=split_percentage,
+            split_config=split_config,
+            feature_keys=self.feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            max_samples_per_class=max_samples_per_class,
+            class_sampling_seed=class_sampling_seed,
+            chunk_codec=chunk_codec,
+            shared_subsets_owner=self if share_subsets else None,
         )
 
         self.label_extractor_fn = label_extractor_fn
 
-        if self.split_config is None:
-            if split_name == FewShotSuperSplitSetOptions.TRAIN:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if idx < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.VAL:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.TEST:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    + split_percentage[FewShotSuperSplitSetOptions.TEST]
-                }
+        if split_aware_ingest and split_config is None:
+            # only the classes of this split were ingested, in sorted order
+            split_class_names = list(self.class_to_address_dict.keys())
         else:
-            if self.print_info:
-                log.info(self.split_config)
-            self.current_class_to_address_dict = {
-                label_name: self.class_to_address_dict[label_name]
-                for label_name in self.split_config[split_name]
-            }
-
-        self.print_info = False
-
-    def __len__(self):
-        return self.num_episodes
-
-    def __getitem__(self, index):
-        rng = np.random.RandomState(index)
-
-        support_set_inputs = []
-        support_set_labels = []
-
-        query_set_inputs = []
-        query_set_labels = []
-
-        num_classes_per_set = (
-            rng.choice(range(self.min_num_classes_per_set, self.num_classes_per_set))
-            if self.variable_num_classes_per_set
-            else self.num_classes_per_set
-        )
-
-        available_class_labels = list(self.current_class_to_address_dict.keys())
-        select_classes_for_set = rng.choice(
-            available_class_labels,
-            size=min(num_classes_per_set, len(available_class_labels)),
-        )
-
-        label_idx = set(select_classes_for_set)
-        label_idx = list(label_idx)
+            split_class_names = select_split_classes(
+                class_names=list(self.class_to_address_dict.keys()),
+                split_name=split_name,
+                split_percentage=split_percentage,
+                split_config=split_config,
+            )
 
-        # shuffle label idx
-        label_idx = rng.permutation(label_idx)
+        if self.split_config is not None and self.print_info:
+            log.info(self.split_config)
 
-        label_idx_to_local_label_idx = {
-            label_name: i for i, label_name in enumerate(label_idx)
+        self.current_class_to_address_dict = {
+            class_name: self.class_to_address_dict[class_name]
+            for class_name in split_class_names
         }
 
-        # This is done once for all classes such that query set is balanced
-        if self.variable_num_queries_per_class:
-            num_queries_per_class = rng.choice(
-                range(
-                    self.min_num_queries_per_class,
-                    self.num_queries_per_class,
-                )
-            )
-        else:
-            num_queries_per_class = self.num_queries_per_class
-
-        for class_name in select_classes_for_set:
-            if self.variable_num_samples_per_class:
-                num_samples_per_class = rng.choice(
-                    range(
-                        self.min_num_samples_per_class,
-                        self.num_samples_per_class,
-                    )
-                )
-            else:
-                num_samples_per_class = self.num_samples_per_class
+        self.episode_sampler = get_dataset_episode_sampler(self)
 
-            selected_samples_addresses_idx = rng.choice(
-                range(
-                    len(self.current_class_to_address_dict[class_name]),
-                ),
-                size=min(
-                    len(self.current_class_to_address_dict[class_name]),
-                    num_samples_per_class + num_queries_per_class,
-                ),
-                replace=False,
-            )
+        if self.episode_manifest_path is not None:
+            self.num_episodes = len(self.episode_sampler)
 
-            selected_samples_addresses = [
-                self.current_class_to_address_dict[class_name][sample_address_idx]
-                for sample_address_idx in selected_samples_addresses_idx
-            ]
+        self.print_info = False
 
-            data_inputs = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["inputs"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
+    def decoded_image_cache_info(self) -> Optional[DecodedImageCacheInfo]:
+        """
+        Return the hit and miss counters of the decoded image cache of this
+        process, when images are kept encoded.
+        """
+        return get_decoded_image_cache_info(self.subsets)
 
-            data_labels = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["target_annotations"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
+    def __len__(self):
+        return self.num_episodes
 
-            data_labels = [
-                label_idx_to_local_label_idx[self.label_extractor_fn(item)]
-                for item in data_labels
+    def get_episode_batch(self, indices: Sequence[int]):
+        """
+        Build the episodes at `indices` as one meta-batch, with the images of
+        all of them in one [tasks, examples, C, H, W] uint8 tensor (see
+        `build_episode_batch`), so that they are not stacked again per
+        episode and by the DataLoader. Only episodes of a fixed shape can be
+        batched: set sizes can not vary, and per-sample transforms can not
+        be used, they are applied to the batch instead.
+        """
+        if (
+            self.variable_num_classes_per_set
+            or self.variable_num_samples_per_class
+            or self.variable_num_queries_per_class
+        ):
+            raise ValueError("Episodes of variable size can not be batched")
+
+        if any(
+            transform is not None
+            for transform in [
+                self.support_set_input_transform,
+                self.query_set_input_transform,
+                self.support_set_target_transform,
+                self.query_set_target_transform,
             ]
+        ):
+            raise ValueError(
+                "Episodes can only be batched without per-sample transforms"
+            )
 
-            shuffled_idx = rng.permutation(len(data_inputs))
-
-            data_inputs = [data_inputs[i] for i in shuffled_idx]
-
-            if isinstance(data_inputs[0], np.ndarray):
-                data_inputs = [
-                    torch.tensor(sample).permute(2, 0, 1) for sample in data_inputs
-                ]
+        images, labels, num_support = build_episode_batch(
+            subsets=self.subsets,
+            episodes=[self.episode_sampler.sample(int(index)) for index in indices],
+            input_key=self.input_target_annotation_keys["inputs"],
+        )
 
-            data_labels = [data_labels[i] for i in shuffled_idx]
+        input_dict = DottedDict(
+            image=DottedDict(
+                support_set=images[:, :num_support],
+                query_set=images[:, num_support:],
+            ),
+        )
 
-            if len(data_inputs) > num_samples_per_class:
-                support_set_inputs.extend(data_inputs[:num_samples_per_class])
-                support_set_labels.extend(data_labels[:num_samples_per_class])
+        label_dict = DottedDict(
+            image=DottedDict(
+                support_set=labels[:, :num_support],
+                query_set=labels[:, num_support:],
+            )
+        )
 
-                query_set_inputs.extend(data_inputs[num_samples_per_class:])
-                query_set_labels.extend(data_labels[num_samples_per_class:])
-            else:
-                support_set_inputs.extend(data_inputs[:-1])
-                support_set_labels.extend(data_labels[:-1])
+        return input_dict, label_dict
 
-                query_set_inputs.extend(data_inputs[-1:])
-                query_set_labels.extend(data_labels[-1:])
+    def __getitem__(self, index):
+        # a list of indices, as given by a BatchSampler, is a meta-batch
+        if isinstance(index, (list, tuple, np.ndarray)):
+            return self.get_episode_batch(index)
+
+        episode = self.episode_sampler.sample(index)
+
+        (
+            support_set_inputs,
+            support_set_labels,
+            query_set_inputs,
+            query_set_labels,
+        ) = split_episode_sets(
+            episode=episode,
+            data_inputs=read_episode_inputs(
+                subsets=self.subsets,
+                episode=episode,
+                input_key=self.input_target_annotation_keys["inputs"],
+            ),
+        )
 
         if self.support_set_input_transform:
             support_set_inputs = apply_input_transforms(
@@ -616,6 +2352,20 @@ class FewShotClassificationMetaDatasetTFDS(Dataset):
         query_set_target_transform: Any = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
+        max_samples_per_class: Optional[int] = None,
+        class_sampling_seed: int = 0,
+        chunk_codec: str = ChunkCodecs.LZ4,
         label_extractor_fn: Optional[Any] = None,
     ):
         super(FewShotClassificationMetaDatasetTFDS, self).__init__()
@@ -681,200 +2431,120 @@ class FewShotClassificationMetaDatasetTFDS(Dataset):
 
         self.split_name = split_name
         self.split_percentage = split_percentage
-        self.subsets = []
+        self.storage_mode = storage_mode
+        self.split_aware_ingest = split_aware_ingest
+        self.share_subsets = share_subsets
+        self.ingest_batch_size = ingest_batch_size
+        self.tfds_reader = tfds_reader
+        self.image_cache_size = image_cache_size
+        self.image_cache_interpolation = image_cache_interpolation
+        self.decoded_image_cache_bytes = decoded_image_cache_bytes
+        self.episode_manifest_path = episode_manifest_path
+        self.episode_manifest_range = episode_manifest_range
+        self.max_samples_per_class = max_samples_per_class
+        self.class_sampling_seed = class_sampling_seed
+        self.chunk_codec = chunk_codec
+
+        # only keep the features that are read from the dataset
+        self.feature_keys = list(
+            dict.fromkeys(
+                [
+                    self.input_target_annotation_keys["inputs"],
+                    self.input_target_annotation_keys["target_annotations"],
+                ]
+                + list(extra_feature_keys or [])
+                + get_required_feature_keys(
+                    self.support_set_input_transform,
+                    self.query_set_input_transform,
+                    self.support_set_target_transform,
+                    self.query_set_target_transform,
+                )
+            )
+        )
 
         if subset_split_name_list is None:
             subset_split_name_list = ["train", "test"]
 
-        for subset_name in subset_split_name_list:
-
-            subset, subset_info = tfds.load(
-                self.dataset_name,
-                split=subset_name,
-                shuffle_files=False,
-                download=download,
-                as_supervised=False,
-                data_dir=self.dataset_root,
-                with_info=True,
-            )
-
-            log.info(f"Loading into memory {subset_name} info: {subset_info}")
-            subset_samples = []
-            with tqdm(total=len(subset)) as pbar:
-                for sample in subset:
-                    sample = {key: sample[key].numpy() for key in sample.keys()}
-                    subset_samples.append(sample)
-                    pbar.update(1)
-                self.subsets.append(subset_samples)
-
-            if self.print_info:
-                log.info(f"Loaded two subsets with info: {subset_info}")
-
-        self.class_to_address_dict = get_class_to_idx_dict(
-            self.subsets,
+        self.subsets, self.class_to_address_dict = load_tfds_class_indexed_subsets(
+            dataset_name=self.dataset_name,
+            dataset_root=self.dataset_root,
+            subset_split_name_list=subset_split_name_list,
+            download=download,
+            image_key=self.input_target_annotation_keys["inputs"],
             class_name_key=self.input_target_annotation_keys["target_annotations"],
             label_extractor_fn=label_extractor_fn,
+            storage_mode=storage_mode,
+            rescan_cache=rescan_cache,
+            split_aware_ingest=split_aware_ingest,
+            split_name=split_name,
+            split_percentage=split_percentage,
+            split_config=split_config,
+            feature_keys=self.feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            max_samples_per_class=max_samples_per_class,
+            class_sampling_seed=class_sampling_seed,
+            chunk_codec=chunk_codec,
+            shared_subsets_owner=self if share_subsets else None,
         )
 
         self.label_extractor_fn = label_extractor_fn
 
-        if self.split_config is None:
-            if split_name == FewShotSuperSplitSetOptions.TRAIN:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if idx < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.VAL:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.TEST:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    + split_percentage[FewShotSuperSplitSetOptions.TEST]
-                }
-        else:
-            if self.print_info:
-                log.info(self.split_config)
-            self.current_class_to_address_dict = {
-                label_name: self.class_to_address_dict[label_name]
-                for label_name in self.split_config[split_name]
-            }
-
-        self.print_info = False
-
-    def __len__(self):
-        return self.num_episodes
-
-    def __getitem__(self, index):
-        rng = np.random.RandomState(index)
-
-        support_set_inputs = []
-        support_set_labels = []
-
-        query_set_inputs = []
-        query_set_labels = []
-
-        num_classes_per_set = (
-            rng.choice(range(self.min_num_classes_per_set, self.num_classes_per_set))
-            if self.variable_num_classes_per_set
-            else self.num_classes_per_set
-        )
-
-        available_class_labels = list(self.current_class_to_address_dict.keys())
-        select_classes_for_set = rng.choice(
-            available_class_labels,
-            size=min(num_classes_per_set, len(available_class_labels)),
-        )
-
-        label_idx = set(select_classes_for_set)
-        label_idx = list(label_idx)
-
-        # shuffle label idx
-        label_idx = rng.permutation(label_idx)
-
-        label_idx_to_local_label_idx = {
-            label_name: i for i, label_name in enumerate(label_idx)
-        }
-
-        # This is done once for all classes such that query set is balanced
-        if self.variable_num_queries_per_class:
-            num_queries_per_class = rng.choice(
-                range(
-                    self.min_num_queries_per_class,
-                    self.num_queries_per_class,
-                )
-            )
+        if split_aware_ingest and split_config is None:
+            # only the classes of this split were ingested, in sorted order
+            split_class_names = list(self.class_to_address_dict.keys())
         else:
-            num_queries_per_class = self.num_queries_per_class
-
-        for class_name in select_classes_for_set:
-            if self.variable_num_samples_per_class:
-                num_samples_per_class = rng.choice(
-                    range(
-                        self.min_num_samples_per_class,
-                        self.num_samples_per_class,
-                    )
-                )
-            else:
-                num_samples_per_class = self.num_samples_per_class
-
-            selected_samples_addresses_idx = rng.choice(
-                range(
-                    len(self.current_class_to_address_dict[class_name]),
-                ),
-                size=min(
-                    len(self.current_class_to_address_dict[class_name]),
-                    num_samples_per_class + num_queries_per_class,
-                ),
-                replace=False,
+            split_class_names = select_split_classes(
+                class_names=list(self.class_to_address_dict.keys()),
+                split_name=split_name,
+                split_percentage=split_percentage,
+                split_config=split_config,
             )
 
-            selected_samples_addresses = [
-                self.current_class_to_address_dict[class_name][sample_address_idx]
-                for sample_address_idx in selected_samples_addresses_idx
-            ]
-
-            data_inputs = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["inputs"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
-
-            data_labels = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["target_annotations"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
-
-            data_labels = [
-                label_idx_to_local_label_idx[self.label_extractor_fn(item)]
-                for item in data_labels
-            ]
+        if self.split_config is not None and self.print_info:
+            log.info(self.split_config)
 
-            shuffled_idx = rng.permutation(len(data_inputs))
+        self.current_class_to_address_dict = {
+            class_name: self.class_to_address_dict[class_name]
+            for class_name in split_class_names
+        }
 
-            data_inputs = [data_inputs[i] for i in shuffled_idx]
+        self.episode_sampler = get_dataset_episode_sampler(self)
 
-            if isinstance(data_inputs[0], np.ndarray):
-                data_inputs = [
-                    torch.tensor(sample).permute(2, 0, 1) for sample in data_inputs
-                ]
+        if self.episode_manifest_path is not None:
+            self.num_episodes = len(self.episode_sampler)
 
-            data_labels = [data_labels[i] for i in shuffled_idx]
+        self.print_info = False
 
-            if len(data_inputs) > num_samples_per_class:
-                support_set_inputs.extend(data_inputs[:num_samples_per_class])
-                support_set_labels.extend(data_labels[:num_samples_per_class])
+    def decoded_image_cache_info(self) -> Optional[DecodedImageCacheInfo]:
+        """
+        Return the hit and miss counters of the decoded image cache of this
+        process, when images are kept encoded.
+        """
+        return get_decoded_image_cache_info(self.subsets)
 
-                query_set_inputs.extend(data_inputs[num_samples_per_class:])
-                query_set_labels.extend(data_labels[num_samples_per_class:])
-            else:
-                support_set_inputs.extend(data_inputs[:-1])
-                support_set_labels.extend(data_labels[:-1])
+    def __len__(self):
+        return self.num_episodes
 
-                query_set_inputs.extend(data_inputs[-1:])
-                query_set_labels.extend(data_labels[-1:])
+    def __getitem__(self, index):
+        episode = self.episode_sampler.sample(index)
+
+        (
+            support_set_inputs,
+            support_set_labels,
+            query_set_inputs,
+            query_set_labels,
+        ) = split_episode_sets(
+            episode=episode,
+            data_inputs=read_episode_inputs(
+                subsets=self.subsets,
+                episode=episode,
+                input_key=self.input_target_annotation_keys["inputs"],
+            ),
+        )
 
         if self.support_set_input_transform:
             support_set_inputs = apply_input_transforms(
@@ -1019,6 +2689,20 @@ class FewShotClassificationMetaDatasetTFDS(Dataset):
         query_set_target_transform: Any = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
+        max_samples_per_class: Optional[int] = None,
+        class_sampling_seed: int = 0,
+        chunk_codec: str = ChunkCodecs.LZ4,
         label_extractor_fn: Optional[Any] = None,
     ):
         super(FewShotClassificationMetaDatasetTFDS, self).__init__()
@@ -1064,243 +2748,142 @@ class FewShotClassificationMetaDatasetTFDS(Dataset):
         self.query_set_input_transform = (
             hydra.utils.instantiate(query_set_input_transform)
             if isinstance(query_set_input_transform, Dict)
-            or isinstance(query_set_input_transform, DictConfig)
-            else query_set_input_transform
-        )
-
-        self.support_set_target_transform = (
-            hydra.utils.instantiate(support_set_target_transform)
-            if isinstance(support_set_target_transform, Dict)
-            or isinstance(support_set_input_transform, DictConfig)
-            else support_set_target_transform
-        )
-
-        self.query_set_target_transform = (
-            hydra.utils.instantiate(query_set_target_transform)
-            if isinstance(query_set_target_transform, Dict)
-            or isinstance(query_set_target_transform, DictConfig)
-            else query_set_target_transform
-        )
-
-        self.split_name = split_name
-        self.split_percentage = split_percentage
-        self.subsets = []
-
-        if subset_split_name_list is None:
-            subset_split_name_list = ["train", "test"]
-
-        for subset_name in subset_split_name_list:
-
-            subset, subset_info = tfds.load(
-                self.dataset_name,
-                split=subset_name,
-                shuffle_files=False,
-                download=download,
-                as_supervised=False,
-                data_dir=self.dataset_root,
-                with_info=True,
-            )
-
-            log.info(f"Loading into memory {subset_name} info: {subset_info}")
-            subset_samples = []
-            with tqdm(total=len(subset)) as pbar:
-                for sample in subset:
-                    sample = {key: sample[key].numpy() for key in sample.keys()}
-                    subset_samples.append(sample)
-                    pbar.update(1)
-                self.subsets.append(subset_samples)
-
-            if self.print_info:
-                log.info(f"Loaded two subsets with info: {subset_info}")
-
-        self.class_to_address_dict = get_class_to_idx_dict(
-            self.subsets,
-            class_name_key=self.input_target_annotation_keys["target_annotations"],
-            label_extractor_fn=label_extractor_fn,
-        )
-
-        self.label_extractor_fn = label_extractor_fn
-
-        if self.split_config is None:
-            if split_name == FewShotSuperSplitSetOptions.TRAIN:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if idx < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.VAL:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.TEST:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    + split_percentage[FewShotSuperSplitSetOptions.TEST]
-                }
-        else:
-            if self.print_info:
-                log.info(self.split_config)
-            self.current_class_to_address_dict = {
-                label_name: self.class_to_address_dict[label_name]
-                for label_name in self.split_config[split_name]
-            }
-
-        self.print_info = False
-
-    def __len__(self):
-        return self.num_episodes
-
-    def __getitem__(self, index):
-        rng = np.random.RandomState(index)
-
-        support_set_inputs = []
-        support_set_labels = []
-
-        query_set_inputs = []
-        query_set_labels = []
-
-        num_classes_per_set = (
-            rng.choice(range(self.min_num_classes_per_set, self.num_classes_per_set))
-            if self.variable_num_classes_per_set
-            else self.num_classes_per_set
-        )
-
-        available_class_labels = list(self.current_class_to_address_dict.keys())
-        select_classes_for_set = rng.choice(
-            available_class_labels,
-            size=min(num_classes_per_set, len(available_class_labels)),
-        )
-
-        label_idx = set(select_classes_for_set)
-        label_idx = list(label_idx)
-
-        # shuffle label idx
-        label_idx = rng.permutation(label_idx)
-
-        label_idx_to_local_label_idx = {
-            label_name: i for i, label_name in enumerate(label_idx)
-        }
-
-        # This is done once for all classes such that query set is balanced
-
-        class_to_num_available_samples = {
-            class_name: len(self.current_class_to_address_dict[class_name])
-            for class_name in select_classes_for_set
-        }
-
-        log.info(f"Class to num available samples: {class_to_num_available_samples}")
-
-        min_available_shots = min(
-            [value for value in class_to_num_available_samples.values()]
-        )
-
-        num_query_samples_per_class = int(np.floor(min_available_shots * 0.5))
-
-        if num_query_samples_per_class == 0:
-            num_query_samples_per_class = 1
-
-        num_query_samples_per_class = min(num_query_samples_per_class, 10)
-
-        max_support_set_size = 500
-        max_per_class_support_set_size = 100
+            or isinstance(query_set_input_transform, DictConfig)
+            else query_set_input_transform
+        )
 
-        for idx, class_name in enumerate(label_idx):
+        self.support_set_target_transform = (
+            hydra.utils.instantiate(support_set_target_transform)
+            if isinstance(support_set_target_transform, Dict)
+            or isinstance(support_set_input_transform, DictConfig)
+            else support_set_target_transform
+        )
 
-            available_support_set_size = (
-                max_support_set_size - len(support_set_inputs) - (len(label_idx) - idx)
-            )
+        self.query_set_target_transform = (
+            hydra.utils.instantiate(query_set_target_transform)
+            if isinstance(query_set_target_transform, Dict)
+            or isinstance(query_set_target_transform, DictConfig)
+            else query_set_target_transform
+        )
 
-            if self.variable_num_samples_per_class:
-                num_support_samples_per_class = rng.choice(
-                    range(
-                        self.min_num_samples_per_class,
-                        min(
-                            class_to_num_available_samples[class_name],
-                            available_support_set_size,
-                            max_per_class_support_set_size,
-                        )
-                        - num_query_samples_per_class,
-                    )
+        self.split_name = split_name
+        self.split_percentage = split_percentage
+        self.storage_mode = storage_mode
+        self.split_aware_ingest = split_aware_ingest
+        self.share_subsets = share_subsets
+        self.ingest_batch_size = ingest_batch_size
+        self.tfds_reader = tfds_reader
+        self.image_cache_size = image_cache_size
+        self.image_cache_interpolation = image_cache_interpolation
+        self.decoded_image_cache_bytes = decoded_image_cache_bytes
+        self.episode_manifest_path = episode_manifest_path
+        self.episode_manifest_range = episode_manifest_range
+        self.max_samples_per_class = max_samples_per_class
+        self.class_sampling_seed = class_sampling_seed
+        self.chunk_codec = chunk_codec
+
+        # only keep the features that are read from the dataset
+        self.feature_keys = list(
+            dict.fromkeys(
+                [
+                    self.input_target_annotation_keys["inputs"],
+                    self.input_target_annotation_keys["target_annotations"],
+                ]
+                + list(extra_feature_keys or [])
+                + get_required_feature_keys(
+                    self.support_set_input_transform,
+                    self.query_set_input_transform,
+                    self.support_set_target_transform,
+                    self.query_set_target_transform,
                 )
-            else:
-                num_support_samples_per_class = self.num_samples_per_class
-
-            selected_samples_addresses_idx = rng.choice(
-                range(
-                    len(self.current_class_to_address_dict[class_name]),
-                ),
-                size=min(
-                    len(self.current_class_to_address_dict[class_name]),
-                    num_support_samples_per_class + num_query_samples_per_class,
-                ),
-                replace=False,
             )
+        )
 
-            selected_samples_addresses = [
-                self.current_class_to_address_dict[class_name][sample_address_idx]
-                for sample_address_idx in selected_samples_addresses_idx
-            ]
+        if subset_split_name_list is None:
+            subset_split_name_list = ["train", "test"]
 
-            data_inputs = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["inputs"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
+        self.subsets, self.class_to_address_dict = load_tfds_class_indexed_subsets(
+            dataset_name=self.dataset_name,
+            dataset_root=self.dataset_root,
+            subset_split_name_list=subset_split_name_list,
+            download=download,
+            image_key=self.input_target_annotation_keys["inputs"],
+            class_name_key=self.input_target_annotation_keys["target_annotations"],
+            label_extractor_fn=label_extractor_fn,
+            storage_mode=storage_mode,
+            rescan_cache=rescan_cache,
+            split_aware_ingest=split_aware_ingest,
+            split_name=split_name,
+            split_percentage=split_percentage,
+            split_config=split_config,
+            feature_keys=self.feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            max_samples_per_class=max_samples_per_class,
+            class_sampling_seed=class_sampling_seed,
+            chunk_codec=chunk_codec,
+            shared_subsets_owner=self if share_subsets else None,
+        )
 
-            data_labels = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["target_annotations"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
+        self.label_extractor_fn = label_extractor_fn
 
-            data_labels = [
-                label_idx_to_local_label_idx[self.label_extractor_fn(item)]
-                for item in data_labels
-            ]
+        if split_aware_ingest and split_config is None:
+            # only the classes of this split were ingested, in sorted order
+            split_class_names = list(self.class_to_address_dict.keys())
+        else:
+            split_class_names = select_split_classes(
+                class_names=list(self.class_to_address_dict.keys()),
+                split_name=split_name,
+                split_percentage=split_percentage,
+                split_config=split_config,
+            )
 
-            shuffled_idx = rng.permutation(len(data_inputs))
+        if self.split_config is not None and self.print_info:
+            log.info(self.split_config)
 
-            data_inputs = [data_inputs[i] for i in shuffled_idx]
+        self.current_class_to_address_dict = {
+            class_name: self.class_to_address_dict[class_name]
+            for class_name in split_class_names
+        }
 
-            if isinstance(data_inputs[0], np.ndarray):
-                data_inputs = [
-                    torch.tensor(sample).permute(2, 0, 1) for sample in data_inputs
-                ]
+        self.episode_sampler = get_dataset_episode_sampler(
+            self, episode_sampler_class=MetaDatasetEpisodeSampler
+        )
 
-            data_labels = [data_labels[i] for i in shuffled_idx]
+        if self.episode_manifest_path is not None:
+            self.num_episodes = len(self.episode_sampler)
 
-            if len(data_inputs) > num_support_samples_per_class:
-                support_set_inputs.extend(data_inputs[:num_support_samples_per_class])
-                support_set_labels.extend(data_labels[:num_support_samples_per_class])
+        self.print_info = False
 
-                query_set_inputs.extend(data_inputs[num_support_samples_per_class:])
-                query_set_labels.extend(data_labels[num_support_samples_per_class:])
+    def decoded_image_cache_info(self) -> Optional[DecodedImageCacheInfo]:
+        """
+        Return the hit and miss counters of the decoded image cache of this
+        process, when images are kept encoded.
+        """
+        return get_decoded_image_cache_info(self.subsets)
 
-            else:
-                support_set_inputs.extend(data_inputs[:-1])
-                support_set_labels.extend(data_labels[:-1])
+    def __len__(self):
+        return self.num_episodes
 
-                query_set_inputs.extend(data_inputs[-1:])
-                query_set_labels.extend(data_labels[-1:])
+    def __getitem__(self, index):
+        episode = self.episode_sampler.sample(index)
+
+        (
+            support_set_inputs,
+            support_set_labels,
+            query_set_inputs,
+            query_set_labels,
+        ) = split_episode_sets(
+            episode=episode,
+            data_inputs=read_episode_inputs(
+                subsets=self.subsets,
+                episode=episode,
+                input_key=self.input_target_annotation_keys["inputs"],
+            ),
+        )
 
         if self.support_set_input_transform:
             support_set_inputs = apply_input_transforms(
@@ -1443,7 +3026,74 @@ class FewShotClassificationMetaDatasetTFDS(Dataset):
         return input_dict, label_dict
 
 
+def build_object_crop_store(
+    store_dir: pathlib.Path,
+    subsets: List[Any],
+    objects: np.ndarray,
+    image_key: str,
+    crop_size: Sequence[int],
+    interpolation: str = "bilinear",
+    metadata: Optional[Dict[str, Any]] = None,
+) -> MemmapImageStore:
+    """
+    Crop the box of every object record in `objects` out of its image in
+    `subsets` and resize it to `crop_size`, into a `MemmapImageStore` with
+    one crop per record, in record order. Every image is only decoded once.
+    """
+    # records are in (subset, sample, object) order, so the objects of an
+    # image are consecutive
+    image_ids = (objects["subset_idx"].astype(np.int64) << 32) | objects[
+        "sample_idx"
+    ].astype(np.int64)
+    image_starts = np.flatnonzero(
+        np.concatenate([[True], image_ids[1:] != image_ids[:-1]])
+    )[: len(objects)]
+    image_ends = np.append(image_starts[1:], len(objects))
+
+    def crop_image_objects(start, end):
+        image_objects = objects[start:end]
+        image = subsets[image_objects["subset_idx"][0]][image_objects["sample_idx"][0]][
+            image_key
+        ]
+        return {
+            image_key: np.stack(
+                [
+                    resize_image(
+                        image[row_min:row_max, col_min:col_max],
+                        size=crop_size,
+                        interpolation=interpolation,
+                    )
+                    for row_min, col_min, row_max, col_max in image_objects["bbox"]
+                ]
+            )
+        }
+
+    with ThreadPoolExecutor() as executor:
+        return MemmapImageStore.build_from_batches(
+            store_dir=store_dir,
+            batches=tqdm(
+                executor.map(crop_image_objects, image_starts, image_ends),
+                total=len(image_starts),
+            ),
+            num_samples=len(objects),
+            image_shape=(*crop_size, 3),
+            image_key=image_key,
+            metadata=metadata,
+        )
+
+
 class MSCOCOFewShotClassificationDatasetTFDS(Dataset):
+    """
+    Few-shot episodes of the objects of MSCOCO, cropped out of the images by
+    their bounding boxes.
+
+    Objects are indexed as one compact `OBJECT_RECORD_DTYPE` record each, and
+    images are only decoded when an episode crops an object out of them,
+    when kept encoded. With `crop_cache_size` every object is instead cropped
+    and resized to that size once, into a memory-mapped store that is reused
+    across runs, and the images are not loaded at all once it exists.
+    """
+
     def __init__(
         self,
         dataset_name: str,
@@ -1470,10 +3120,45 @@ class MSCOCOFewShotClassificationDatasetTFDS(Dataset):
         support_set_target_transform: Any = None,
         query_set_target_transform: Any = None,
         rescan_cache: bool = True,
+        storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
+        crop_cache_size: Optional[List[int]] = None,
+        crop_cache_interpolation: str = "bilinear",
         label_extractor_fn: Optional[Callable] = None,
     ):
         super(MSCOCOFewShotClassificationDatasetTFDS, self).__init__()
 
+        if storage_mode not in (
+            DatasetStorageOptions.IN_MEMORY,
+            DatasetStorageOptions.ENCODED,
+        ):
+            raise ValueError(
+                f"{self.__class__.__name__} only supports storage_mode "
+                f"{DatasetStorageOptions.IN_MEMORY} or "
+                f"{DatasetStorageOptions.ENCODED}, got {storage_mode}"
+            )
+
+        if split_aware_ingest:
+            raise ValueError(
+                f"{self.__class__.__name__} does not support split_aware_ingest, "
+                f"as an image can hold objects of classes from several splits"
+            )
+
+        if image_cache_size is not None:
+            raise ValueError(
+                f"{self.__class__.__name__} does not support image_cache_size, "
+                f"as objects are cropped out of the full size images"
+            )
+
         self.dataset_name = dataset_name
         self.dataset_root = dataset_root
         self.input_shape_dict = input_shape_dict
@@ -1534,12 +3219,53 @@ class MSCOCOFewShotClassificationDatasetTFDS(Dataset):
 
         self.split_name = split_name
         self.split_percentage = split_percentage
-        self.subsets = []
+        self.storage_mode = storage_mode
+        self.share_subsets = share_subsets
+        self.extra_feature_keys = list(extra_feature_keys or [])
+        # coco images differ in size, so they can not be ingested in batches
+        self.ingest_batch_size = ingest_batch_size
+        self.tfds_reader = tfds_reader
+        self.image_cache_size = image_cache_size
+        self.image_cache_interpolation = image_cache_interpolation
+        self.decoded_image_cache_bytes = decoded_image_cache_bytes
+        self.episode_manifest_path = episode_manifest_path
+        self.episode_manifest_range = episode_manifest_range
+        self.crop_cache_size = crop_cache_size
+        self.crop_cache_interpolation = crop_cache_interpolation
 
         if subset_split_name_list is None:
             subset_split_name_list = ["train", "test"]
 
-        for subset_name in subset_split_name_list:
+        check_tfds_reader(tfds_reader)
+
+        keep_encoded = storage_mode == DatasetStorageOptions.ENCODED
+
+        def load_subset(subset_name, with_objects):
+            # only keep the image, and the object boxes and labels when the
+            # object index has to be built
+            object_feature_keys = (
+                ["objects/bbox", "objects/label"] if with_objects else []
+            )
+
+            if tfds_reader != TFDSReaderOptions.TENSORFLOW:
+                return list(
+                    load_prepared_tfds_dataset(
+                        "coco_captions",
+                        data_dir=self.dataset_root,
+                        download=download,
+                        tfds_reader=tfds_reader,
+                    ).iterate(
+                        subset_name,
+                        feature_keys=[
+                            "image",
+                            *object_feature_keys,
+                            *self.extra_feature_keys,
+                        ],
+                        decode_images=not keep_encoded,
+                    )
+                )
+
+            import tensorflow_datasets as tfds
 
             subset, subset_info = tfds.load(
                 "coco_captions",
@@ -1549,36 +3275,164 @@ class MSCOCOFewShotClassificationDatasetTFDS(Dataset):
                 as_supervised=False,
                 data_dir=self.dataset_root,
                 with_info=True,
+                decoders=tfds.decode.PartialDecoding(
+                    dict(
+                        image=True,
+                        **(
+                            dict(objects=dict(bbox=True, label=True))
+                            if with_objects
+                            else {}
+                        ),
+                        **{key: True for key in self.extra_feature_keys},
+                    ),
+                    decoders=(
+                        dict(image=tfds.decode.SkipDecoding()) if keep_encoded else None
+                    ),
+                ),
             )
 
-            self.subsets.append(list(subset.as_numpy_iterator()))
-
             if self.print_info:
                 log.info(f"Loaded two subsets with info: {subset_info}")
 
-        self.class_to_address_dict = get_class_to_image_idx_and_bbox(
-            self.subsets,
-            label_extractor_fn=label_extractor_fn,
-        )
+            return list(subset.as_numpy_iterator())
+
+        def load_fn():
+            index_dir = (
+                pathlib.Path(self.dataset_root)
+                / "coco_captions_class_index"
+                / get_subset_store_name(subset_split_name_list, "bbox")
+            )
+            manifest = dict(
+                dataset_name="coco_captions",
+                tfds_version=get_tfds_version(
+                    "coco_captions", self.dataset_root, tfds_reader
+                ),
+                subset_split_name_list=list(subset_split_name_list),
+                label_extractor=get_callable_fingerprint(label_extractor_fn),
+            )
+
+            object_index = (
+                None
+                if rescan_cache
+                else load_object_index(index_dir=index_dir, manifest=manifest)
+            )
+
+            if crop_cache_size is not None:
+                crop_store_dir = (
+                    pathlib.Path(self.dataset_root)
+                    / "coco_captions_crop_cache"
+                    / get_subset_store_name(
+                        subset_split_name_list,
+                        get_image_cache_name(crop_cache_size, crop_cache_interpolation),
+                    )
+                )
+                crop_store_metadata = dict(
+                    manifest,
+                    tfds_reader=tfds_reader,
+                    crop_cache_size=list(crop_cache_size),
+                    crop_cache_interpolation=crop_cache_interpolation,
+                )
+
+                if (
+                    object_index is not None
+                    and MemmapImageStore.exists(crop_store_dir)
+                    and MemmapImageStore(crop_store_dir).manifest["metadata"]
+                    == json.loads(json.dumps(crop_store_metadata))
+                ):
+                    # every crop an episode needs is in the store, so the
+                    # images are not loaded
+                    log.info(f"Reusing object crops at {crop_store_dir}")
+                    return (
+                        [],
+                        *object_index,
+                        MemmapImageStore(crop_store_dir),
+                    )
+
+            subsets = [
+                load_subset(subset_name, with_objects=object_index is None)
+                for subset_name in subset_split_name_list
+            ]
+
+            if object_index is None:
+                objects, class_to_rows = get_object_records(
+                    subsets, image_key="image", label_extractor_fn=label_extractor_fn
+                )
+                save_object_index(
+                    index_dir=index_dir,
+                    objects=objects,
+                    class_to_rows=class_to_rows,
+                    manifest=manifest,
+                )
+                # the objects are kept in the index only
+                for subset in subsets:
+                    for sample in subset:
+                        sample.pop("objects", None)
+            else:
+                log.info(f"Loaded object index from {index_dir}")
+                objects, class_to_rows = object_index
+
+            if keep_encoded:
+                decoded_image_cache = DecodedImageCache(
+                    max_bytes=decoded_image_cache_bytes
+                )
+                subsets = [
+                    EncodedImageSubset(
+                        subset,
+                        image_key="image",
+                        channels=3,
+                        name=subset_name,
+                        cache=decoded_image_cache,
+                    )
+                    for subset_name, subset in zip(subset_split_name_list, subsets)
+                ]
+
+            if crop_cache_size is None:
+                return subsets, objects, class_to_rows, None
+
+            crop_store = build_object_crop_store(
+                store_dir=crop_store_dir,
+                subsets=subsets,
+                objects=objects,
+                image_key="image",
+                crop_size=crop_cache_size,
+                interpolation=crop_cache_interpolation,
+                metadata=crop_store_metadata,
+            )
+
+            # episodes only read the crops
+            return [], objects, class_to_rows, crop_store
+
+        if share_subsets:
+            (
+                self.subsets,
+                self.objects,
+                self.class_to_address_dict,
+                self.crop_store,
+            ) = acquire_shared_subsets(
+                key=(
+                    "coco_captions",
+                    str(self.dataset_root),
+                    tuple(subset_split_name_list),
+                    get_callable_fingerprint(label_extractor_fn),
+                    tuple(self.extra_feature_keys),
+                    tfds_reader,
+                    storage_mode,
+                    decoded_image_cache_bytes,
+                    None if crop_cache_size is None else tuple(crop_cache_size),
+                    crop_cache_interpolation,
+                ),
+                owner=self,
+                load_fn=load_fn,
+            )
+        else:
+            (
+                self.subsets,
+                self.objects,
+                self.class_to_address_dict,
+                self.crop_store,
+            ) = load_fn()
 
         self.label_extractor_fn = label_extractor_fn
-        # dataset_root = (
-        #     pathlib.Path(self.dataset_root)
-        #     if isinstance(self.dataset_root, str)
-        #     else self.dataset_root
-        # )
-
-        # hdf5_filepath = (
-        #     dataset_root
-        #     / f"{self.dataset_name}_few_shot_classification_dataset.h5"
-        # )
-        #
-        # if hdf5_filepath.exists() and not rescan_cache:
-        #     self.class_to_address_dict = h5py.File(hdf5_filepath, "r")
-        # else:
-        #     self.class_to_address_dict = store_dict_as_hdf5(
-        #         self.class_to_address_dict, hdf5_filepath
-        #     )
 
         self.current_class_to_address_dict = self.class_to_address_dict
 
@@ -1622,137 +3476,55 @@ class MSCOCOFewShotClassificationDatasetTFDS(Dataset):
                 label_name: self.class_to_address_dict[label_name]
                 for idx, label_name in enumerate(self.split_config[split_name])
             }
-        self.print_info = False
-
-    def __len__(self):
 
-        return self.num_episodes
-
-    def __getitem__(self, index):
-        rng = np.random.RandomState(index)
-
-        support_set_inputs = []
-        support_set_labels = []
-
-        query_set_inputs = []
-        query_set_labels = []
-
-        # log.info(
-        #     f"Check {self.min_num_classes_per_set} {self.num_classes_per_set}"
-        # )
-        num_classes_per_set = (
-            rng.choice(range(self.min_num_classes_per_set, self.num_classes_per_set))
-            if self.variable_num_classes_per_set
-            else self.num_classes_per_set
-        )
-
-        available_class_labels = list(self.current_class_to_address_dict.keys())
-        select_classes_for_set = rng.choice(
-            available_class_labels,
-            size=min(num_classes_per_set, len(available_class_labels)),
+        # the number of queries is drawn for every class
+        self.episode_sampler = get_dataset_episode_sampler(
+            self, variable_num_queries_per_class_draw=True
         )
 
-        label_idx = set(select_classes_for_set)
-        label_idx = list(label_idx)
-
-        # shuffle label idx
-        label_idx = rng.permutation(label_idx)
-
-        label_idx_to_local_label_idx = {
-            label_name: i for i, label_name in enumerate(label_idx)
-        }
-
-        for class_name in select_classes_for_set:
-            if self.variable_num_samples_per_class:
-                num_samples_per_class = rng.choice(
-                    range(
-                        self.min_num_samples_per_class,
-                        self.num_samples_per_class,
-                    )
-                )
-            else:
-                num_samples_per_class = self.num_samples_per_class
-
-            if self.variable_num_queries_per_class:
-                num_queries_per_class = rng.choice(
-                    range(
-                        self.min_num_queries_per_class,
-                        self.num_queries_per_class,
-                    )
-                )
-            else:
-                num_queries_per_class = self.num_queries_per_class
-
-            selected_samples_addresses_idx = rng.choice(
-                range(
-                    len(self.current_class_to_address_dict[class_name]),
-                ),
-                size=min(
-                    len(self.current_class_to_address_dict[class_name]),
-                    num_samples_per_class + num_queries_per_class,
-                ),
-                replace=False,
-            )
-
-            selected_samples_addresses = [
-                self.current_class_to_address_dict[class_name][sample_address_idx]
-                for sample_address_idx in selected_samples_addresses_idx
-            ]
-
-            # log.info("HERE HERE")
-
-            data_inputs = [
-                self.subsets[object_dict["subset_idx"]][object_dict["sample_idx"]][
-                    "image"
-                ][
-                    object_dict["bbox"]["x_min"] : object_dict["bbox"]["x_max"],
-                    object_dict["bbox"]["y_min"] : object_dict["bbox"]["y_max"],
-                ]
-                for object_dict in selected_samples_addresses
-            ]
-
-            data_labels = [
-                object_dict["label"] for object_dict in selected_samples_addresses
-            ]
-
-            # log.info("HERE HERE HERE")
+        if self.episode_manifest_path is not None:
+            self.num_episodes = len(self.episode_sampler)
 
-            # log.info(
-            #     f"label idx to local label idx:
-            #  {label_idx_to_local_label_idx}, data labels {data_labels}"
-            # )
-
-            # log.info(data_labels)
-            #
-            # log.info(label_idx_to_local_label_idx)
-            #
-            # log.info(self.current_class_to_address_dict)
-
-            # log.info(data_inputs)
+        self.print_info = False
 
-            data_labels = [
-                label_idx_to_local_label_idx[self.label_extractor_fn(item)]
-                for item in data_labels
-            ]
+    def decoded_image_cache_info(self) -> Optional[DecodedImageCacheInfo]:
+        """
+        Return the hit and miss counters of the decoded image cache of this
+        process, when images are kept encoded.
+        """
+        return get_decoded_image_cache_info(self.subsets)
 
-            shuffled_idx = rng.permutation(len(data_inputs))
+    def get_object_crop(self, row: int) -> np.ndarray:
+        """
+        Return the HxWxC crop of the object of record `row`.
+        """
+        if self.crop_store is not None:
+            return self.crop_store.get_image(row)
 
-            data_inputs = [data_inputs[i] for i in shuffled_idx]
+        record = self.objects[row]
+        row_min, col_min, row_max, col_max = record["bbox"]
+        image = self.subsets[record["subset_idx"]][record["sample_idx"]]["image"]
 
-            if isinstance(data_inputs[0], np.ndarray):
-                data_inputs = [
-                    torch.tensor(sample).permute(2, 0, 1) for sample in data_inputs
-                ]
+        return image[row_min:row_max, col_min:col_max]
 
-            data_labels = [data_labels[i] for i in shuffled_idx]
+    def __len__(self):
 
-            assert len(data_labels) == num_samples_per_class + num_queries_per_class
+        return self.num_episodes
 
-            support_set_inputs.extend(data_inputs[:num_samples_per_class])
-            support_set_labels.extend(data_labels[:num_samples_per_class])
+    def __getitem__(self, index):
+        episode = self.episode_sampler.sample(index)
 
-            query_set_inputs.extend(data_inputs[num_samples_per_class:])
-            query_set_labels.extend(data_labels[num_samples_per_class:])
+        (
+            support_set_inputs,
+            support_set_labels,
+            query_set_inputs,
+            query_set_labels,
+        ) = split_episode_sets(
+            episode=episode,
+            data_inputs=[
+                self.get_object_crop(row) for row in episode.records[:, 0].tolist()
+            ],
+        )
 
         if self.support_set_input_transform:
             support_set_inputs = torch.stack(
@@ -1847,6 +3619,20 @@ class MultiViewFewShotClassificationDatasetTFDS(Dataset):
         query_set_target_transform: Any = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = DatasetStorageOptions.IN_MEMORY,
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = DEFAULT_DECODED_IMAGE_CACHE_BYTES,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
+        max_samples_per_class: Optional[int] = None,
+        class_sampling_seed: int = 0,
+        chunk_codec: str = ChunkCodecs.LZ4,
         label_extractor_fn: Optional[Any] = None,
     ):
         super(MultiViewFewShotClassificationDatasetTFDS, self).__init__()
@@ -1913,200 +3699,120 @@ class MultiViewFewShotClassificationDatasetTFDS(Dataset):
 
         self.split_name = split_name
         self.split_percentage = split_percentage
-        self.subsets = []
+        self.storage_mode = storage_mode
+        self.split_aware_ingest = split_aware_ingest
+        self.share_subsets = share_subsets
+        self.ingest_batch_size = ingest_batch_size
+        self.tfds_reader = tfds_reader
+        self.image_cache_size = image_cache_size
+        self.image_cache_interpolation = image_cache_interpolation
+        self.decoded_image_cache_bytes = decoded_image_cache_bytes
+        self.episode_manifest_path = episode_manifest_path
+        self.episode_manifest_range = episode_manifest_range
+        self.max_samples_per_class = max_samples_per_class
+        self.class_sampling_seed = class_sampling_seed
+        self.chunk_codec = chunk_codec
+
+        # only keep the features that are read from the dataset
+        self.feature_keys = list(
+            dict.fromkeys(
+                [
+                    self.input_target_annotation_keys["inputs"],
+                    self.input_target_annotation_keys["target_annotations"],
+                ]
+                + list(extra_feature_keys or [])
+                + get_required_feature_keys(
+                    self.support_set_input_transform,
+                    self.query_set_input_transform,
+                    self.support_set_target_transform,
+                    self.query_set_target_transform,
+                )
+            )
+        )
 
         if subset_split_name_list is None:
             subset_split_name_list = ["train", "test"]
 
-        for subset_name in subset_split_name_list:
-
-            subset, subset_info = tfds.load(
-                self.dataset_name,
-                split=subset_name,
-                shuffle_files=False,
-                download=download,
-                as_supervised=False,
-                data_dir=self.dataset_root,
-                with_info=True,
-            )
-
-            log.info(f"Loading into memory {subset_name} info: {subset_info}")
-            subset_samples = []
-            with tqdm(total=len(subset)) as pbar:
-                for sample in subset:
-                    sample = {key: sample[key].numpy() for key in sample.keys()}
-                    subset_samples.append(sample)
-                    pbar.update(1)
-                self.subsets.append(subset_samples)
-
-            if self.print_info:
-                log.info(f"Loaded two subsets with info: {subset_info}")
-
-        self.class_to_address_dict = get_class_to_idx_dict(
-            self.subsets,
+        self.subsets, self.class_to_address_dict = load_tfds_class_indexed_subsets(
+            dataset_name=self.dataset_name,
+            dataset_root=self.dataset_root,
+            subset_split_name_list=subset_split_name_list,
+            download=download,
+            image_key=self.input_target_annotation_keys["inputs"],
             class_name_key=self.input_target_annotation_keys["target_annotations"],
             label_extractor_fn=label_extractor_fn,
+            storage_mode=storage_mode,
+            rescan_cache=rescan_cache,
+            split_aware_ingest=split_aware_ingest,
+            split_name=split_name,
+            split_percentage=split_percentage,
+            split_config=split_config,
+            feature_keys=self.feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            max_samples_per_class=max_samples_per_class,
+            class_sampling_seed=class_sampling_seed,
+            chunk_codec=chunk_codec,
+            shared_subsets_owner=self if share_subsets else None,
         )
 
         self.label_extractor_fn = label_extractor_fn
 
-        if self.split_config is None:
-            if split_name == FewShotSuperSplitSetOptions.TRAIN:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if idx < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.VAL:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                }
-            elif split_name == FewShotSuperSplitSetOptions.TEST:
-                self.current_class_to_address_dict = {
-                    key: value
-                    for idx, (key, value) in enumerate(
-                        self.class_to_address_dict.items()
-                    )
-                    if split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    < idx
-                    < split_percentage[FewShotSuperSplitSetOptions.TRAIN]
-                    + split_percentage[FewShotSuperSplitSetOptions.VAL]
-                    + split_percentage[FewShotSuperSplitSetOptions.TEST]
-                }
-        else:
-            if self.print_info:
-                log.info(self.split_config)
-            self.current_class_to_address_dict = {
-                label_name: self.class_to_address_dict[label_name]
-                for label_name in self.split_config[split_name]
-            }
-
-        self.print_info = False
-
-    def __len__(self):
-        return self.num_episodes
-
-    def __getitem__(self, index):
-        rng = np.random.RandomState(index)
-
-        support_set_inputs = []
-        support_set_labels = []
-
-        query_set_inputs = []
-        query_set_labels = []
-
-        num_classes_per_set = (
-            rng.choice(range(self.min_num_classes_per_set, self.num_classes_per_set))
-            if self.variable_num_classes_per_set
-            else self.num_classes_per_set
-        )
-
-        available_class_labels = list(self.current_class_to_address_dict.keys())
-        select_classes_for_set = rng.choice(
-            available_class_labels,
-            size=min(num_classes_per_set, len(available_class_labels)),
-        )
-
-        label_idx = set(select_classes_for_set)
-        label_idx = list(label_idx)
-
-        # shuffle label idx
-        label_idx = rng.permutation(label_idx)
-
-        label_idx_to_local_label_idx = {
-            label_name: i for i, label_name in enumerate(label_idx)
-        }
-
-        # This is done once for all classes such that query set is balanced
-        if self.variable_num_queries_per_class:
-            num_queries_per_class = rng.choice(
-                range(
-                    self.min_num_queries_per_class,
-                    self.num_queries_per_class,
-                )
-            )
+        if split_aware_ingest and split_config is None:
+            # only the classes of this split were ingested, in sorted order
+            split_class_names = list(self.class_to_address_dict.keys())
         else:
-            num_queries_per_class = self.num_queries_per_class
-
-        for class_name in select_classes_for_set:
-            if self.variable_num_samples_per_class:
-                num_samples_per_class = rng.choice(
-                    range(
-                        self.min_num_samples_per_class,
-                        self.num_samples_per_class,
-                    )
-                )
-            else:
-                num_samples_per_class = self.num_samples_per_class
-
-            selected_samples_addresses_idx = rng.choice(
-                range(
-                    len(self.current_class_to_address_dict[class_name]),
-                ),
-                size=min(
-                    len(self.current_class_to_address_dict[class_name]),
-                    num_samples_per_class + num_queries_per_class,
-                ),
-                replace=False,
+            split_class_names = select_split_classes(
+                class_names=list(self.class_to_address_dict.keys()),
+                split_name=split_name,
+                split_percentage=split_percentage,
+                split_config=split_config,
             )
 
-            selected_samples_addresses = [
-                self.current_class_to_address_dict[class_name][sample_address_idx]
-                for sample_address_idx in selected_samples_addresses_idx
-            ]
-
-            data_inputs = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["inputs"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
-
-            data_labels = [
-                self.subsets[subset_idx][idx][
-                    self.input_target_annotation_keys["target_annotations"]
-                ]
-                for (subset_idx, idx) in selected_samples_addresses
-            ]
-
-            data_labels = [
-                label_idx_to_local_label_idx[self.label_extractor_fn(item)]
-                for item in data_labels
-            ]
+        if self.split_config is not None and self.print_info:
+            log.info(self.split_config)
 
-            shuffled_idx = rng.permutation(len(data_inputs))
+        self.current_class_to_address_dict = {
+            class_name: self.class_to_address_dict[class_name]
+            for class_name in split_class_names
+        }
 
-            data_inputs = [data_inputs[i] for i in shuffled_idx]
+        self.episode_sampler = get_dataset_episode_sampler(self)
 
-            if isinstance(data_inputs[0], np.ndarray):
-                data_inputs = [
-                    torch.tensor(sample).permute(2, 0, 1) for sample in data_inputs
-                ]
+        if self.episode_manifest_path is not None:
+            self.num_episodes = len(self.episode_sampler)
 
-            data_labels = [data_labels[i] for i in shuffled_idx]
+        self.print_info = False
 
-            if len(data_inputs) > num_samples_per_class:
-                support_set_inputs.extend(data_inputs[:num_samples_per_class])
-                support_set_labels.extend(data_labels[:num_samples_per_class])
+    def decoded_image_cache_info(self) -> Optional[DecodedImageCacheInfo]:
+        """
+        Return the hit and miss counters of the decoded image cache of this
+        process, when images are kept encoded.
+        """
+        return get_decoded_image_cache_info(self.subsets)
 
-                query_set_inputs.extend(data_inputs[num_samples_per_class:])
-                query_set_labels.extend(data_labels[num_samples_per_class:])
-            else:
-                support_set_inputs.extend(data_inputs[:-1])
-                support_set_labels.extend(data_labels[:-1])
+    def __len__(self):
+        return self.num_episodes
 
-                query_set_inputs.extend(data_inputs[-1:])
-                query_set_labels.extend(data_labels[-1:])
+    def __getitem__(self, index):
+        episode = self.episode_sampler.sample(index)
+
+        (
+            support_set_inputs,
+            support_set_labels,
+            query_set_inputs,
+            query_set_labels,
+        ) = split_episode_sets(
+            episode=episode,
+            data_inputs=read_episode_inputs(
+                subsets=self.subsets,
+                episode=episode,
+                input_key=self.input_target_annotation_keys["inputs"],
+            ),
+        )
 
         if self.support_set_input_transform:
             support_set_inputs = apply_input_transforms(
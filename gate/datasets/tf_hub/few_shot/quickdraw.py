@@ -7,16 +7,40 @@ from omegaconf import DictConfig
 from gate.base.utils.loggers import get_logger
 from gate.configs.datasets.data_splits_config import data_splits_dict
 from gate.datasets.data_utils import FewShotSuperSplitSetOptions
-from gate.datasets.tf_hub import bytes_to_string
 from gate.datasets.tf_hub.few_shot.base import (
     FewShotClassificationDatasetTFDS,
     MultiViewFewShotClassificationDatasetTFDS,
+    get_class_label_names,
 )
 
 log = get_logger(
     __name__,
 )
 
+DATASET_NAME = "quickdraw_bitmap"
+
+
+def get_quickdraw_split_config(
+    dataset_root: Union[str, pathlib.Path], download: bool, tfds_reader: str
+):
+    """
+    Map the category names of the QuickDraw splits to the integer labels of
+    the `quickdraw_bitmap` TFDS dataset.
+    """
+    label_names = get_class_label_names(
+        dataset_name=DATASET_NAME,
+        dataset_root=dataset_root,
+        class_name_key="label",
+        download=download,
+        tfds_reader=tfds_reader,
+    )
+    label_name_to_id = {name.lower(): idx for idx, name in enumerate(label_names)}
+
+    return {
+        split_name: [label_name_to_id[name.lower()] for name in category_list]
+        for split_name, category_list in data_splits_dict["quickdraw"].items()
+    }
+
 
 class QuickDrawFewShotClassificationDataset(FewShotClassificationDatasetTFDS):
     def __init__(
@@ -40,29 +64,26 @@ class QuickDrawFewShotClassificationDataset(FewShotClassificationDatasetTFDS):
         query_set_target_transform: Optional[Any] = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = "in_memory",
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = "tensorflow",
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = 256 * 1024 * 1024,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
+        max_samples_per_class: Optional[int] = 1000,
+        class_sampling_seed: int = 0,
     ):
-        DATASET_NAME = "quickdraw_bitmap"
         split_counts = {
             key: len(value) for key, value in data_splits_dict["quickdraw"].items()
         }
-        category_text_descriptions = set(
-            list(data_splits_dict["quickdraw"]["train"])
-            + list(data_splits_dict["quickdraw"]["test"])
-            + list(data_splits_dict["quickdraw"]["val"])
+        dataset_splits_in_ids = get_quickdraw_split_config(
+            dataset_root=dataset_root, download=download, tfds_reader=tfds_reader
         )
-        category_text_descriptions_to_ids = {
-            text: i for i, text in enumerate(category_text_descriptions)
-        }
-
-        dataset_splits_in_ids = {}
-
-        for split_name, category_list in data_splits_dict["quickdraw"].items():
-            split_list_in_ids = [
-                category_text_descriptions_to_ids[category_text_description]
-                for category_text_description in category_list
-            ]
-
-            dataset_splits_in_ids[split_name] = split_list_in_ids
 
         log.info(f"data_splits_dict: {split_counts}")
         super(QuickDrawFewShotClassificationDataset, self).__init__(
@@ -81,6 +102,19 @@ class QuickDrawFewShotClassificationDataset(FewShotClassificationDatasetTFDS):
             variable_num_queries_per_class=variable_num_queries_per_class,
             support_to_query_ratio=support_to_query_ratio,
             rescan_cache=rescan_cache,
+            storage_mode=storage_mode,
+            split_aware_ingest=split_aware_ingest,
+            share_subsets=share_subsets,
+            extra_feature_keys=extra_feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            episode_manifest_path=episode_manifest_path,
+            episode_manifest_range=episode_manifest_range,
+            max_samples_per_class=max_samples_per_class,
+            class_sampling_seed=class_sampling_seed,
             input_target_annotation_keys=dict(
                 inputs="image",
                 targets="label",
@@ -96,7 +130,7 @@ class QuickDrawFewShotClassificationDataset(FewShotClassificationDatasetTFDS):
                 FewShotSuperSplitSetOptions.TEST: split_counts["test"],
             },
             split_config=DictConfig(dataset_splits_in_ids),
-            label_extractor_fn=lambda x: bytes_to_string(x).split("/")[0],
+            label_extractor_fn=int,
             subset_split_name_list=["train"],
             min_num_classes_per_set=min_num_classes_per_set,
             min_num_samples_per_class=min_num_samples_per_class,
@@ -128,29 +162,26 @@ class QuickDrawMultiViewFewShotClassificationDataset(
         query_set_target_transform: Optional[Any] = None,
         support_to_query_ratio: float = 0.75,
         rescan_cache: bool = True,
+        storage_mode: str = "in_memory",
+        split_aware_ingest: bool = False,
+        share_subsets: bool = True,
+        extra_feature_keys: Optional[List[str]] = None,
+        ingest_batch_size: Optional[int] = None,
+        tfds_reader: str = "tensorflow",
+        image_cache_size: Optional[List[int]] = None,
+        image_cache_interpolation: str = "bilinear",
+        decoded_image_cache_bytes: int = 256 * 1024 * 1024,
+        episode_manifest_path: Optional[str] = None,
+        episode_manifest_range: Optional[List[int]] = None,
+        max_samples_per_class: Optional[int] = 1000,
+        class_sampling_seed: int = 0,
     ):
-        DATASET_NAME = "quickdraw_bitmap"
         split_counts = {
             key: len(value) for key, value in data_splits_dict["quickdraw"].items()
         }
-        category_text_descriptions = set(
-            list(data_splits_dict["quickdraw"]["train"])
-            + list(data_splits_dict["quickdraw"]["test"])
-            + list(data_splits_dict["quickdraw"]["val"])
+        dataset_splits_in_ids = get_quickdraw_split_config(
+            dataset_root=dataset_root, download=download, tfds_reader=tfds_reader
         )
-        category_text_descriptions_to_ids = {
-            text: i for i, text in enumerate(category_text_descriptions)
-        }
-
-        dataset_splits_in_ids = {}
-
-        for split_name, category_list in data_splits_dict["quickdraw"].items():
-            split_list_in_ids = [
-                category_text_descriptions_to_ids[category_text_description]
-                for category_text_description in category_list
-            ]
-
-            dataset_splits_in_ids[split_name] = split_list_in_ids
 
         log.info(f"data_splits_dict: {split_counts}")
         super(QuickDrawMultiViewFewShotClassificationDataset, self).__init__(
@@ -169,6 +200,19 @@ class QuickDrawMultiViewFewShotClassificationDataset(
             variable_num_queries_per_class=variable_num_queries_per_class,
             support_to_query_ratio=support_to_query_ratio,
             rescan_cache=rescan_cache,
+            storage_mode=storage_mode,
+            split_aware_ingest=split_aware_ingest,
+            share_subsets=share_subsets,
+            extra_feature_keys=extra_feature_keys,
+            ingest_batch_size=ingest_batch_size,
+            tfds_reader=tfds_reader,
+            image_cache_size=image_cache_size,
+            image_cache_interpolation=image_cache_interpolation,
+            decoded_image_cache_bytes=decoded_image_cache_bytes,
+            episode_manifest_path=episode_manifest_path,
+            episode_manifest_range=episode_manifest_range,
+            max_samples_per_class=max_samples_per_class,
+            class_sampling_seed=class_sampling_seed,
             input_target_annotation_keys=dict(
                 inputs="image",
                 targets="label",
@@ -184,7 +228,7 @@ class QuickDrawMultiViewFewShotClassificationDataset(
                 FewShotSuperSplitSetOptions.TEST: split_counts["test"],
             },
             split_config=DictConfig(dataset_splits_in_ids),
-            label_extractor_fn=lambda x: bytes_to_string(x).split("/")[0],
+            label_extractor_fn=int,
             subset_split_name_list=["train"],
             min_num_classes_per_set=min_num_classes_per_set,
             min_num_samples_per_class=min_num_samples_per_class,
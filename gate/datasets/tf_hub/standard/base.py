@@ -1,18 +1,106 @@
+import copy
 import pathlib
-from typing import Any, Callable, Dict, Optional, Union
+from typing import Any, Dict, Optional, Tuple, Union
 
 import hydra
-import tensorflow_datasets as tfds
+import numpy as np
 import torch
 from omegaconf import DictConfig
 from torch.utils.data import Dataset
 
 from gate.base.utils.loggers import get_logger
+from gate.datasets.data_utils import TFDSReaderOptions
+from gate.datasets.tfrecord_reader import load_prepared_tfds_dataset
 
 log = get_logger(__name__, set_default_handler=False)
 
 
+def load_tfds_classification_arrays(
+    dataset_name: str,
+    dataset_root: Union[str, pathlib.Path],
+    split_name: str,
+    download: bool,
+    input_key: str,
+    target_key: str,
+    tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
+    batch_size: int = 1024,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the images of a TFDS split, which must all share one shape, into
+    one contiguous NxHxWxC uint8 array, along with an int64 array of their
+    labels.
+    """
+    if tfds_reader != TFDSReaderOptions.TENSORFLOW:
+        # read the prepared TFRecord shards without importing TensorFlow
+        dataset = load_prepared_tfds_dataset(
+            dataset_name,
+            data_dir=dataset_root,
+            download=download,
+            tfds_reader=tfds_reader,
+        )
+        num_samples = dataset.num_examples(split_name)
+        images = None
+        labels = np.empty(shape=(num_samples,), dtype=np.int64)
+        current_idx = 0
+
+        for batch in dataset.iterate_batches(
+            split_name, batch_size=batch_size, feature_keys=[input_key, target_key]
+        ):
+            if images is None:
+                images = np.empty(
+                    shape=(num_samples,) + batch[input_key].shape[1:], dtype=np.uint8
+                )
+            batch_size = len(batch[input_key])
+            images[current_idx : current_idx + batch_size] = batch[input_key]
+            labels[current_idx : current_idx + batch_size] = batch[target_key]
+            current_idx += batch_size
+
+        log.info(f"Loaded {split_name} set with {num_samples} samples")
+
+        return images, labels
+
+    import tensorflow_datasets as tfds
+
+    from gate.datasets.tf_hub.few_shot.base import get_tfds_decoders
+
+    tf_dataset, info = tfds.load(
+        dataset_name,
+        split=split_name,
+        shuffle_files=False,
+        download=download,
+        as_supervised=False,
+        data_dir=dataset_root,
+        with_info=True,
+        batch_size=-1,
+        decoders=get_tfds_decoders(feature_keys=[input_key, target_key]),
+    )
+    log.info(f"Loaded {split_name} set with info: {info}")
+    samples = tfds.as_numpy(tf_dataset)
+
+    return (
+        np.ascontiguousarray(samples[input_key], dtype=np.uint8),
+        np.ascontiguousarray(samples[target_key], dtype=np.int64),
+    )
+
+
+def instantiate_transform(transform: Optional[Any]) -> Optional[Any]:
+    if isinstance(transform, Dict) or isinstance(transform, DictConfig):
+        return hydra.utils.instantiate(transform)
+
+    return transform
+
+
 class ClassificationDataset(Dataset):
+    """
+    An image classification dataset held as one contiguous uint8 array of
+    images and an int64 array of labels.
+
+    Without an input transform, items are zero-copy CxHxW uint8 views of the
+    images, so DataLoader workers ship a quarter of the bytes of float
+    images, and conversion to float and normalization are left to be done a
+    batch at a time (see the `batch_input_transform` of the datamodules).
+    """
+
     def __init__(
         self,
         dataset_name: str,
@@ -24,54 +112,115 @@ class ClassificationDataset(Dataset):
         target_shape_dict: Dict[str, int],
         input_transform: Optional[Any] = None,
         target_transform: Optional[Any] = None,
+        tfds_reader: str = TFDSReaderOptions.TENSORFLOW,
     ):
         super(ClassificationDataset, self).__init__()
-        self.tf_dataset, info = tfds.load(
-            dataset_name,
-            split=split_name,
-            shuffle_files=False,
+        images, labels = load_tfds_classification_arrays(
+            dataset_name=dataset_name,
+            dataset_root=dataset_root,
+            split_name=split_name,
             download=download,
-            as_supervised=False,
-            data_dir=dataset_root,
-            with_info=True,
+            input_key=input_target_keys["inputs"],
+            target_key=input_target_keys["targets"],
+            tfds_reader=tfds_reader,
         )
-        log.info(f"Loaded {split_name} set with info: {info}")
-        self.dataset = list(self.tf_dataset.as_numpy_iterator())
+
+        self.tfds_reader = tfds_reader
 
         self.input_target_keys = input_target_keys
 
-        self.input_transform = (
-            hydra.utils.instantiate(input_transform)
-            if isinstance(input_transform, Dict)
-            or isinstance(input_transform, DictConfig)
-            else input_transform
+        self._set_arrays(
+            images=images,
+            labels=labels,
+            input_shape_dict=input_shape_dict,
+            target_shape_dict=target_shape_dict,
+            input_transform=input_transform,
+            target_transform=target_transform,
         )
-        self.target_transform = (
-            hydra.utils.instantiate(target_transform)
-            if isinstance(target_transform, Dict)
-            or isinstance(input_transform, DictConfig)
-            else target_transform
+
+    @classmethod
+    def from_numpy(
+        cls,
+        images: np.ndarray,
+        labels: np.ndarray,
+        input_shape_dict: Dict[str, int],
+        target_shape_dict: Dict[str, int],
+        input_transform: Optional[Any] = None,
+        target_transform: Optional[Any] = None,
+    ) -> "ClassificationDataset":
+        """
+        Build a dataset straight from an NxHxWxC uint8 array of images and an
+        array of N integer labels, without reading TFDS.
+        """
+        dataset = cls.__new__(cls)
+        Dataset.__init__(dataset)
+        dataset.tfds_reader = None
+        dataset.input_target_keys = dict(inputs="image", targets="label")
+        dataset._set_arrays(
+            images=images,
+            labels=labels,
+            input_shape_dict=input_shape_dict,
+            target_shape_dict=target_shape_dict,
+            input_transform=input_transform,
+            target_transform=target_transform,
         )
+        return dataset
+
+    def _set_arrays(
+        self,
+        images: np.ndarray,
+        labels: np.ndarray,
+        input_shape_dict: Dict[str, int],
+        target_shape_dict: Dict[str, int],
+        input_transform: Optional[Any] = None,
+        target_transform: Optional[Any] = None,
+    ):
+        if len(images) != len(labels):
+            raise ValueError(
+                f"Got {len(images)} images but {len(labels)} labels, "
+                f"there must be one label per image"
+            )
+
+        if images.ndim != 4:
+            raise ValueError(
+                f"Images must be an NxHxWxC array, got shape {images.shape}"
+            )
+
+        self.images = np.ascontiguousarray(images, dtype=np.uint8)
+        self.labels = np.ascontiguousarray(labels, dtype=np.int64)
+
+        self.input_transform = instantiate_transform(input_transform)
+        self.target_transform = instantiate_transform(target_transform)
 
         self.input_shape_dict = input_shape_dict
         self.target_shape_dict = target_shape_dict
 
+    def with_input_transform(
+        self, input_transform: Optional[Any]
+    ) -> "ClassificationDataset":
+        """
+        Return a copy of the dataset which applies `input_transform` to its
+        images, sharing the image and label arrays rather than copying or
+        reloading them.
+        """
+        dataset = copy.copy(self)
+        dataset.input_transform = instantiate_transform(input_transform)
+        return dataset
+
     def __len__(self):
-        return len(self.tf_dataset)
+        return len(self.images)
 
     def __getitem__(self, index):
-        sample = self.dataset[index]
-        x = sample[self.input_target_keys["inputs"]]
-        y = sample[self.input_target_keys["targets"]]
-
         if self.input_transform:
-            x = self.input_transform(x)
+            x = self.input_transform(self.images[index])
+        else:
+            x = torch.from_numpy(self.images[index]).permute(2, 0, 1)
 
         if self.target_transform:
-            y = self.target_transform(y)
-        # log.info(
-        #     f"Returning sample: {torch.tensor(x).type(torch.FloatTensor).shape}"
-        # )
-        return {"image": torch.tensor(x).type(torch.FloatTensor)}, {
-            "image": torch.ones(size=(1,)).type(torch.LongTensor) * y
-        }
+            y = torch.ones(size=(1,)).type(torch.LongTensor) * self.target_transform(
+                self.labels[index]
+            )
+        else:
+            y = torch.from_numpy(self.labels[index : index + 1])
+
+        return {"image": x}, {"image": y}
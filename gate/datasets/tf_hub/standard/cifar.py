@@ -17,6 +17,7 @@ class CIFAR10ClassificationDataset(ClassificationDataset):
         download: bool,
         input_transform: Optional[Any] = None,
         target_transform: Optional[Any] = None,
+        tfds_reader: str = "tensorflow",
     ):
         super(CIFAR10ClassificationDataset, self).__init__(
             dataset_name="cifar10",
@@ -26,6 +27,7 @@ class CIFAR10ClassificationDataset(ClassificationDataset):
             download=download,
             input_transform=input_transform,
             target_transform=target_transform,
+            tfds_reader=tfds_reader,
             input_shape_dict=DottedDict(
                 image=DottedDict(channels=3, height=32, width=32)
             ),
@@ -41,6 +43,7 @@ class CIFAR100ClassificationDataset(ClassificationDataset):
         download: bool,
         input_transform: Optional[Any] = None,
         target_transform: Optional[Any] = None,
+        tfds_reader: str = "tensorflow",
     ):
         super(CIFAR100ClassificationDataset, self).__init__(
             dataset_name="cifar100",
@@ -50,6 +53,7 @@ class CIFAR100ClassificationDataset(ClassificationDataset):
             download=download,
             input_transform=input_transform,
             target_transform=target_transform,
+            tfds_reader=tfds_reader,
             input_shape_dict=DottedDict(
                 image=DottedDict(channels=3, height=32, width=32)
             ),
@@ -25,6 +25,7 @@ class OmniglotClassificationDataset(ClassificationDataset):
         download: bool,
         input_transform: Optional[Any] = None,
         target_transform: Optional[Any] = None,
+        tfds_reader: str = "tensorflow",
     ):
         super(OmniglotClassificationDataset, self).__init__(
             dataset_name="omniglot",
@@ -34,6 +35,7 @@ class OmniglotClassificationDataset(ClassificationDataset):
             download=download,
             input_transform=input_transform,
             target_transform=target_transform,
+            tfds_reader=tfds_reader,
             input_shape_dict=DottedDict(
                 image=DottedDict(channels=1, height=28, width=28)
             ),
@@ -0,0 +1,826 @@
+import io
+import json
+import pathlib
+import re
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from PIL import Image
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.data_utils import TFDSReaderOptions
+
+log = get_logger(
+    __name__,
+)
+
+# TFRecord framing: uint64 length, uint32 length crc, data, uint32 data crc
+_RECORD_HEADER = struct.Struct("<QI")
+_RECORD_FOOTER_SIZE = 4
+
+# wire types of the protobuf encoding
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH_DELIMITED = 2
+_WIRE_FIXED32 = 5
+
+_IMAGE_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+class TFDSFeatureKinds:
+    IMAGE: str = "image"
+    CLASS_LABEL: str = "class_label"
+    TEXT: str = "text"
+    TENSOR: str = "tensor"
+
+
+@dataclass
+class TFRecordFeature:
+    """
+    One leaf feature of a TFDS `FeaturesDict`, as it is serialized in the
+    `tf.train.Example` of every record: `key` is the "/" joined path of the
+    feature, and `sequence` is set for features nested in a `Sequence`,
+    which gain a leading dimension of variable length.
+    """
+
+    key: str
+    kind: str
+    dtype: str
+    shape: Tuple[Optional[int], ...]
+    encoding: str = "none"
+    sequence: bool = False
+
+    @property
+    def is_fixed_shape(self) -> bool:
+        return not self.sequence and all(dim is not None for dim in self.shape)
+
+
+def read_tfrecord_file(
+    path: Union[str, pathlib.Path], keep_mask: Optional[np.ndarray] = None
+) -> Iterator[bytes]:
+    """
+    Yield the serialized records of a TFRecord file, in order. When
+    `keep_mask` is given, records whose entry is False are seeked past
+    without being read, and reading stops at the end of the mask.
+    Checksums are not verified.
+    """
+    with open(path, "rb") as record_file:
+        record_idx = 0
+        while True:
+            if keep_mask is not None and record_idx >= len(keep_mask):
+                return
+
+            header = record_file.read(_RECORD_HEADER.size)
+
+            if len(header) == 0:
+                return
+
+            if len(header) < _RECORD_HEADER.size:
+                raise ValueError(f"Truncated record header in {path}")
+
+            length, _ = _RECORD_HEADER.unpack(header)
+
+            if keep_mask is not None and not keep_mask[record_idx]:
+                record_file.seek(length + _RECORD_FOOTER_SIZE, io.SEEK_CUR)
+            else:
+                data = record_file.read(length)
+                if len(data) < length:
+                    raise ValueError(f"Truncated record data in {path}")
+                record_file.seek(_RECORD_FOOTER_SIZE, io.SEEK_CUR)
+                yield data
+
+            record_idx += 1
+
+
+def get_interleave_blocks(
+    lengths: Sequence[int], cycle_length: int, block_length: int
+) -> List[Tuple[int, int, int]]:
+    """
+    Return the (input index, offset, count) blocks in which
+    `tf.data.Dataset.interleave` reads inputs of the given `lengths`,
+    which is how `tfds.load` reads the shards of a split.
+
+    A cycle of `cycle_length` slots is visited in turn, reading up to
+    `block_length` records from the input open in each slot. An exhausted
+    input frees its slot once it is found empty, and the next input is
+    opened the next time that free slot is visited.
+    """
+    slots: List[Optional[List[int]]] = [None] * cycle_length
+    blocks = []
+    next_input_idx = 0
+    num_open = 0
+    cycle_idx = 0
+
+    while next_input_idx < len(lengths) or num_open > 0:
+        slot = slots[cycle_idx]
+
+        if slot is None:
+            if next_input_idx < len(lengths):
+                slots[cycle_idx] = [next_input_idx, 0]
+                next_input_idx += 1
+                num_open += 1
+                continue
+        else:
+            input_idx, offset = slot
+            count = min(block_length, lengths[input_idx] - offset)
+
+            if count > 0:
+                blocks.append((input_idx, offset, count))
+                slot[1] += count
+
+            if count < block_length:
+                # reading past the end of the input closes it
+                slots[cycle_idx] = None
+                num_open -= 1
+
+        cycle_idx = (cycle_idx + 1) % cycle_length
+
+    return blocks
+
+
+def _read_varint(buffer: memoryview, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buffer: memoryview) -> Iterator[Tuple[int, int, Any]]:
+    """
+    Yield the (field number, wire type, value) of each field of a protobuf
+    message, with length delimited values as memoryview slices.
+    """
+    pos = 0
+    end = len(buffer)
+    while pos < end:
+        tag, pos = _read_varint(buffer, pos)
+        field_number, wire_type = tag >> 3, tag & 0x7
+
+        if wire_type == _WIRE_VARINT:
+            value, pos = _read_varint(buffer, pos)
+        elif wire_type == _WIRE_LENGTH_DELIMITED:
+            length, pos = _read_varint(buffer, pos)
+            value = buffer[pos : pos + length]
+            pos += length
+        elif wire_type == _WIRE_FIXED64:
+            value = buffer[pos : pos + 8]
+            pos += 8
+        elif wire_type == _WIRE_FIXED32:
+            value = buffer[pos : pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+
+        yield field_number, wire_type, value
+
+
+def _to_signed_int64(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _parse_feature(buffer: memoryview) -> Union[List[bytes], np.ndarray]:
+    """
+    Parse a `tf.train.Feature`, which holds one of a bytes list (field 1),
+    a float list (field 2) or an int64 list (field 3).
+    """
+    for field_number, _, value_list in _iter_fields(buffer):
+        if field_number == 1:
+            return [bytes(value) for _, _, value in _iter_fields(value_list)]
+
+        if field_number == 2:
+            values = []
+            for _, wire_type, value in _iter_fields(value_list):
+                # packed (the default) or one fixed32 field per value
+                values.append(
+                    np.frombuffer(value, dtype="<f4")
+                    if wire_type == _WIRE_LENGTH_DELIMITED
+                    else np.frombuffer(value, dtype="<f4", count=1)
+                )
+            return (
+                np.concatenate(values).astype(np.float32)
+                if len(values) > 0
+                else np.zeros((0,), dtype=np.float32)
+            )
+
+        if field_number == 3:
+            values = []
+            for _, wire_type, value in _iter_fields(value_list):
+                if wire_type == _WIRE_LENGTH_DELIMITED:
+                    pos = 0
+                    while pos < len(value):
+                        item, pos = _read_varint(value, pos)
+                        values.append(_to_signed_int64(item))
+                else:
+                    values.append(_to_signed_int64(value))
+            return np.array(values, dtype=np.int64)
+
+    # a feature with no value list set
+    return np.zeros((0,), dtype=np.int64)
+
+
+def parse_example(
+    serialized: bytes, keys: Optional[Sequence[str]] = None
+) -> Dict[str, Union[List[bytes], np.ndarray]]:
+    """
+    Parse a serialized `tf.train.Example` into a dict of its raw feature
+    values: a list of bytes, or a float32 or int64 array. When `keys` is
+    given, the values of any other feature are not parsed.
+    """
+    keys = None if keys is None else set(keys)
+    features = {}
+
+    for _, _, features_buffer in _iter_fields(memoryview(serialized)):
+        # Example.features (field 1) -> Features.feature (map, field 1)
+        for _, _, entry in _iter_fields(features_buffer):
+            key, feature_buffer = None, None
+            for field_number, _, value in _iter_fields(entry):
+                if field_number == 1:
+                    key = bytes(value).decode("utf-8")
+                elif field_number == 2:
+                    feature_buffer = value
+
+            if key is None or (keys is not None and key not in keys):
+                continue
+
+            features[key] = (
+                _parse_feature(feature_buffer)
+                if feature_buffer is not None
+                else np.zeros((0,), dtype=np.int64)
+            )
+
+    return features
+
+
+def _get_shape(dimensions: Optional[List[Any]]) -> Tuple[Optional[int], ...]:
+    return tuple(
+        None if dim is None or int(dim) < 0 else int(dim) for dim in (dimensions or [])
+    )
+
+
+def _parse_feature_spec(
+    spec: Dict[str, Any], key: str, sequence: bool
+) -> List[TFRecordFeature]:
+    """
+    Flatten a TFDS feature description, as found in `features.json`, into
+    its leaf features. Both the current protobuf based format
+    (`pythonClassName`) and the older one (`type` and `content`) are read.
+    """
+    class_name = spec.get("pythonClassName", spec.get("type", ""))
+    content = spec.get("content", spec)
+    class_name = class_name.rsplit(".", 1)[-1]
+
+    def join_key(child_key):
+        return child_key if key == "" else f"{key}/{child_key}"
+
+    if class_name == "FeaturesDict":
+        children = (
+            content["featuresDict"]["features"]
+            if "featuresDict" in content
+            else content
+        )
+        return [
+            feature
+            for child_key, child_spec in children.items()
+            for feature in _parse_feature_spec(
+                child_spec, key=join_key(child_key), sequence=sequence
+            )
+        ]
+
+    if class_name == "Sequence":
+        sequence_spec = content.get("sequence", content)
+        return _parse_feature_spec(sequence_spec["feature"], key=key, sequence=True)
+
+    if class_name == "Image":
+        image_spec = content.get("image", content)
+        shape = image_spec.get("shape", [None, None, 3])
+        return [
+            TFRecordFeature(
+                key=key,
+                kind=TFDSFeatureKinds.IMAGE,
+                dtype=image_spec.get("dtype", "uint8"),
+                shape=_get_shape(
+                    shape["dimensions"] if isinstance(shape, dict) else shape
+                ),
+                sequence=sequence,
+            )
+        ]
+
+    if class_name == "ClassLabel":
+        return [
+            TFRecordFeature(
+                key=key,
+                kind=TFDSFeatureKinds.CLASS_LABEL,
+                dtype="int64",
+                shape=(),
+                sequence=sequence,
+            )
+        ]
+
+    if class_name == "Text":
+        return [
+            TFRecordFeature(
+                key=key,
+                kind=TFDSFeatureKinds.TEXT,
+                dtype="string",
+                shape=(),
+                sequence=sequence,
+            )
+        ]
+
+    if class_name in ("Tensor", "BBoxFeature", "Scalar"):
+        tensor_spec = content.get("tensor", content)
+        shape = tensor_spec.get("shape", [4] if class_name == "BBoxFeature" else [])
+        return [
+            TFRecordFeature(
+                key=key,
+                kind=TFDSFeatureKinds.TENSOR,
+                dtype=tensor_spec.get("dtype", "float32"),
+                shape=_get_shape(
+                    shape.get("dimensions") if isinstance(shape, dict) else shape
+                ),
+                encoding=tensor_spec.get("encoding", "none"),
+                sequence=sequence,
+            )
+        ]
+
+    raise ValueError(f"Unsupported TFDS feature {class_name} for {key}")
+
+
+def decode_image(encoded: bytes, channels: Optional[int]) -> np.ndarray:
+    """
+    Decode a PNG or JPEG image to a HxWxC uint8 array, converting it to
+    `channels` channels when given, like `tf.image.decode_image`.
+    """
+    image = Image.open(io.BytesIO(encoded))
+
+    if channels is not None and image.mode != _IMAGE_MODES[channels]:
+        image = image.convert(_IMAGE_MODES[channels])
+
+    image = np.asarray(image)
+
+    if image.ndim == 2:
+        image = image[..., None]
+
+    return image
+
+
+def decode_feature(
+    feature: TFRecordFeature,
+    value: Union[List[bytes], np.ndarray],
+    decode_images: bool = True,
+) -> Any:
+    """
+    Turn the raw value of a feature into the numpy value that
+    `tfds.as_numpy` yields for it.
+    """
+    if feature.kind == TFDSFeatureKinds.IMAGE:
+        if not decode_images:
+            return value[0] if not feature.sequence else np.array(value, dtype=object)
+        channels = feature.shape[-1] if len(feature.shape) > 0 else None
+        images = [decode_image(encoded, channels=channels) for encoded in value]
+        return images[0] if not feature.sequence else np.stack(images)
+
+    if feature.kind == TFDSFeatureKinds.TEXT or feature.dtype == "string":
+        value = np.array(value, dtype=object)
+    else:
+        if feature.encoding in ("bytes", "zlib"):
+            buffer = b"".join(value)
+            if feature.encoding == "zlib":
+                buffer = zlib.decompress(buffer)
+            value = np.frombuffer(buffer, dtype=np.dtype(feature.dtype))
+
+        value = np.asarray(value).astype(np.dtype(feature.dtype), copy=False)
+
+    shape = tuple(-1 if dim is None else dim for dim in feature.shape)
+
+    if feature.sequence:
+        if value.size == 0:
+            return value.reshape((0,) + tuple(max(dim, 0) for dim in shape))
+        return value.reshape((-1,) + shape)
+
+    if len(shape) == 0:
+        return value[0]
+
+    return value.reshape(shape)
+
+
+def _unflatten(flat_sample: Dict[str, Any]) -> Dict[str, Any]:
+    sample = {}
+    for key, value in flat_sample.items():
+        *parent_keys, leaf_key = key.split("/")
+        node = sample
+        for parent_key in parent_keys:
+            node = node.setdefault(parent_key, {})
+        node[leaf_key] = value
+    return sample
+
+
+def parse_split(
+    split: str, split_num_examples: Dict[str, int], dataset_name: str
+) -> Tuple[str, int, int]:
+    """
+    Resolve a split name, optionally sliced with absolute or percent
+    boundaries (e.g. "train[:80%]"), to its name and record range, given the
+    number of examples of every split.
+    """
+    match = re.fullmatch(r"\s*(\w+)\s*(?:\[([^:\]]*):([^\]]*)\])?\s*", split)
+
+    if match is None or match.group(1) not in split_num_examples:
+        raise ValueError(
+            f"Unsupported split {split} of {dataset_name}, available "
+            f"splits are {list(split_num_examples.keys())}"
+        )
+
+    split_name, start, end = match.groups()
+    num_examples = split_num_examples[split_name]
+
+    def to_index(boundary, default):
+        if boundary is None or boundary.strip() == "":
+            return default
+        boundary = boundary.strip()
+        if boundary.endswith("%"):
+            # rounded to the closest record, as tfds does by default
+            index = int(round(float(boundary[:-1]) * num_examples / 100.0))
+        else:
+            index = int(boundary)
+        if index < 0:
+            index += num_examples
+        return min(max(index, 0), num_examples)
+
+    return split_name, to_index(start, 0), to_index(end, num_examples)
+
+
+class PreparedTFDSDataset:
+    """
+    Read a TFDS dataset that has already been downloaded and prepared under
+    `data_dir`, straight from its TFRecord shards, `dataset_info.json` and
+    `features.json`, without importing TensorFlow.
+
+    Samples are yielded in the order `tfds.load(..., shuffle_files=False)`
+    yields them, as dicts of numpy values like those of `tfds.as_numpy`.
+    Images are decoded with PIL, which matches TensorFlow exactly for PNG,
+    while JPEG decoders may differ by a few intensity levels.
+    """
+
+    def __init__(
+        self,
+        dataset_name: str,
+        data_dir: Union[str, pathlib.Path],
+        version: Optional[str] = None,
+    ):
+        self.dataset_name = dataset_name
+        self.dataset_dir = self.find_dataset_dir(dataset_name, data_dir, version)
+
+        if self.dataset_dir is None:
+            raise FileNotFoundError(
+                f"No prepared TFDS dataset {dataset_name} found in {data_dir}"
+            )
+
+        with open(self.dataset_dir / "dataset_info.json", "r") as info_file:
+            self.info = json.load(info_file)
+
+        with open(self.dataset_dir / "features.json", "r") as features_file:
+            self.features = {
+                feature.key: feature
+                for feature in _parse_feature_spec(
+                    json.load(features_file), key="", sequence=False
+                )
+            }
+
+        file_format = self.info.get("fileFormat", "tfrecord")
+        if file_format != "tfrecord":
+            raise ValueError(
+                f"{dataset_name} is stored as {file_format}, only tfrecord "
+                f"shards can be read without TensorFlow"
+            )
+
+        self.splits = {split["name"]: split for split in self.info["splits"]}
+        self.version = self.info.get("version", self.dataset_dir.name)
+
+    @staticmethod
+    def find_dataset_dir(
+        dataset_name: str,
+        data_dir: Union[str, pathlib.Path],
+        version: Optional[str] = None,
+    ) -> Optional[pathlib.Path]:
+        """
+        Return the prepared directory of `dataset_name` (which may name a
+        builder config, as in "name/config", and a version, as in
+        "name:1.0.0"), picking the latest version unless one is given.
+        """
+        if ":" in dataset_name:
+            dataset_name, version = dataset_name.split(":", 1)
+
+        builder_dir = pathlib.Path(data_dir) / dataset_name
+
+        if version is not None:
+            version_dirs = [builder_dir / version]
+        else:
+            version_dirs = sorted(
+                (
+                    path
+                    for path in builder_dir.glob("*")
+                    if re.fullmatch(r"\d+\.\d+\.\d+", path.name)
+                ),
+                key=lambda path: tuple(int(item) for item in path.name.split(".")),
+                reverse=True,
+            )
+
+        for version_dir in version_dirs:
+            if (version_dir / "dataset_info.json").exists() and (
+                version_dir / "features.json"
+            ).exists():
+                return version_dir
+
+        return None
+
+    @staticmethod
+    def exists(
+        dataset_name: str,
+        data_dir: Union[str, pathlib.Path],
+        version: Optional[str] = None,
+    ) -> bool:
+        return (
+            PreparedTFDSDataset.find_dataset_dir(dataset_name, data_dir, version)
+            is not None
+        )
+
+    def _parse_split(self, split: str) -> Tuple[str, int, int]:
+        return parse_split(
+            split,
+            split_num_examples={
+                split_name: sum(int(length) for length in split_info["shardLengths"])
+                for split_name, split_info in self.splits.items()
+            },
+            dataset_name=self.dataset_name,
+        )
+
+    def get_shard_paths(self, split_name: str) -> List[pathlib.Path]:
+        split_info = self.splits[split_name]
+        num_shards = len(split_info["shardLengths"])
+        template = split_info.get(
+            "filepathTemplate", "{DATASET}-{SPLIT}.{FILEFORMAT}-{SHARD_X_OF_Y}"
+        )
+
+        return [
+            self.dataset_dir
+            / template.replace("{DATASET}", self.info["name"])
+            .replace("{SPLIT}", split_name)
+            .replace("{FILEFORMAT}", self.info.get("fileFormat", "tfrecord"))
+            .replace("{SHARD_X_OF_Y}", f"{shard_idx:05d}-of-{num_shards:05d}")
+            for shard_idx in range(num_shards)
+        ]
+
+    def num_examples(self, split: str) -> int:
+        _, start, end = self._parse_split(split)
+        return max(end - start, 0)
+
+    def get_features(
+        self, feature_keys: Optional[Sequence[str]] = None
+    ) -> List[TFRecordFeature]:
+        """
+        Return the leaf features selected by `feature_keys`, where a key
+        selects a feature and everything nested under it.
+        """
+        if feature_keys is None:
+            return list(self.features.values())
+
+        return [
+            feature
+            for feature in self.features.values()
+            if any(
+                feature.key == key or feature.key.startswith(f"{key}/")
+                for key in feature_keys
+            )
+        ]
+
+    def get_class_names(self, key: str) -> Optional[List[str]]:
+        """
+        Return the names of the classes of the `ClassLabel` feature `key`,
+        stored by TFDS next to the shards, or None if it has no names.
+        """
+        names_path = self.dataset_dir / f"{key.replace('/', '-')}.labels.txt"
+
+        if not names_path.exists():
+            return None
+
+        with open(names_path, "r") as names_file:
+            return [
+                name.strip() for name in names_file.read().split("\n") if name.strip()
+            ]
+
+    def has_fixed_shapes(self, feature_keys: Optional[Sequence[str]] = None) -> bool:
+        return all(
+            feature.is_fixed_shape for feature in self.get_features(feature_keys)
+        )
+
+    def get_file_instructions(self, split: str) -> List[Tuple[pathlib.Path, int, int]]:
+        """
+        Return the (shard path, skip, take) of each shard that holds records
+        of `split`, like the file instructions of `tfds`.
+        """
+        split_name, start, end = self._parse_split(split)
+        file_instructions = []
+        shard_start = 0
+
+        for shard_path, shard_length in zip(
+            self.get_shard_paths(split_name),
+            [int(item) for item in self.splits[split_name]["shardLengths"]],
+        ):
+            skip = max(start - shard_start, 0)
+            take = min(end - shard_start, shard_length) - skip
+            shard_start += shard_length
+
+            if take > 0:
+                file_instructions.append((shard_path, skip, take))
+
+        return file_instructions
+
+    def iterate_records(
+        self,
+        split: str,
+        sample_indices: Optional[np.ndarray] = None,
+        interleave_block_length: int = 16,
+    ) -> Iterator[bytes]:
+        """
+        Yield the serialized records of `split` in the order `tfds` reads
+        them, restricted to `sample_indices` (positions in that order) when
+        given.
+        """
+        file_instructions = self.get_file_instructions(split)
+        takes = [take for _, _, take in file_instructions]
+        # tfds interleaves 16 shards at a time unless the dataset must be
+        # read in order
+        cycle_length = 1 if self.info.get("disableShuffling", False) else 16
+        blocks = get_interleave_blocks(
+            takes, cycle_length=cycle_length, block_length=interleave_block_length
+        )
+
+        keep_mask = None
+        if sample_indices is not None:
+            keep_mask = np.zeros((sum(takes),), dtype=bool)
+            keep_mask[np.asarray(sample_indices, dtype=np.int64)] = True
+
+        file_keep_masks = [
+            np.zeros((skip + take,), dtype=bool) for _, skip, take in file_instructions
+        ]
+        block_num_kept = []
+        position = 0
+        for file_idx, offset, count in blocks:
+            skip = file_instructions[file_idx][1]
+            block_mask = (
+                True if keep_mask is None else keep_mask[position : position + count]
+            )
+            file_keep_masks[file_idx][
+                skip + offset : skip + offset + count
+            ] = block_mask
+            block_num_kept.append(count if keep_mask is None else int(block_mask.sum()))
+            position += count
+
+        file_readers = {}
+        file_num_remaining = [int(mask.sum()) for mask in file_keep_masks]
+        for (file_idx, _, _), num_kept in zip(blocks, block_num_kept):
+            if num_kept == 0:
+                continue
+
+            if file_idx not in file_readers:
+                file_readers[file_idx] = read_tfrecord_file(
+                    file_instructions[file_idx][0],
+                    keep_mask=file_keep_masks[file_idx],
+                )
+
+            for _ in range(num_kept):
+                yield next(file_readers[file_idx])
+
+            file_num_remaining[file_idx] -= num_kept
+            if file_num_remaining[file_idx] == 0:
+                # close the shard as soon as all its records have been read
+                file_readers.pop(file_idx).close()
+
+    def iterate(
+        self,
+        split: str,
+        feature_keys: Optional[Sequence[str]] = None,
+        sample_indices: Optional[np.ndarray] = None,
+        decode_images: bool = True,
+        num_parallel_calls: Optional[int] = None,
+        chunk_size: int = 256,
+        map_fn: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the samples of `split` with the features in `feature_keys`
+        (all features if None), restricted to `sample_indices` when given.
+        Records are parsed and their images decoded by a pool of
+        `num_parallel_calls` threads, a chunk of records at a time, which
+        also apply `map_fn` to every decoded sample when given.
+        """
+        features = self.get_features(feature_keys)
+        keys = [feature.key for feature in features]
+
+        def decode_record(record):
+            raw_sample = parse_example(record, keys=keys)
+            sample = _unflatten(
+                {
+                    feature.key: decode_feature(
+                        feature,
+                        raw_sample.get(feature.key, np.zeros((0,), dtype=np.int64)),
+                        decode_images=decode_images,
+                    )
+                    for feature in features
+                }
+            )
+            return map_fn(sample) if map_fn is not None else sample
+
+        records = self.iterate_records(split, sample_indices=sample_indices)
+
+        if num_parallel_calls is not None and num_parallel_calls <= 1:
+            for record in records:
+                yield decode_record(record)
+            return
+
+        with ThreadPoolExecutor(max_workers=num_parallel_calls) as executor:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == chunk_size:
+                    yield from executor.map(decode_record, chunk)
+                    chunk = []
+            yield from executor.map(decode_record, chunk)
+
+    def iterate_batches(
+        self,
+        split: str,
+        batch_size: int,
+        feature_keys: Optional[Sequence[str]] = None,
+        sample_indices: Optional[np.ndarray] = None,
+        num_parallel_calls: Optional[int] = None,
+        map_fn: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Yield the samples of `split` stacked into batches of `batch_size`,
+        for features that all have a fixed shape once `map_fn` is applied.
+        """
+        batch = []
+        for sample in self.iterate(
+            split,
+            feature_keys=feature_keys,
+            sample_indices=sample_indices,
+            num_parallel_calls=num_parallel_calls,
+            chunk_size=batch_size,
+            map_fn=map_fn,
+        ):
+            batch.append(sample)
+            if len(batch) == batch_size:
+                yield {key: np.stack([item[key] for item in batch]) for key in batch[0]}
+                batch = []
+
+        if len(batch) > 0:
+            yield {key: np.stack([item[key] for item in batch]) for key in batch[0]}
+
+
+def load_prepared_tfds_dataset(
+    dataset_name: str,
+    data_dir: Union[str, pathlib.Path],
+    download: bool,
+    tfds_reader: str = TFDSReaderOptions.TFRECORD,
+) -> Union[PreparedTFDSDataset, "SyntheticTFDSDataset"]:
+    """
+    Open a prepared TFDS dataset without TensorFlow. If it has not been
+    prepared yet and `download` is set, it is downloaded and prepared with
+    `tensorflow_datasets` first, which is then the only time TensorFlow is
+    imported.
+
+    With `TFDSReaderOptions.SYNTHETIC`, the synthetic stand-in prepared
+    under `data_dir` with `prepare_synthetic_tfds_dataset` is opened
+    instead, which has the same interface and never touches the network.
+    """
+    if tfds_reader == TFDSReaderOptions.SYNTHETIC:
+        from gate.datasets.synthetic_tfds import SyntheticTFDSDataset
+
+        return SyntheticTFDSDataset(dataset_name, data_dir)
+
+    if not PreparedTFDSDataset.exists(dataset_name, data_dir) and download:
+        import tensorflow_datasets as tfds
+
+        tfds.builder(dataset_name, data_dir=data_dir).download_and_prepare()
+
+    return PreparedTFDSDataset(dataset_name, data_dir)
@@ -1,14 +1,17 @@
-from typing import Tuple, Union
+from typing import Sequence, Tuple, Union
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torchvision.transforms.functional as F
+from PIL import Image
 from torchvision import transforms
 from torchvision.transforms.transforms import _setup_size
 from torchvision.utils import _log_api_usage_once, save_image
 import os
 import random
 
+from gate.datasets.data_utils import resize_image
 from gate.datasets.tf_hub.few_shot.base import CardinalityType
 
 
@@ -28,6 +31,58 @@ class RandomApply(nn.Module):
         return self.fn(x)
 
 
+class ResizeToTensor(nn.Module):
+    """
+    Equivalent to `ToPILImage()`, `Resize(size, interpolation)` and
+    `ToTensor()`, for HxWxC uint8 arrays and CxHxW uint8 tensors (as the
+    few-shot datasets give, see `split_episode_sets`). Images that already
+    have `size`, such as those of a pre-resized image cache, are converted
+    to a float tensor directly, which gives the same result without going
+    through PIL.
+    """
+
+    def __init__(self, size: Sequence[int], interpolation: str = "bilinear"):
+        super().__init__()
+        self.size = tuple(size)
+        self.interpolation = interpolation
+
+    def forward(self, x):
+        if isinstance(x, torch.Tensor) and x.ndim == 3 and x.dtype == torch.uint8:
+            if tuple(x.shape[-2:]) == self.size:
+                return x.to(dtype=torch.get_default_dtype()).div(255)
+
+            x = x.permute(1, 2, 0).numpy()
+
+        if isinstance(x, np.ndarray) and x.ndim == 3:
+            if x.shape[:2] != self.size:
+                x = resize_image(x, size=self.size, interpolation=self.interpolation)
+
+            return (
+                torch.from_numpy(np.array(x, copy=True))
+                .permute(2, 0, 1)
+                .contiguous()
+                .to(dtype=torch.get_default_dtype())
+                .div(255)
+            )
+
+        if not isinstance(x, Image.Image):
+            x = F.to_pil_image(x)
+
+        return F.to_tensor(
+            F.resize(
+                x,
+                size=list(self.size),
+                interpolation=transforms.InterpolationMode(self.interpolation),
+            )
+        )
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(size={self.size}, "
+            f"interpolation={self.interpolation})"
+        )
+
+
 class SuperClassExistingLabels(torch.nn.Module):
     def __init__(self, num_classes_to_group: Union[int, Tuple[int, int]]):
         super().__init__()
@@ -9,10 +9,13 @@ from gate.configs.datamodule.base import ShapeConfig
 from gate.configs.task.image_classification import TaskConfig
 from gate.learners.protonet import PrototypicalNetworkEpisodicTuningScheme
 from gate.learners.utils import (
+    flatten_examples,
+    get_class_mask,
     get_cosine_distances,
     matching_logits,
     matching_loss,
     get_matching_accuracy,
+    unflatten_examples,
 )
 
 log = loggers.get_logger(__name__)
@@ -49,34 +52,52 @@ class MatchingNetworkEpisodicTuningScheme(PrototypicalNetworkEpisodicTuningSchem
         support_set_targets = target_dict["image"]["support_set"]
         query_set_inputs = input_dict["image"]["query_set"]
         query_set_targets = target_dict["image"]["query_set"]
+        # set for meta-batches of padded episodes, see collate_padded_episodes
+        support_set_mask = target_dict["image"].get("support_set_mask")
+        query_set_mask = target_dict["image"].get("query_set_mask")
 
         num_tasks, num_examples = support_set_inputs.shape[:2]
         support_set_embedding = self.forward(
-            {"image": support_set_inputs.view(-1, *support_set_inputs.shape[2:])}
+            {"image": flatten_examples(support_set_inputs, mask=support_set_mask)}
         )["image"]
         support_set_embedding = F.adaptive_avg_pool2d(support_set_embedding, 1)
-        support_set_embedding = support_set_embedding.view(num_tasks, num_examples, -1)
+        support_set_embedding = unflatten_examples(
+            support_set_embedding.flatten(1),
+            num_tasks,
+            num_examples,
+            mask=support_set_mask,
+        )
 
         num_tasks, num_examples = query_set_inputs.shape[:2]
         query_set_embedding = self.forward(
-            {"image": query_set_inputs.view(-1, *query_set_inputs.shape[2:])}
+            {"image": flatten_examples(query_set_inputs, mask=query_set_mask)}
         )["image"]
         query_set_embedding = F.adaptive_avg_pool2d(query_set_embedding, 1)
-        query_set_embedding = query_set_embedding.view(num_tasks, num_examples, -1)
+        query_set_embedding = unflatten_examples(
+            query_set_embedding.flatten(1), num_tasks, num_examples, mask=query_set_mask
+        )
 
         cosine_distances = get_cosine_distances(
             query_embeddings=query_set_embedding,
             support_embeddings=support_set_embedding,
         )
 
+        num_classes = int(torch.max(support_set_targets)) + 1
+        class_mask = get_class_mask(
+            support_set_targets, num_classes, mask=support_set_mask
+        )
+
         logits = matching_logits(
             cosine_distances=cosine_distances,
             targets=support_set_targets,
-            num_classes=int(torch.max(support_set_targets)) + 1,
+            num_classes=num_classes,
+            mask=support_set_mask,
         )
 
         computed_task_metrics_dict = {
-            f"{phase_name}/loss": matching_loss(logits, query_set_targets)
+            f"{phase_name}/loss": matching_loss(
+                logits, query_set_targets, mask=query_set_mask, class_mask=class_mask
+            )
         }
 
         opt_loss_list = [computed_task_metrics_dict[f"{phase_name}/loss"]]
@@ -84,7 +105,12 @@ class MatchingNetworkEpisodicTuningScheme(PrototypicalNetworkEpisodicTuningSchem
         with torch.no_grad():
             computed_task_metrics_dict[
                 f"{phase_name}/accuracy"
-            ] = get_matching_accuracy(logits=logits, targets=query_set_targets)
+            ] = get_matching_accuracy(
+                logits=logits,
+                targets=query_set_targets,
+                mask=query_set_mask,
+                class_mask=class_mask,
+            )
 
         return (
             output_dict,
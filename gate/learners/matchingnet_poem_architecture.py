@@ -9,10 +9,13 @@ from gate.configs.datamodule.base import ShapeConfig
 from gate.configs.task.image_classification import TaskConfig
 from gate.learners.protonet_poem_architecture import PrototypicalNetworkPOEMHead
 from gate.learners.utils import (
+    flatten_examples,
+    get_class_mask,
     get_cosine_distances,
     matching_logits,
     matching_loss,
     get_matching_accuracy,
+    unflatten_examples,
 )
 
 log = loggers.get_logger(__name__)
@@ -64,6 +67,9 @@ class MatchingNetworkPOEMHead(PrototypicalNetworkPOEMHead):
         support_set_targets = target_dict["image"]["support_set"]
         query_set_inputs = {"image": input_dict["image"]["query_set"]}
         query_set_targets = target_dict["image"]["query_set"]
+        # set for meta-batches of padded episodes, see collate_padded_episodes
+        support_set_mask = target_dict["image"].get("support_set_mask")
+        query_set_mask = target_dict["image"].get("query_set_mask")
 
         if "support_set_extras" in input_dict["image"]:
             support_set_view_information = torch.cat(
@@ -92,41 +98,57 @@ class MatchingNetworkPOEMHead(PrototypicalNetworkPOEMHead):
         num_tasks, num_support_examples = support_set_inputs["image"].shape[:2]
         num_classes = int(torch.max(support_set_targets)) + 1
 
-        support_set_inputs["image"] = support_set_inputs["image"].view(
-            -1, *support_set_inputs["image"].shape[2:]
+        support_set_inputs["image"] = flatten_examples(
+            support_set_inputs["image"], mask=support_set_mask
         )
         if support_set_inputs["view_information"] is not None:
-            support_set_inputs["view_information"] = support_set_inputs[
-                "view_information"
-            ].view(-1, support_set_inputs["view_information"].shape[2])
+            support_set_inputs["view_information"] = flatten_examples(
+                support_set_inputs["view_information"], mask=support_set_mask
+            )
 
         support_set_embedding = self.forward(support_set_inputs)["image"]
 
-        support_set_embedding_mean = support_set_embedding["mean"].view(
-            num_tasks, num_support_examples, -1
+        support_set_embedding_mean = unflatten_examples(
+            support_set_embedding["mean"],
+            num_tasks,
+            num_support_examples,
+            mask=support_set_mask,
         )
-        support_set_embedding_precision = support_set_embedding["precision"].view(
-            num_tasks, num_support_examples, -1
+        # padded examples get a unit precision, see inner_gaussian_product
+        support_set_embedding_precision = unflatten_examples(
+            support_set_embedding["precision"],
+            num_tasks,
+            num_support_examples,
+            mask=support_set_mask,
+            fill_value=1,
         )
 
         num_tasks, num_query_examples = query_set_inputs["image"].shape[:2]
 
-        query_set_inputs["image"] = query_set_inputs["image"].view(
-            -1, *query_set_inputs["image"].shape[2:]
+        query_set_inputs["image"] = flatten_examples(
+            query_set_inputs["image"], mask=query_set_mask
         )
         if query_set_inputs["view_information"] is not None:
-            query_set_inputs["view_information"] = query_set_inputs[
-                "view_information"
-            ].view(-1, query_set_inputs["view_information"].shape[2])
+            query_set_inputs["view_information"] = flatten_examples(
+                query_set_inputs["view_information"], mask=query_set_mask
+            )
 
         query_set_embedding = self.forward(query_set_inputs)["image"]
 
-        query_set_embedding_mean = query_set_embedding["mean"].view(
-            num_tasks, num_query_examples, -1
+        query_set_embedding_mean = unflatten_examples(
+            query_set_embedding["mean"],
+            num_tasks,
+            num_query_examples,
+            mask=query_set_mask,
         )
 
-        query_set_embedding_precision = query_set_embedding["precision"].view(
-            num_tasks, num_query_examples, -1
+        # padded examples get a unit precision, see inner_gaussian_product
+        query_set_embedding_precision = unflatten_examples(
+            query_set_embedding["precision"],
+            num_tasks,
+            num_query_examples,
+            mask=query_set_mask,
+            fill_value=1,
         )
 
         cosine_distances = get_cosine_distances(
@@ -134,14 +156,22 @@ class MatchingNetworkPOEMHead(PrototypicalNetworkPOEMHead):
             support_embeddings=support_set_embedding_mean,
         )
 
+        num_classes = int(torch.max(support_set_targets)) + 1
+        class_mask = get_class_mask(
+            support_set_targets, num_classes, mask=support_set_mask
+        )
+
         logits = matching_logits(
             cosine_distances=cosine_distances,
             targets=support_set_targets,
-            num_classes=int(torch.max(support_set_targets)) + 1,
+            num_classes=num_classes,
+            mask=support_set_mask,
         )
 
         computed_task_metrics_dict = {
-            f"{phase_name}/loss": matching_loss(logits, query_set_targets)
+            f"{phase_name}/loss": matching_loss(
+                logits, query_set_targets, mask=query_set_mask, class_mask=class_mask
+            )
         }
 
         opt_loss_list = [computed_task_metrics_dict[f"{phase_name}/loss"]]
@@ -149,7 +179,12 @@ class MatchingNetworkPOEMHead(PrototypicalNetworkPOEMHead):
         with torch.no_grad():
             computed_task_metrics_dict[
                 f"{phase_name}/accuracy"
-            ] = get_matching_accuracy(logits=logits, targets=query_set_targets)
+            ] = get_matching_accuracy(
+                logits=logits,
+                targets=query_set_targets,
+                mask=query_set_mask,
+                class_mask=class_mask,
+            )
 
         return (
             output_dict,
@@ -10,10 +10,15 @@ from gate.configs.datamodule.base import ShapeConfig
 from gate.configs.task.image_classification import TaskConfig
 from gate.learners.protonet import PrototypicalNetworkEpisodicTuningScheme
 from gate.learners.utils import (
+    flatten_examples,
+    get_class_mask,
     inner_gaussian_product,
+    masked_accuracy,
+    masked_cross_entropy,
     outer_gaussian_product,
     prototypical_loss,
     replace_with_counts,
+    unflatten_examples,
 )
 import os
 from torchvision.utils import save_image
@@ -188,6 +193,9 @@ class PartialObservationExpertsModelling(PrototypicalNetworkEpisodicTuningScheme
         support_set_targets = target_dict["image"]["support_set"]
         query_set_inputs = {"image": input_dict["image"]["query_set"]}
         query_set_targets = target_dict["image"]["query_set"]
+        # set for meta-batches of padded episodes, see collate_padded_episodes
+        support_set_mask = target_dict["image"].get("support_set_mask")
+        query_set_mask = target_dict["image"].get("query_set_mask")
 
         if "support_set_extras" in input_dict["image"]:
             support_set_view_information = torch.cat(
@@ -216,21 +224,29 @@ class PartialObservationExpertsModelling(PrototypicalNetworkEpisodicTuningScheme
         num_tasks, num_support_examples = support_set_inputs["image"].shape[:2]
         num_classes = int(torch.max(support_set_targets)) + 1
 
-        support_set_inputs["image"] = support_set_inputs["image"].view(
-            -1, *support_set_inputs["image"].shape[2:]
+        support_set_inputs["image"] = flatten_examples(
+            support_set_inputs["image"], mask=support_set_mask
         )
         if support_set_inputs["view_information"] is not None:
-            support_set_inputs["view_information"] = support_set_inputs[
-                "view_information"
-            ].view(-1, support_set_inputs["view_information"].shape[2])
+            support_set_inputs["view_information"] = flatten_examples(
+                support_set_inputs["view_information"], mask=support_set_mask
+            )
 
         support_set_embedding = self.forward(support_set_inputs)["image"]
 
-        support_set_embedding_mean = support_set_embedding["mean"].view(
-            num_tasks, num_support_examples, -1
+        support_set_embedding_mean = unflatten_examples(
+            support_set_embedding["mean"],
+            num_tasks,
+            num_support_examples,
+            mask=support_set_mask,
         )
-        support_set_embedding_precision = support_set_embedding["precision"].view(
-            num_tasks, num_support_examples, -1
+        # padded examples get a unit precision, see inner_gaussian_product
+        support_set_embedding_precision = unflatten_examples(
+            support_set_embedding["precision"],
+            num_tasks,
+            num_support_examples,
+            mask=support_set_mask,
+            fill_value=1,
         )
 
         # support_view_counts = replace_with_counts(support_set_targets)
@@ -241,22 +257,30 @@ class PartialObservationExpertsModelling(PrototypicalNetworkEpisodicTuningScheme
 
         num_tasks, num_query_examples = query_set_inputs["image"].shape[:2]
 
-        query_set_inputs["image"] = query_set_inputs["image"].view(
-            -1, *query_set_inputs["image"].shape[2:]
+        query_set_inputs["image"] = flatten_examples(
+            query_set_inputs["image"], mask=query_set_mask
         )
         if query_set_inputs["view_information"] is not None:
-            query_set_inputs["view_information"] = query_set_inputs[
-                "view_information"
-            ].view(-1, query_set_inputs["view_information"].shape[2])
+            query_set_inputs["view_information"] = flatten_examples(
+                query_set_inputs["view_information"], mask=query_set_mask
+            )
 
         query_set_embedding = self.forward(query_set_inputs)["image"]
 
-        query_set_embedding_mean = query_set_embedding["mean"].view(
-            num_tasks, num_query_examples, -1
+        query_set_embedding_mean = unflatten_examples(
+            query_set_embedding["mean"],
+            num_tasks,
+            num_query_examples,
+            mask=query_set_mask,
         )
 
-        query_set_embedding_precision = query_set_embedding["precision"].view(
-            num_tasks, num_query_examples, -1
+        # padded examples get a unit precision, see inner_gaussian_product
+        query_set_embedding_precision = unflatten_examples(
+            query_set_embedding["precision"],
+            num_tasks,
+            num_query_examples,
+            mask=query_set_mask,
+            fill_value=1,
         )
 
         (
@@ -268,6 +292,10 @@ class PartialObservationExpertsModelling(PrototypicalNetworkEpisodicTuningScheme
             support_set_embedding_precision,
             support_set_targets,
             num_classes,
+            mask=support_set_mask,
+        )
+        class_mask = get_class_mask(
+            support_set_targets, num_classes, mask=support_set_mask
         )
 
         (
@@ -281,19 +309,29 @@ class PartialObservationExpertsModelling(PrototypicalNetworkEpisodicTuningScheme
             proto_precision,
         )
 
-        computed_task_metrics_dict[f"{phase_name}/loss"] = F.cross_entropy(
-            log_proto_query_product_normalisation, query_set_targets
+        computed_task_metrics_dict[f"{phase_name}/loss"] = masked_cross_entropy(
+            log_proto_query_product_normalisation,
+            query_set_targets,
+            mask=query_set_mask,
+            class_mask=class_mask,
         )
 
         opt_loss_list = [computed_task_metrics_dict[f"{phase_name}/loss"]]
 
+        if class_mask is not None:
+            log_proto_query_product_normalisation = (
+                log_proto_query_product_normalisation.masked_fill(
+                    ~class_mask.unsqueeze(-1), float("-inf")
+                )
+            )
+
         _, predictions = log_proto_query_product_normalisation.max(1)
 
         output_dict["predictions"] = predictions
 
         with torch.no_grad():
-            computed_task_metrics_dict[f"{phase_name}/accuracy"] = torch.mean(
-                predictions.eq(query_set_targets).float()
+            computed_task_metrics_dict[f"{phase_name}/accuracy"] = masked_accuracy(
+                predictions, query_set_targets, mask=query_set_mask
             )
             computed_task_metrics_dict[f"{phase_name}/support_precisions"] = torch.mean(
                 support_set_embedding_precision.detach().cpu()
@@ -310,7 +348,11 @@ class PartialObservationExpertsModelling(PrototypicalNetworkEpisodicTuningScheme
             computed_task_metrics_dict[
                 f"{phase_name}/prototypical_loss"
             ] = prototypical_loss(
-                proto_mean, query_set_embedding_mean, query_set_targets
+                proto_mean,
+                query_set_embedding_mean,
+                query_set_targets,
+                mask=query_set_mask,
+                class_mask=class_mask,
             )
 
         return (
@@ -8,7 +8,14 @@ import gate.base.utils.loggers as loggers
 from gate.configs.datamodule.base import ShapeConfig
 from gate.configs.task.image_classification import TaskConfig
 from gate.learners.base import LearnerModule
-from gate.learners.utils import get_accuracy, get_prototypes, prototypical_loss
+from gate.learners.utils import (
+    flatten_examples,
+    get_accuracy,
+    get_class_mask,
+    get_prototypes,
+    prototypical_loss,
+    unflatten_examples,
+)
 
 log = loggers.get_logger(__name__)
 
@@ -181,30 +188,50 @@ class PrototypicalNetworkEpisodicTuningScheme(LearnerModule):
         support_set_targets = target_dict["image"]["support_set"]
         query_set_inputs = input_dict["image"]["query_set"]
         query_set_targets = target_dict["image"]["query_set"]
+        # set for meta-batches of padded episodes, see collate_padded_episodes
+        support_set_mask = target_dict["image"].get("support_set_mask")
+        query_set_mask = target_dict["image"].get("query_set_mask")
 
         num_tasks, num_examples = support_set_inputs.shape[:2]
         support_set_embedding = self.forward(
-            {"image": support_set_inputs.view(-1, *support_set_inputs.shape[2:])}
+            {"image": flatten_examples(support_set_inputs, mask=support_set_mask)}
         )["image"]
         support_set_embedding = F.adaptive_avg_pool2d(support_set_embedding, 1)
-        support_set_embedding = support_set_embedding.view(num_tasks, num_examples, -1)
+        support_set_embedding = unflatten_examples(
+            support_set_embedding.flatten(1),
+            num_tasks,
+            num_examples,
+            mask=support_set_mask,
+        )
 
         num_tasks, num_examples = query_set_inputs.shape[:2]
         query_set_embedding = self.forward(
-            {"image": query_set_inputs.view(-1, *query_set_inputs.shape[2:])}
+            {"image": flatten_examples(query_set_inputs, mask=query_set_mask)}
         )["image"]
         query_set_embedding = F.adaptive_avg_pool2d(query_set_embedding, 1)
-        query_set_embedding = query_set_embedding.view(num_tasks, num_examples, -1)
+        query_set_embedding = unflatten_examples(
+            query_set_embedding.flatten(1), num_tasks, num_examples, mask=query_set_mask
+        )
+
+        num_classes = int(torch.max(support_set_targets)) + 1
+        class_mask = get_class_mask(
+            support_set_targets, num_classes, mask=support_set_mask
+        )
 
         prototypes = get_prototypes(
             embeddings=support_set_embedding,
             targets=support_set_targets,
-            num_classes=int(torch.max(support_set_targets)) + 1,
+            num_classes=num_classes,
+            mask=support_set_mask,
         )
 
         computed_task_metrics_dict = {
             f"{phase_name}/loss": prototypical_loss(
-                prototypes, query_set_embedding, query_set_targets
+                prototypes,
+                query_set_embedding,
+                query_set_targets,
+                mask=query_set_mask,
+                class_mask=class_mask,
             )
         }
 
@@ -212,7 +239,11 @@ class PrototypicalNetworkEpisodicTuningScheme(LearnerModule):
 
         with torch.no_grad():
             computed_task_metrics_dict[f"{phase_name}/accuracy"] = get_accuracy(
-                prototypes, query_set_embedding, query_set_targets
+                prototypes,
+                query_set_embedding,
+                query_set_targets,
+                mask=query_set_mask,
+                class_mask=class_mask,
             )
 
         return (
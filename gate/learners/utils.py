@@ -33,11 +33,15 @@ def learning_scheduler_smart_autofill(
     return lr_scheduler_config
 
 
-def get_num_samples(targets, num_classes, dtype=None):
+def get_num_samples(targets, num_classes, dtype=None, mask=None):
     batch_size = targets.size(0)
     with torch.no_grad():
         # log.info(f"Batch size is {batch_size}")
-        ones = torch.ones_like(targets, dtype=dtype)
+        ones = (
+            torch.ones_like(targets, dtype=dtype)
+            if mask is None
+            else mask.to(dtype=dtype or targets.dtype)
+        )
         # log.info(f"Ones tensor is {ones.shape}")
         num_samples = ones.new_zeros((batch_size, num_classes))
         # log.info(f"Num samples tensor is {num_samples.shape}")
@@ -45,7 +49,98 @@ def get_num_samples(targets, num_classes, dtype=None):
     return num_samples
 
 
-def get_prototypes(embeddings, targets, num_classes):
+def flatten_examples(inputs, mask=None):
+    """Flatten a meta-batch of examples of shape `(batch_size, num_examples,
+    ...)` into a batch of shape `(num_kept_examples, ...)`, leaving out the
+    examples where `mask` (of shape `(batch_size, num_examples)`) is False,
+    i.e. the padding of a meta-batch of padded episodes, so that the
+    backbone neither spends time on nor normalises over padding.
+    """
+    if mask is None:
+        return inputs.reshape(-1, *inputs.shape[2:])
+
+    return inputs[mask]
+
+
+def unflatten_examples(values, batch_size, num_examples, mask=None, fill_value=0):
+    """Undo `flatten_examples` on the per-example `values` (e.g. embeddings)
+    computed from its output, filling the examples where `mask` is False with
+    `fill_value`.
+    """
+    if mask is None:
+        return values.view(batch_size, num_examples, *values.shape[1:])
+
+    unflattened = values.new_full(
+        (batch_size, num_examples) + values.shape[1:], fill_value
+    )
+    unflattened[mask] = values
+
+    return unflattened
+
+
+def get_class_mask(targets, num_classes, mask=None):
+    """Find the classes of each task that have at least one (unmasked)
+    support point, e.g. in a meta-batch of tasks of different ways.
+
+    Classes are only left out of meta-batches of padded tasks: without a
+    `mask`, every class below `num_classes` is kept, since a class whose
+    only samples went to the query set is still a target of those queries.
+
+    Parameters
+    ----------
+    targets : `torch.LongTensor` instance
+        A tensor containing the targets of the support points. This tensor has
+        shape `(batch_size, num_examples)`.
+
+    num_classes : int
+        Number of classes in the task.
+
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the support points that are not padding. This tensor
+        has shape `(batch_size, num_examples)`.
+
+    Returns
+    -------
+    class_mask : `torch.BoolTensor` instance or None
+        A tensor marking the classes of each task. This tensor has shape
+        `(batch_size, num_classes)`. None if `mask` is None.
+    """
+    if mask is None:
+        return None
+
+    return get_num_samples(targets, num_classes, mask=mask) > 0
+
+
+def masked_cross_entropy(logits, targets, mask=None, class_mask=None, **kwargs):
+    """Compute the cross entropy of `logits` of shape `(batch_size,
+    num_classes, num_queries)`, leaving out the queries where `mask` (of shape
+    `(batch_size, num_queries)`) is False and the classes where `class_mask`
+    (of shape `(batch_size, num_classes)`) is False.
+    """
+    if class_mask is not None:
+        logits = logits.masked_fill(~class_mask.unsqueeze(-1), float("-inf"))
+
+    if mask is not None:
+        ignore_index = kwargs.setdefault("ignore_index", -100)
+        targets = targets.masked_fill(~mask, ignore_index)
+
+    return F.cross_entropy(logits, targets, **kwargs)
+
+
+def masked_accuracy(predictions, targets, mask=None):
+    """Compute the mean accuracy of `predictions`, leaving out the queries
+    where `mask` is False.
+    """
+    correct = predictions.eq(targets).float()
+
+    if mask is None:
+        return torch.mean(correct)
+
+    mask = mask.float()
+    return torch.sum(correct * mask) / torch.clamp(torch.sum(mask), min=1)
+
+
+def get_prototypes(embeddings, targets, num_classes, mask=None):
     """Compute the prototypes (the mean vector of the embedded training/support
     points belonging to its class) for each classes in the task.
 
@@ -62,6 +157,11 @@ def get_prototypes(embeddings, targets, num_classes):
     num_classes : int
         Number of classes in the task.
 
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the support points that are not padding, which are
+        left out of the prototypes. This tensor has shape
+        `(batch_size, num_examples)`.
+
     Returns
     -------
     prototypes : `torch.FloatTensor` instance
@@ -70,10 +170,15 @@ def get_prototypes(embeddings, targets, num_classes):
     """
     batch_size, embedding_size = embeddings.size(0), embeddings.size(-1)
 
-    num_samples = get_num_samples(targets, num_classes, dtype=embeddings.dtype)
+    num_samples = get_num_samples(
+        targets, num_classes, dtype=embeddings.dtype, mask=mask
+    )
     num_samples.unsqueeze_(-1)
     num_samples = torch.max(num_samples, torch.ones_like(num_samples))
 
+    if mask is not None:
+        embeddings = embeddings * mask.unsqueeze(-1).to(embeddings.dtype)
+
     prototypes = embeddings.new_zeros((batch_size, num_classes, embedding_size))
     indices = targets.unsqueeze(-1).expand_as(embeddings)
     prototypes.scatter_add_(1, indices, embeddings).div_(num_samples)
@@ -81,7 +186,9 @@ def get_prototypes(embeddings, targets, num_classes):
     return prototypes
 
 
-def prototypical_loss(prototypes, embeddings, targets, **kwargs):
+def prototypical_loss(
+    prototypes, embeddings, targets, mask=None, class_mask=None, **kwargs
+):
     """Compute the loss (i.e. negative log-likelihood) for the prototypical
     network, on the test/query points.
 
@@ -99,6 +206,14 @@ def prototypical_loss(prototypes, embeddings, targets, **kwargs):
         A tensor containing the targets of the query points. This tensor has
         shape `(batch_size, num_examples)`.
 
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the query points that are not padding. This tensor
+        has shape `(batch_size, num_examples)`.
+
+    class_mask : `torch.BoolTensor` instance, optional
+        A tensor marking the classes of each task (see `get_class_mask`). This
+        tensor has shape `(batch_size, num_classes)`.
+
     Returns
     -------
     loss : `torch.FloatTensor` instance
@@ -107,10 +222,12 @@ def prototypical_loss(prototypes, embeddings, targets, **kwargs):
     squared_distances = torch.sum(
         (prototypes.unsqueeze(2) - embeddings.unsqueeze(1)) ** 2, dim=-1
     )
-    return F.cross_entropy(-squared_distances, targets, **kwargs)
+    return masked_cross_entropy(
+        -squared_distances, targets, mask=mask, class_mask=class_mask, **kwargs
+    )
 
 
-def get_accuracy(prototypes, embeddings, targets):
+def get_accuracy(prototypes, embeddings, targets, mask=None, class_mask=None):
     """Compute the accuracy of the prototypical network on the test/query points.
     Parameters
     ----------
@@ -123,6 +240,12 @@ def get_accuracy(prototypes, embeddings, targets):
     targets : `torch.LongTensor` instance
         A tensor containing the targets of the query points. This tensor has
         shape `(meta_batch_size, num_examples)`.
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the query points that are not padding. This tensor
+        has shape `(meta_batch_size, num_examples)`.
+    class_mask : `torch.BoolTensor` instance, optional
+        A tensor marking the classes of each task. This tensor has shape
+        `(meta_batch_size, num_classes)`.
     Returns
     -------
     accuracy : `torch.FloatTensor` instance
@@ -131,8 +254,10 @@ def get_accuracy(prototypes, embeddings, targets):
     sq_distances = torch.sum(
         (prototypes.unsqueeze(1) - embeddings.unsqueeze(2)) ** 2, dim=-1
     )
+    if class_mask is not None:
+        sq_distances = sq_distances.masked_fill(~class_mask.unsqueeze(1), float("inf"))
     _, predictions = torch.min(sq_distances, dim=-1)
-    return torch.mean(predictions.eq(targets).float())
+    return masked_accuracy(predictions, targets, mask=mask)
 
 
 def get_cosine_distances(query_embeddings, support_embeddings):
@@ -162,7 +287,7 @@ def get_cosine_distances(query_embeddings, support_embeddings):
     return cosine_distances
 
 
-def matching_logits(cosine_distances, targets, num_classes):
+def matching_logits(cosine_distances, targets, num_classes, mask=None):
     """Compute the matching network logits for each query belonging to each class.
 
     Parameters
@@ -178,6 +303,10 @@ def matching_logits(cosine_distances, targets, num_classes):
     num_classes : int
         Number of classes in the task.
 
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the support points that are not padding, which get
+        no attention. This tensor has shape `(batch_size, num_examples)`.
+
     Returns
     -------
     logits : `torch.FloatTensor` instance
@@ -186,10 +315,17 @@ def matching_logits(cosine_distances, targets, num_classes):
     """
     batch_size, num_queries = cosine_distances.size(0), cosine_distances.size(2)
 
-    num_samples = get_num_samples(targets, num_classes, dtype=cosine_distances.dtype)
+    num_samples = get_num_samples(
+        targets, num_classes, dtype=cosine_distances.dtype, mask=mask
+    )
     num_samples.unsqueeze_(-1)
     num_samples = torch.max(num_samples, torch.ones_like(num_samples))
 
+    if mask is not None:
+        cosine_distances = cosine_distances.masked_fill(
+            ~mask.unsqueeze(2), float("-inf")
+        )
+
     # attentions = cosine_distances
     # For probabilistic attentions as in original paper use softmax:
     attentions = F.softmax(cosine_distances, dim=1)
@@ -201,7 +337,7 @@ def matching_logits(cosine_distances, targets, num_classes):
     return logits
 
 
-def matching_loss(logits, targets):
+def matching_loss(logits, targets, mask=None, class_mask=None):
     """Compute the loss (i.e. negative log-likelihood) for the matching
     network, on the test/query points.
 
@@ -215,18 +351,29 @@ def matching_loss(logits, targets):
         A tensor containing the targets of the query points. This tensor has
         shape `(batch_size, num_queries)`.
 
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the query points that are not padding. This tensor
+        has shape `(batch_size, num_queries)`.
+
+    class_mask : `torch.BoolTensor` instance, optional
+        A tensor marking the classes of each task. This tensor has shape
+        `(batch_size, num_classes)`.
+
     Returns
     -------
     loss : `torch.FloatTensor` instance
         The negative log-likelihood on the query points.
     """
-    (batch_size, num_classes, num_queries) = logits.shape
+    if mask is not None or class_mask is not None:
+        return masked_cross_entropy(logits, targets, mask=mask, class_mask=class_mask)
+
+    batch_size, num_classes, num_queries = logits.shape
     logits = logits.permute(0, 2, 1).view(batch_size * num_queries, num_classes)
     targets = targets.view(-1)
     return F.cross_entropy(logits, targets)
 
 
-def get_matching_accuracy(logits, targets):
+def get_matching_accuracy(logits, targets, mask=None, class_mask=None):
     """Compute the accuracy of the prototypical network on the test/query points.
     Parameters
     ----------
@@ -236,16 +383,24 @@ def get_matching_accuracy(logits, targets):
     targets : `torch.LongTensor` instance
         A tensor containing the targets of the query points. This tensor has
         shape `(meta_batch_size, num_examples)`.
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the query points that are not padding. This tensor
+        has shape `(meta_batch_size, num_examples)`.
+    class_mask : `torch.BoolTensor` instance, optional
+        A tensor marking the classes of each task. This tensor has shape
+        `(meta_batch_size, num_classes)`.
     Returns
     -------
     accuracy : `torch.FloatTensor` instance
         Mean accuracy on the query points.
     """
+    if class_mask is not None:
+        logits = logits.masked_fill(~class_mask.unsqueeze(-1), float("-inf"))
     _, predictions = torch.max(logits, dim=1)
-    return torch.mean(predictions.eq(targets).float())
+    return masked_accuracy(predictions, targets, mask=mask)
 
 
-def inner_gaussian_product(means, precisions, targets, num_classes):
+def inner_gaussian_product(means, precisions, targets, num_classes, mask=None):
     """Compute the product of n Gaussians for each class (where n can vary by class) from their means and precisions.
     Parameters
     ----------
@@ -255,6 +410,10 @@ def inner_gaussian_product(means, precisions, targets, num_classes):
     precisions : `torch.FloatTensor` instance
         A tensor containing the precisions of the Gaussian embeddings. This tensor has shape
         `(batch_size, num_examples, embedding_size)`.
+    mask : `torch.BoolTensor` instance, optional
+        A tensor marking the examples that are not padding, which are left out of the products.
+        Classes without any examples get a unit precision product at 0. This tensor has shape
+        `(batch_size, num_examples)`.
     Returns
     -------
     product_mean : `torch.FloatTensor` instance
@@ -270,7 +429,7 @@ def inner_gaussian_product(means, precisions, targets, num_classes):
     assert means.shape == precisions.shape
     batch_size, num_examples, embedding_size = means.shape
 
-    num_samples = get_num_samples(targets, num_classes, dtype=means.dtype)
+    num_samples = get_num_samples(targets, num_classes, dtype=means.dtype, mask=mask)
     num_samples.unsqueeze_(-1)
     num_samples = torch.max(
         num_samples, torch.ones_like(num_samples)
@@ -278,10 +437,21 @@ def inner_gaussian_product(means, precisions, targets, num_classes):
 
     indices = targets.unsqueeze(-1).expand_as(means)
 
+    if mask is not None:
+        example_mask = mask.unsqueeze(-1)
+        means = means.masked_fill(~example_mask, 0)
+        log_precisions = torch.log(precisions.masked_fill(~example_mask, 1))
+        precisions = precisions.masked_fill(~example_mask, 0)
+    else:
+        log_precisions = torch.log(precisions)
+
     # NOTE: If this approach doesn't work well, try first normalising precisions by number of samples with:
     # precisions.div_(num_samples)
     product_precision = precisions.new_zeros((batch_size, num_classes, embedding_size))
     product_precision.scatter_add_(1, indices, precisions)
+    if mask is not None:
+        # classes missing from a padded task
+        product_precision = product_precision.masked_fill(product_precision == 0, 1)
 
     product_mean = means.new_zeros((batch_size, num_classes, embedding_size))
     product_mean = torch.reciprocal(product_precision) * product_mean.scatter_add_(
@@ -306,7 +476,7 @@ def inner_gaussian_product(means, precisions, targets, num_classes):
         * torch.log(torch.ones_like(num_samples) * (2 * math.pi))
         + 0.5
         * (
-            log_product_normalisation.scatter_add_(1, indices, torch.log(precisions))
+            log_product_normalisation.scatter_add_(1, indices, log_precisions)
             - torch.log(product_precision)
         )
         + product_normalisation_exponent
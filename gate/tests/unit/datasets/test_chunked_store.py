@@ -0,0 +1,124 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.chunked_store import (
+    ChunkCodecs,
+    ChunkedImageStore,
+    get_chunk_ranges,
+    get_subset_group_ids,
+    resolve_chunk_codec,
+)
+from gate.datasets.memmap_store import MemmapImageStore
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+def get_samples(num_samples=12, num_classes=3):
+    rng = np.random.RandomState(0)
+    return [
+        dict(
+            image=rng.randint(0, 255, size=(4 + idx % 2, 4, 3)).astype(np.uint8),
+            label=np.int64(idx % num_classes),
+        )
+        for idx in range(num_samples)
+    ]
+
+
+def test_chunk_ranges_never_span_groups():
+    chunk_ranges = get_chunk_ranges(
+        image_sizes=np.full((7,), 10, dtype=np.int64),
+        group_ids=np.array([0, 0, 0, 1, 1, 2, 2]),
+        chunk_bytes=20,
+    )
+
+    assert [tuple(chunk_range) for chunk_range in chunk_ranges] == [
+        (0, 2),
+        (2, 3),
+        (3, 5),
+        (5, 7),
+    ]
+
+
+def test_subset_group_ids_follow_class_addresses():
+    class_to_address_dict = {"a": [(0, 1), (1, 0)], "b": [(0, 0), (0, 2)]}
+
+    group_ids = get_subset_group_ids(
+        num_samples=4, subset_idx=0, class_to_address_dict=class_to_address_dict
+    )
+
+    assert group_ids.tolist() == [1, 0, 1, -1]
+
+
+@pytest.mark.parametrize("use_memmap_store", [False, True])
+def test_chunked_store_round_trip(tmp_path, use_memmap_store):
+    samples = get_samples()
+    subset = samples
+
+    if use_memmap_store:
+        subset = MemmapImageStore.build(
+            store_dir=tmp_path / "train",
+            samples=iter(samples),
+            image_key="image",
+        )
+
+    store = ChunkedImageStore.build(
+        store_dir=tmp_path / "train_chunked",
+        subset=subset,
+        image_key="image",
+        group_ids=np.array([sample["label"] for sample in samples]),
+        chunk_bytes=100,
+        codec=ChunkCodecs.ZLIB,
+        num_workers=2,
+    )
+
+    assert ChunkedImageStore.exists(tmp_path / "train_chunked")
+    assert len(store) == len(samples)
+    for sample, stored_sample in zip(samples, store):
+        assert np.array_equal(sample["image"], stored_sample["image"])
+        assert sample["label"] == stored_sample["label"]
+
+    # the samples of a class never share a chunk with another class
+    sample_chunks = np.array([store.get_sample_chunks([idx])[0] for idx in range(12)])
+    for chunk_idx in np.unique(sample_chunks):
+        chunk_labels = {
+            int(samples[idx]["label"])
+            for idx in np.where(sample_chunks == chunk_idx)[0]
+        }
+        assert len(chunk_labels) == 1
+
+
+def test_chunked_store_prefetch_only_decompresses_needed_chunks(tmp_path):
+    samples = get_samples()
+    store = ChunkedImageStore.build(
+        store_dir=tmp_path / "train_chunked",
+        subset=samples,
+        image_key="image",
+        group_ids=np.array([sample["label"] for sample in samples]),
+        chunk_bytes=100,
+        codec=ChunkCodecs.ZLIB,
+    )
+
+    class_indices = [0, 3, 6, 9]
+    store.prefetch(class_indices)
+
+    assert set(store.cache.images.keys()) == set(
+        store.get_sample_chunks(class_indices).tolist()
+    )
+    assert store.cache.cache_info().num_images < store.num_chunks
+
+    misses = store.cache.cache_info().misses
+    for idx in class_indices:
+        assert np.array_equal(store[idx]["image"], samples[idx]["image"])
+    assert store.cache.cache_info().misses == misses
+
+    reloaded_store = pickle.loads(pickle.dumps(store))
+    assert reloaded_store.cache.cache_info().num_images == 0
+    assert np.array_equal(reloaded_store[3]["image"], samples[3]["image"])
+
+
+def test_resolve_chunk_codec_falls_back_to_zlib():
+    assert resolve_chunk_codec(ChunkCodecs.ZLIB) == ChunkCodecs.ZLIB
+    assert resolve_chunk_codec(ChunkCodecs.LZ4) in [ChunkCodecs.LZ4, ChunkCodecs.ZLIB]
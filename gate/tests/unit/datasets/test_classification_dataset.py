@@ -0,0 +1,45 @@
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.tf_hub.standard.base import ClassificationDataset
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+def test_classification_dataset_yields_uint8_views():
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 255, size=(10, 32, 32, 3)).astype(np.uint8)
+    labels = rng.randint(0, 10, size=10)
+
+    dataset = ClassificationDataset.from_numpy(
+        images=images,
+        labels=labels,
+        input_shape_dict=dict(channels=3, height=32, width=32),
+        target_shape_dict=dict(num_classes=10),
+    )
+
+    inputs, targets = dataset[3]
+
+    assert len(dataset) == 10
+    assert inputs["image"].dtype == torch.uint8
+    assert inputs["image"].shape == (3, 32, 32)
+    assert np.shares_memory(inputs["image"].numpy(), dataset.images)
+    assert targets["image"].dtype == torch.long
+    assert targets["image"].tolist() == [labels[3]]
+
+    # normalizing a batch of uint8 images matches normalizing each image
+    normalize = transforms.Normalize(mean=[0.5, 0.4, 0.3], std=[0.2, 0.2, 0.1])
+    batch_transform = transforms.Compose(
+        [transforms.ConvertImageDtype(torch.float32), normalize]
+    )
+    sample_transform = transforms.Compose([transforms.ToTensor(), normalize])
+
+    inputs, targets = next(iter(DataLoader(dataset, batch_size=10)))
+    expected = torch.stack([sample_transform(image) for image in images], dim=0)
+
+    assert inputs["image"].dtype == torch.uint8
+    assert torch.equal(batch_transform(inputs["image"]), expected)
+    assert targets["image"].view(-1).tolist() == labels.tolist()
@@ -0,0 +1,342 @@
+import numpy as np
+import pytest
+import torch
+from dotted_dict import DottedDict
+from torchvision import transforms
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.data_utils import (
+    PerClassReservoir,
+    get_class_to_idx_dict,
+    get_object_records,
+    load_class_index,
+    load_object_index,
+    resize_image,
+    save_class_index,
+    save_object_index,
+    select_split_classes,
+)
+from gate.datasets.synthetic_tfds import prepare_synthetic_tfds_dataset
+from gate.datasets.tf_hub.few_shot.base import FewShotClassificationDatasetTFDS
+from gate.datasets.transforms import ResizeToTensor
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+@pytest.mark.parametrize("split_name", ["train", "val", "test"])
+def test_select_split_classes_matches_class_index_ranges(split_name):
+    class_names = [f"class_{idx:03d}" for idx in range(100)]
+    split_percentage = dict(train=60, val=20, test=20)
+
+    split_class_names = select_split_classes(
+        class_names=class_names,
+        split_name=split_name,
+        split_percentage=split_percentage,
+    )
+
+    expected_idx = dict(
+        train=range(0, 60),
+        val=range(61, 80),
+        test=range(81, 100),
+    )[split_name]
+
+    assert split_class_names == [class_names[idx] for idx in expected_idx]
+
+
+def test_select_split_classes_uses_split_config():
+    split_config = dict(train=["b", "a"], val=["c"], test=["d"])
+
+    assert select_split_classes(
+        class_names=["a", "b", "c", "d"],
+        split_name="train",
+        split_config=split_config,
+    ) == ["b", "a"]
+
+
+def test_get_class_to_idx_dict_from_label_arrays():
+    labels = [np.array([b"B", b"a", b"b"]), np.array([b"A"])]
+
+    class_to_idx_dict = get_class_to_idx_dict(
+        labels,
+        class_name_key="label",
+        label_extractor_fn=lambda x: x.decode("utf-8").lower(),
+    )
+
+    assert class_to_idx_dict == {"a": [(0, 1), (1, 0)], "b": [(0, 0), (0, 2)]}
+
+
+def test_class_index_round_trip_and_invalidation(tmp_path):
+    class_to_idx_dict = {"a": [(0, 1), (1, 0)], "b": [(0, 0), (0, 2)], "c": []}
+    manifest = dict(tfds_version="3.0.0", subset_split_name_list=["train", "test"])
+
+    saved = save_class_index(
+        index_dir=tmp_path / "index",
+        class_to_records_dict=class_to_idx_dict,
+        manifest=manifest,
+    )
+    loaded = load_class_index(index_dir=tmp_path / "index", manifest=manifest)
+
+    for class_to_records_dict in [saved, loaded]:
+        assert list(class_to_records_dict.keys()) == ["a", "b", "c"]
+        for class_name, addresses in class_to_idx_dict.items():
+            assert class_to_records_dict[class_name].dtype == np.int32
+            assert class_to_records_dict[class_name].tolist() == [
+                list(address) for address in addresses
+            ]
+
+    assert (
+        load_class_index(
+            index_dir=tmp_path / "index",
+            manifest=dict(manifest, tfds_version="3.1.0"),
+        )
+        is None
+    )
+    assert load_class_index(index_dir=tmp_path / "missing", manifest=manifest) is None
+
+    new_manifest = dict(manifest, tfds_version="3.1.0")
+    save_class_index(
+        index_dir=tmp_path / "index",
+        class_to_records_dict={"d": [(1, 1)]},
+        manifest=new_manifest,
+    )
+    assert list(
+        load_class_index(index_dir=tmp_path / "index", manifest=new_manifest).keys()
+    ) == ["d"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["index"]
+
+
+@pytest.mark.parametrize("num_channels", [1, 3])
+@pytest.mark.parametrize("interpolation", ["bilinear", "bicubic"])
+def test_resized_images_match_resize_transform(num_channels, interpolation):
+    image = np.random.RandomState(0).randint(0, 255, size=(37, 23, num_channels))
+    image = image.astype(np.uint8)
+    resize_transform = transforms.Compose(
+        [
+            transforms.ToPILImage(),
+            transforms.Resize(
+                size=(28, 28),
+                interpolation=transforms.InterpolationMode(interpolation),
+            ),
+            transforms.ToTensor(),
+        ]
+    )
+    expected = resize_transform(image)
+
+    resized_image = resize_image(image, size=(28, 28), interpolation=interpolation)
+
+    assert resized_image.shape == (28, 28, num_channels)
+    assert torch.equal(ResizeToTensor((28, 28), interpolation)(image), expected)
+    assert torch.equal(ResizeToTensor((28, 28), interpolation)(resized_image), expected)
+
+
+def test_resize_to_tensor_skips_pil_for_cached_episode_images(tmp_path, monkeypatch):
+    prepare_synthetic_tfds_dataset(
+        tmp_path,
+        "fake_dataset",
+        num_classes=8,
+        split_num_samples_per_class=dict(train=6),
+        image_shape=(37, 23, 3),
+    )
+
+    def get_dataset(input_transform):
+        return FewShotClassificationDatasetTFDS(
+            dataset_name="fake_dataset",
+            dataset_root=tmp_path,
+            split_name="train",
+            download=False,
+            num_episodes=4,
+            min_num_classes_per_set=2,
+            min_num_samples_per_class=1,
+            min_num_queries_per_class=1,
+            num_classes_per_set=3,
+            num_samples_per_class=2,
+            num_queries_per_class=2,
+            variable_num_samples_per_class=False,
+            variable_num_queries_per_class=False,
+            variable_num_classes_per_set=False,
+            modality_config=DottedDict(image=True),
+            input_shape_dict=DottedDict(image=dict(channels=3, height=28, width=28)),
+            input_target_annotation_keys=dict(
+                inputs="image", targets="label", target_annotations="label"
+            ),
+            subset_split_name_list=["train"],
+            split_percentage=dict(train=100, val=50, test=50),
+            support_set_input_transform=input_transform,
+            query_set_input_transform=input_transform,
+            rescan_cache=False,
+            storage_mode="memmap",
+            tfds_reader="synthetic",
+            image_cache_size=[28, 28],
+        )
+
+    resize_transform = transforms.Compose(
+        [
+            transforms.ToPILImage(),
+            transforms.Resize(size=(28, 28)),
+            transforms.ToTensor(),
+        ]
+    )
+    dataset = get_dataset(resize_transform)
+    expected_episodes = [dataset[index] for index in range(len(dataset))]
+
+    def to_pil_image(*args, **kwargs):
+        raise AssertionError("cached images should not go through PIL")
+
+    monkeypatch.setattr(transforms.functional, "to_pil_image", to_pil_image)
+    dataset = get_dataset(ResizeToTensor((28, 28)))
+    episodes = [dataset[index] for index in range(len(dataset))]
+
+    for (inputs, _), (expected_inputs, _) in zip(episodes, expected_episodes):
+        for set_name in ["support_set", "query_set"]:
+            assert inputs["image"][set_name].shape[-2:] == (28, 28)
+            assert torch.equal(
+                inputs["image"][set_name], expected_inputs["image"][set_name]
+            )
+
+
+@pytest.mark.parametrize("share_subsets", [True, False])
+def test_split_aware_stores_follow_split_definition(tmp_path, share_subsets):
+    prepare_synthetic_tfds_dataset(
+        tmp_path,
+        "fake_dataset",
+        num_classes=8,
+        split_num_samples_per_class=dict(train=3),
+        image_shape=(8, 8, 3),
+    )
+
+    def get_dataset(num_train_classes):
+        return FewShotClassificationDatasetTFDS(
+            dataset_name="fake_dataset",
+            dataset_root=tmp_path,
+            split_name="train",
+            download=False,
+            num_episodes=2,
+            min_num_classes_per_set=2,
+            min_num_samples_per_class=1,
+            min_num_queries_per_class=1,
+            num_classes_per_set=2,
+            num_samples_per_class=1,
+            num_queries_per_class=1,
+            variable_num_samples_per_class=False,
+            variable_num_queries_per_class=False,
+            variable_num_classes_per_set=False,
+            modality_config=DottedDict(image=True),
+            input_shape_dict=DottedDict(image=dict(channels=3, height=8, width=8)),
+            input_target_annotation_keys=dict(
+                inputs="image", targets="label", target_annotations="label"
+            ),
+            subset_split_name_list=["train"],
+            split_percentage=dict(train=num_train_classes, val=1, test=1),
+            split_aware_ingest=True,
+            share_subsets=share_subsets,
+            rescan_cache=False,
+            storage_mode="memmap",
+            tfds_reader="synthetic",
+        )
+
+    # the store and index of the first split must not be reused for the others
+    datasets = [get_dataset(3), get_dataset(6), get_dataset(3)]
+
+    for dataset, num_train_classes in zip(datasets, [3, 6, 3]):
+        subset = dataset.subsets[0]
+        assert list(dataset.class_to_address_dict) == list(range(num_train_classes))
+        assert len(subset) == 3 * num_train_classes
+        assert {subset[idx]["label"].item() for idx in range(len(subset))} == set(
+            range(num_train_classes)
+        )
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 1000])
+def test_per_class_reservoir_keeps_capped_uniform_samples(batch_size):
+    labels = np.random.RandomState(0).randint(0, 5, size=600)
+    labels[labels == 4] = 3  # class 4 is never seen
+    labels[:2] = 4
+
+    reservoir = PerClassReservoir(capacity=20, seed=1)
+    for start in range(0, len(labels), batch_size):
+        batch_labels = labels[start : start + batch_size]
+        reservoir.add(batch_labels, get_item_fn=lambda idx: start + idx)
+    class_items = reservoir.get_class_items()
+
+    # offering the stream one sample at a time keeps the same samples
+    sequential_reservoir = PerClassReservoir(capacity=20, seed=1)
+    for idx, label in enumerate(labels):
+        sequential_reservoir.add([label], get_item_fn=lambda _: idx)
+
+    assert class_items == sequential_reservoir.get_class_items()
+    assert sorted(class_items.keys()) == [0, 1, 2, 3, 4]
+    assert class_items[4] == [0, 1]
+    for label, items in class_items.items():
+        assert len(items) == min(20, int(np.sum(labels == label)))
+        assert items == sorted(items)
+        assert all(labels[item] == label for item in items)
+
+    other_seed_reservoir = PerClassReservoir(capacity=20, seed=2)
+    other_seed_reservoir.add(labels, get_item_fn=lambda idx: idx)
+    assert other_seed_reservoir.get_class_items() != class_items
+
+    with pytest.raises(ValueError):
+        reservoir.add(np.array([0.5]), get_item_fn=lambda idx: idx)
+
+
+def test_object_records_index_boxes_in_pixels(tmp_path):
+    rng = np.random.RandomState(0)
+    subsets = [
+        [
+            dict(
+                image=np.zeros((rng.randint(20, 40), rng.randint(20, 40), 3), np.uint8),
+                objects=dict(
+                    label=rng.randint(0, 4, size=num_objects),
+                    bbox=np.sort(rng.rand(num_objects, 2, 2), axis=1)
+                    .reshape(num_objects, 4)
+                    .astype(np.float32),
+                ),
+            )
+            for num_objects in rng.randint(0, 4, size=10)
+        ]
+        for _ in range(2)
+    ]
+    # an object with an empty box is left out
+    subsets[0][0]["objects"] = dict(
+        label=np.array([1, 2]),
+        bbox=np.array([[0.1, 0.1, 0.5, 0.5], [0.5, 0.1, 0.5, 0.9]], np.float32),
+    )
+
+    objects, class_to_rows = get_object_records(subsets, label_extractor_fn=str)
+
+    expected = {}
+    for subset_idx, subset in enumerate(subsets):
+        for sample_idx, sample in enumerate(subset):
+            height, width = sample["image"].shape[:2]
+            for label, bbox in zip(*sample["objects"].values()):
+                box = [
+                    int(bbox[0] * height),
+                    int(bbox[1] * width),
+                    int(bbox[2] * height),
+                    int(bbox[3] * width),
+                ]
+                if box[2] > box[0] and box[3] > box[1]:
+                    expected.setdefault(str(label), []).append(
+                        (subset_idx, sample_idx, int(label), box)
+                    )
+
+    assert list(class_to_rows.keys()) == sorted(expected.keys())
+    for class_name, rows in class_to_rows.items():
+        assert [
+            (
+                int(objects["subset_idx"][row]),
+                int(objects["sample_idx"][row]),
+                int(objects["label"][row]),
+                objects["bbox"][row].tolist(),
+            )
+            for row in rows
+        ] == expected[class_name]
+
+    manifest = dict(dataset_name="fake_objects")
+    save_object_index(tmp_path, objects, class_to_rows, manifest=manifest)
+    loaded_objects, loaded_class_to_rows = load_object_index(tmp_path, manifest)
+
+    assert np.array_equal(loaded_objects, objects)
+    assert list(loaded_class_to_rows.keys()) == list(class_to_rows.keys())
+    for class_name, rows in class_to_rows.items():
+        assert np.array_equal(loaded_class_to_rows[class_name], rows)
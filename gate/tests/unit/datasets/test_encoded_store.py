@@ -0,0 +1,77 @@
+import io
+import pickle
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.data_utils import get_class_to_idx_dict
+from gate.datasets.encoded_store import DecodedImageCache, EncodedImageSubset
+from gate.datasets.memmap_store import MemmapImageStore
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_decoded_image_cache_evicts_least_recently_used_images():
+    cache = DecodedImageCache(max_bytes=2 * 48)
+    images = {key: np.full((4, 4, 3), key, dtype=np.uint8) for key in range(3)}
+
+    cache.get(0, lambda: images[0])
+    cache.get(1, lambda: images[1])
+    cache.get(0, lambda: images[0])
+    cache.get(2, lambda: images[2])
+
+    assert list(cache.images.keys()) == [0, 2]
+    assert cache.cache_info().hits == 1
+    assert cache.cache_info().misses == 3
+    assert cache.cache_info().num_bytes == 2 * 48
+
+    reloaded_cache = pickle.loads(pickle.dumps(cache))
+    assert reloaded_cache.cache_info().num_images == 0
+    assert reloaded_cache.max_bytes == cache.max_bytes
+
+
+@pytest.mark.parametrize("use_store", [False, True])
+def test_encoded_subset_decodes_images(tmp_path, use_store):
+    rng = np.random.RandomState(0)
+    images = [
+        rng.randint(0, 255, size=(5 + idx % 2, 4, 3)).astype(np.uint8)
+        for idx in range(6)
+    ]
+    samples = [
+        dict(image=encode_png(image), label=np.int64(idx % 3))
+        for idx, image in enumerate(images)
+    ]
+
+    if use_store:
+        subset = MemmapImageStore.build(
+            store_dir=tmp_path / "train",
+            samples=(
+                {**sample, "image": np.frombuffer(sample["image"], dtype=np.uint8)}
+                for sample in samples
+            ),
+            image_key="image",
+        )
+    else:
+        subset = samples
+
+    encoded_subset = EncodedImageSubset(subset, image_key="image", channels=3)
+
+    for idx, image in enumerate(images):
+        assert np.array_equal(encoded_subset[idx]["image"], image)
+        assert encoded_subset[idx]["label"] == idx % 3
+
+    assert encoded_subset.cache_info().misses == len(images)
+    assert encoded_subset.cache_info().hits == len(images)
+    assert get_class_to_idx_dict([encoded_subset], class_name_key="label") == {
+        0: [(0, 0), (0, 3)],
+        1: [(0, 1), (0, 4)],
+        2: [(0, 2), (0, 5)],
+    }
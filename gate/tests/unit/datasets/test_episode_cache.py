@@ -0,0 +1,109 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+from dotted_dict import DottedDict
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.episode_cache import EpisodeCache
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+def get_episodes(num_episodes=5, num_samples=6):
+    episodes = []
+    for idx in range(num_episodes):
+        rng = np.random.RandomState(idx)
+        episodes.append(
+            (
+                DottedDict(
+                    image=dict(
+                        support_set=torch.from_numpy(
+                            rng.rand(num_samples, 3, 4, 4).astype(np.float32)
+                        ),
+                        query_set=torch.from_numpy(
+                            rng.rand(num_samples, 3, 4, 4).astype(np.float32)
+                        ),
+                    )
+                ),
+                DottedDict(
+                    image=dict(
+                        support_set=torch.arange(num_samples),
+                        query_set=torch.arange(num_samples),
+                    ),
+                    num_classes=idx + 1,
+                    record_ids=rng.randint(0, 100, size=(num_samples, 2)),
+                ),
+            )
+        )
+    return episodes
+
+
+def assert_episodes_equal(episode, cached_episode):
+    assert isinstance(cached_episode[0], DottedDict)
+    for key in ["support_set", "query_set"]:
+        assert torch.equal(episode[0].image[key], cached_episode[0].image[key])
+        assert torch.equal(episode[1].image[key], cached_episode[1].image[key])
+    assert cached_episode[1].num_classes == episode[1].num_classes
+    assert isinstance(cached_episode[1].record_ids, np.ndarray)
+    assert np.array_equal(cached_episode[1].record_ids, episode[1].record_ids)
+
+
+def test_episode_cache_round_trip(tmp_path):
+    episodes = get_episodes()
+    cache = EpisodeCache.build(tmp_path / "val", episodes=iter(episodes))
+
+    assert EpisodeCache.exists(tmp_path / "val")
+    assert len(cache) == len(episodes)
+    for episode, cached_episode in zip(episodes, cache):
+        assert_episodes_equal(episode, cached_episode)
+
+    reloaded_cache = pickle.loads(pickle.dumps(cache))
+    assert reloaded_cache._data is None
+    assert_episodes_equal(episodes[-1], reloaded_cache[-1])
+
+
+def test_episode_cache_stacks_meta_batches(tmp_path):
+    episodes = get_episodes()
+    cache = EpisodeCache.build(tmp_path / "val", episodes=iter(episodes))
+
+    inputs, targets = cache[[3, 1]]
+
+    assert inputs.image.support_set.shape == (2, 6, 3, 4, 4)
+    assert torch.equal(inputs.image.support_set[0], episodes[3][0].image.support_set)
+    assert targets.num_classes.tolist() == [4, 2]
+    assert targets.record_ids.shape == (2, 6, 2)
+
+
+def test_episode_cache_is_rebuilt_when_its_metadata_changes(tmp_path):
+    episodes = get_episodes()
+    calls = []
+
+    def get_episodes_fn():
+        calls.append(1)
+        return iter(episodes)
+
+    for metadata in [dict(split_name="val"), dict(split_name="val")]:
+        EpisodeCache.load_or_build(
+            tmp_path / "val", get_episodes_fn=get_episodes_fn, metadata=metadata
+        )
+    assert len(calls) == 1
+
+    cache = EpisodeCache.load_or_build(
+        tmp_path / "val",
+        get_episodes_fn=get_episodes_fn,
+        metadata=dict(split_name="val", num_episodes=5),
+    )
+    assert len(calls) == 2
+    assert cache.manifest["metadata"]["num_episodes"] == 5
+
+
+def test_episode_cache_rejects_unsupported_leaves(tmp_path):
+    with pytest.raises(ValueError):
+        EpisodeCache.build(
+            tmp_path / "val", episodes=iter([(DottedDict(name="episode"),)])
+        )
+
+    assert not EpisodeCache.exists(tmp_path / "val")
+    assert list(tmp_path.iterdir()) == []
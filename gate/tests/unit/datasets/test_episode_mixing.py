@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader, Dataset
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.episode_mixing import MultiSourceEpisodeDataset
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+class FakeEpisodeSampler:
+    def __init__(self, name):
+        self.name = name
+
+    def sample(self, index):
+        return self.name, index
+
+
+class FakeEpisodicDataset(Dataset):
+    def __init__(self, name, num_episodes):
+        self.name = name
+        self.num_episodes = num_episodes
+        self.episode_sampler = FakeEpisodeSampler(name)
+
+    def __len__(self):
+        return self.num_episodes
+
+    def __getitem__(self, index):
+        return dict(source=self.name, index=index)
+
+
+def get_multi_source_dataset(num_episodes=300, **kwargs):
+    return MultiSourceEpisodeDataset(
+        datasets=dict(
+            omniglot=FakeEpisodicDataset("omniglot", num_episodes),
+            cub200=FakeEpisodicDataset("cub200", num_episodes),
+            aircraft=FakeEpisodicDataset("aircraft", 10),
+        ),
+        num_episodes=num_episodes,
+        **kwargs,
+    )
+
+
+def test_multi_source_dataset_mixes_sources_by_weight():
+    dataset = get_multi_source_dataset(
+        source_weights=dict(omniglot=3.0, cub200=1.0, aircraft=0.0)
+    )
+    episodes = [dataset[index] for index in range(len(dataset))]
+
+    source_counts = dataset.get_source_episode_counts()
+    assert source_counts["aircraft"] == 0
+    assert sum(source_counts.values()) == len(dataset)
+    assert 0.65 < source_counts["omniglot"] / len(dataset) < 0.85
+
+    # every source gives its episodes in order, each once
+    for source_name in ["omniglot", "cub200"]:
+        indices = [e["index"] for e in episodes if e["source"] == source_name]
+        assert indices == list(range(source_counts[source_name]))
+
+    # the episode sampler tells the episode of an index ahead of loading it
+    for index, episode in enumerate(episodes):
+        assert dataset.episode_sampler.sample(index) == (
+            episode["source"],
+            episode["index"],
+        )
+
+    same_dataset = get_multi_source_dataset(
+        source_weights=dict(omniglot=3.0, cub200=1.0, aircraft=0.0)
+    )
+    assert np.array_equal(dataset.source_ids, same_dataset.source_ids)
+
+    dataset.reset_source_episode_counts()
+    assert sum(dataset.get_source_episode_counts().values()) == 0
+
+
+def test_multi_source_dataset_wraps_around_small_sources():
+    dataset = get_multi_source_dataset()
+    aircraft_indices = [
+        dataset[index]["index"]
+        for index in range(len(dataset))
+        if dataset.source_names[dataset.source_ids[index]] == "aircraft"
+    ]
+
+    assert len(aircraft_indices) > 10
+    assert max(aircraft_indices) < 10
+
+
+def test_multi_source_dataset_counts_episodes_of_all_workers():
+    dataset = get_multi_source_dataset(num_workers=2)
+
+    for _ in range(2):
+        for _ in DataLoader(dataset, batch_size=8, num_workers=2):
+            pass
+
+    source_counts = dataset.get_source_episode_counts()
+    assert sum(source_counts.values()) == 2 * len(dataset)
+    assert dataset.episode_counts[0].sum() == 0
+    assert (dataset.episode_counts[1:].sum(dim=1) > 0).all()
+
+
+@pytest.mark.parametrize(
+    "source_weights", [dict(quickdraw=1.0), dict(omniglot=-1.0), dict(cub200=0.0)]
+)
+def test_multi_source_dataset_rejects_invalid_weights(source_weights):
+    with pytest.raises(ValueError):
+        get_multi_source_dataset(source_weights=source_weights)
@@ -0,0 +1,555 @@
+import inspect
+
+import numpy as np
+import pytest
+import torch
+from dotted_dict import DottedDict
+from pytorch_lightning import Trainer
+from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.episode_sampler import (
+    AffinePermutation,
+    ClassAddressIndex,
+    DistributedEpisodeSampler,
+    Episode,
+    EpisodeBudgetBatchSampler,
+    EpisodeIndexBatchSampler,
+    EpisodeManifest,
+    EpisodeSampler,
+    EpisodeShapeBatchSampler,
+    ManifestEpisodeSampler,
+    trainer_replaces_samplers,
+)
+from gate.datasets.tf_hub.few_shot.base import (
+    build_episode_batch,
+    collate_padded_episodes,
+)
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+def get_class_to_address_dict(class_sizes):
+    class_to_address_dict = {}
+    sample_idx = 0
+    for class_idx, class_size in enumerate(class_sizes):
+        class_to_address_dict[f"class_{class_idx}"] = [
+            (class_idx % 2, sample_idx + offset) for offset in range(class_size)
+        ]
+        sample_idx += class_size
+    return class_to_address_dict
+
+
+def test_class_address_index_is_csr():
+    class_to_address_dict = get_class_to_address_dict([3, 1, 2])
+    class_index = ClassAddressIndex.from_class_to_records_dict(class_to_address_dict)
+
+    assert class_index.class_offsets.tolist() == [0, 3, 4, 6]
+    assert class_index.records.dtype == np.int32
+    assert class_index.record_class_ids.tolist() == [0, 0, 0, 1, 2, 2]
+    for class_id, records in enumerate(class_to_address_dict.values()):
+        assert class_index.get_class_records(class_id).tolist() == [
+            list(record) for record in records
+        ]
+
+
+@pytest.mark.parametrize("variable", [False, True])
+def test_episode_sampler_draws_valid_episodes(variable):
+    class_to_address_dict = get_class_to_address_dict([20, 8, 30, 2, 25, 40])
+    class_index = ClassAddressIndex.from_class_to_records_dict(class_to_address_dict)
+    address_to_class_id = {
+        tuple(record): class_id
+        for class_id, record in zip(
+            class_index.record_class_ids.tolist(), class_index.records.tolist()
+        )
+    }
+    sampler = EpisodeSampler(
+        class_index=class_index,
+        num_classes_per_set=4,
+        num_samples_per_class=5,
+        num_queries_per_class=3,
+        min_num_classes_per_set=2,
+        min_num_samples_per_class=1,
+        min_num_queries_per_class=1,
+        variable_num_classes_per_set=variable,
+        variable_num_samples_per_class=variable,
+        variable_num_queries_per_class=variable,
+    )
+
+    for index in range(50):
+        episode = sampler.sample(index)
+
+        assert episode.labels.max() + 1 == len(episode.label_class_ids)
+        assert episode.support_mask.any() and (~episode.support_mask).any()
+
+        # every sample is labelled with the class it was indexed under
+        class_ids = [address_to_class_id[tuple(r)] for r in episode.records.tolist()]
+        assert np.array_equal(episode.label_class_ids[episode.labels], class_ids)
+
+        if not variable:
+            for label in range(len(episode.label_class_ids)):
+                class_size = class_index.class_sizes[episode.label_class_ids[label]]
+                if class_size >= 8:
+                    assert (episode.support_labels == label).sum() % 5 == 0
+
+    first, second = sampler.sample(7), sampler.sample(7)
+    assert np.array_equal(first.records, second.records)
+    assert np.array_equal(first.support_mask, second.support_mask)
+
+
+def test_episode_sampler_draws_samples_without_replacement():
+    class_index = ClassAddressIndex.from_class_to_records_dict(
+        get_class_to_address_dict([30, 2])
+    )
+    sampler = EpisodeSampler(
+        class_index=class_index,
+        num_classes_per_set=1,
+        num_samples_per_class=5,
+        num_queries_per_class=3,
+    )
+
+    for index in range(20):
+        episode = sampler.sample(index)
+
+        assert len(np.unique(episode.records, axis=0)) == len(episode.records)
+
+        if episode.label_class_ids[0] == 0:
+            assert episode.support_mask.tolist() == [True] * 5 + [False] * 3
+        else:
+            # a class with too few samples keeps its last one as a query
+            assert episode.support_mask.tolist() == [True, False]
+
+
+def test_build_episode_batch_writes_support_examples_first():
+    class_to_address_dict = get_class_to_address_dict([10, 12, 9, 11])
+    class_index = ClassAddressIndex.from_class_to_records_dict(class_to_address_dict)
+    sampler = EpisodeSampler(
+        class_index=class_index,
+        num_classes_per_set=3,
+        num_samples_per_class=2,
+        num_queries_per_class=3,
+    )
+    # every image is filled with its sample index, one subset per parity
+    subsets = [
+        [dict(image=np.full((4, 5, 3), idx, dtype=np.uint8)) for idx in range(50)]
+        for _ in range(2)
+    ]
+    episodes = [sampler.sample(index) for index in range(4)]
+
+    images, labels, num_support = build_episode_batch(
+        subsets=subsets, episodes=episodes, input_key="image"
+    )
+
+    assert images.dtype == torch.uint8
+    assert images.shape == (4, 15, 3, 4, 5)
+    assert labels.shape == (4, 15)
+    assert num_support == 6
+    for task, episode in enumerate(episodes):
+        records = np.concatenate([episode.support_records, episode.query_records])
+        assert images[task, :, 0, 0, 0].tolist() == records[:, 1].tolist()
+        assert labels[task, :num_support].tolist() == episode.support_labels.tolist()
+        assert labels[task, num_support:].tolist() == episode.query_labels.tolist()
+
+
+def test_build_episode_batch_needs_episodes_of_one_shape():
+    class_index = ClassAddressIndex.from_class_to_records_dict(
+        get_class_to_address_dict([10, 2])
+    )
+    sampler = EpisodeSampler(
+        class_index=class_index,
+        num_classes_per_set=1,
+        num_samples_per_class=2,
+        num_queries_per_class=3,
+    )
+    subsets = [[dict(image=np.zeros((4, 4, 3), dtype=np.uint8))] * 12] * 2
+    episodes = [sampler.sample(index) for index in range(20)]
+
+    with pytest.raises(ValueError):
+        build_episode_batch(subsets=subsets, episodes=episodes, input_key="image")
+
+
+def test_episode_manifest_round_trip_and_shards(tmp_path):
+    class_index = ClassAddressIndex.from_class_to_records_dict(
+        get_class_to_address_dict([20, 8, 30, 2, 25, 40])
+    )
+    sampler = EpisodeSampler(
+        class_index=class_index,
+        num_classes_per_set=4,
+        num_samples_per_class=5,
+        num_queries_per_class=3,
+        min_num_classes_per_set=2,
+        min_num_samples_per_class=1,
+        variable_num_classes_per_set=True,
+        variable_num_samples_per_class=True,
+    )
+
+    EpisodeManifest.from_sampler(
+        sampler, indices=range(10, 20), metadata=dict(split_name="val")
+    ).save(tmp_path / "val.npz")
+    manifest = EpisodeManifest.load(tmp_path / "val.npz")
+
+    assert len(manifest) == 10
+    assert manifest.metadata == dict(split_name="val")
+    assert manifest.episode_indices.tolist() == list(range(10, 20))
+
+    shards = [manifest.get_shard(shard_idx, 3) for shard_idx in range(3)]
+    assert [len(shard) for shard in shards] == [3, 3, 4]
+
+    replayed_episodes = [shard[idx] for shard in shards for idx in range(len(shard))]
+    for index, episode in zip(range(10, 20), replayed_episodes):
+        sampled_episode = sampler.sample(index)
+        for key in Episode._fields:
+            assert np.array_equal(getattr(episode, key), getattr(sampled_episode, key))
+
+
+def test_manifest_episode_sampler_maps_classes_by_name():
+    class_to_address_dict = get_class_to_address_dict([20, 8, 30, 25])
+    sampler = EpisodeSampler(
+        class_index=ClassAddressIndex.from_class_to_records_dict(class_to_address_dict),
+        num_classes_per_set=3,
+        num_samples_per_class=2,
+        num_queries_per_class=2,
+    )
+    manifest = EpisodeManifest.from_sampler(sampler, indices=range(5))
+
+    # the replaying dataset indexes its classes in another order
+    reversed_class_index = ClassAddressIndex.from_class_to_records_dict(
+        dict(reversed(list(class_to_address_dict.items())))
+    )
+    replay_sampler = ManifestEpisodeSampler(manifest, reversed_class_index)
+
+    assert len(replay_sampler) == 5
+    for index in range(5):
+        episode = sampler.sample(index)
+        replayed_episode = replay_sampler.sample(index)
+
+        assert np.array_equal(episode.records, replayed_episode.records)
+        assert [
+            reversed_class_index.class_names[class_id]
+            for class_id in replayed_episode.label_class_ids
+        ] == [
+            sampler.class_index.class_names[class_id]
+            for class_id in episode.label_class_ids
+        ]
+
+    with pytest.raises(ValueError):
+        ManifestEpisodeSampler(
+            manifest,
+            ClassAddressIndex.from_class_to_records_dict(
+                get_class_to_address_dict([20, 8])
+            ),
+        )
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_episode_shape_batch_sampler_batches_episodes_of_one_shape(drop_last):
+    sampler = EpisodeSampler(
+        class_index=ClassAddressIndex.from_class_to_records_dict(
+            get_class_to_address_dict([20, 8, 30, 25, 40])
+        ),
+        num_classes_per_set=4,
+        num_samples_per_class=4,
+        num_queries_per_class=2,
+        min_num_classes_per_set=2,
+        min_num_samples_per_class=1,
+        variable_num_classes_per_set=True,
+        variable_num_samples_per_class=True,
+    )
+
+    def get_shape(index):
+        support_mask = sampler.sample(index).support_mask
+        return int(support_mask.sum()), int((~support_mask).sum())
+
+    batch_sampler = EpisodeShapeBatchSampler(
+        RandomSampler(range(200)),
+        episode_sampler=sampler,
+        batch_size=4,
+        drop_last=drop_last,
+    )
+    batches = list(batch_sampler)
+
+    assert len(batches) == len(batch_sampler)
+    if not drop_last:
+        assert sorted(index for batch in batches for index in batch) == list(range(200))
+    for batch in batches:
+        assert len({get_shape(index) for index in batch}) == 1
+        if drop_last:
+            assert len(batch) == 4
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_episode_budget_batch_sampler_packs_episodes_into_the_budget(shuffle):
+    sampler = EpisodeSampler(
+        class_index=ClassAddressIndex.from_class_to_records_dict(
+            get_class_to_address_dict([20, 8, 30, 25, 40])
+        ),
+        num_classes_per_set=5,
+        num_samples_per_class=6,
+        num_queries_per_class=4,
+        min_num_classes_per_set=2,
+        min_num_samples_per_class=1,
+        min_num_queries_per_class=1,
+        variable_num_classes_per_set=True,
+        variable_num_samples_per_class=True,
+        variable_num_queries_per_class=True,
+    )
+
+    batch_sampler = EpisodeBudgetBatchSampler(
+        RandomSampler(range(200)) if shuffle else SequentialSampler(range(200)),
+        episode_sampler=sampler,
+        max_images_per_batch=60,
+        pool_size=64,
+    )
+    num_batches = len(batch_sampler)
+    batches = list(batch_sampler)
+
+    assert len(batches) == len(batch_sampler) == num_batches
+    assert sorted(index for batch in batches for index in batch) == list(range(200))
+    assert any(len(batch) > 1 for batch in batches)
+    for batch in batches:
+        episodes = [sampler.sample(index) for index in batch]
+        num_padded_images = len(batch) * (
+            max(episode.num_support for episode in episodes)
+            + max(episode.num_queries for episode in episodes)
+        )
+        assert num_padded_images <= 60 or len(batch) == 1
+
+
+class CountingEpisodeSampler:
+    def __init__(self, episode_sampler):
+        self.episode_sampler = episode_sampler
+        self.num_samples = 0
+
+    def sample(self, index):
+        self.num_samples += 1
+        return self.episode_sampler.sample(index)
+
+
+@pytest.mark.parametrize("batch_sampler_type", ["shape", "budget"])
+def test_episode_batch_samplers_build_the_batches_of_an_epoch_once(
+    batch_sampler_type,
+):
+    episode_sampler = CountingEpisodeSampler(
+        EpisodeSampler(
+            class_index=ClassAddressIndex.from_class_to_records_dict(
+                get_class_to_address_dict([20, 8, 30, 25, 40])
+            ),
+            num_classes_per_set=4,
+            num_samples_per_class=4,
+            num_queries_per_class=2,
+            min_num_classes_per_set=2,
+            min_num_samples_per_class=1,
+            variable_num_classes_per_set=True,
+            variable_num_samples_per_class=True,
+        )
+    )
+    index_sampler = DistributedEpisodeSampler(range(100), num_replicas=1, rank=0)
+
+    if batch_sampler_type == "shape":
+        batch_sampler = EpisodeShapeBatchSampler(
+            index_sampler, episode_sampler=episode_sampler, batch_size=4
+        )
+    else:
+        batch_sampler = EpisodeBudgetBatchSampler(
+            index_sampler,
+            episode_sampler=episode_sampler,
+            max_images_per_batch=60,
+            pool_size=32,
+        )
+
+    num_batches = len(batch_sampler)
+    num_samples = episode_sampler.num_samples
+    batches = list(batch_sampler)
+
+    assert len(batches) == len(batch_sampler) == num_batches
+    assert list(batch_sampler) == batches
+    assert episode_sampler.num_samples == num_samples == 100
+
+    batch_sampler.set_epoch(1)
+    next_batches = list(batch_sampler)
+
+    assert len(next_batches) == len(batch_sampler)
+    assert next_batches != batches
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_distributed_episode_sampler_partitions_episodes(shuffle, drop_last):
+    shards = [
+        DistributedEpisodeSampler(
+            range(103), num_replicas=4, rank=rank, shuffle=shuffle, drop_last=drop_last
+        )
+        for rank in range(4)
+    ]
+    for shard in shards:
+        shard.set_epoch(3)
+    indices = [list(shard) for shard in shards]
+
+    assert [len(shard) for shard in shards] == [len(idx) for idx in indices]
+    all_indices = [index for shard_indices in indices for index in shard_indices]
+    assert len(set(all_indices)) == len(all_indices)
+
+    if drop_last:
+        assert [len(shard_indices) for shard_indices in indices] == [25] * 4
+    else:
+        assert sorted(all_indices) == list(range(103))
+        assert [len(shard_indices) for shard_indices in indices] == [26, 26, 26, 25]
+
+    if shuffle:
+        shards[0].set_epoch(4)
+        assert list(shards[0]) != indices[0]
+
+        batch_sampler = EpisodeShapeBatchSampler(
+            shards[1], episode_sampler=None, batch_size=4
+        )
+        batch_sampler.set_epoch(4)
+        assert shards[1].epoch == 4
+
+
+@pytest.mark.parametrize("size", [1, 2, 12, 97, 1000])
+def test_affine_permutation_is_a_seeded_permutation(size):
+    permutation = AffinePermutation(size, seed=5)
+    indices = [permutation[position] for position in range(size)]
+
+    assert sorted(indices) == list(range(size))
+    assert indices == [AffinePermutation(size, seed=5)[i] for i in range(size)]
+    if size > 2:
+        assert indices != [AffinePermutation(size, seed=6)[i] for i in range(size)]
+
+
+@pytest.mark.parametrize("num_replicas", [1, 3])
+def test_distributed_episode_sampler_resumes_where_it_stopped(num_replicas):
+    def get_sampler(seed=0):
+        sampler = DistributedEpisodeSampler(
+            range(100), num_replicas=num_replicas, rank=num_replicas - 1, seed=seed
+        )
+        sampler.set_epoch(2)
+        return sampler
+
+    sampler = get_sampler()
+    indices = list(sampler)
+    sampler.advance(7)
+
+    resumed_sampler = get_sampler()
+    resumed_sampler.load_state_dict(sampler.state_dict())
+    resumed_sampler.set_epoch(2)
+    assert list(resumed_sampler) == indices[7:]
+
+    # the state only holds within its epoch
+    resumed_sampler.load_state_dict(sampler.state_dict())
+    resumed_sampler.set_epoch(3)
+    assert len(list(resumed_sampler)) == len(indices)
+
+    # a finished epoch drawn again starts over
+    sampler.advance(len(indices))
+    assert list(sampler) == indices
+
+    with pytest.raises(ValueError):
+        get_sampler(seed=1).load_state_dict(sampler.state_dict())
+
+
+class IndexListDataset:
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, indices):
+        return list(indices)
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_episode_index_batch_sampler_moves_on_every_epoch(drop_last):
+    index_sampler = DistributedEpisodeSampler(
+        range(10), num_replicas=1, rank=0, drop_last=True
+    )
+    # as for batch_episodes, the dataset is given whole lists of indices
+    loader = DataLoader(
+        IndexListDataset(),
+        sampler=EpisodeIndexBatchSampler(
+            index_sampler, batch_size=3, drop_last=drop_last
+        ),
+        batch_size=None,
+        collate_fn=lambda indices: indices,
+    )
+
+    epoch_batches = []
+    for epoch in range(2):
+        # as Lightning does at the start of every epoch
+        for sampler in [loader.sampler, loader.batch_sampler]:
+            if hasattr(sampler, "set_epoch"):
+                sampler.set_epoch(epoch)
+
+        batches = []
+        for batch in loader:
+            index_sampler.advance(len(batch))
+            batches.append(batch)
+        epoch_batches.append(batches)
+
+    assert index_sampler.epoch == 1
+    for batches in epoch_batches:
+        indices = [index for batch in batches for index in batch]
+        assert len(batches) == (3 if drop_last else 4)
+        assert len(set(indices)) == len(indices) == (9 if drop_last else 10)
+    assert epoch_batches[0] != epoch_batches[1]
+
+
+def get_ddp_trainer(replace_samplers):
+    flag_name = (
+        "use_distributed_sampler"
+        if "use_distributed_sampler" in inspect.signature(Trainer).parameters
+        else "replace_sampler_ddp"
+    )
+
+    return Trainer(
+        accelerator="cpu",
+        devices=2,
+        strategy="ddp",
+        logger=False,
+        enable_checkpointing=False,
+        **{flag_name: replace_samplers},
+    )
+
+
+def test_trainer_replaces_samplers_of_distributed_trainers():
+    assert trainer_replaces_samplers(get_ddp_trainer(replace_samplers=True))
+    assert not trainer_replaces_samplers(get_ddp_trainer(replace_samplers=False))
+    assert not trainer_replaces_samplers(
+        Trainer(accelerator="cpu", devices=1, logger=False)
+    )
+    assert not trainer_replaces_samplers(None)
+
+
+def test_collate_padded_episodes_pads_and_masks_sets():
+    def get_episode(num_support, num_queries):
+        return (
+            DottedDict(
+                image=DottedDict(
+                    support_set=torch.ones(num_support, 3, 2, 2),
+                    query_set=torch.ones(num_queries, 3, 2, 2),
+                    support_set_extras=dict(view=torch.ones(num_support, 4)),
+                )
+            ),
+            DottedDict(
+                image=DottedDict(
+                    support_set=torch.arange(num_support) + 1,
+                    query_set=torch.arange(num_queries) + 1,
+                )
+            ),
+        )
+
+    input_dict, target_dict = collate_padded_episodes(
+        [get_episode(2, 3), get_episode(4, 1)]
+    )
+
+    assert input_dict.image.support_set.shape == (2, 4, 3, 2, 2)
+    assert input_dict.image.query_set.shape == (2, 3, 3, 2, 2)
+    assert input_dict.image.support_set_extras.view.shape == (2, 4, 4)
+    assert target_dict.image.support_set.tolist() == [[1, 2, 0, 0], [1, 2, 3, 4]]
+    assert target_dict.image.support_set_mask.tolist() == [
+        [True, True, False, False],
+        [True, True, True, True],
+    ]
+    assert target_dict.image.query_set_mask.tolist() == [
+        [True, True, True],
+        [True, False, False],
+    ]
+    assert input_dict.image.support_set[0, 2:].abs().sum() == 0
@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+from dotted_dict import DottedDict
+from PIL import Image
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.data_utils import resize_image
+from gate.datasets.learn2learn_hub.few_shot import base
+from gate.datasets.learn2learn_hub.few_shot.base import (
+    FewShotClassificationDatsetL2L,
+    decode_samples,
+)
+from gate.datasets.transforms import ResizeToTensor
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+class InMemoryLearn2LearnDataset:
+    """
+    Stand-in for a learn2learn vision dataset, of random RGB images of
+    varying sizes as PIL images, with labels that sort differently as
+    strings than as integers.
+    """
+
+    num_samples = 24
+    num_classes = 12
+
+    def __init__(
+        self, root, mode, transform=None, target_transform=None, download=False
+    ):
+        rng = np.random.RandomState(dict(train=0, validation=1, test=2)[mode])
+        self.images = [
+            rng.randint(
+                0, 256, size=(rng.randint(8, 16), rng.randint(8, 16), 3), dtype=np.uint8
+            )
+            for _ in range(self.num_samples)
+        ]
+        self.labels = [idx % self.num_classes for idx in range(self.num_samples)]
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, idx):
+        return Image.fromarray(self.images[idx]), self.labels[idx]
+
+
+DATASET_MODULE_PATH = (
+    f"{InMemoryLearn2LearnDataset.__module__}."
+    f"{InMemoryLearn2LearnDataset.__qualname__}"
+)
+
+
+def get_dataset(dataset_root, **kwargs):
+    return FewShotClassificationDatsetL2L(
+        dataset_name="in_memory_dataset",
+        dataset_root=str(dataset_root),
+        split_name="val",
+        download=False,
+        num_episodes=4,
+        min_num_classes_per_set=2,
+        min_num_samples_per_class=1,
+        min_num_queries_per_class=1,
+        num_classes_per_set=3,
+        num_samples_per_class=1,
+        num_queries_per_class=1,
+        variable_num_samples_per_class=False,
+        variable_num_queries_per_class=False,
+        variable_num_classes_per_set=False,
+        modality_config=DottedDict(image=True),
+        input_shape_dict=DottedDict(image=dict(channels=3, height=12, width=12)),
+        input_target_annotation_keys=dict(
+            inputs="image", targets="label", target_annotations="label"
+        ),
+        dataset_module_path=DATASET_MODULE_PATH,
+        support_set_input_transform=ResizeToTensor((12, 12)),
+        query_set_input_transform=ResizeToTensor((12, 12)),
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("image_size", [None, (12, 12)])
+def test_decode_samples_keeps_uint8_pixels(image_size):
+    dataset = InMemoryLearn2LearnDataset(root=None, mode="train")
+
+    samples = list(
+        decode_samples(dataset, image_size=image_size, num_workers=2, chunk_size=5)
+    )
+
+    assert len(samples) == len(dataset)
+    for sample, image, label in zip(samples, dataset.images, dataset.labels):
+        expected_image = (
+            image if image_size is None else resize_image(image, size=image_size)
+        )
+        assert sample["image"].dtype == np.uint8
+        assert sample["label"] == label
+        assert np.array_equal(sample["image"], expected_image)
+
+
+@pytest.mark.parametrize("storage_mode", ["in_memory", "memmap"])
+@pytest.mark.parametrize("image_cache_size", [None, [12, 12]])
+def test_l2l_dataset_reuses_store_and_index_unless_rescanned(
+    tmp_path, monkeypatch, storage_mode, image_cache_size
+):
+    num_decodes = []
+    num_index_builds = []
+
+    def count_calls(fn, calls):
+        def wrapped(*args, **kwargs):
+            calls.append(1)
+            return fn(*args, **kwargs)
+
+        return wrapped
+
+    monkeypatch.setattr(
+        base, "decode_samples", count_calls(base.decode_samples, num_decodes)
+    )
+    monkeypatch.setattr(
+        base,
+        "get_class_to_idx_dict",
+        count_calls(base.get_class_to_idx_dict, num_index_builds),
+    )
+
+    source = InMemoryLearn2LearnDataset(root=None, mode="validation")
+    class_names = sorted(str(label) for label in set(source.labels))
+
+    def check_dataset(dataset):
+        subset = dataset.subsets[0]
+        assert len(subset) == len(source)
+        for idx, image in enumerate(source.images):
+            if image_cache_size is not None:
+                image = resize_image(image, size=image_cache_size)
+            assert subset[idx]["image"].dtype == np.uint8
+            assert np.array_equal(subset[idx]["image"], image)
+
+        assert list(dataset.class_to_address_dict) == class_names
+        for class_name, addresses in dataset.class_to_address_dict.items():
+            assert all(
+                str(source.labels[sample_idx]) == class_name
+                for _, sample_idx in addresses
+            )
+
+        inputs, _ = dataset[0]
+        assert inputs["image"]["support_set"].shape == (3, 3, 12, 12)
+
+    kwargs = dict(storage_mode=storage_mode, image_cache_size=image_cache_size)
+
+    check_dataset(get_dataset(tmp_path, rescan_cache=False, **kwargs))
+    assert (len(num_decodes), len(num_index_builds)) == (1, 1)
+
+    # the store, when there is one, and the index match their manifests
+    check_dataset(get_dataset(tmp_path, rescan_cache=False, **kwargs))
+    assert len(num_decodes) == (1 if storage_mode == "memmap" else 2)
+    assert len(num_index_builds) == 1
+
+    check_dataset(get_dataset(tmp_path, rescan_cache=True, **kwargs))
+    assert len(num_decodes) == (2 if storage_mode == "memmap" else 3)
+    assert len(num_index_builds) == 2
@@ -0,0 +1,100 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.data_utils import get_class_to_idx_dict
+from gate.datasets.memmap_store import ColumnarSubset, MemmapImageStore
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+def get_samples(num_samples, variable_shape):
+    rng = np.random.RandomState(0)
+    samples = []
+    for idx in range(num_samples):
+        height = 8 + idx % 3 if variable_shape else 8
+        samples.append(
+            dict(
+                image=rng.randint(0, 255, size=(height, 6, 3)).astype(np.uint8),
+                label=np.int64(idx % 4),
+                alphabet=f"alphabet_{idx % 2}".encode("utf-8"),
+            )
+        )
+    return samples
+
+
+@pytest.mark.parametrize("variable_shape", [False, True])
+def test_memmap_store_round_trip(tmp_path, variable_shape):
+    samples = get_samples(num_samples=10, variable_shape=variable_shape)
+    store = MemmapImageStore.build(
+        store_dir=tmp_path / "train", samples=iter(samples), image_key="image"
+    )
+
+    assert MemmapImageStore.exists(tmp_path / "train")
+    assert len(store) == len(samples)
+
+    reopened = pickle.loads(pickle.dumps(MemmapImageStore(tmp_path / "train")))
+
+    for idx, sample in enumerate(samples):
+        assert np.array_equal(reopened[idx]["image"], sample["image"])
+        assert reopened[idx]["label"] == sample["label"]
+        assert reopened[idx]["alphabet"] == sample["alphabet"]
+
+    assert get_class_to_idx_dict(
+        [store], class_name_key="label"
+    ) == get_class_to_idx_dict([samples], class_name_key="label")
+
+
+@pytest.mark.parametrize("storage_mode", ["in_memory", "memmap"])
+def test_build_from_batches_matches_samples(tmp_path, storage_mode):
+    samples = get_samples(num_samples=10, variable_shape=False)
+    batches = [
+        {
+            key: np.stack([sample[key] for sample in samples[idx : idx + 4]])
+            for key in samples[0].keys()
+        }
+        for idx in range(0, len(samples), 4)
+    ]
+
+    if storage_mode == "memmap":
+        subset = MemmapImageStore.build_from_batches(
+            store_dir=tmp_path / "train",
+            batches=iter(batches),
+            num_samples=len(samples),
+            image_shape=samples[0]["image"].shape,
+            image_key="image",
+        )
+    else:
+        subset = ColumnarSubset.build_from_batches(
+            batches=iter(batches),
+            num_samples=len(samples),
+            image_shape=samples[0]["image"].shape,
+            image_key="image",
+        )
+
+    assert len(subset) == len(samples)
+
+    for idx, sample in enumerate(samples):
+        assert np.array_equal(subset[idx]["image"], sample["image"])
+        assert subset[idx]["label"] == sample["label"]
+        assert subset[idx]["alphabet"] == sample["alphabet"]
+
+
+def test_rebuilding_a_store_replaces_it(tmp_path):
+    samples = get_samples(num_samples=10, variable_shape=False)
+    old_store = MemmapImageStore.build(
+        store_dir=tmp_path / "train", samples=iter(samples), image_key="image"
+    )
+    old_image = old_store[0]["image"]
+
+    new_samples = samples[::-1][:6]
+    store = MemmapImageStore.build(
+        store_dir=tmp_path / "train", samples=iter(new_samples), image_key="image"
+    )
+
+    assert len(store) == len(new_samples)
+    assert np.array_equal(store[0]["image"], new_samples[0]["image"])
+    assert np.array_equal(old_store[0]["image"], old_image)
+    assert [path.name for path in tmp_path.iterdir()] == ["train"]
@@ -0,0 +1,90 @@
+import functools
+import gc
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.shared_subsets import (
+    acquire_shared_subsets,
+    get_callable_fingerprint,
+    get_shared_subsets_ref_counts,
+    release_shared_subsets,
+)
+from gate.datasets.tf_hub import bytes_to_string
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+class Owner:
+    pass
+
+
+def test_shared_subsets_are_loaded_once_and_released_with_last_owner():
+    num_loads = []
+
+    def load_fn():
+        num_loads.append(1)
+        return [list(range(10))]
+
+    key = ("omniglot", "/tmp", ("train", "test"))
+    train_owner, val_owner = Owner(), Owner()
+
+    train_subsets = acquire_shared_subsets(key=key, owner=train_owner, load_fn=load_fn)
+    val_subsets = acquire_shared_subsets(key=key, owner=val_owner, load_fn=load_fn)
+
+    assert train_subsets is val_subsets
+    assert len(num_loads) == 1
+    assert get_shared_subsets_ref_counts()[key] == 2
+
+    release_shared_subsets(train_owner)
+    release_shared_subsets(train_owner)
+    assert get_shared_subsets_ref_counts()[key] == 1
+
+    del val_owner
+    gc.collect()
+    assert key not in get_shared_subsets_ref_counts()
+
+
+def test_callable_fingerprint_is_stable_across_imports():
+    from gate.datasets.tf_hub import bytes_to_string as imported_again
+
+    assert get_callable_fingerprint(bytes_to_string) == get_callable_fingerprint(
+        imported_again
+    )
+    assert get_callable_fingerprint(lambda x: x) != get_callable_fingerprint(
+        bytes_to_string
+    )
+
+
+def get_key_extractor(key):
+    def extract(example):
+        return example[key]
+
+    return extract
+
+
+def test_callable_fingerprint_changes_with_code_and_arguments():
+    def extract_label(example):
+        return example["label"]
+
+    first_fingerprint = get_callable_fingerprint(extract_label)
+
+    def extract_label(example):
+        return example["label_coarse"]
+
+    assert get_callable_fingerprint(extract_label) != first_fingerprint
+
+    assert get_callable_fingerprint(
+        get_key_extractor("label")
+    ) == get_callable_fingerprint(get_key_extractor("label"))
+    assert get_callable_fingerprint(
+        get_key_extractor("label")
+    ) != get_callable_fingerprint(get_key_extractor("label_coarse"))
+
+    assert get_callable_fingerprint(
+        functools.partial(bytes_to_string, encoding="utf-8")
+    ) == get_callable_fingerprint(functools.partial(bytes_to_string, encoding="utf-8"))
+    assert get_callable_fingerprint(
+        functools.partial(bytes_to_string, encoding="utf-8")
+    ) != get_callable_fingerprint(functools.partial(bytes_to_string, encoding="ascii"))
+    assert get_callable_fingerprint(
+        functools.partial(get_key_extractor, "label")
+    ) != get_callable_fingerprint(functools.partial(bytes_to_string, "label"))
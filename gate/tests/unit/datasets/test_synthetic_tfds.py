@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.data_utils import TFDSReaderOptions
+from gate.datasets.synthetic_tfds import prepare_synthetic_tfds_dataset
+from gate.datasets.tfrecord_reader import decode_image, load_prepared_tfds_dataset
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+@pytest.mark.parametrize("label_encoding", ["int", "bytes"])
+@pytest.mark.parametrize("channels", [1, 3])
+def test_synthetic_dataset_samples_match_across_reads(
+    tmp_path, label_encoding, channels
+):
+    prepare_synthetic_tfds_dataset(
+        tmp_path,
+        "fake_dataset",
+        num_classes=7,
+        split_num_samples_per_class=dict(train=3, test=2),
+        image_shape=(9, 5, channels),
+        label_encoding=label_encoding,
+        label_keys=["label", "super_label"],
+    )
+    dataset = load_prepared_tfds_dataset(
+        "fake_dataset",
+        data_dir=tmp_path,
+        download=False,
+        tfds_reader=TFDSReaderOptions.SYNTHETIC,
+    )
+
+    assert dataset.num_examples("train") == 21
+    assert dataset.num_examples("test[:50%]") == 7
+
+    samples = list(dataset.iterate("train"))
+    encoded_samples = list(
+        dataset.iterate("train", decode_images=False, num_parallel_calls=4)
+    )
+    class_names = dataset.get_class_names("label")
+
+    for idx, (sample, encoded_sample) in enumerate(zip(samples, encoded_samples)):
+        assert sample["image"].shape == (9, 5, channels)
+        assert sample["image"].dtype == np.uint8
+        assert np.array_equal(
+            decode_image(encoded_sample["image"], channels=channels), sample["image"]
+        )
+        assert sample["label"] == sample["super_label"] == encoded_sample["label"]
+
+        if label_encoding == "int":
+            assert sample["label"] == idx % 7
+            assert class_names[sample["label"]] == f"class_{idx % 7}"
+        else:
+            assert sample["label"] == f"class_{idx % 7}".encode("utf-8")
+            assert class_names is None
+
+    assert not np.array_equal(samples[0]["image"], samples[1]["image"])
+
+    batches = list(
+        dataset.iterate_batches(
+            "train[5:]", batch_size=4, feature_keys=["image", "label"]
+        )
+    )
+    assert [len(batch["image"]) for batch in batches] == [4, 4, 4, 4]
+    assert np.array_equal(
+        np.concatenate([batch["image"] for batch in batches]),
+        np.stack([sample["image"] for sample in samples[5:]]),
+    )
+
+    selected = list(dataset.iterate("train", sample_indices=[8, 2]))
+    assert [sample["label"] for sample in selected] == [
+        samples[2]["label"],
+        samples[8]["label"],
+    ]
+
+    # the version changes with the spec, which invalidates derived caches
+    other_dataset = prepare_synthetic_tfds_dataset(
+        tmp_path,
+        "fake_dataset",
+        num_classes=8,
+        split_num_samples_per_class=dict(train=3),
+    )
+    assert other_dataset.version != dataset.version
@@ -0,0 +1,237 @@
+import io
+import json
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from gate.base.utils.loggers import get_logger
+from gate.datasets.tfrecord_reader import (
+    PreparedTFDSDataset,
+    get_interleave_blocks,
+    parse_example,
+)
+
+log = get_logger(__name__, set_default_handler=True)
+
+
+def encode_varint(value):
+    if value < 0:
+        value += 1 << 64
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def encode_field(field_number, payload):
+    return (
+        encode_varint((field_number << 3) | 2) + encode_varint(len(payload)) + payload
+    )
+
+
+def encode_example(features):
+    entries = b""
+    for key, value in features.items():
+        if isinstance(value, list) and all(isinstance(item, bytes) for item in value):
+            feature = encode_field(1, b"".join(encode_field(1, item) for item in value))
+        elif np.asarray(value).dtype.kind == "f":
+            feature = encode_field(
+                2, encode_field(1, np.asarray(value, dtype="<f4").tobytes())
+            )
+        else:
+            feature = encode_field(
+                3,
+                encode_field(1, b"".join(encode_varint(int(item)) for item in value)),
+            )
+        entries += encode_field(
+            1, encode_field(1, key.encode("utf-8")) + encode_field(2, feature)
+        )
+    return encode_field(1, entries)
+
+
+def write_tfrecord_file(path, records):
+    with open(path, "wb") as record_file:
+        for record in records:
+            # checksums are not verified by the reader
+            record_file.write(struct.pack("<QI", len(record), 0))
+            record_file.write(record)
+            record_file.write(struct.pack("<I", 0))
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def build_prepared_dataset(data_dir, shard_lengths):
+    dataset_dir = data_dir / "fake_dataset" / "1.0.0"
+    dataset_dir.mkdir(parents=True)
+    rng = np.random.RandomState(0)
+    samples = []
+
+    for shard_idx, shard_length in enumerate(shard_lengths):
+        records = []
+        for _ in range(shard_length):
+            num_objects = rng.randint(0, 3)
+            sample = dict(
+                idx=len(samples),
+                image=rng.randint(0, 255, size=(6, 5, 3)).astype(np.uint8),
+                label=f"class_{rng.randint(4)}".encode("utf-8"),
+                bbox=rng.rand(num_objects, 4).astype(np.float32),
+            )
+            samples.append(sample)
+            records.append(
+                encode_example(
+                    {
+                        "idx": [sample["idx"]],
+                        "image": [encode_png(sample["image"])],
+                        "label": [sample["label"]],
+                        "objects/bbox": sample["bbox"].reshape(-1),
+                    }
+                )
+            )
+        write_tfrecord_file(
+            dataset_dir
+            / f"fake_dataset-train.tfrecord-{shard_idx:05d}-of-{len(shard_lengths):05d}",
+            records,
+        )
+
+    with open(dataset_dir / "dataset_info.json", "w") as info_file:
+        json.dump(
+            dict(
+                name="fake_dataset",
+                version="1.0.0",
+                fileFormat="tfrecord",
+                splits=[
+                    dict(
+                        name="train",
+                        shardLengths=[str(length) for length in shard_lengths],
+                    )
+                ],
+            ),
+            info_file,
+        )
+
+    with open(dataset_dir / "features.json", "w") as features_file:
+        json.dump(
+            {
+                "pythonClassName": "tensorflow_datasets.core.features.features_dict.FeaturesDict",
+                "featuresDict": {
+                    "features": {
+                        "idx": {
+                            "pythonClassName": "tensorflow_datasets.core.features.tensor_feature.Tensor",
+                            "tensor": {"shape": {}, "dtype": "int64"},
+                        },
+                        "image": {
+                            "pythonClassName": "tensorflow_datasets.core.features.image_feature.Image",
+                            "image": {
+                                "shape": {"dimensions": ["6", "5", "3"]},
+                                "dtype": "uint8",
+                            },
+                        },
+                        "label": {
+                            "pythonClassName": "tensorflow_datasets.core.features.text_feature.Text",
+                            "text": {},
+                        },
+                        "objects": {
+                            "pythonClassName": "tensorflow_datasets.core.features.sequence_feature.Sequence",
+                            "sequence": {
+                                "feature": {
+                                    "pythonClassName": "tensorflow_datasets.core.features.features_dict.FeaturesDict",
+                                    "featuresDict": {
+                                        "features": {
+                                            "bbox": {
+                                                "pythonClassName": "tensorflow_datasets.core.features.bounding_boxes.BBoxFeature",
+                                                "tensor": {
+                                                    "shape": {"dimensions": ["4"]},
+                                                    "dtype": "float32",
+                                                },
+                                            }
+                                        }
+                                    },
+                                },
+                                "length": "-1",
+                            },
+                        },
+                    }
+                },
+            },
+            features_file,
+        )
+
+    return samples
+
+
+def test_interleave_blocks_follow_tf_data_interleave():
+    # two slots of blocks of 2: the second input is opened in the second slot,
+    # and the third input only once the first one has been found exhausted
+    assert get_interleave_blocks([3, 4, 2], cycle_length=2, block_length=2) == [
+        (0, 0, 2),
+        (1, 0, 2),
+        (0, 2, 1),
+        (1, 2, 2),
+        (2, 0, 2),
+    ]
+
+
+def test_parse_example_keeps_requested_keys():
+    record = encode_example({"a": [1, -2], "b": [b"x"], "c": np.array([0.5])})
+
+    features = parse_example(record, keys=["a", "c"])
+
+    assert sorted(features.keys()) == ["a", "c"]
+    assert features["a"].tolist() == [1, -2]
+    assert features["c"].tolist() == [0.5]
+
+
+@pytest.mark.parametrize("split", ["train", "train[10%:70%]", "train[3:-4]"])
+def test_prepared_dataset_matches_tfds_read_order(tmp_path, split):
+    shard_lengths = [40, 7, 19]
+    samples = build_prepared_dataset(tmp_path, shard_lengths)
+    dataset = PreparedTFDSDataset("fake_dataset", data_dir=tmp_path)
+
+    # tfds reads the records of a split from 16 shards at a time, in blocks
+    # of 16 records
+    shard_starts = np.cumsum([0] + shard_lengths)
+    _, start, end = dataset._parse_split(split)
+    lengths, skips = [], []
+    for shard_idx, shard_length in enumerate(shard_lengths):
+        skip = max(start - shard_starts[shard_idx], 0)
+        take = min(end - shard_starts[shard_idx], shard_length) - skip
+        if take > 0:
+            lengths.append(take)
+            skips.append(shard_starts[shard_idx] + skip)
+    expected_order = [
+        skips[input_idx] + offset + idx
+        for input_idx, offset, count in get_interleave_blocks(lengths, 16, 16)
+        for idx in range(count)
+    ]
+
+    loaded = list(dataset.iterate(split))
+
+    assert dataset.num_examples(split) == len(expected_order) == len(loaded)
+    for sample, expected_idx in zip(loaded, expected_order):
+        expected = samples[expected_idx]
+        assert sample["idx"] == expected["idx"]
+        assert np.array_equal(sample["image"], expected["image"])
+        assert sample["label"] == expected["label"]
+        assert sample["objects"]["bbox"].shape == expected["bbox"].shape
+        assert np.array_equal(sample["objects"]["bbox"], expected["bbox"])
+
+    sample_indices = np.arange(0, len(loaded), 3)
+    selected = list(
+        dataset.iterate(split, feature_keys=["idx"], sample_indices=sample_indices)
+    )
+
+    assert [sample["idx"] for sample in selected] == [
+        loaded[idx]["idx"] for idx in sample_indices
+    ]
+    assert list(selected[0].keys()) == ["idx"]
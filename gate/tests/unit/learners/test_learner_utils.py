@@ -0,0 +1,213 @@
+import torch
+import torch.nn.functional as F
+
+from gate.learners.utils import (
+    flatten_examples,
+    get_accuracy,
+    get_class_mask,
+    get_cosine_distances,
+    get_prototypes,
+    inner_gaussian_product,
+    matching_logits,
+    matching_loss,
+    prototypical_loss,
+    unflatten_examples,
+)
+
+
+def get_padded_tasks(num_ways=(3, 2), num_shots=(2, 3), num_queries=(4, 1), dim=5):
+    """
+    Build tasks of different sizes, and the same tasks padded into one
+    meta-batch with masks.
+    """
+    torch.manual_seed(0)
+    tasks = []
+    for num_way, num_shot, num_query in zip(num_ways, num_shots, num_queries):
+        tasks.append(
+            dict(
+                support_embeddings=torch.randn(num_way * num_shot, dim),
+                support_targets=torch.arange(num_way).repeat_interleave(num_shot),
+                query_embeddings=torch.randn(num_way * num_query, dim),
+                query_targets=torch.arange(num_way).repeat_interleave(num_query),
+            )
+        )
+
+    padded = {}
+    for key in tasks[0].keys():
+        size = max(len(task[key]) for task in tasks)
+        padded[key] = torch.stack(
+            [
+                F.pad(
+                    task[key],
+                    [0, 0] * (task[key].dim() - 1) + [0, size - len(task[key])],
+                )
+                for task in tasks
+            ]
+        )
+        padded[f"{key.split('_')[0]}_mask"] = torch.stack(
+            [torch.arange(size) < len(task[key]) for task in tasks]
+        )
+
+    return tasks, padded
+
+
+def test_masked_prototypical_loss_matches_unpadded_tasks():
+    tasks, padded = get_padded_tasks()
+    num_classes = int(padded["support_targets"].max()) + 1
+    class_mask = get_class_mask(
+        padded["support_targets"], num_classes, mask=padded["support_mask"]
+    )
+
+    prototypes = get_prototypes(
+        padded["support_embeddings"],
+        padded["support_targets"],
+        num_classes,
+        mask=padded["support_mask"],
+    )
+    loss = prototypical_loss(
+        prototypes,
+        padded["query_embeddings"],
+        padded["query_targets"],
+        mask=padded["query_mask"],
+        class_mask=class_mask,
+    )
+    accuracy = get_accuracy(
+        prototypes,
+        padded["query_embeddings"],
+        padded["query_targets"],
+        mask=padded["query_mask"],
+        class_mask=class_mask,
+    )
+
+    assert class_mask.tolist() == [[True, True, True], [True, True, False]]
+
+    losses, num_correct = [], 0
+    for task_idx, task in enumerate(tasks):
+        task_num_classes = int(task["support_targets"].max()) + 1
+        task_prototypes = get_prototypes(
+            task["support_embeddings"][None],
+            task["support_targets"][None],
+            task_num_classes,
+        )
+        assert torch.allclose(
+            prototypes[task_idx, :task_num_classes], task_prototypes[0]
+        )
+        losses.append(
+            prototypical_loss(
+                task_prototypes,
+                task["query_embeddings"][None],
+                task["query_targets"][None],
+                reduction="sum",
+            )
+        )
+        num_correct += get_accuracy(
+            task_prototypes, task["query_embeddings"][None], task["query_targets"][None]
+        ) * len(task["query_targets"])
+
+    num_queries = int(padded["query_mask"].sum())
+    assert torch.allclose(loss, sum(losses) / num_queries)
+    assert torch.allclose(accuracy, num_correct / num_queries)
+
+
+def test_unpadded_task_keeps_classes_without_support():
+    # class 1 drew all of its samples into the query set
+    support_targets = torch.tensor([[0, 2]])
+    query_targets = torch.tensor([[0, 1, 2]])
+    support_embeddings = torch.randn(1, 2, 5)
+    query_embeddings = torch.randn(1, 3, 5)
+    num_classes = int(support_targets.max()) + 1
+
+    class_mask = get_class_mask(support_targets, num_classes)
+    assert class_mask is None
+
+    prototypes = get_prototypes(support_embeddings, support_targets, num_classes)
+    loss = prototypical_loss(
+        prototypes, query_embeddings, query_targets, class_mask=class_mask
+    )
+
+    assert torch.isfinite(loss)
+    assert torch.allclose(
+        loss, prototypical_loss(prototypes, query_embeddings, query_targets)
+    )
+
+
+def test_masked_matching_loss_matches_unpadded_tasks():
+    tasks, padded = get_padded_tasks()
+    num_classes = int(padded["support_targets"].max()) + 1
+    class_mask = get_class_mask(
+        padded["support_targets"], num_classes, mask=padded["support_mask"]
+    )
+
+    logits = matching_logits(
+        get_cosine_distances(padded["query_embeddings"], padded["support_embeddings"]),
+        padded["support_targets"],
+        num_classes,
+        mask=padded["support_mask"],
+    )
+
+    for task_idx, task in enumerate(tasks):
+        task_num_classes = int(task["support_targets"].max()) + 1
+        task_logits = matching_logits(
+            get_cosine_distances(
+                task["query_embeddings"][None], task["support_embeddings"][None]
+            ),
+            task["support_targets"][None],
+            task_num_classes,
+        )
+        num_queries = len(task["query_targets"])
+        assert torch.allclose(
+            logits[task_idx, :task_num_classes, :num_queries], task_logits[0]
+        )
+
+    loss = matching_loss(
+        logits,
+        padded["query_targets"],
+        mask=padded["query_mask"],
+        class_mask=class_mask,
+    )
+    assert torch.isfinite(loss)
+
+
+def test_masked_inner_gaussian_product_matches_unpadded_tasks():
+    tasks, padded = get_padded_tasks()
+    num_classes = int(padded["support_targets"].max()) + 1
+    precisions = padded["support_embeddings"].exp()
+
+    outputs = inner_gaussian_product(
+        padded["support_embeddings"],
+        precisions,
+        padded["support_targets"],
+        num_classes,
+        mask=padded["support_mask"],
+    )
+
+    for output in outputs:
+        assert torch.isfinite(output).all()
+
+    for task_idx, task in enumerate(tasks):
+        task_num_classes = int(task["support_targets"].max()) + 1
+        task_outputs = inner_gaussian_product(
+            task["support_embeddings"][None],
+            task["support_embeddings"][None].exp(),
+            task["support_targets"][None],
+            task_num_classes,
+        )
+        for output, task_output in zip(outputs, task_outputs):
+            assert torch.allclose(output[task_idx, :task_num_classes], task_output[0])
+
+
+def test_flatten_examples_leaves_out_padding():
+    _, padded = get_padded_tasks()
+    mask = padded["support_mask"]
+
+    flattened = flatten_examples(padded["support_embeddings"], mask=mask)
+    assert flattened.shape == (int(mask.sum()), 5)
+
+    unflattened = unflatten_examples(flattened, *mask.shape, mask=mask, fill_value=1)
+    assert torch.equal(unflattened[mask], padded["support_embeddings"][mask])
+    assert (unflattened[~mask] == 1).all()
+
+    assert torch.equal(
+        unflatten_examples(flatten_examples(padded["support_embeddings"]), *mask.shape),
+        padded["support_embeddings"],
+    )
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import torch
 from dotted_dict import DottedDict
@@ -11,6 +11,7 @@ from gate.base.utils.loggers import get_logger
 from gate.configs.learner.linear_layer_fine_tuning import LearnerConfig
 from gate.configs.task.image_classification import TaskConfig
 from gate.datamodules.base import DataModule
+from gate.datasets.data_utils import get_batch_size
 from gate.learners.base import LearnerModule
 from gate.models.base import ModelModule
 from gate.tasks.base import TaskModule
@@ -113,7 +114,14 @@ class TrainingEvaluationAgent(LightningModule):
             task_metrics_dict=self.task.task_metrics_dict,
             top_level_pl_module=self,
         )
-        self.collect_metrics_step(computed_task_metrics_dict)
+        # ranks can run different numbers of evaluation steps, so evaluation
+        # metrics are only reduced across ranks once, at the end of the epoch,
+        # weighted by the number of episodes each rank evaluated
+        self.collect_metrics_step(
+            computed_task_metrics_dict,
+            on_step=False,
+            batch_size=get_batch_size(batch),
+        )
 
     def test_step(self, batch, batch_idx):
         task_batch = batch
@@ -123,12 +131,21 @@ class TrainingEvaluationAgent(LightningModule):
             task_metrics_dict=self.task.task_metrics_dict,
             top_level_pl_module=self,
         )
-        self.collect_metrics_step(computed_task_metrics_dict)
+        self.collect_metrics_step(
+            computed_task_metrics_dict,
+            on_step=False,
+            batch_size=get_batch_size(batch),
+        )
 
     def configure_optimizers(self):
         return self.learner.configure_optimizers()
 
-    def collect_metrics_step(self, computed_task_metrics_dict):
+    def collect_metrics_step(
+        self,
+        computed_task_metrics_dict,
+        on_step: bool = True,
+        batch_size: Optional[int] = None,
+    ):
         # sourcery skip: boolean-if-exp-identity
         logger = get_wandb_logger(trainer=self.trainer)
         for metric_key, computed_value in computed_task_metrics_dict.items():
@@ -149,9 +166,10 @@ class TrainingEvaluationAgent(LightningModule):
                             else torch.stack(computed_value),
                             prog_bar=True if "opt_loss" in metric_key else False,
                             logger=True,
-                            on_step=True,
+                            on_step=on_step,
                             on_epoch=True,
                             sync_dist=True,
+                            batch_size=batch_size,
                         )
                     else:
                         logger.log_table(
@@ -175,9 +193,10 @@ class TrainingEvaluationAgent(LightningModule):
                                 else torch.stack(computed_value),
                                 prog_bar=True if "opt_loss" in metric_key else False,
                                 logger=True,
-                                on_step=True,
+                                on_step=on_step,
                                 on_epoch=True,
                                 sync_dist=True,
+                                batch_size=batch_size,
                             )
                         else:
                             logger.log_table(
@@ -196,7 +215,8 @@ class TrainingEvaluationAgent(LightningModule):
                             else torch.stack(computed_value),
                             prog_bar=True if "opt_loss" in metric_key else False,
                             logger=True,
-                            on_step=True,
+                            on_step=on_step,
                             on_epoch=True,
                             sync_dist=True,
+                            batch_size=batch_size,
                         )